@@ -0,0 +1,190 @@
+"""
+Test data for the benchmarks, all of which is available offline.
+
+*   ``replay_api()`` returns an API client that answers requests with
+    the responses recorded in the VCR cassettes in ``tests/fixtures``
+*   ``make_collection_page()`` generates a synthetic page of a collection
+    response, of any size, using the fake Flickr API from the tests
+*   ``load_photos()`` loads the photos saved in
+    ``tests/fixtures/api_responses``, for rendering templates
+
+"""
+
+from datetime import datetime
+import functools
+import glob
+import gzip
+import json
+import os
+import sys
+import typing
+from xml.etree import ElementTree as ET
+
+import httpx
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from fake_flickr import FakeFlickr, make_owner, make_photos  # noqa: E402
+from flinumeratr.cache import CachingFlickrApi  # noqa: E402
+from flinumeratr.flickr_api import _extras  # noqa: E402
+from flinumeratr.models import Photo  # noqa: E402
+from flinumeratr.sizes import SIZE_LABELS, SIZE_PROFILES, SizeProfile  # noqa: E402
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures")
+
+
+# The sizes we'd get for each photo on /see_photos.  The saved API
+# responses have every size, so we pick out the ones we'd ask for.
+RESPONSIVE_LABELS = {SIZE_LABELS[suffix] for suffix in SIZE_PROFILES["responsive"]}
+
+
+# A URL of each type we have recorded responses for.
+CASSETTE_URLS = {
+    "single_photo": "https://www.flickr.com/photos/sdasmarchives/50567413447",
+    "album": "https://www.flickr.com/photos/aljazeeraenglish/albums/72157626164453131",
+    "group": "https://www.flickr.com/groups/birdguide/",
+    "user": "https://www.flickr.com/people/blueminds/",
+    "gallery": "https://www.flickr.com/photos/george/galleries/72157621848008117/",
+    "tag": "https://flickr.com/photos/tags/thatch/",
+}
+
+
+RequestKey = tuple[tuple[str, str], ...]
+
+
+def _request_key(params: typing.Iterable[tuple[str, str]]) -> RequestKey:
+    return tuple(sorted((k, v) for k, v in params if k != "api_key"))
+
+
+@functools.cache
+def load_cassette_responses() -> dict[RequestKey, bytes]:
+    """
+    Load every response recorded in the VCR cassettes, keyed by
+    the query parameters of the request.
+    """
+    responses = {}
+
+    for path in glob.glob(os.path.join(FIXTURES_DIR, "cassettes", "*.yml")):
+        with open(path) as in_file:
+            cassette = yaml.safe_load(in_file)
+
+        for interaction in cassette["interactions"]:
+            url = httpx.URL(interaction["request"]["uri"])
+            response = interaction["response"]
+
+            body = response["body"]["string"]
+
+            if isinstance(body, str):
+                body = body.encode("utf8")
+
+            headers = {k.lower(): v for k, v in response["headers"].items()}
+
+            if headers.get("content-encoding") == ["gzip"]:
+                body = gzip.decompress(body)
+
+            responses[_request_key(url.params.multi_items())] = body
+
+    return responses
+
+
+def replay_api() -> CachingFlickrApi:
+    """
+    Create an API client which replays the responses recorded in
+    the VCR cassettes.
+
+    Unlike vcr.py, this can replay the same response as many times
+    as we like, and adds almost no overhead to each request.
+    """
+    responses = load_cassette_responses()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        key = _request_key(request.url.params.multi_items())
+        return httpx.Response(status_code=200, content=responses[key])
+
+    return CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+
+def make_collection_page(
+    *, count_photos: int, count_owners: int, size_profile: SizeProfile
+) -> str:
+    """
+    Generate the XML for a single page of a tag search, with
+    ``count_photos`` photos spread among ``count_owners`` different owners.
+    """
+    fake_flickr = FakeFlickr()
+
+    owners = [make_owner(n) for n in range(count_owners)]
+    fake_flickr.tags["benchmark"] = make_photos(count_photos, owners)
+
+    return fake_flickr.respond(
+        {
+            "method": "flickr.photos.search",
+            "tags": "benchmark",
+            "per_page": str(count_photos),
+            "extras": _extras(size_profile),
+        }
+    )
+
+
+def find_collection_elem(xml: str | bytes) -> ET.Element:
+    """
+    Find the collection element (e.g. <photos> or <photoset>) in
+    an API response.
+    """
+    return ET.fromstring(xml)[0]
+
+
+def _decode(value: typing.Any) -> typing.Any:
+    """
+    Decode the JSON saved in ``tests/fixtures/api_responses``, which
+    stores datetimes as ``{"type": "datetime.datetime", "value": …}``.
+    """
+    if isinstance(value, dict):
+        if value.keys() == {"type", "value"} and value["type"] == "datetime.datetime":
+            return datetime.fromisoformat(value["value"])
+
+        return {k: _decode(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_decode(v) for v in value]
+    else:
+        return value
+
+
+def load_photos(count: int) -> list[Photo]:
+    """
+    Load ``count`` real photos from ``tests/fixtures/api_responses``.
+
+    These files were saved by an older version of Flinumeratr, so we
+    convert them to the current ``Photo`` model.
+    """
+    photos: list[Photo] = []
+
+    for path in sorted(
+        glob.glob(os.path.join(FIXTURES_DIR, "api_responses", "*.json"))
+    ):
+        with open(path) as in_file:
+            data = _decode(json.load(in_file))
+
+        for p in data.get("photos", []):
+            medium = next(s for s in p["sizes"] if s["label"] == "Medium")
+
+            photos.append(
+                {
+                    "url": p["url"],
+                    "image_url": medium["source"],
+                    "sizes": [s for s in p["sizes"] if s["label"] in RESPONSIVE_LABELS],
+                    "title": p["title"],
+                    "owner_url": p["owner"]["profile_url"],
+                    "owner_name": p["owner"]["realname"] or p["owner"]["username"],
+                    "date_taken": p["date_taken"],
+                    "date_posted": p["date_posted"],
+                    "license": p["license"],
+                }
+            )
+
+            if len(photos) == count:
+                return photos
+
+    raise ValueError(f"Only have {len(photos)} photos in the fixtures, not {count}")
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Measure how fast we can fetch, parse and render photos, and how much
+memory it takes.
+
+Everything runs offline, using the responses recorded in the VCR
+cassettes, the photos saved in ``tests/fixtures/api_responses``, and
+synthetic pages from the fake Flickr API in the tests.  See
+``benchmarks/fixtures.py``.
+
+Run it from the root of the repo:
+
+    $ python3 benchmarks/run.py
+
+To compare the results to the saved baseline, and exit with an error
+if anything has got noticeably slower or uses more memory:
+
+    $ python3 benchmarks/run.py --check
+
+If you've made something faster (or slower, on purpose), save a new
+baseline and commit it:
+
+    $ python3 benchmarks/run.py --save
+
+Timings vary a lot between machines, so the check only fails if
+a benchmark is more than twice as slow as the baseline.  Memory use
+is much more stable, and fails if it grows by more than 20%.
+"""
+
+import argparse
+from collections.abc import Callable
+import dataclasses
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+import typing
+from xml.etree import ElementTree as ET
+
+from fixtures import (
+    CASSETTE_URLS,
+    find_collection_elem,
+    load_photos,
+    make_collection_page,
+    replay_api,
+)
+
+os.environ.setdefault("FLICKR_API_KEY", "<benchmarks>")
+
+from flask import stream_template  # noqa: E402
+from flickr_api.models import User  # noqa: E402
+from flickr_url_parser import parse_flickr_url  # noqa: E402
+
+from flinumeratr.app import app  # noqa: E402
+from flinumeratr.flickr_api import (  # noqa: E402
+    _create_collection,
+    _from_collection_photo,
+    get_photos_from_flickr_url,
+    iterparse_collection,
+)
+from flinumeratr.fragments import fragment_cache  # noqa: E402
+from flinumeratr.models import CollectionOfPhotos, Photo  # noqa: E402
+from flinumeratr.sizes import SIZE_PROFILES, parse_sizes  # noqa: E402
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+TIME_TOLERANCE = 2.0
+MEMORY_TOLERANCE = 1.2
+
+
+@dataclasses.dataclass
+class Benchmark:
+    """
+    A function to measure, which processes ``count_photos`` photos
+    every time it's called.
+    """
+
+    name: str
+    func: Callable[[], object]
+    count_photos: int
+
+
+class Result(typing.TypedDict):
+    seconds_per_photo: float
+    peak_bytes_per_photo: float
+
+
+def get_benchmarks() -> list[Benchmark]:
+    """
+    Build all the benchmarks.
+    """
+    api = replay_api()
+    licenses = api.get_licenses()
+
+    benchmarks = []
+
+    # Parsing the sizes and other attributes of individual photos
+    for profile in SIZE_PROFILES:
+        xml = make_collection_page(
+            count_photos=100, count_owners=5, size_profile=profile
+        )
+        photo_elems = find_collection_elem(xml).findall("photo")
+
+        benchmarks.append(
+            Benchmark(
+                name=f"parse_sizes[{profile}]",
+                func=lambda photo_elems=photo_elems, profile=profile: [
+                    parse_sizes(elem, profile=profile) for elem in photo_elems
+                ],
+                count_photos=len(photo_elems),
+            )
+        )
+
+    def from_collection_photos(photo_elems: list[ET.Element]) -> list[Photo]:
+        owners: dict[str, User] = {}
+
+        return [
+            _from_collection_photo(
+                api,
+                elem,
+                owner=None,
+                licenses=licenses,
+                owners=owners,
+                size_profile="medium-only",
+            )
+            for elem in photo_elems
+        ]
+
+    xml = make_collection_page(
+        count_photos=100, count_owners=5, size_profile="medium-only"
+    )
+    photo_elems = find_collection_elem(xml).findall("photo")
+
+    benchmarks.append(
+        Benchmark(
+            name="_from_collection_photo",
+            func=lambda: from_collection_photos(photo_elems),
+            count_photos=len(photo_elems),
+        )
+    )
+
+    # Parsing whole pages of synthetic collections: a gallery-like page
+    # where photos come from a handful of owners, and a tag-like page
+    # where almost every photo has a different owner.
+    for count_photos in (100, 500):
+        for label, count_owners in [("gallery-like", 5), ("tag-like", count_photos)]:
+            xml = make_collection_page(
+                count_photos=count_photos,
+                count_owners=count_owners,
+                size_profile="medium-only",
+            )
+            elem = find_collection_elem(xml)
+
+            benchmarks.append(
+                Benchmark(
+                    name=f"_create_collection[{label}-{count_photos}]",
+                    func=lambda elem=elem: _create_collection(
+                        api, elem, size_profile="medium-only"
+                    ),
+                    count_photos=count_photos,
+                )
+            )
+
+    xml = make_collection_page(
+        count_photos=500, count_owners=500, size_profile="medium-only"
+    )
+
+    benchmarks.append(
+        Benchmark(
+            name="iterparse_collection[tag-like-500]",
+            func=lambda: list(
+                iterparse_collection(
+                    api, [xml.encode("utf8")], size_profile="medium-only"
+                )["photos"]
+            ),
+            count_photos=500,
+        )
+    )
+
+    # Fetching and parsing the first page of photos at a URL, replaying
+    # the recorded responses.
+    for url_type, url in CASSETTE_URLS.items():
+        parsed_url = parse_flickr_url(url)
+        photo_data = get_photos_from_flickr_url(api, parsed_url)
+
+        benchmarks.append(
+            Benchmark(
+                name=f"get_photos_from_flickr_url[{url_type}]",
+                func=lambda parsed_url=parsed_url: get_photos_from_flickr_url(
+                    api, parsed_url
+                ),
+                count_photos=(
+                    len(photo_data["photos"]) if "photos" in photo_data else 1
+                ),
+            )
+        )
+
+    # Rendering the /see_photos page, with nothing in the fragment cache
+    # (somebody looking at a collection for the first time)...
+    for count_photos in (100, 500):
+        photos = load_photos(count_photos)
+
+        benchmarks.append(
+            Benchmark(
+                name=f"render_see_photos[{count_photos}]",
+                func=lambda photos=photos: render_see_photos(photos, warm=False),
+                count_photos=count_photos,
+            )
+        )
+
+    # ...and with every photo already in the cache (a popular collection).
+    photos = load_photos(500)
+
+    benchmarks.append(
+        Benchmark(
+            name="render_see_photos[500-warm]",
+            func=lambda: render_see_photos(photos, warm=True),
+            count_photos=500,
+        )
+    )
+
+    return benchmarks
+
+
+def render_see_photos(photos: list[Photo], *, warm: bool) -> str:
+    """
+    Render the /see_photos page for a tag with these photos.
+
+    If ``warm`` is False, we empty the fragment cache first, so every
+    photo has to be rendered from scratch.
+    """
+    if not warm:
+        fragment_cache.clear()
+
+    photo_data: CollectionOfPhotos = {
+        "photos": photos,
+        "count_pages": 1,
+        "count_photos": len(photos),
+    }
+
+    with app.test_request_context("/see_photos"):
+        return "".join(
+            stream_template(
+                "see_photos.html",
+                flickr_url="https://www.flickr.com/photos/tags/botany/",
+                parsed_url={"type": "tag", "tag": "botany", "page": 1},
+                photo_data=photo_data,
+                photos=photos,
+                label="a tag",
+            )
+        )
+
+
+def measure(benchmark: Benchmark) -> Result:
+    """
+    Measure how long a benchmark takes, and the peak memory it uses.
+    """
+    timer = timeit.Timer(benchmark.func)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=5, number=number)) / number
+
+    tracemalloc.start()
+    benchmark.func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds_per_photo": seconds / benchmark.count_photos,
+        "peak_bytes_per_photo": peak_bytes / benchmark.count_photos,
+    }
+
+
+def compare(result: Result, baseline: Result | None) -> tuple[str, bool]:
+    """
+    Compare a result to the baseline.  Returns a description of the
+    change, and whether it's a regression.
+    """
+    if baseline is None:
+        return "(new)", False
+
+    time_ratio = result["seconds_per_photo"] / baseline["seconds_per_photo"]
+    memory_ratio = result["peak_bytes_per_photo"] / baseline["peak_bytes_per_photo"]
+
+    is_regression = time_ratio > TIME_TOLERANCE or memory_ratio > MEMORY_TOLERANCE
+
+    return (
+        f"time {time_ratio:5.2f}x  memory {memory_ratio:5.2f}x"
+        + ("  REGRESSION" if is_regression else ""),
+        is_regression,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-k", dest="pattern", help="only run benchmarks whose name contains this"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="save the results as the new baseline"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with an error if anything is slower than the baseline",
+    )
+    args = parser.parse_args()
+
+    try:
+        with open(BASELINE_PATH) as in_file:
+            baseline: dict[str, Result] = json.load(in_file)
+    except FileNotFoundError:
+        baseline = {}
+
+    results: dict[str, Result] = {}
+    regressions = []
+
+    for benchmark in get_benchmarks():
+        if args.pattern and args.pattern not in benchmark.name:
+            continue
+
+        result = results[benchmark.name] = measure(benchmark)
+        change, is_regression = compare(result, baseline.get(benchmark.name))
+
+        if is_regression:
+            regressions.append(benchmark.name)
+
+        print(
+            f"{benchmark.name:<42} "
+            f"{result['seconds_per_photo'] * 1_000_000:8.2f} µs/photo "
+            f"{1 / result['seconds_per_photo']:10.0f} photos/s "
+            f"{result['peak_bytes_per_photo']:9.0f} bytes/photo  "
+            f"{change}"
+        )
+
+    if args.save:
+        with open(BASELINE_PATH, "w") as out_file:
+            out_file.write(json.dumps({**baseline, **results}, indent=2) + "\n")
+
+    if args.check and regressions:
+        sys.exit(f"Regressions compared to the baseline: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -68,6 +68,36 @@ kill -HUP $(cat flinumeratr.pid)
 
 
 
+# 4. Restart the job workers.
+#
+#    We send the old workers a SIGTERM, which tells them to stop once
+#    they've finished their current job, and start new workers straight
+#    away, so we don't have to wait for a long job to finish.
+#
+#    If the app was started before we had job workers, there's no
+#    job_workers.pid, and we just start the new workers.
+#
+#    This should be the same number of workers as in start_prod.sh.
+#
+JOB_WORKERS=2
+
+print_info "Restarting the job workers"
+if [[ -f job_workers.pid ]]
+then
+  kill -TERM $(cat job_workers.pid) || true
+  rm -f job_workers.pid
+fi
+
+for _ in $(seq "$JOB_WORKERS")
+do
+  FLINUMERATR_CACHE_PATH="$(pwd)/flickr_api_cache.db" \
+  FLINUMERATR_JOBS_PATH="$(pwd)/jobs" \
+    nohup flask --app flinumeratr.app run-job-worker >> jobs.log 2>&1 &
+  echo $! >> job_workers.pid
+done
+
+
+
 echo ""
 echo "To see the access logs (e.g. people using the app):"
 echo ""
@@ -77,3 +107,7 @@ echo "To follow the application logs (e.g. application errors):"
 echo ""
 echo "    tail -f app.log"
 echo ""
+echo "To follow the job workers (e.g. big exports):"
+echo ""
+echo "    tail -f jobs.log"
+echo ""
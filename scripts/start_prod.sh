@@ -41,6 +41,42 @@ fi
 
 
 
+# Where should we cache responses from the Flickr API?
+#
+# This is a SQLite database which is shared between all the gunicorn
+# workers, so a response fetched by one worker can be reused by the others.
+export FLINUMERATR_CACHE_PATH="$(pwd)/flickr_api_cache.db"
+
+
+
+# Where should we keep background jobs?
+#
+# This is a directory with a SQLite queue of jobs, and the results of
+# finished jobs.  It's shared between the web app, which submits jobs,
+# and the job workers, which run them.
+export FLINUMERATR_JOBS_PATH="$(pwd)/jobs"
+
+
+
+# How many job workers should we run?
+#
+# These are separate from the gunicorn workers, so long-running jobs
+# don't tie up the processes that serve web requests.
+JOB_WORKERS=2
+
+
+
+print_info "Starting the job workers…"
+rm -f job_workers.pid
+
+for _ in $(seq "$JOB_WORKERS")
+do
+  nohup flask --app flinumeratr.app run-job-worker >> jobs.log 2>&1 &
+  echo $! >> job_workers.pid
+done
+
+
+
 print_info "Starting the web app…"
 gunicorn flinumeratr.app:app \
   --workers 4 \
@@ -64,6 +100,10 @@ echo "To follow the application logs (e.g. application errors):"
 echo ""
 echo "    tail -f app.log"
 echo ""
+echo "To follow the job workers (e.g. big exports):"
+echo ""
+echo "    tail -f jobs.log"
+echo ""
 echo "To pull changes from GitHub and restart the app:"
 echo ""
 echo "    bash scripts/restart_prod.sh"
@@ -1,20 +1,66 @@
+from collections.abc import Iterable, Mapping
+from datetime import datetime, timezone
+import functools
+import hashlib
+import itertools
+import json
 import os
 import secrets
+import signal
 import sys
+import threading
+import typing
 
-from flask import Flask, flash, redirect, render_template, request, url_for
-from flickr_api import FlickrApi, ResourceNotFound
-from flickr_url_parser import (
-    parse_flickr_url,
-    NotAFlickrUrl,
-    UnrecognisedUrl,
+import click
+from flask import (
+    Flask,
+    Response,
+    flash,
+    redirect,
+    render_template,
+    request,
+    send_file,
+    stream_template,
+    url_for,
 )
+from flickr_api import FlickrApi, ResourceNotFound
+from flickr_url_parser import NotAFlickrUrl, ParseResult, UnrecognisedUrl
+import httpx
 import humanize
 import werkzeug
+from werkzeug.http import is_resource_modified
 
 from . import __version__
+from .batch import lookup_flickr_urls, result_to_json
+from .cache import CachingFlickrApi, get_response_cache
+from .conditional import MAX_AGE, get_etag
+from .export import EXPORT_FORMATS, ExportFormat, export_photos, photo_to_dict
 from .filters import render_date_taken
-from .flickr_api import get_photos_from_flickr_url
+from .fragments import render_photo
+from .flickr_api import (
+    PER_PAGE,
+    get_pages_from_flickr_url,
+    prefetch_page,
+    stream_photos_from_flickr_url,
+    with_page,
+)
+from .images import CACHE_CONTROL, get_image_proxy, is_image_path
+from .jobs import Job, estimate_seconds_remaining, get_job_queue, run_worker
+from .metrics import (
+    CACHE_REQUESTS,
+    Timings,
+    get_metrics_store,
+    iter_timed,
+    render_metrics,
+    start_saving_metrics,
+    timed,
+)
+from .models import CollectionOfPhotos, Pagination, Photo, PhotosFromUrl
+from .ratelimit import RateLimitExceeded, get_rate_budget
+from .resolution import get_resolution_index, resolve_flickr_url
+from .singleflight import get_single_flight
+from .sizes import SizeProfile, srcset
+from .snapshots import get_snapshot_store, refresh_snapshot
 
 
 app = Flask(__name__)
@@ -22,6 +68,8 @@ app = Flask(__name__)
 app.config["SECRET_KEY"] = secrets.token_hex()
 
 app.add_template_filter(render_date_taken)
+app.add_template_filter(srcset)
+app.add_template_global(render_photo)
 
 try:
     api_key = os.environ["FLICKR_API_KEY"]
@@ -31,10 +79,48 @@ except KeyError:  # pragma: no cover
         "Please set the FLICKR_API_KEY environment variable and run again."
     )
 else:
-    api = FlickrApi.with_api_key(
+    api = CachingFlickrApi.with_api_key(
         api_key=api_key,
         user_agent=f"Flinumeratr/{__version__} (https://github.com/flickr-foundation/flinumeratr; hello@flickr.org)",
     )
+    api.response_cache = get_response_cache()
+    api.resolution_index = get_resolution_index()
+    api.single_flight = get_single_flight()
+    api.rate_budget = get_rate_budget()
+
+job_queue = get_job_queue()
+image_proxy = get_image_proxy()
+
+# Every process (web and job workers) saves its metrics in the shared
+# store in the background, so /metrics can add them all up.
+metrics_store = get_metrics_store()
+start_saving_metrics(metrics_store, stop=threading.Event())
+
+
+CATEGORY_LABELS = {
+    "single_photo": "a photo",
+    "album": "an album",
+    "user": "a person",
+    "group": "a group",
+    "gallery": "a gallery",
+    "tag": "a tag",
+}
+
+
+# The most URLs we'll look up in a single /batch request, and how many
+# of them we'll fetch at once.
+MAX_BATCH_URLS = 1000
+BATCH_CONCURRENCY = 8
+
+
+# The most pages of photos we'll show on a single /see_photos page.
+MAX_PAGES = 10
+
+
+# The sizes we ask Flickr for on /see_photos.  We give the browser
+# a ``srcset`` with all of them, so it can download the right size
+# for the visitor's screen.
+SIZE_PROFILE: SizeProfile = "responsive"
 
 
 @app.template_filter()
@@ -53,12 +139,46 @@ def intcomma(n: int) -> str:
     return humanize.intcomma(n)
 
 
+@app.template_global()
+def proxied_image_url(url: str) -> str:
+    """
+    Returns the URL we should use for an image in the page: either
+    the URL of the image on the image proxy, or the original URL
+    if the proxy isn't enabled.
+    """
+    if image_proxy is None:
+        return url
+
+    image_path = image_proxy.image_path(url)
+
+    if image_path is None:
+        return url
+
+    return url_for("proxy_image", image_path=image_path)
+
+
 @app.route("/")
-def homepage() -> str:
+def homepage() -> Response:
     """
     The Flinumeratr homepage.
     """
-    return render_template("homepage.html")
+    html, etag = render_homepage()
+
+    return make_conditional(Response(html), etag)
+
+
+@functools.cache
+def render_homepage() -> tuple[str, str]:
+    """
+    Render the homepage, and return the HTML and an ETag for it.
+
+    The homepage doesn't change until we deploy a new version of
+    the app, so we only render it once per process.
+    """
+    html = render_template("homepage.html")
+    etag = hashlib.sha256(html.encode("utf8")).hexdigest()[:32]
+
+    return html, etag
 
 
 @app.route("/see_photos")
@@ -73,44 +193,608 @@ def see_photos() -> str | werkzeug.Response:
     if not flickr_url:
         return redirect(url_for("homepage"))
 
+    timings = Timings()
+
+    with timings.activate():
+        try:
+            with timed("parse_url"):
+                parsed_url = resolve_flickr_url(flickr_url, index=api.resolution_index)
+        except (UnrecognisedUrl, NotAFlickrUrl) as err:
+            return instrument_response(
+                render_url_error(flickr_url, err), timings, url_type="invalid"
+            )
+
+        parsed_url = get_requested_page(parsed_url)
+        count_pages = get_count_pages()
+
+        try:
+            photo_data, photos = get_pages_from_flickr_url(
+                api, parsed_url, count_pages=count_pages, size_profile=SIZE_PROFILE
+            )
+        except ResourceNotFound:
+            resp: str | Response = render_not_found(flickr_url, parsed_url)
+        except RateLimitExceeded:
+            resp = render_rate_limited(flickr_url)
+        except Exception as e:  # pragma: no cover
+            raise
+            flash(f"Boom! Something went wrong: {e}")
+            return render_template("error.html", flickr_url=flickr_url, error=e)
+        else:
+            pagination = get_pagination(
+                flickr_url, parsed_url, photo_data, count_pages=count_pages
+            )
+            start_prefetch(api, parsed_url, pagination)
+
+            resp = make_conditional(
+                render_photos(flickr_url, parsed_url, photo_data, photos, pagination),
+                get_etag(parsed_url, photo_data, count_pages=count_pages),
+            )
+
+    return instrument_response(resp, timings, url_type=parsed_url["type"])
+
+
+# These helpers are shared between the /see_photos view above, and the
+# async version in ``flinumeratr.asgi``.
+
+
+def get_count_pages() -> int:
+    """
+    Returns the number of pages of photos to show, from the ``pages``
+    query parameter.
+    """
     try:
-        parsed_url = parse_flickr_url(flickr_url)
-    except UnrecognisedUrl:
+        count_pages = int(request.args.get("pages", "1"))
+    except ValueError:
+        count_pages = 1
+
+    return max(1, min(count_pages, MAX_PAGES))
+
+
+def get_requested_page(parsed_url: ParseResult) -> ParseResult:
+    """
+    Returns the parsed URL for the page in the ``page`` query parameter,
+    which is used by the prev/next links.  If there isn't one, we show
+    the page in the Flickr URL.
+    """
+    try:
+        page = int(request.args["page"])
+    except (KeyError, ValueError):
+        return parsed_url
+
+    return with_page(parsed_url, max(1, page))
+
+
+def get_pagination(
+    flickr_url: str,
+    parsed_url: ParseResult,
+    photo_data: PhotosFromUrl,
+    *,
+    count_pages: int,
+) -> Pagination | None:
+    """
+    Work out which pages we're showing, and the links to the pages
+    before and after them.  Single photos don't have any pages.
+    """
+    if parsed_url["type"] in {"single_photo", "homepage"}:
+        return None
+
+    first_page = typing.cast(int, parsed_url.get("page"))
+    total_pages = typing.cast(CollectionOfPhotos, photo_data)["count_pages"]
+    last_page = min(first_page + count_pages - 1, total_pages)
+
+    def page_url(page: int) -> str:
+        return url_for(
+            "see_photos",
+            flickr_url=flickr_url,
+            page=page,
+            pages=count_pages if count_pages > 1 else None,
+        )
+
+    return {
+        "page": first_page,
+        "last_page": max(first_page, last_page),
+        "count_pages": total_pages,
+        "prev_url": (
+            page_url(max(1, first_page - count_pages)) if first_page > 1 else None
+        ),
+        "next_url": page_url(last_page + 1) if last_page < total_pages else None,
+    }
+
+
+def start_prefetch(
+    api: FlickrApi, parsed_url: ParseResult, pagination: Pagination | None
+) -> None:
+    """
+    Start fetching the next page into the response cache, so it's
+    ready if somebody clicks "next".
+
+    If there's no response cache, there's nowhere to put the page,
+    so we don't bother.
+    """
+    if pagination is None or pagination["next_url"] is None:
+        return
+
+    if isinstance(api, CachingFlickrApi) and api.response_cache is not None:
+        prefetch_page(
+            api,
+            parsed_url,
+            page=pagination["last_page"] + 1,
+            size_profile=SIZE_PROFILE,
+        )
+
+
+def render_url_error(flickr_url: str, err: UnrecognisedUrl | NotAFlickrUrl) -> str:
+    """
+    Render the error page for a URL we can't show photos for.
+    """
+    if isinstance(err, UnrecognisedUrl):
         flash(
             f"There are no photos to show at <span class='user_input'>{flickr_url}</span>"
         )
-        return render_template("error.html", flickr_url=flickr_url)
-    except NotAFlickrUrl:
+    else:
         flash(
             f"<span class='user_input'>{flickr_url}</span> doesn’t live on Flickr.com"
         )
-        return render_template("error.html", flickr_url=flickr_url)
 
-    category_label = {
-        "single_photo": "a photo",
-        "album": "an album",
-        "user": "a person",
-        "group": "a group",
-        "gallery": "a gallery",
-        "tag": "a tag",
-    }[parsed_url["type"]]
+    return render_template("error.html", flickr_url=flickr_url)
 
-    try:
-        photo_data = get_photos_from_flickr_url(api, parsed_url)
-    except ResourceNotFound:
-        flash(
-            f"Unable to find {category_label} at <span class='user_input'>{flickr_url}</span>"
+
+def render_not_found(flickr_url: str, parsed_url: ParseResult) -> str:
+    """
+    Render the error page for a photo or collection that doesn't exist.
+    """
+    category_label = CATEGORY_LABELS[parsed_url["type"]]
+
+    flash(
+        f"Unable to find {category_label} at <span class='user_input'>{flickr_url}</span>"
+    )
+
+    return render_template("error.html", flickr_url=flickr_url)
+
+
+def render_rate_limited(flickr_url: str) -> Response:
+    """
+    Render the error page for when we've used up our budget of
+    Flickr API calls.
+    """
+    flash("Flickr is very busy right now. Please try again in a minute.")
+
+    return Response(
+        render_template("error.html", flickr_url=flickr_url),
+        status=503,
+        headers={"Retry-After": "60"},
+    )
+
+
+def make_conditional(resp: Response, etag: str) -> Response:
+    """
+    Add the caching headers to a response, and turn it into a
+    304 Not Modified if the client already has this version.
+
+    The body of the /see_photos page is a lazy generator, so if we
+    drop it here, we never render the template.  (In the WSGI app,
+    we don't fetch the later pages either; the ASGI app fetches them
+    all before we get here.)
+    """
+    resp.set_etag(etag, weak=True)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = MAX_AGE
+
+    # Note: we don't use ``Response.make_conditional()``, because it
+    # reads the whole body to work out the Content-Length, which would
+    # stop us streaming the page.
+    if not is_resource_modified(request.environ, etag=resp.headers["ETag"]):
+        resp.status_code = 304
+        resp.response = []
+
+    return resp
+
+
+def instrument_response(
+    rv: str | werkzeug.Response, timings: Timings, *, url_type: str
+) -> werkzeug.Response:
+    """
+    Add the timings for a request to the response, and to our metrics.
+
+    The ``Server-Timing`` header has to be sent before the body, so if
+    the response is streamed, it only includes the phases that happened
+    before we started rendering.  The time spent rendering the page
+    is added to the metrics once the response is finished.
+    """
+    resp = app.make_response(rv)
+    resp.headers["Server-Timing"] = timings.server_timing()
+
+    if resp.is_streamed:
+        resp.response = iter_timed(
+            resp.iter_encoded(), timings, phase="render", url_type=url_type
         )
-        return render_template("error.html", flickr_url=flickr_url)
-    except Exception as e:  # pragma: no cover
-        raise
-        flash(f"Boom! Something went wrong: {e}")
-        return render_template("error.html", flickr_url=flickr_url, error=e)
     else:
-        return render_template(
+        timings.observe(url_type=url_type)
+
+    return resp
+
+
+def render_photos(
+    flickr_url: str,
+    parsed_url: ParseResult,
+    photo_data: PhotosFromUrl,
+    photos: Iterable[Photo],
+    pagination: Pagination | None = None,
+) -> Response:
+    """
+    Render the page of photos.
+
+    We stream the response, so the browser gets the header, form
+    and infobox as soon as we know the collection metadata, and
+    can start loading images while we're still rendering the rest
+    of the page (or fetching later pages).
+    """
+    return Response(
+        stream_template(
             "see_photos.html",
             flickr_url=flickr_url,
             parsed_url=parsed_url,
             photo_data=photo_data,
-            label=category_label,
+            photos=photos,
+            pagination=pagination,
+            label=CATEGORY_LABELS[parsed_url["type"]],
+        )
+    )
+
+
+@app.route("/metrics")
+def metrics() -> Response:
+    """
+    Our metrics, in the Prometheus text format.
+
+    See https://prometheus.io/docs/instrumenting/exposition_formats/
+    """
+    return Response(
+        render_metrics(store=metrics_store),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@app.route("/export")
+def export() -> werkzeug.Response | tuple[str, int]:
+    """
+    Download every photo at a URL as CSV or JSON Lines, e.g.
+
+        /export?flickr_url=https://www.flickr.com/groups/birdguide/&format=csv
+
+    The response is streamed, and we fetch and parse the pages from
+    Flickr as we go, so this works for collections of any size.
+    """
+    try:
+        flickr_url = request.args["flickr_url"]
+    except KeyError:
+        return redirect(url_for("homepage"))
+
+    if not flickr_url:
+        return redirect(url_for("homepage"))
+
+    export_format = typing.cast(ExportFormat, request.args.get("format", "jsonl"))
+
+    if export_format not in EXPORT_FORMATS:
+        flash(
+            f"<span class='user_input'>{export_format}</span> isn’t a format we can export"
+        )
+        return render_template("error.html", flickr_url=flickr_url), 400
+
+    try:
+        parsed_url = resolve_flickr_url(flickr_url, index=api.resolution_index)
+    except UnrecognisedUrl as err:
+        return render_url_error(flickr_url, err), 404
+    except NotAFlickrUrl as err:
+        return render_url_error(flickr_url, err), 400
+
+    photos = stream_photos_from_flickr_url(
+        api.with_priority("bulk"), parsed_url, per_page=PER_PAGE["bulk"]
+    )
+
+    # We fetch the first photo before we start the response, so if
+    # the collection doesn't exist, we can still return an error page.
+    try:
+        first_photo = next(photos, None)
+    except ResourceNotFound:
+        return render_not_found(flickr_url, parsed_url), 404
+    except RateLimitExceeded:
+        return render_rate_limited(flickr_url)
+
+    if first_photo is not None:
+        photos = itertools.chain([first_photo], photos)
+
+    return Response(
+        export_photos(photos, format=export_format),
+        content_type=EXPORT_FORMATS[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="photos.{export_format}"',
+        },
+    )
+
+
+@app.route("/batch", methods=["POST"])
+def batch() -> werkzeug.Response | tuple[dict[str, str], int]:
+    """
+    Look up the photos at lots of URLs at once.
+
+    Pass the URLs either as JSON, e.g.
+
+        {"flickr_urls": ["https://www.flickr.com/photos/…", …]}
+
+    or as a form field ``flickr_urls`` with one URL per line.
+
+    The response is JSON Lines, with one line per URL.  The lines are
+    sent in the order the lookups finish, not the order of the URLs.
+    """
+    if request.is_json:
+        flickr_urls = (request.get_json(silent=True) or {}).get("flickr_urls")
+    else:
+        flickr_urls = [
+            line.strip()
+            for line in request.form.get("flickr_urls", "").splitlines()
+            if line.strip()
+        ]
+
+    if not isinstance(flickr_urls, list) or not all(
+        isinstance(url, str) for url in flickr_urls
+    ):
+        return {"error": "flickr_urls should be a list of URLs"}, 400
+
+    if len(flickr_urls) > MAX_BATCH_URLS:
+        return {"error": f"You can look up at most {MAX_BATCH_URLS} URLs at once"}, 400
+
+    results = lookup_flickr_urls(
+        api.with_priority("bulk"),
+        flickr_urls,
+        concurrency=BATCH_CONCURRENCY,
+        per_page=PER_PAGE["bulk"],
+        index=api.resolution_index,
+    )
+
+    return Response(
+        (result_to_json(r) + "\n" for r in results),
+        content_type="application/x-ndjson; charset=utf-8",
+    )
+
+
+@app.route("/images/<path:image_path>")
+def proxy_image(image_path: str) -> werkzeug.Response:
+    """
+    Serve an image from ``live.staticflickr.com`` through the image
+    proxy, e.g.
+
+        /images/65535/50000000001_abcdef1234_b.jpg
+
+    See ``flinumeratr.images``.
+    """
+    if image_proxy is None or not is_image_path(image_path):
+        return Response("Not Found", status=404, content_type="text/plain")
+
+    content_type = image_proxy.content_type(image_path)
+    cache_path = image_proxy.get_cached(image_path)
+
+    if cache_path is not None:
+        CACHE_REQUESTS.inc(cache="image", result="hit")
+        resp = send_file(
+            cache_path, mimetype=content_type, conditional=False, etag=False
         )
+        resp.headers["Cache-Control"] = CACHE_CONTROL
+        return resp
+
+    CACHE_REQUESTS.inc(cache="image", result="miss")
+
+    try:
+        upstream = image_proxy.fetch(image_path)
+    except httpx.HTTPError:
+        return Response("Bad Gateway", status=502, content_type="text/plain")
+
+    if upstream.status_code != 200:
+        upstream.close()
+
+        if upstream.status_code == 404:
+            return Response("Not Found", status=404, content_type="text/plain")
+        else:
+            return Response("Bad Gateway", status=502, content_type="text/plain")
+
+    resp = Response(
+        image_proxy.stream_and_cache(image_path, upstream),
+        content_type=content_type,
+        headers={"Cache-Control": CACHE_CONTROL},
+    )
+
+    if "Content-Length" in upstream.headers:
+        resp.headers["Content-Length"] = upstream.headers["Content-Length"]
+
+    # If the response is closed before we start reading the image
+    # (e.g. for a HEAD request), we still need to close the connection.
+    resp.call_on_close(upstream.close)
+
+    return resp
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job() -> (
+    tuple[dict[str, typing.Any], int, dict[str, str]] | tuple[dict[str, str], int]
+):
+    """
+    Start a background job to fetch every photo at a URL.
+
+    Pass the URL and the format of the result, either as JSON, e.g.
+
+        {"flickr_url": "https://www.flickr.com/photos/…", "format": "csv"}
+
+    or as form fields.  The response has the job's ID, and a URL
+    where you can poll its progress.
+    """
+    if job_queue is None:
+        return {"error": "Background jobs aren’t enabled on this server"}, 503
+
+    body = request.get_json(silent=True) if request.is_json else request.form
+
+    if not isinstance(body, Mapping):
+        body = {}
+
+    flickr_url = body.get("flickr_url")
+    export_format = typing.cast(ExportFormat, body.get("format", "jsonl"))
+
+    if not isinstance(flickr_url, str) or not flickr_url:
+        return {"error": "flickr_url should be a Flickr URL"}, 400
+
+    if export_format not in EXPORT_FORMATS:
+        return {"error": f"{export_format} isn’t a format we can export"}, 400
+
+    try:
+        parsed_url = resolve_flickr_url(flickr_url, index=api.resolution_index)
+    except UnrecognisedUrl:
+        return {"error": f"There are no photos to show at {flickr_url}"}, 404
+    except NotAFlickrUrl:
+        return {"error": f"{flickr_url} doesn’t live on Flickr.com"}, 400
+
+    job_id = job_queue.submit(flickr_url, parsed_url, format=export_format)
+    job = typing.cast(Job, job_queue.get(job_id))
+
+    return job_to_json(job), 202, {"Location": url_for("job_progress", job_id=job_id)}
+
+
+@app.route("/jobs/<job_id>")
+def job_progress(job_id: str) -> dict[str, typing.Any] | tuple[dict[str, str], int]:
+    """
+    Get the progress of a background job.
+    """
+    job = job_queue.get(job_id) if job_queue is not None else None
+
+    if job is None:
+        return {"error": f"There is no job {job_id}"}, 404
+
+    return job_to_json(job)
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id: str) -> werkzeug.Response | tuple[dict[str, str], int]:
+    """
+    Download the photos found by a background job.
+    """
+    if job_queue is None or (job := job_queue.get(job_id)) is None:
+        return {"error": f"There is no job {job_id}"}, 404
+
+    if job["state"] != "done":
+        return {"error": f"Job {job_id} is {job['state']}, not done"}, 409
+
+    resp = send_file(
+        job_queue.result_path(job),
+        as_attachment=True,
+        download_name=f"photos.{job['format']}",
+    )
+    resp.content_type = EXPORT_FORMATS[job["format"]]
+
+    return resp
+
+
+def job_to_json(job: Job) -> dict[str, typing.Any]:
+    """
+    Convert a job to the JSON we return from the /jobs endpoints.
+    """
+    eta = estimate_seconds_remaining(job, now=datetime.now(tz=timezone.utc))
+
+    return {
+        "id": job["id"],
+        "flickr_url": job["flickr_url"],
+        "format": job["format"],
+        "state": job["state"],
+        "attempts": job["attempts"],
+        "submitted_at": job["submitted_at"].isoformat(),
+        "started_at": job["started_at"] and job["started_at"].isoformat(),
+        "finished_at": job["finished_at"] and job["finished_at"].isoformat(),
+        "pages_done": job["pages_done"],
+        "count_pages": job["count_pages"],
+        "count_photos": job["count_photos"],
+        "eta_seconds": round(eta) if eta is not None else None,
+        "error": job["error"],
+        "result_url": (
+            url_for("job_result", job_id=job["id"]) if job["state"] == "done" else None
+        ),
+    }
+
+
+@app.cli.command("run-job-worker")
+@click.option("--burst", is_flag=True, help="Stop as soon as the queue is empty.")
+def run_job_worker(burst: bool) -> None:
+    """
+    Run background jobs from the queue at ``FLINUMERATR_JOBS_PATH``.
+
+    The worker keeps running until it gets a SIGTERM, and then stops
+    after it's finished its current job.
+    """
+    if job_queue is None:
+        raise click.UsageError("Set FLINUMERATR_JOBS_PATH to the path of a directory.")
+
+    stop = threading.Event()
+    previous_handler = signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    try:
+        run_worker(job_queue, api.with_priority("bulk"), burst=burst, stop=stop)
+    finally:
+        signal.signal(signal.SIGTERM, previous_handler)
+
+
+@app.cli.command("refresh-snapshots")
+@click.argument("flickr_urls", nargs=-1, required=True)
+@click.option(
+    "--full", is_flag=True, help="Fetch every photo, even if we don't need to."
+)
+def refresh_snapshots(flickr_urls: tuple[str, ...], full: bool) -> None:
+    """
+    Refresh the snapshots of the photos at some Flickr URLs.
+
+    The photos that were added or removed are printed as JSON Lines,
+    with one line per photo.  Snapshots are stored in the SQLite
+    database at ``FLINUMERATR_SNAPSHOT_PATH``.
+    """
+    store = get_snapshot_store()
+
+    if store is None:
+        raise click.UsageError(
+            "Set FLINUMERATR_SNAPSHOT_PATH to the path of a SQLite database."
+        )
+
+    failed = False
+
+    for flickr_url in flickr_urls:
+        try:
+            parsed_url = resolve_flickr_url(flickr_url, index=api.resolution_index)
+            diff = refresh_snapshot(
+                api.with_priority("bulk"), store, parsed_url, full=full
+            )
+        except (
+            NotAFlickrUrl,
+            UnrecognisedUrl,
+            ResourceNotFound,
+            RateLimitExceeded,
+        ) as err:
+            click.echo(f"{flickr_url}: {type(err).__name__}: {err}", err=True)
+            failed = True
+            continue
+
+        for change in ("added", "removed"):
+            for photo in diff[change]:
+                click.echo(
+                    json.dumps(
+                        {
+                            "flickr_url": flickr_url,
+                            "change": change,
+                            "photo": photo_to_dict(photo.to_photo()),
+                        },
+                        ensure_ascii=False,
+                    )
+                )
+
+        click.echo(
+            f"{flickr_url}: {len(diff['added'])} added, "
+            f"{len(diff['removed'])} removed "
+            f"({'full' if diff['is_full'] else 'incremental'} refresh)",
+            err=True,
+        )
+
+    if failed:
+        sys.exit(1)
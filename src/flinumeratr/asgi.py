@@ -0,0 +1,243 @@
+"""
+An ASGI entry point for Flinumeratr, which serves /see_photos asynchronously.
+
+You can run it with any ASGI server, e.g.
+
+    uvicorn flinumeratr.asgi:app
+
+The /see_photos view fetches photos with the async fetch layer in
+``flinumeratr.async_flickr_api``, so a single process can have hundreds
+of requests waiting on Flickr at once.  It renders the same templates
+as the Flask view.  Jinja renders synchronously, so we render the page
+in a thread, a chunk at a time, to keep the event loop free.
+
+Every other route (the homepage, static files, /export) is passed
+through to the Flask app, which runs in a pool of threads.
+"""
+
+import asyncio
+import contextvars
+
+from asgiref.typing import (
+    ASGIReceiveCallable,
+    ASGISendCallable,
+    HTTPScope,
+    Scope,
+)
+from asgiref.wsgi import WsgiToAsgi
+from flask import redirect, request, url_for
+from flickr_api import ResourceNotFound
+from flickr_url_parser import NotAFlickrUrl, UnrecognisedUrl
+import werkzeug
+from werkzeug.test import EnvironBuilder
+
+from .app import (
+    SIZE_PROFILE,
+    api,
+    app as flask_app,
+    get_count_pages,
+    get_pagination,
+    get_requested_page,
+    instrument_response,
+    make_conditional,
+    render_not_found,
+    render_photos,
+    render_rate_limited,
+    render_url_error,
+    start_prefetch,
+)
+from .async_flickr_api import AsyncFlickrApi, get_pages_from_flickr_url
+from .conditional import get_etag
+from .metrics import Timings, timed
+from .ratelimit import RateLimitExceeded
+from .resolution import resolve_flickr_url
+
+
+wsgi_app = WsgiToAsgi(flask_app)  # type: ignore[no-untyped-call]
+
+async_api = AsyncFlickrApi.from_api(api)
+
+
+# How much of the rendered page we buffer before sending it to the client.
+# Jinja yields lots of tiny strings, and sending each of them separately
+# is slow.
+CHUNK_SIZE = 16 * 1024
+
+
+async def app(
+    scope: Scope, receive: ASGIReceiveCallable, send: ASGISendCallable
+) -> None:
+    """
+    The ASGI application.
+
+    Only GET and HEAD requests for /see_photos go to the async view.
+    Everything else goes to the Flask app, so other methods get the
+    same responses as they do under gunicorn (e.g. a 405 for a POST).
+    """
+    if (
+        scope["type"] == "http"
+        and scope["path"] == "/see_photos"
+        and scope["method"] in {"GET", "HEAD"}
+    ):
+        await see_photos(scope, send)
+    elif scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    else:
+        await wsgi_app(scope, receive, send)
+
+
+async def lifespan(receive: ASGIReceiveCallable, send: ASGISendCallable) -> None:
+    """
+    Handle the ASGI lifespan protocol, so we can close our pool of
+    connections to Flickr when the server shuts down.
+    """
+    while True:
+        message = await receive()
+
+        # The lifespan protocol only has two messages: startup and shutdown.
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        else:
+            await async_api.client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def see_photos(scope: HTTPScope, send: ASGISendCallable) -> None:
+    """
+    The async version of the /see_photos view.
+
+    We build a Flask request context from the ASGI scope, so we can use
+    the same helpers and templates as the Flask view.
+    """
+    environ = EnvironBuilder(
+        path=scope["path"],
+        base_url=f"{scope['scheme']}://localhost{scope['root_path']}",
+        query_string=scope["query_string"].decode("latin1"),
+        headers=[(k.decode("latin1"), v.decode("latin1")) for k, v in scope["headers"]],
+    ).get_environ()
+
+    with flask_app.request_context(environ):
+        # Flask pushes the request context again when it starts
+        # a streamed template, and pops it when the template is done,
+        # and both have to happen in the same context.  We render the
+        # page in a thread (see below), so we run the view in a copy of
+        # the context that we can also use in the thread.
+        render_context = contextvars.copy_context()
+        resp = await asyncio.create_task(_see_photos(), context=render_context)
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": resp.status_code,
+                "headers": [
+                    (k.lower().encode("latin1"), v.encode("latin1"))
+                    for k, v in resp.headers.items()
+                ],
+                "trailers": False,
+            }
+        )
+
+        # Jinja renders synchronously, so we render the page in a thread,
+        # a chunk at a time, so we don't hold up other requests.
+        chunks = resp.iter_encoded()
+
+        def render_chunk() -> tuple[bytes, bool]:
+            """
+            Render the next chunk of the page, and return it along with
+            whether there's more to come.
+            """
+            buffer = bytearray()
+
+            for chunk in chunks:
+                buffer += chunk
+
+                if len(buffer) >= CHUNK_SIZE:
+                    return bytes(buffer), True
+
+            return bytes(buffer), False
+
+        try:
+            # A HEAD request gets the same headers as a GET, but no body,
+            # so we don't render the page.  We do start the stream, because
+            # closing a stream that hasn't started doesn't close the stream
+            # inside it, and Flask only pops the request context it pushed
+            # when that inner stream is closed.
+            if scope["method"] == "HEAD":
+
+                def start_stream() -> None:
+                    next(chunks, b"")
+
+                await asyncio.to_thread(render_context.run, start_stream)
+                await send(
+                    {"type": "http.response.body", "body": b"", "more_body": False}
+                )
+                return
+
+            more_body = True
+
+            while more_body:
+                body, more_body = await asyncio.to_thread(
+                    render_context.run, render_chunk
+                )
+                await send(
+                    {"type": "http.response.body", "body": body, "more_body": more_body}
+                )
+        finally:
+            await asyncio.to_thread(render_context.run, resp.close)
+
+
+async def _see_photos() -> werkzeug.Response:
+    """
+    Fetch the photos for a /see_photos request, and return the response.
+
+    This mirrors ``flinumeratr.app.see_photos``.
+    """
+    flickr_url = request.args.get("flickr_url")
+
+    if not flickr_url:
+        return redirect(url_for("homepage"))
+
+    timings = Timings()
+
+    with timings.activate():
+        # Resolving a short URL may need an HTTP request, which we do in
+        # a thread so it doesn't block the event loop.
+        try:
+            with timed("parse_url"):
+                parsed_url = await asyncio.to_thread(
+                    resolve_flickr_url, flickr_url, index=async_api.resolution_index
+                )
+        except (UnrecognisedUrl, NotAFlickrUrl) as err:
+            return instrument_response(
+                render_url_error(flickr_url, err), timings, url_type="invalid"
+            )
+
+        parsed_url = get_requested_page(parsed_url)
+        count_pages = get_count_pages()
+
+        try:
+            photo_data, photos = await get_pages_from_flickr_url(
+                async_api,
+                parsed_url,
+                count_pages=count_pages,
+                size_profile=SIZE_PROFILE,
+            )
+        except ResourceNotFound:
+            resp: str | werkzeug.Response = render_not_found(flickr_url, parsed_url)
+        except RateLimitExceeded:
+            resp = render_rate_limited(flickr_url)
+        else:
+            pagination = get_pagination(
+                flickr_url, parsed_url, photo_data, count_pages=count_pages
+            )
+
+            # We prefetch with the sync client, in a background thread.
+            start_prefetch(async_api.api, parsed_url, pagination)
+
+            resp = make_conditional(
+                render_photos(flickr_url, parsed_url, photo_data, photos, pagination),
+                get_etag(parsed_url, photo_data, count_pages=count_pages),
+            )
+
+    return instrument_response(resp, timings, url_type=parsed_url["type"])
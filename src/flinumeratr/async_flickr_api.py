@@ -0,0 +1,661 @@
+"""
+An async version of the fetch layer in ``flinumeratr.flickr_api``.
+
+The sync functions block a worker for the whole round trip to Flickr,
+so each gunicorn sync worker can only serve one request at a time.
+These functions make the same API calls on a pooled ``httpx.AsyncClient``,
+so a single process can have hundreds of requests in flight.
+
+Only the network I/O is async.  We build the same API requests and parse
+the responses with the same functions as the sync code, so the two paths
+can't drift apart.
+
+A few things still go through the sync ``FlickrApi``, in a thread:
+
+*   Single photos, which need two small API calls that we parse with
+    the flickr-photos-api library
+*   The list of licenses, which we fetch once and then cache
+*   The response cache and resolution index, which are local SQLite files
+*   Parsing the XML of each response, which is CPU-bound and would
+    otherwise hold up every other request on the event loop
+
+"""
+
+import asyncio
+from collections.abc import Mapping
+import typing
+from xml.etree import ElementTree as ET
+
+from flickr_api import FlickrApi, ResourceNotFound
+from flickr_api.api.base import is_retryable
+from flickr_api.exceptions import InvalidXmlException
+from flickr_url_parser import ParseResult, parse_flickr_url
+import httpx
+from nitrate.xml import find_required_elem
+from tenacity import (
+    retry,
+    retry_if_exception,
+    RetryError,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from .cache import CachingFlickrApi, ResponseCache
+from .flickr_api import (
+    FLICKR_PER_PAGE,
+    MAX_PER_PAGE,
+    PER_PAGE,
+    CollectionRequest,
+    _album_request,
+    _gallery_request,
+    _get_single_photo,
+    _group_pool_request,
+    _parse_album_response,
+    _parse_gallery_response,
+    _parse_group_lookup,
+    _parse_group_pool_response,
+    _parse_photostream_response,
+    _parse_tag_response,
+    _photostream_request,
+    _tag_request,
+    first_api_page,
+    in_flickr_pages,
+    plan_page_requests,
+    raise_api_error,
+    skip_photos,
+)
+from .models import (
+    CollectionOfPhotos,
+    GroupInfo,
+    Photo,
+    PhotosFromUrl,
+    PhotosInAlbum,
+    PhotosInGallery,
+    PhotosInGroup,
+)
+from .metrics import API_CALLS, timed
+from .resolution import ResolutionIndex
+from .singleflight import AsyncSingleFlight, flight_key
+from .sizes import DEFAULT_SIZE_PROFILE, SizeProfile
+
+
+class AsyncFlickrApi:
+    """
+    An async client for the Flickr API.
+
+    This wraps a sync ``FlickrApi``, which it uses for the few calls
+    that aren't worth doing asynchronously (see the module docstring),
+    and for its response cache and resolution index, if it has them.
+    """
+
+    def __init__(self, api: FlickrApi, client: httpx.AsyncClient) -> None:
+        client.base_url = httpx.URL("https://api.flickr.com/services/rest/")
+        self.api = api
+        self.client = client
+        self.single_flight = AsyncSingleFlight()
+
+        self._licenses_loaded = False
+
+    @classmethod
+    def from_api(cls, api: FlickrApi, *, max_connections: int = 200) -> typing.Self:
+        """
+        Create an async client with the same API key and User-Agent as
+        an existing sync client.
+        """
+        client = httpx.AsyncClient(
+            params=api.client.params,
+            headers={"User-Agent": api.client.headers["User-Agent"]},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+        return cls(api=api, client=client)
+
+    @property
+    def response_cache(self) -> ResponseCache | None:
+        """
+        The sync API's response cache, if it has one.
+        """
+        return (
+            self.api.response_cache if isinstance(self.api, CachingFlickrApi) else None
+        )
+
+    @property
+    def resolution_index(self) -> ResolutionIndex | None:
+        """
+        The sync API's resolution index, if it has one.
+        """
+        return (
+            self.api.resolution_index
+            if isinstance(self.api, CachingFlickrApi)
+            else None
+        )
+
+    async def call(
+        self,
+        *,
+        method: str,
+        params: Mapping[str, str | int] | None = None,
+        exceptions: dict[str, Exception] | None = None,
+    ) -> ET.Element:
+        """
+        Call the Flickr API and return the XML of the result, using
+        a cached response if we have one.
+
+        This mirrors ``CachingFlickrApi.call()``, but only supports GET.
+        """
+        response_cache = self.response_cache
+
+        if response_cache is not None:
+            with timed("cache"):
+                cached = await asyncio.to_thread(
+                    response_cache.lookup, method, params or {}
+                )
+
+                if cached is not None:
+                    if cached["is_stale"]:
+                        # We only have a response cache if the sync API
+                        # is a ``CachingFlickrApi``, which does the refresh.
+                        await asyncio.to_thread(
+                            typing.cast(
+                                CachingFlickrApi, self.api
+                            ).refresh_in_background,
+                            method=method,
+                            params=params,
+                            exceptions=exceptions,
+                        )
+
+                    return await asyncio.to_thread(ET.fromstring, cached["body"])
+
+        async def call_api() -> ET.Element:
+            API_CALLS.inc(method=method)
+
+            try:
+                with timed("api_call"):
+                    return await self._call_api(
+                        method=method, params=params, exceptions=exceptions or {}
+                    )
+            except RetryError as retry_err:  # pragma: no cover
+                retry_err.reraise()
+
+        if isinstance(self.api, CachingFlickrApi) and self.api.rate_budget is not None:
+            xml = await self.api.rate_budget.async_call(
+                call_api, priority=self.api.priority, max_wait=self.api.max_wait
+            )
+        else:
+            xml = await call_api()
+
+        if response_cache is not None:
+            priority = typing.cast(CachingFlickrApi, self.api).priority
+
+            def save_response() -> None:
+                response_cache.set(
+                    method,
+                    params or {},
+                    body=ET.tostring(xml, encoding="unicode"),
+                    priority=priority,
+                )
+
+            with timed("cache"):
+                await asyncio.to_thread(save_response)
+
+        return xml
+
+    @retry(
+        retry=retry_if_exception(is_retryable),
+        stop=stop_after_attempt(5),
+        wait=wait_random_exponential(),
+    )
+    async def _call_api(
+        self,
+        *,
+        method: str,
+        params: Mapping[str, str | int] | None,
+        exceptions: dict[str, Exception],
+    ) -> ET.Element:
+        """
+        Call the Flickr API and return the XML of the result.
+
+        This mirrors ``HttpxImplementation._call_api()``, and is retried
+        on the same errors.
+        """
+        resp = await self.client.get(
+            "", params={"method": method, **(params or {})}, timeout=15
+        )
+        resp.raise_for_status()
+
+        try:
+            xml = await asyncio.to_thread(ET.fromstring, resp.text)
+        except ET.ParseError as err:
+            raise InvalidXmlException(
+                f"Unable to parse response as XML ({resp.text!r}), got error {err}"
+            )
+
+        if xml.attrib["stat"] == "fail":
+            errors = find_required_elem(xml, path=".//err").attrib
+            raise_api_error(dict(errors), exceptions=exceptions)
+
+        return xml
+
+    async def ensure_licenses(self) -> None:
+        """
+        Make sure the sync API has fetched the list of licenses.
+
+        We parse photos with the sync API's ``lookup_license_by_id``,
+        which fetches the licenses the first time it's called.  We
+        don't want that to block the event loop, so we load them in
+        a thread before parsing any photos.
+        """
+        if not self._licenses_loaded:
+            await asyncio.to_thread(self.api.get_licenses)
+            self._licenses_loaded = True
+
+    async def ensure_user_id(self, *, user_url: str) -> str:
+        """
+        Given the URL to a user's profile page, return their user ID.
+
+        This mirrors ``FlickrApi._ensure_user_id()`` and
+        ``CachingFlickrApi._lookup_user_id_for_user_url()``.
+        """
+        parsed_user_url = parse_flickr_url(user_url)
+        assert parsed_user_url["type"] == "user"
+
+        if parsed_user_url["user_id"]:
+            return parsed_user_url["user_id"]
+
+        resolution_index = self.resolution_index
+
+        if resolution_index is not None:
+            user_id: str | None = await asyncio.to_thread(
+                resolution_index.get, "user", user_url
+            )
+
+            if user_id is not None:
+                return user_id
+
+        # See https://www.flickr.com/services/api/flickr.urls.lookupUser.htm
+        lookup_resp = await self.call(
+            method="flickr.urls.lookupUser",
+            params={"url": user_url},
+            exceptions={
+                "1": ResourceNotFound(f"Could not find user with URL: {user_url!r}")
+            },
+        )
+        user_id = find_required_elem(lookup_resp, path=".//user").attrib["id"]
+
+        if resolution_index is not None:
+            await asyncio.to_thread(resolution_index.set, "user", user_url, user_id)
+
+        return user_id
+
+    async def call_collection_api(
+        self, request: CollectionRequest, *, page: int, per_page: int
+    ) -> ET.Element:
+        """
+        Fetch a single page of a collection from the Flickr API.
+        """
+        await self.ensure_licenses()
+
+        return await self.call(
+            method=request["method"],
+            params={**request["params"], "page": page, "per_page": per_page},
+            exceptions=request["exceptions"],
+        )
+
+
+async def get_photos_from_flickr_url(
+    api: AsyncFlickrApi,
+    parsed_url: ParseResult,
+    *,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> PhotosFromUrl:
+    """
+    Given a URL on Flickr.com that's been parsed with flickr-url-parser,
+    return the photos at that URL (if possible).
+    """
+    photo_data, _ = await get_pages_from_flickr_url(
+        api, parsed_url, count_pages=1, size_profile=size_profile
+    )
+
+    return photo_data
+
+
+class AsyncPageFetcher(typing.Protocol):
+    """
+    An async function that fetches a single page of photos from a collection.
+    """
+
+    async def __call__(  # pragma: no cover
+        self, *, page: int, per_page: int
+    ) -> CollectionOfPhotos: ...
+
+
+async def get_page_fetcher(
+    api: AsyncFlickrApi,
+    parsed_url: ParseResult,
+    *,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> AsyncPageFetcher:
+    """
+    Given a URL on Flickr.com that points to a collection of photos,
+    return an async function that fetches individual pages of that collection.
+
+    This is the async version of ``flickr_api.get_page_fetcher``.
+    """
+    with timed("resolve"):
+        if parsed_url["type"] == "album":
+            album_id = parsed_url["album_id"]
+            user_id = await api.ensure_user_id(user_url=parsed_url["user_url"])
+
+            async def fetch_album_page(*, page: int, per_page: int) -> PhotosInAlbum:
+                return await get_photos_in_album(
+                    api,
+                    user_id=user_id,
+                    album_id=album_id,
+                    page=page,
+                    per_page=per_page,
+                    size_profile=size_profile,
+                )
+
+            return fetch_album_page
+        elif parsed_url["type"] == "user":
+            user_id = await api.ensure_user_id(user_url=parsed_url["user_url"])
+
+            async def fetch_photostream_page(
+                *, page: int, per_page: int
+            ) -> CollectionOfPhotos:
+                return await get_photos_in_user_photostream(
+                    api,
+                    user_id=user_id,
+                    page=page,
+                    per_page=per_page,
+                    size_profile=size_profile,
+                )
+
+            return fetch_photostream_page
+        elif parsed_url["type"] == "gallery":
+            gallery_id = parsed_url["gallery_id"]
+
+            async def fetch_gallery_page(
+                *, page: int, per_page: int
+            ) -> PhotosInGallery:
+                return await get_photos_in_gallery(
+                    api,
+                    gallery_id=gallery_id,
+                    page=page,
+                    per_page=per_page,
+                    size_profile=size_profile,
+                )
+
+            return fetch_gallery_page
+        elif parsed_url["type"] == "group":
+            group_info = await lookup_group_from_url(api, url=parsed_url["group_url"])
+
+            async def fetch_group_page(*, page: int, per_page: int) -> PhotosInGroup:
+                return await get_photos_in_group_pool(
+                    api,
+                    group_info=group_info,
+                    page=page,
+                    per_page=per_page,
+                    size_profile=size_profile,
+                )
+
+            return fetch_group_page
+        elif parsed_url["type"] == "tag":
+            tag = parsed_url["tag"]
+
+            async def fetch_tag_page(*, page: int, per_page: int) -> CollectionOfPhotos:
+                return await get_photos_with_tag(
+                    api,
+                    tag=tag,
+                    page=page,
+                    per_page=per_page,
+                    size_profile=size_profile,
+                )
+
+            return fetch_tag_page
+        else:  # pragma: no cover
+            raise TypeError(f"Unrecognised URL type: {parsed_url['type']}")
+
+
+async def get_pages_from_flickr_url(
+    api: AsyncFlickrApi,
+    parsed_url: ParseResult,
+    *,
+    count_pages: int,
+    per_page: int = PER_PAGE["interactive"],
+    max_per_page: int = MAX_PER_PAGE,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> tuple[PhotosFromUrl, list[Photo]]:
+    """
+    Given a URL on Flickr.com that's been parsed with flickr-url-parser,
+    return the first page of photos at that URL, and the photos on up to
+    ``count_pages`` pages, starting from that page.
+
+    We fetch the first page to find out how many pages there are, then
+    make all the later calls concurrently.  Pages and page sizes work
+    the same way as the sync ``get_pages_from_flickr_url``.
+
+    If there's already an identical lookup in flight, we wait for it
+    and share its result.
+    """
+    return await api.single_flight.do(
+        flight_key(
+            parsed_url,
+            page=typing.cast(int, parsed_url.get("page", 1)),
+            count_pages=count_pages,
+            per_page=per_page,
+            max_per_page=max_per_page,
+            size_profile=size_profile,
+        ),
+        lambda: _get_pages_from_flickr_url(
+            api,
+            parsed_url,
+            count_pages=count_pages,
+            per_page=per_page,
+            max_per_page=max_per_page,
+            size_profile=size_profile,
+        ),
+    )
+
+
+async def _get_pages_from_flickr_url(
+    api: AsyncFlickrApi,
+    parsed_url: ParseResult,
+    *,
+    count_pages: int,
+    per_page: int,
+    max_per_page: int,
+    size_profile: SizeProfile,
+) -> tuple[PhotosFromUrl, list[Photo]]:
+    """
+    Fetch the photos at a URL; see ``get_pages_from_flickr_url``.
+    """
+    if parsed_url["type"] == "single_photo":
+        photo = await asyncio.to_thread(
+            _get_single_photo, api.api, photo_id=parsed_url["photo_id"]
+        )
+        return photo, [photo]
+    elif parsed_url["type"] == "homepage":  # pragma: no cover
+        raise TypeError(f"Unrecognised URL type: {parsed_url['type']}")
+
+    fetch_page = await get_page_fetcher(api, parsed_url, size_profile=size_profile)
+
+    first = first_api_page(parsed_url["page"], per_page=per_page)
+    photo_data = in_flickr_pages(
+        skip_photos(
+            await fetch_page(page=first["page"], per_page=per_page),
+            skip=first["skip"],
+        ),
+        per_page=per_page,
+    )
+
+    last_page = min(parsed_url["page"] + count_pages - 1, photo_data["count_pages"])
+    requests = plan_page_requests(
+        first["page"] * per_page,
+        last_page * FLICKR_PER_PAGE,
+        max_per_page=max_per_page,
+    )
+
+    later_pages = await asyncio.gather(
+        *(fetch_page(page=req["page"], per_page=req["per_page"]) for req in requests)
+    )
+
+    start = (parsed_url["page"] - 1) * FLICKR_PER_PAGE
+    photos = list(photo_data["photos"][: last_page * FLICKR_PER_PAGE - start])
+
+    for req, collection in zip(requests, later_pages):
+        if not collection["photos"][req["skip"] :]:
+            break
+
+        photos.extend(collection["photos"][req["skip"] :])
+
+    return photo_data, photos
+
+
+async def get_photos_in_album(
+    api: AsyncFlickrApi,
+    *,
+    user_id: str,
+    album_id: str,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> PhotosInAlbum:
+    """
+    Get a page of photos from an album.
+    """
+    resp = await api.call_collection_api(
+        _album_request(user_id=user_id, album_id=album_id, size_profile=size_profile),
+        page=page,
+        per_page=per_page,
+    )
+
+    return await asyncio.to_thread(
+        _parse_album_response, api.api, resp, size_profile=size_profile
+    )
+
+
+async def get_photos_in_gallery(
+    api: AsyncFlickrApi,
+    *,
+    gallery_id: str,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> PhotosInGallery:
+    """
+    Get a page of photos in a gallery.
+    """
+    resp = await api.call_collection_api(
+        _gallery_request(gallery_id=gallery_id, size_profile=size_profile),
+        page=page,
+        per_page=per_page,
+    )
+
+    return await asyncio.to_thread(
+        _parse_gallery_response, api.api, resp, size_profile=size_profile
+    )
+
+
+async def get_photos_in_user_photostream(
+    api: AsyncFlickrApi,
+    *,
+    user_id: str,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> CollectionOfPhotos:
+    """
+    Get a page of photos from a user's photostream.
+    """
+    resp = await api.call_collection_api(
+        _photostream_request(user_id=user_id, size_profile=size_profile),
+        page=page,
+        per_page=per_page,
+    )
+
+    return await asyncio.to_thread(
+        _parse_photostream_response, api.api, resp, size_profile=size_profile
+    )
+
+
+async def lookup_group_from_url(api: AsyncFlickrApi, *, url: str) -> GroupInfo:
+    """
+    Given the link to a group's photos or profile, return some info.
+
+    If the sync API has a resolution index, we check that first.
+    """
+    resolution_index = api.resolution_index
+
+    if resolution_index is not None:
+        group_info: GroupInfo | None = await asyncio.to_thread(
+            resolution_index.get, "group", url
+        )
+
+        if group_info is not None:
+            return group_info
+
+    # See https://www.flickr.com/services/api/flickr.urls.lookupGroup.html
+    resp = await api.call(
+        method="flickr.urls.lookupGroup",
+        params={"url": url},
+        exceptions={"1": ResourceNotFound(f"Could not find group with URL: {url!r}")},
+    )
+
+    group_info = _parse_group_lookup(resp)
+
+    if resolution_index is not None:
+        await asyncio.to_thread(resolution_index.set, "group", url, group_info)
+
+    return group_info
+
+
+async def get_photos_in_group_pool(
+    api: AsyncFlickrApi,
+    *,
+    group_info: GroupInfo,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> PhotosInGroup:
+    """
+    Get a page of photos in a group pool.
+    """
+    resp = await api.call_collection_api(
+        _group_pool_request(group_id=group_info["id"], size_profile=size_profile),
+        page=page,
+        per_page=per_page,
+    )
+
+    return await asyncio.to_thread(
+        _parse_group_pool_response,
+        api.api,
+        resp,
+        group_info=group_info,
+        size_profile=size_profile,
+    )
+
+
+async def get_photos_with_tag(
+    api: AsyncFlickrApi,
+    *,
+    tag: str,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> CollectionOfPhotos:
+    """
+    Get a page of photos in a tag.
+    """
+    resp = await api.call_collection_api(
+        _tag_request(tag=tag, size_profile=size_profile),
+        page=page,
+        per_page=per_page,
+    )
+
+    return await asyncio.to_thread(
+        _parse_tag_response, api.api, resp, size_profile=size_profile
+    )
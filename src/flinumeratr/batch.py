@@ -0,0 +1,208 @@
+"""
+Look up the photos at lots of Flickr URLs at once.
+
+This is for people who have a list of URLs (e.g. albums and galleries
+in a curation spreadsheet) and want the photos behind all of them.
+
+We parse all the URLs, then fetch the photos for each distinct target
+in a pool of threads.  If several URLs point to the same thing (e.g.
+``/photos/user/albums/123`` and ``/photos/user/albums/123/page2``), we
+only fetch it once -- we use the same key as ``SingleFlight``, so the
+two agree on what counts as the same thing.  Results are yielded as soon as they're ready, so
+you don't have to wait for the slowest URL.
+
+Batch lookups are for lots of small collections, not a few huge ones.
+Every photo in a result is held in memory until we've sent it, so we
+stop at ``MAX_PHOTOS_PER_URL`` photos, and return an error pointing
+at the job queue instead.
+"""
+
+from collections.abc import Generator, Iterable
+import concurrent.futures
+import itertools
+import json
+import typing
+
+from flickr_api import FlickrApi
+from flickr_url_parser import ParseResult
+
+from .compact import CompactPhoto, PhotoInterner
+from .export import photo_to_dict
+from .flickr_api import PER_PAGE, stream_photos_from_flickr_url
+from .resolution import ResolutionIndex, resolve_flickr_url
+from .singleflight import flight_key
+
+
+# The most photos we'll fetch for a single URL in a batch.
+MAX_PHOTOS_PER_URL = 10_000
+
+
+class TooManyPhotos(Exception):
+    """
+    Thrown when a URL in a batch has more photos than we'll fetch.
+    """
+
+
+@typing.final
+class BatchSuccess(typing.TypedDict):
+    flickr_url: str
+    parsed_url: ParseResult
+    photos: list[CompactPhoto]
+
+
+@typing.final
+class BatchError(typing.TypedDict):
+    flickr_url: str
+    error: Exception
+
+
+BatchResult = BatchSuccess | BatchError
+
+
+def lookup_flickr_urls(
+    api: FlickrApi,
+    flickr_urls: Iterable[str],
+    *,
+    concurrency: int = 8,
+    per_page: int = PER_PAGE["bulk"],
+    max_photos: int = MAX_PHOTOS_PER_URL,
+    index: ResolutionIndex | None = None,
+) -> Generator[BatchResult, None, None]:
+    """
+    Look up every photo at each of the given URLs, and yield a result
+    for each URL as soon as it's ready.
+
+    At most ``concurrency`` URLs are being parsed or fetched at once,
+    however many URLs there are.  Each distinct URL gets exactly one
+    result, which is either the photos or the error we got looking
+    them up -- an error for one URL never stops the others.
+
+    We only keep the photos from a fetch for as long as another URL
+    might need them, i.e. until we've parsed every URL.  We hold them
+    as ``CompactPhoto`` instances, which share owners and licenses
+    between all the photos in the batch.
+    """
+    # Outcomes of the fetches we've finished, and the URLs which are
+    # waiting for each fetch we haven't.
+    outcomes: dict[str, list[CompactPhoto] | Exception] = {}
+    waiting: dict[str, list[tuple[str, ParseResult]]] = {}
+
+    parse_futures: dict[concurrent.futures.Future[ParseResult], str] = {}
+    fetch_futures: dict[concurrent.futures.Future[list[CompactPhoto]], str] = {}
+
+    interner = PhotoInterner()
+
+    def fetch_photos(parsed_url: ParseResult) -> list[CompactPhoto]:
+        photos = list(
+            interner.compact_all(
+                itertools.islice(
+                    stream_photos_from_flickr_url(api, parsed_url, per_page=per_page),
+                    max_photos + 1,
+                )
+            )
+        )
+
+        if len(photos) > max_photos:
+            raise TooManyPhotos(
+                f"There are more than {max_photos:,} photos at this URL; "
+                "submit it as a job at /jobs instead"
+            )
+
+        return photos
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for url in dict.fromkeys(flickr_urls):
+            parse_futures[executor.submit(resolve_flickr_url, url, index=index)] = url
+
+        pending: set[concurrent.futures.Future[typing.Any]] = set(parse_futures)
+
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+                for future in done:
+                    if future in parse_futures:
+                        url = parse_futures.pop(future)
+
+                        try:
+                            parsed_url = future.result()
+                        except Exception as err:
+                            yield {"flickr_url": url, "error": err}
+                            continue
+
+                        # We fetch every page, so we use the key for
+                        # the whole collection.
+                        key = flight_key(parsed_url)
+
+                        if key in outcomes:
+                            yield _create_result(url, parsed_url, outcomes[key])
+                        elif key in waiting:
+                            waiting[key].append((url, parsed_url))
+                        else:
+                            waiting[key] = [(url, parsed_url)]
+                            fetch = executor.submit(fetch_photos, parsed_url)
+                            fetch_futures[fetch] = key
+                            pending.add(fetch)
+                    else:
+                        key = fetch_futures.pop(future)
+                        outcome: list[CompactPhoto] | Exception
+
+                        try:
+                            outcome = future.result()
+                        except Exception as err:
+                            outcome = err
+
+                        for url, parsed_url in waiting.pop(key):
+                            yield _create_result(url, parsed_url, outcome)
+
+                        if parse_futures:
+                            outcomes[key] = outcome
+
+                # Once we've parsed every URL, no more URLs can point
+                # to a fetch we've finished.
+                if not parse_futures:
+                    outcomes.clear()
+        finally:
+            # If the caller stops iterating early, don't bother with
+            # any lookups that haven't started yet.
+            for future in pending:
+                future.cancel()
+
+
+def _create_result(
+    flickr_url: str,
+    parsed_url: ParseResult,
+    outcome: list[CompactPhoto] | Exception,
+) -> BatchResult:
+    if isinstance(outcome, Exception):
+        return {"flickr_url": flickr_url, "error": outcome}
+    else:
+        return {"flickr_url": flickr_url, "parsed_url": parsed_url, "photos": outcome}
+
+
+def result_to_json(result: BatchResult) -> str:
+    """
+    Serialise a batch result as a single line of JSON.
+    """
+    if "error" in result:
+        return json.dumps(
+            {
+                "flickr_url": result["flickr_url"],
+                "error": {
+                    "type": type(result["error"]).__name__,
+                    "message": str(result["error"]),
+                },
+            },
+            ensure_ascii=False,
+        )
+    else:
+        return json.dumps(
+            {
+                "flickr_url": result["flickr_url"],
+                "parsed_url": result["parsed_url"],
+                "photos": [photo_to_dict(p.to_photo()) for p in result["photos"]],
+            },
+            ensure_ascii=False,
+        )
@@ -0,0 +1,591 @@
+"""
+A cache for responses from the Flickr API.
+
+In prod we run several gunicorn workers, and popular links get loaded
+over and over again.  This cache stores the raw XML of API responses
+in a SQLite database, so it can be shared between all the workers --
+if one worker has fetched an album, the others can reuse that response
+without going back to Flickr.
+
+Once a response is older than its TTL, it's "stale".  We keep serving
+stale responses for a while longer (``MAX_STALE``), so visitors don't
+have to wait for Flickr, and refresh them in a background thread.
+"""
+
+from collections.abc import Callable, Iterator, Mapping
+import concurrent.futures
+import contextlib
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import typing
+from xml.etree import ElementTree as ET
+
+from flickr_api import FlickrApi, ResourceNotFound
+from flickr_api.api.base import HttpMethod
+
+from .metrics import API_CALLS, CACHE_REFRESHES, CACHE_REQUESTS, timed
+from .ratelimit import Priority, RateBudget
+from .resolution import ResolutionIndex
+from .singleflight import SingleFlight
+
+
+T = typing.TypeVar("T")
+
+# How long we cache responses from each API method, in seconds.
+#
+# Things like licenses and URL lookups almost never change, so we can
+# cache them for a long time.  Collections change whenever somebody
+# uploads a new photo, so we only cache them for a few minutes.
+TTLS: dict[str, int] = {
+    "flickr.photos.licenses.getInfo": 24 * 60 * 60,
+    "flickr.urls.lookupUser": 24 * 60 * 60,
+    "flickr.urls.lookupGroup": 24 * 60 * 60,
+    "flickr.photos.getInfo": 15 * 60,
+    "flickr.photos.getSizes": 60 * 60,
+    "flickr.photosets.getPhotos": 10 * 60,
+    "flickr.galleries.getPhotos": 10 * 60,
+    "flickr.people.getPublicPhotos": 5 * 60,
+    "flickr.groups.pools.getPhotos": 5 * 60,
+    "flickr.photos.search": 5 * 60,
+}
+
+DEFAULT_TTL = 5 * 60
+
+# How long we keep serving a response after its TTL, while we refresh
+# it in the background.  After this, it's gone from the cache, and the
+# next request has to wait for Flickr.
+MAX_STALE = 60 * 60
+
+# How long one process gets to refresh a stale response before
+# another process is allowed to try.
+REFRESH_TIMEOUT = 60
+
+# The most bytes of responses we keep, and how many of those bytes can
+# be responses to bulk calls (exports, jobs, batch lookups).  Bulk calls
+# walk through huge collections and only read each page once, so
+# without a limit of their own, they'd push everything else out.
+MAX_CACHE_BYTES = 500_000_000
+MAX_BULK_BYTES = 100_000_000
+
+# We only record that a response has been used if we haven't recorded
+# it in the last minute, so reading a popular response doesn't have to
+# write to the database every time.  The LRU order is only accurate to
+# the minute, which is plenty.
+LAST_USED_RESOLUTION = 60
+
+
+def cache_key(method: str, params: Mapping[str, str | int]) -> str:
+    """
+    Returns the cache key for an API call.
+
+    The params are normalised, so two calls with the same params
+    in a different order (or passing ``page=2`` vs ``page="2"``)
+    get the same key.
+    """
+    normalised = sorted((k, str(v)) for k, v in params.items())
+
+    return hashlib.sha256(json.dumps([method, normalised]).encode("utf8")).hexdigest()
+
+
+class CachedResponse(typing.TypedDict):
+    body: str
+    is_stale: bool
+
+
+class ResponseCache:
+    """
+    A size-bounded LRU cache of API responses, stored in SQLite.
+
+    The size is the total bytes of the response bodies.  Responses to
+    bulk calls have a smaller limit of their own, and are evicted first.
+
+    We open a new connection for every operation, so a single instance
+    can be used from multiple threads, and multiple instances (e.g. in
+    different processes) can share the same database file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        max_bytes: int = MAX_CACHE_BYTES,
+        max_bulk_bytes: int = MAX_BULK_BYTES,
+        ttls: Mapping[str, int] = TTLS,
+        default_ttl: int = DEFAULT_TTL,
+        max_stale: int = MAX_STALE,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_bulk_bytes = max_bulk_bytes
+        self.ttls = ttls
+        self.default_ttl = default_ttl
+        self.max_stale = max_stale
+
+        with self._connect() as conn:
+            # Write-ahead logging means readers don't block writers,
+            # which is what we want with lots of concurrent workers.
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses(
+                    key TEXT PRIMARY KEY,
+                    method TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    refresh_at REAL NOT NULL DEFAULT 0,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    is_bulk INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses(last_used)"
+            )
+
+            # Databases created before we served stale responses don't
+            # have a refresh time; their entries are treated as stale.
+            # Databases created before we counted bytes don't have sizes;
+            # their entries count as empty until they're replaced.
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(responses)")}
+
+            for column in ("refresh_at REAL", "size INTEGER", "is_bulk INTEGER"):
+                if column.split()[0] not in columns:
+                    conn.execute(
+                        f"ALTER TABLE responses ADD COLUMN {column} NOT NULL DEFAULT 0"
+                    )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=10)
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(
+        self, method: str, params: Mapping[str, str | int]
+    ) -> CachedResponse | None:
+        """
+        Returns the cached response for this API call, and whether
+        it's stale, or ``None`` if it isn't in the cache (or has expired).
+        """
+        key = cache_key(method, params)
+        now = time.time()
+
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                SELECT body, refresh_at, last_used FROM responses
+                WHERE key = ? AND expires_at > ?
+                """,
+                (key, now),
+            ).fetchone()
+
+            if row is None:
+                CACHE_REQUESTS.inc(cache="response", result="miss")
+                return None
+
+            body, refresh_at, last_used = row
+
+            if last_used < now - LAST_USED_RESOLUTION:
+                conn.execute(
+                    "UPDATE responses SET last_used = ? WHERE key = ?", (now, key)
+                )
+
+        is_stale = refresh_at <= now
+
+        CACHE_REQUESTS.inc(cache="response", result="stale" if is_stale else "hit")
+
+        return {"body": body, "is_stale": is_stale}
+
+    def get(self, method: str, params: Mapping[str, str | int]) -> str | None:
+        """
+        Returns the cached response body for this API call, or ``None``
+        if it isn't in the cache (or is stale).
+        """
+        cached = self.lookup(method, params)
+
+        if cached is None or cached["is_stale"]:
+            return None
+        else:
+            return cached["body"]
+
+    def set(
+        self,
+        method: str,
+        params: Mapping[str, str | int],
+        body: str,
+        *,
+        priority: Priority = "interactive",
+    ) -> None:
+        """
+        Store the response body for this API call, which was made with
+        the given priority.
+
+        If the cache is full, the least recently used entries are evicted.
+        """
+        key = cache_key(method, params)
+        now = time.time()
+        refresh_at = now + self.ttls.get(method, self.default_ttl)
+        expires_at = refresh_at + self.max_stale
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO responses(
+                    key, method, body, expires_at, last_used, refresh_at,
+                    size, is_bulk
+                )
+                VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    key,
+                    method,
+                    body,
+                    expires_at,
+                    now,
+                    refresh_at,
+                    len(body.encode("utf8")),
+                    priority == "bulk",
+                ),
+            )
+
+            conn.execute("DELETE FROM responses WHERE expires_at <= ?", (now,))
+
+            # Evict the least recently used bulk responses until they fit
+            # in their own limit, then the least recently used responses
+            # of any kind until everything fits.
+            for min_is_bulk, max_bytes in (
+                (1, self.max_bulk_bytes),
+                (0, self.max_bytes),
+            ):
+                conn.execute(
+                    """
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM (
+                            SELECT
+                                key,
+                                SUM(size) OVER (ORDER BY last_used DESC) AS total
+                            FROM responses
+                            WHERE is_bulk >= ?
+                        )
+                        WHERE total > ?
+                    )
+                    """,
+                    (min_is_bulk, max_bytes),
+                )
+
+    def claim_refresh(self, method: str, params: Mapping[str, str | int]) -> bool:
+        """
+        Claim the right to refresh a stale response.  Returns ``False``
+        if it isn't stale, or another process is already refreshing it.
+
+        While we're refreshing a response, we push back its refresh time,
+        so other processes keep serving it without starting their own
+        refresh.  If we don't finish in ``REFRESH_TIMEOUT`` seconds,
+        e.g. because Flickr is down, another process can try.
+        """
+        now = time.time()
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                UPDATE responses SET refresh_at = ?
+                WHERE key = ? AND refresh_at <= ? AND expires_at > ?
+                """,
+                (now + REFRESH_TIMEOUT, cache_key(method, params), now, now),
+            )
+
+        return cursor.rowcount == 1
+
+    def delete(self, method: str, params: Mapping[str, str | int]) -> None:
+        """
+        Remove the response for this API call from the cache.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM responses WHERE key = ?", (cache_key(method, params),)
+            )
+
+
+# The threads that refresh stale responses in the background.  This is
+# shared by every API client in the process, so a burst of stale
+# responses can't start an unbounded number of threads.
+_refresh_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="flinumeratr-refresh"
+)
+
+
+def get_response_cache() -> ResponseCache | None:
+    """
+    Returns the response cache configured by the ``FLINUMERATR_CACHE_PATH``
+    environment variable, or ``None`` if caching is disabled.
+    """
+    try:
+        return ResponseCache(path=os.environ["FLINUMERATR_CACHE_PATH"])
+    except KeyError:
+        return None
+
+
+# The attributes of a ``CachingFlickrApi`` which its copies share.
+SHARED_ATTRIBUTES = {
+    "response_cache",
+    "resolution_index",
+    "single_flight",
+    "rate_budget",
+}
+
+
+class CachingFlickrApi(FlickrApi):
+    """
+    A Flickr API client that looks for responses in a ``ResponseCache``
+    before calling Flickr.
+
+    Only successful GET requests are cached -- if the API returns an
+    error, we'll try again next time.
+
+    If the cached response is stale, we return it immediately, and
+    refresh it in the background.
+
+    It also checks a ``ResolutionIndex`` before looking up user URLs,
+    and uses a ``SingleFlight`` to coalesce identical lookups.
+
+    Calls to Flickr take a token from the ``RateBudget``, if there is
+    one, with this client's ``priority``.  If ``max_wait`` is set, we
+    wait at most that many seconds for a token, rather than the
+    deadline for the priority.
+
+    If ``read_cache`` is False, we always call Flickr, but we still
+    store the responses in the cache.
+    """
+
+    response_cache: ResponseCache | None = None
+    resolution_index: ResolutionIndex | None = None
+    single_flight: SingleFlight | None = None
+    rate_budget: RateBudget | None = None
+    priority: Priority = "interactive"
+    max_wait: float | None = None
+    read_cache: bool = True
+
+    # The copies made by ``with_priority()``, keyed on
+    # ``(priority, max_wait)``.
+    _copies: dict[tuple[Priority, float | None], "CachingFlickrApi"]
+
+    def __setattr__(self, name: str, value: typing.Any) -> None:
+        super().__setattr__(name, value)
+
+        # If we swap out the caches or budget, throw away the copies
+        # that are still using the old ones.
+        if name in SHARED_ATTRIBUTES:
+            self.__dict__.pop("_copies", None)
+
+    def _copy(self) -> "CachingFlickrApi":
+        api = copy.copy(self)
+        api.__dict__.pop("_copies", None)
+        return api
+
+    def with_priority(
+        self, priority: Priority, *, max_wait: float | None = None
+    ) -> "CachingFlickrApi":
+        """
+        Returns a copy of this client which makes calls with a different
+        priority, and optionally a different ``max_wait``.  It shares
+        the HTTP client, caches and budget.
+
+        We only make one copy per priority, so the copy can reuse
+        the licenses it fetches -- until the caches or budget on this
+        client change, when we make a new copy.
+        """
+        copies: dict[tuple[Priority, float | None], CachingFlickrApi] = (
+            self.__dict__.setdefault("_copies", {})
+        )
+
+        try:
+            return copies[(priority, max_wait)]
+        except KeyError:
+            api = self._copy()
+            api.priority = priority
+            api.max_wait = max_wait
+            copies[(priority, max_wait)] = api
+            return api
+
+    def without_cache_reads(self) -> "CachingFlickrApi":
+        """
+        Returns a copy of this client which always gets fresh responses
+        from Flickr, for callers that can't use a cached or stale
+        response.  It shares the HTTP client, caches and budget.
+        """
+        api = self._copy()
+        api.read_cache = False
+        return api
+
+    def call(
+        self,
+        *,
+        http_method: HttpMethod = "GET",
+        method: str,
+        params: Mapping[str, str | int] | None = None,
+        exceptions: dict[str, Exception] | None = None,
+    ) -> ET.Element:
+        """
+        Call the Flickr API and return the XML of the result, using
+        a cached response if we have one.
+        """
+        if self.response_cache is None or http_method != "GET":
+            return self._call_flickr(
+                http_method=http_method,
+                method=method,
+                params=params,
+                exceptions=exceptions,
+            )
+
+        if self.read_cache:
+            with timed("cache"):
+                cached = self.response_cache.lookup(method, params or {})
+
+                if cached is not None:
+                    if cached["is_stale"]:
+                        self.refresh_in_background(
+                            method=method, params=params, exceptions=exceptions
+                        )
+
+                    return ET.fromstring(cached["body"])
+
+        xml = self._call_flickr(method=method, params=params, exceptions=exceptions)
+
+        with timed("cache"):
+            self.response_cache.set(
+                method,
+                params or {},
+                body=ET.tostring(xml, encoding="unicode"),
+                priority=self.priority,
+            )
+
+        return xml
+
+    def refresh_in_background(
+        self,
+        *,
+        method: str,
+        params: Mapping[str, str | int] | None,
+        exceptions: dict[str, Exception] | None,
+    ) -> concurrent.futures.Future[None] | None:
+        """
+        Start refreshing a stale response in a background thread, unless
+        another thread or process is already refreshing it.
+
+        Returns the future for the refresh, if we started one.
+        """
+        assert self.response_cache is not None
+
+        if not self.response_cache.claim_refresh(method, params or {}):
+            return None
+
+        return _refresh_executor.submit(
+            self._refresh, method=method, params=params, exceptions=exceptions
+        )
+
+    def _refresh(
+        self,
+        *,
+        method: str,
+        params: Mapping[str, str | int] | None,
+        exceptions: dict[str, Exception] | None,
+    ) -> None:
+        """
+        Fetch a fresh copy of a response, and store it in the cache.
+
+        If the photos have gone, we drop the stale response, so the next
+        request gets the error.  If Flickr returns any other error or
+        times out, we keep serving the stale response until it expires,
+        and another request will try the refresh again.
+        """
+        assert self.response_cache is not None
+
+        try:
+            xml = self._call_flickr(
+                method=method, params=params, exceptions=exceptions, priority="bulk"
+            )
+        except ResourceNotFound:
+            self.response_cache.delete(method, params or {})
+            CACHE_REFRESHES.inc(result="not_found")
+        except Exception:
+            CACHE_REFRESHES.inc(result="error")
+        else:
+            self.response_cache.set(
+                method,
+                params or {},
+                body=ET.tostring(xml, encoding="unicode"),
+                priority=self.priority,
+            )
+            CACHE_REFRESHES.inc(result="ok")
+
+    def _call_flickr(
+        self,
+        *,
+        http_method: HttpMethod = "GET",
+        method: str,
+        params: Mapping[str, str | int] | None,
+        exceptions: dict[str, Exception] | None,
+        priority: Priority | None = None,
+    ) -> ET.Element:
+        """
+        Call the Flickr API within our rate budget, and record the call
+        in our metrics.
+        """
+        return self.call_within_budget(
+            lambda: super(CachingFlickrApi, self).call(
+                http_method=http_method,
+                method=method,
+                params=params,
+                exceptions=exceptions,
+            ),
+            method=method,
+            priority=priority,
+        )
+
+    def call_within_budget(
+        self, fn: Callable[[], T], *, method: str, priority: Priority | None = None
+    ) -> T:
+        """
+        Call ``fn()``, which makes a call to the Flickr API ``method``,
+        within our rate budget, and record the call in our metrics.
+
+        This is for calls that don't go through ``call()``, e.g. because
+        they stream the response.
+        """
+
+        def call_api() -> T:
+            API_CALLS.inc(method=method)
+
+            with timed("api_call"):
+                return fn()
+
+        if self.rate_budget is None:
+            return call_api()
+        else:
+            return self.rate_budget.call(
+                call_api, priority=priority or self.priority, max_wait=self.max_wait
+            )
+
+    def _lookup_user_id_for_user_url(self, *, user_url: str) -> str:
+        """
+        Given the URL to a user's profile page, return their user ID.
+        """
+        if self.resolution_index is None:
+            return super()._lookup_user_id_for_user_url(user_url=user_url)
+
+        user_id: str | None = self.resolution_index.get("user", user_url)
+
+        if user_id is None:
+            user_id = super()._lookup_user_id_for_user_url(user_url=user_url)
+            self.resolution_index.set("user", user_url, user_id)
+
+        return user_id
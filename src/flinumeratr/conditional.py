@@ -0,0 +1,73 @@
+"""
+Validators for conditional GET requests.
+
+Shared links to the same album get loaded over and over again.  Rather
+than rendering the whole page every time, we send an ``ETag`` header
+that describes the state of the collection.  If a browser (or a reverse
+proxy in front of the app) already has a copy of the page for that
+state, it can send it back to us, and we reply with a 304 Not Modified
+-- which means we don't render the template, or fetch any of the
+later pages.
+
+We don't send a ``Last-Modified`` header, because there's no date that
+changes whenever the collection does.  The latest upload date doesn't
+change if a photo is removed, or an old photo is added to an album,
+and a client that only sent ``If-Modified-Since`` would get a 304 for
+a page that's out of date.
+
+We still have to fetch the first page of photos to know if anything
+has changed, but that usually comes from the response cache.
+"""
+
+import hashlib
+import json
+import typing
+
+from flickr_url_parser import ParseResult
+
+from . import __version__
+from .models import CollectionOfPhotos, Photo, PhotosFromUrl
+
+
+# How long browsers and proxies can reuse a page without checking back
+# with us.  This matches the shortest time we cache a collection in
+# the response cache, so they don't keep a page for longer than we would.
+MAX_AGE = 5 * 60
+
+
+def get_etag(
+    parsed_url: ParseResult, photo_data: PhotosFromUrl, *, count_pages: int
+) -> str:
+    """
+    Compute the ETag for the page of photos at this URL.
+
+    The ETag changes if the total number of photos changes, or if
+    the photos on the first page change, e.g. because somebody uploaded
+    a new photo.  It also includes the version of the app, so we don't
+    serve out-of-date pages after we change the templates.
+
+    This is a weak ETag: two pages with the same ETag show the same
+    photos, but aren't necessarily byte-for-byte identical.  For example,
+    a photo's title may have changed.
+    """
+    if parsed_url["type"] == "single_photo":
+        photos = [typing.cast(Photo, photo_data)]
+        count_photos = count_collection_pages = 1
+    else:
+        collection = typing.cast(CollectionOfPhotos, photo_data)
+        photos = collection["photos"]
+        count_photos = collection["count_photos"]
+        count_collection_pages = collection["count_pages"]
+
+    state = {
+        "version": __version__,
+        "parsed_url": parsed_url,
+        "count_pages": count_pages,
+        "count_photos": count_photos,
+        "count_collection_pages": count_collection_pages,
+        "photo_urls": [p["url"] for p in photos],
+    }
+
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf8")).hexdigest()[
+        :32
+    ]
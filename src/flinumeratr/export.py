@@ -0,0 +1,181 @@
+"""
+Serialise photos as CSV or JSON Lines, for the bulk export endpoint.
+
+Both serialisers take an iterable of photos and yield the document in
+chunks, so we can stream an export of any size without holding the
+whole thing in memory.
+"""
+
+from collections.abc import Iterable, Iterator
+import csv
+from datetime import datetime
+import io
+import json
+import typing
+
+from .models import Photo
+
+
+ExportFormat = typing.Literal["csv", "jsonl"]
+
+EXPORT_FORMATS: dict[ExportFormat, str] = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson; charset=utf-8",
+}
+
+
+# The columns in a CSV export.  The nested fields of a ``Photo``
+# (the date taken and the license) are flattened into separate columns.
+CSV_FIELDS = [
+    "url",
+    "image_url",
+    "title",
+    "owner_url",
+    "owner_name",
+    "date_taken",
+    "date_taken_granularity",
+    "date_posted",
+    "license_id",
+    "license_label",
+    "license_url",
+]
+
+
+# How many photos we serialise before yielding a chunk.  Yielding
+# every photo separately means lots of tiny writes to the socket.
+CHUNK_SIZE = 100
+
+
+def photo_to_row(photo: Photo) -> list[str]:
+    """
+    Flatten a photo into a row of the CSV export.
+    """
+    date_taken = photo["date_taken"]
+
+    return [
+        photo["url"],
+        photo["image_url"],
+        photo["title"] or "",
+        photo["owner_url"],
+        photo["owner_name"],
+        date_taken["value"].isoformat() if date_taken else "",
+        date_taken["granularity"] if date_taken else "",
+        photo["date_posted"].isoformat(),
+        photo["license"]["id"],
+        photo["license"]["label"],
+        photo["license"]["url"],
+    ]
+
+
+def photo_to_dict(photo: Photo) -> dict[str, typing.Any]:
+    """
+    Convert a photo to a dict that can be serialised as JSON.
+    """
+    date_taken = photo["date_taken"]
+
+    return {
+        **photo,
+        "date_taken": (
+            {
+                "value": date_taken["value"].isoformat(),
+                "granularity": date_taken["granularity"],
+            }
+            if date_taken
+            else None
+        ),
+        "date_posted": photo["date_posted"].isoformat(),
+    }
+
+
+def photo_from_dict(d: dict[str, typing.Any]) -> Photo:
+    """
+    Convert a dict created by ``photo_to_dict`` back into a photo.
+    """
+    date_taken = d["date_taken"]
+
+    return typing.cast(
+        Photo,
+        {
+            # Exports and snapshots saved before we kept the sizes
+            # of each photo don't have them.
+            "sizes": d.get("sizes", []),
+            **d,
+            "date_taken": (
+                {
+                    "value": datetime.fromisoformat(date_taken["value"]),
+                    "granularity": date_taken["granularity"],
+                }
+                if date_taken
+                else None
+            ),
+            "date_posted": datetime.fromisoformat(d["date_posted"]),
+        },
+    )
+
+
+def photo_to_json(photo: Photo) -> str:
+    """
+    Serialise a photo as a single line of JSON.
+    """
+    return json.dumps(photo_to_dict(photo), ensure_ascii=False)
+
+
+def _chunked(photos: Iterable[Photo]) -> Iterator[list[Photo]]:
+    batch: list[Photo] = []
+
+    for photo in photos:
+        batch.append(photo)
+
+        if len(batch) == CHUNK_SIZE:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def export_as_csv(photos: Iterable[Photo], *, header: bool = True) -> Iterator[str]:
+    """
+    Serialise photos as CSV, starting with a header row unless
+    ``header`` is False.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if header:
+        writer.writerow(CSV_FIELDS)
+
+    for batch in _chunked(photos):
+        writer.writerows(photo_to_row(p) for p in batch)
+
+        yield buffer.getvalue()
+
+        buffer.seek(0)
+        buffer.truncate()
+
+    # If there weren't any photos, we still need to send the header.
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_as_jsonl(photos: Iterable[Photo]) -> Iterator[str]:
+    """
+    Serialise photos as JSON Lines, with one photo per line.
+    """
+    for batch in _chunked(photos):
+        yield "".join(photo_to_json(p) + "\n" for p in batch)
+
+
+def export_photos(
+    photos: Iterable[Photo], *, format: ExportFormat, header: bool = True
+) -> Iterator[str]:
+    """
+    Serialise photos in the given format.
+
+    Set ``header`` to False if you're adding photos to the end of
+    a document you've already started.
+    """
+    if format == "csv":
+        return export_as_csv(photos, header=header)
+    else:
+        return export_as_jsonl(photos)
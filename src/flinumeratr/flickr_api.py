@@ -1,11 +1,33 @@
+import collections
+from collections.abc import Iterable, Iterator
+import concurrent.futures
+from datetime import datetime
+import itertools
+import math
+import typing
 from xml.etree import ElementTree as ET
 
-from flickr_api import FlickrApi, ResourceNotFound
-from flickr_api.models import Size, User
+from flickr_api import (
+    FlickrApi,
+    InvalidApiKey,
+    ResourceNotFound,
+    UnrecognisedFlickrApiException,
+)
+from flickr_api.api.base import is_retryable
+from flickr_api.models import License, Size, User
 from flickr_api.parsers import create_user, parse_date_taken, parse_timestamp
 from flickr_url_parser import ParseResult
+import httpx
 from nitrate.xml import find_required_elem, find_required_text
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 
+from .cache import CachingFlickrApi
+from .metrics import PREFETCHES, timed
 from .models import (
     CollectionOfPhotos,
     GroupInfo,
@@ -14,82 +36,524 @@ from .models import (
     PhotosInGroup,
     Photo,
     PhotosFromUrl,
+    StreamedCollection,
 )
+from .ratelimit import Priority
+from .singleflight import flight_key
+from .sizes import DEFAULT_SIZE_PROFILE, SizeProfile, parse_sizes, size_extras
+
+
+T = typing.TypeVar("T")
+C = typing.TypeVar("C", bound=CollectionOfPhotos)
+
+
+# Page numbers in Flickr URLs (e.g. ``/photos/tags/sunset/page3``)
+# count pages of this many photos, which is what Flickr.com shows.
+FLICKR_PER_PAGE = 100
+
+# The most photos that Flickr's collection methods return in one call.
+MAX_PER_PAGE = 500
+
+# How many photos we ask for in each API call.  When somebody is
+# waiting to see the photos, we fetch a Flickr.com page at a time, so
+# the first photos arrive quickly.  When we're walking a whole
+# collection, we fetch as many as we can, to make fewer round trips.
+PER_PAGE: dict[Priority, int] = {
+    "interactive": FLICKR_PER_PAGE,
+    "bulk": MAX_PER_PAGE,
+}
 
 
 def get_photos_from_flickr_url(
-    api: FlickrApi, parsed_url: ParseResult
+    api: FlickrApi,
+    parsed_url: ParseResult,
+    *,
+    per_page: int = PER_PAGE["interactive"],
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
 ) -> PhotosFromUrl:
     """
     Given a URL on Flickr.com that's been parsed with flickr-url-parser,
     return the photos at that URL (if possible).
+
+    For collections, this is up to ``per_page`` photos, starting with
+    the first photo on the page of Flickr.com in the URL.  If ``per_page``
+    doesn't divide evenly into a Flickr.com page (e.g. ``PER_PAGE["bulk"]``),
+    the API page may start before the Flickr.com page, so we drop the
+    photos before it and return fewer than ``per_page`` photos.
     """
     if parsed_url["type"] == "single_photo":
-        photo = api.get_single_photo(photo_id=parsed_url["photo_id"])
-
-        return {
-            "url": photo["url"],
-            "image_url": get_image_url(photo["sizes"], desired_size="Medium"),
-            "title": photo["title"],
-            "owner_url": photo["owner"]["profile_url"],
-            "owner_name": photo["owner"]["realname"] or photo["owner"]["username"],
-            "date_taken": photo["date_taken"],
-            "date_posted": photo["date_posted"],
-            "license": photo["license"],
-        }
-    elif parsed_url["type"] == "album":
-        return get_photos_in_album(
+        return _get_single_photo(api, photo_id=parsed_url["photo_id"])
+    elif parsed_url["type"] == "homepage":  # pragma: no cover
+        raise TypeError(f"Unrecognised URL type: {parsed_url['type']}")
+    else:
+        fetch_page = get_page_fetcher(api, parsed_url, size_profile=size_profile)
+        first = first_api_page(parsed_url["page"], per_page=per_page)
+
+        return skip_photos(
+            fetch_page(page=first["page"], per_page=per_page), skip=first["skip"]
+        )
+
+
+def get_pages_from_flickr_url(
+    api: FlickrApi,
+    parsed_url: ParseResult,
+    *,
+    count_pages: int,
+    per_page: int = PER_PAGE["interactive"],
+    max_per_page: int = MAX_PER_PAGE,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> tuple[PhotosFromUrl, Iterator[Photo]]:
+    """
+    Given a URL on Flickr.com that's been parsed with flickr-url-parser,
+    return the first page of photos at that URL, and an iterator over
+    the photos on up to ``count_pages`` pages, starting from that page.
+
+    Pages are counted the same way as Flickr.com, whatever the page
+    sizes we use for API calls.  The first call gets ``per_page``
+    photos; the later calls get up to ``max_per_page`` photos each --
+    see ``plan_page_requests()``.
+
+    Only the first call is made before this function returns, so
+    the caller can start rendering the collection metadata (e.g. the
+    album title) straight away.  The later calls are made lazily,
+    as the caller iterates over the photos.
+    """
+    if parsed_url["type"] == "single_photo":
+        photo = _coalesce(
             api,
-            user_url=parsed_url["user_url"],
-            album_id=parsed_url["album_id"],
-            page=parsed_url["page"],
-            per_page=100,
+            flight_key(parsed_url),
+            lambda: _get_single_photo(api, photo_id=parsed_url["photo_id"]),
         )
-    elif parsed_url["type"] == "user":
-        return get_photos_in_user_photostream(
-            api, user_url=parsed_url["user_url"], page=parsed_url["page"], per_page=100
+        return photo, iter([photo])
+    elif parsed_url["type"] == "homepage":  # pragma: no cover
+        raise TypeError(f"Unrecognised URL type: {parsed_url['type']}")
+
+    first = first_api_page(parsed_url["page"], per_page=per_page)
+
+    def page_key(page: int, per_page: int) -> str:
+        return flight_key(
+            parsed_url, page=page, per_page=per_page, size_profile=size_profile
         )
-    elif parsed_url["type"] == "gallery":
-        return get_photos_in_gallery(
-            api,
-            gallery_id=parsed_url["gallery_id"],
-            page=parsed_url["page"],
-            per_page=100,
+
+    # We coalesce the lookups needed to create the page fetcher (e.g.
+    # resolving the user's NSID) along with the first page.
+    def fetch_first_page() -> tuple[PageFetcher, CollectionOfPhotos]:
+        fetch_page = get_page_fetcher(api, parsed_url, size_profile=size_profile)
+        collection = fetch_page(page=first["page"], per_page=per_page)
+        return fetch_page, in_flickr_pages(
+            skip_photos(collection, skip=first["skip"]), per_page=per_page
         )
-    elif parsed_url["type"] == "group":
-        return get_photos_in_group_pool(
-            api,
-            group_url=parsed_url["group_url"],
-            page=parsed_url["page"],
-            per_page=100,
+
+    fetch_page, photo_data = _coalesce(
+        api, page_key(first["page"], per_page), fetch_first_page
+    )
+
+    def iter_photos() -> Iterator[Photo]:
+        last_page = min(parsed_url["page"] + count_pages - 1, photo_data["count_pages"])
+        stop = last_page * FLICKR_PER_PAGE
+
+        # If the first call asked for more than a Flickr.com page (e.g.
+        # in bulk mode), it may have more photos than we want.
+        start = (parsed_url["page"] - 1) * FLICKR_PER_PAGE
+        yield from photo_data["photos"][: stop - start]
+
+        for req in plan_page_requests(
+            first["page"] * per_page, stop, max_per_page=max_per_page
+        ):
+            collection = _coalesce(
+                api,
+                page_key(req["page"], req["per_page"]),
+                lambda: fetch_page(page=req["page"], per_page=req["per_page"]),
+            )
+
+            photos = collection["photos"][req["skip"] :]
+
+            if not photos:
+                break
+
+            yield from photos
+
+    return photo_data, iter_photos()
+
+
+def first_api_page(flickr_page: int, *, per_page: int) -> "PageRequest":
+    """
+    Returns the API call that gets the first photo on a page of
+    Flickr.com, if we're asking for ``per_page`` photos in each call.
+
+    Flickr only lets us ask for the nth page of a given size.  If
+    ``per_page`` divides evenly into a Flickr.com page, the API page
+    starts with the first photo on the Flickr.com page; otherwise it
+    may start earlier, and ``skip`` is the number of photos before it.
+    """
+    start = (flickr_page - 1) * FLICKR_PER_PAGE
+    page = start // per_page + 1
+
+    return {"page": page, "per_page": per_page, "skip": start - (page - 1) * per_page}
+
+
+def skip_photos(collection: C, *, skip: int) -> C:
+    """
+    Returns a collection without the first ``skip`` photos.
+    """
+    if skip == 0:
+        return collection
+
+    return typing.cast(C, {**collection, "photos": collection["photos"][skip:]})
+
+
+def in_flickr_pages(collection: C, *, per_page: int) -> C:
+    """
+    Returns a collection whose ``count_pages`` counts Flickr.com pages,
+    rather than pages of ``per_page`` photos.
+    """
+    if per_page == FLICKR_PER_PAGE:
+        return collection
+
+    count_pages = math.ceil(collection["count_pages"] * per_page / FLICKR_PER_PAGE)
+
+    return typing.cast(C, {**collection, "count_pages": count_pages})
+
+
+class PageRequest(typing.TypedDict):
+    """
+    An API call for a page of photos, and how many photos to skip
+    at the start of the page because we've already got them.
+    """
+
+    page: int
+    per_page: int
+    skip: int
+
+
+def plan_page_requests(
+    start: int, stop: int, *, max_per_page: int = MAX_PER_PAGE
+) -> list[PageRequest]:
+    """
+    Plan the API calls to get photos ``start`` to ``stop`` of
+    a collection (counting from 0), in as few calls as possible.
+
+    Flickr only lets us ask for the nth page of a given size, so a call
+    can't start at any photo we like.  For each call, we pick the page
+    size that gets the most photos we don't have yet, even if we have to
+    skip a few photos we've already got -- a few extra photos in
+    a response are much cheaper than another round trip.
+    """
+    requests: list[PageRequest] = []
+
+    while start < stop:
+        per_page = max(
+            range(1, max_per_page + 1),
+            key=lambda size: (min((start // size + 1) * size, stop), -size),
         )
-    elif parsed_url["type"] == "tag":
-        return get_photos_with_tag(
-            api, tag=parsed_url["tag"], page=parsed_url["page"], per_page=100
+        page = start // per_page + 1
+
+        requests.append(
+            {"page": page, "per_page": per_page, "skip": start - (page - 1) * per_page}
         )
-    else:  # pragma: no cover
-        raise TypeError(f"Unrecognised URL type: {parsed_url['type']}")
+        start = min(page * per_page, stop)
+
+    return requests
+
+
+def with_page(parsed_url: ParseResult, page: int) -> ParseResult:
+    """
+    Returns a parsed URL for a different page of the same collection.
+
+    URLs which aren't paginated (e.g. single photos) are returned as-is.
+    """
+    if parsed_url["type"] in {"single_photo", "homepage"}:
+        return parsed_url
+
+    return typing.cast(ParseResult, {**parsed_url, "page": page})
+
+
+# The threads that prefetch pages in the background.  This is shared
+# by every request in the process, so a burst of requests can't start
+# an unbounded number of threads.
+_prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=2, thread_name_prefix="flinumeratr-prefetch"
+)
+
+
+def prefetch_page(
+    api: CachingFlickrApi,
+    parsed_url: ParseResult,
+    *,
+    page: int,
+    per_page: int = PER_PAGE["interactive"],
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> concurrent.futures.Future[None]:
+    """
+    Fetch a page of photos in a background thread, so it's in the
+    response cache by the time somebody asks for it.
+
+    This makes the same API calls as ``get_pages_from_flickr_url()``,
+    so once it's finished, the page is served from the cache.  The calls
+    are "bulk" priority, so prefetching never uses the budget we keep
+    for interactive requests, and if there are no bulk tokens free,
+    we give up rather than wait for one -- a prefetch is only worth
+    doing if it's quick.
+
+    If somebody asks for the page while we're still prefetching it,
+    they don't wait for the prefetch -- lookups are only shared between
+    clients with the same priority (see ``_coalesce()``).
+    """
+
+    def prefetch() -> None:
+        try:
+            get_pages_from_flickr_url(
+                api.with_priority("bulk", max_wait=0),
+                with_page(parsed_url, page),
+                count_pages=1,
+                per_page=per_page,
+                size_profile=size_profile,
+            )
+        except Exception:
+            PREFETCHES.inc(result="error")
+        else:
+            PREFETCHES.inc(result="ok")
+
+    return _prefetch_executor.submit(prefetch)
+
+
+def _coalesce(api: FlickrApi, key: str, fn: typing.Callable[[], T]) -> T:
+    """
+    Call ``fn()``, sharing the result with any identical lookups that
+    are in flight at the same time, if the API has a ``SingleFlight``.
+
+    Lookups are only shared between clients with the same priority,
+    so an interactive request never waits for a bulk lookup (which may
+    be stuck behind the bulk budget), or gets its errors.  A client that
+    doesn't read the cache only shares with other such clients, so it
+    never gets a cached response from a lookup it joined.
+    """
+    if isinstance(api, CachingFlickrApi) and api.single_flight is not None:
+        if not api.read_cache:
+            key = f"uncached:{key}"
+
+        return api.single_flight.do(f"{api.priority}:{key}", fn)
+    else:
+        return fn()
+
+
+class PageFetcher(typing.Protocol):
+    """
+    A function that fetches a single page of photos from a collection.
+    """
+
+    def __call__(  # pragma: no cover
+        self, *, page: int, per_page: int
+    ) -> CollectionOfPhotos: ...
+
+
+def get_page_fetcher(
+    api: FlickrApi,
+    parsed_url: ParseResult,
+    *,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> PageFetcher:
+    """
+    Given a URL on Flickr.com that points to a collection of photos,
+    return a function that fetches individual pages of that collection.
+
+    Any lookups that only need to happen once per collection (e.g.
+    resolving a user's path alias to their NSID) are done here, so they
+    aren't repeated for every page.
+    """
+    with timed("resolve"):
+        if parsed_url["type"] == "album":
+            album_id = parsed_url["album_id"]
+            user_id = api._ensure_user_id(user_url=parsed_url["user_url"])
+
+            return lambda *, page, per_page: _get_photos_in_album(
+                api,
+                user_id=user_id,
+                album_id=album_id,
+                page=page,
+                per_page=per_page,
+                size_profile=size_profile,
+            )
+        elif parsed_url["type"] == "user":
+            user_id = api._ensure_user_id(user_url=parsed_url["user_url"])
+
+            return lambda *, page, per_page: _get_photos_in_user_photostream(
+                api,
+                user_id=user_id,
+                page=page,
+                per_page=per_page,
+                size_profile=size_profile,
+            )
+        elif parsed_url["type"] == "gallery":
+            gallery_id = parsed_url["gallery_id"]
+
+            return lambda *, page, per_page: get_photos_in_gallery(
+                api,
+                gallery_id=gallery_id,
+                page=page,
+                per_page=per_page,
+                size_profile=size_profile,
+            )
+        elif parsed_url["type"] == "group":
+            group_info = _lookup_group_from_url(api, url=parsed_url["group_url"])
+
+            return lambda *, page, per_page: _get_photos_in_group_pool(
+                api,
+                group_info=group_info,
+                page=page,
+                per_page=per_page,
+                size_profile=size_profile,
+            )
+        elif parsed_url["type"] == "tag":
+            tag = parsed_url["tag"]
+
+            return lambda *, page, per_page: get_photos_with_tag(
+                api, tag=tag, page=page, per_page=per_page, size_profile=size_profile
+            )
+        else:  # pragma: no cover
+            raise TypeError(f"Unrecognised URL type: {parsed_url['type']}")
+
+
+def iter_photos_from_flickr_url(
+    api: FlickrApi,
+    parsed_url: ParseResult,
+    *,
+    per_page: int = PER_PAGE["bulk"],
+    concurrency: int = 1,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> Iterator[Photo]:
+    """
+    Given a URL on Flickr.com that's been parsed with flickr-url-parser,
+    yield every photo at that URL, walking through all the pages.
+
+    Pages are only fetched as they're needed, so only a handful of pages
+    are held in memory at a time -- this can be used for collections
+    of any size.
+
+    If ``concurrency`` is more than 1, we fetch up to that many pages
+    in parallel, ahead of the page currently being consumed.  Photos are
+    still yielded in page order.
+
+    Note: this ignores the ``page`` in the parsed URL, and always
+    starts from the first page of the collection.
+    """
+    if parsed_url["type"] == "single_photo":
+        yield _get_single_photo(api, photo_id=parsed_url["photo_id"])
+        return
+
+    fetch_page = get_page_fetcher(api, parsed_url, size_profile=size_profile)
+
+    if concurrency > 1:
+        yield from _iter_pages_concurrently(
+            fetch_page, per_page=per_page, concurrency=concurrency
+        )
+        return
+
+    page = 1
+
+    while True:
+        collection = fetch_page(page=page, per_page=per_page)
+        yield from collection["photos"]
+
+        # We check the page count on every page, rather than just the
+        # first, because collections can change while we're walking them.
+        #
+        # We also stop if we get an empty page -- e.g. tag searches can
+        # report more pages than they'll actually return.
+        if page >= collection["count_pages"] or not collection["photos"]:
+            break
+
+        page += 1
+
+
+def _iter_pages_concurrently(
+    fetch_page: PageFetcher, *, per_page: int, concurrency: int
+) -> Iterator[Photo]:
+    """
+    Yield every photo in a collection, fetching up to ``concurrency``
+    pages at once in a pool of threads.
+
+    We have to fetch the first page by itself to find out how many
+    pages there are; after that, each page is independent.  We keep
+    a bounded window of pages in flight, so memory use doesn't grow
+    with the size of the collection.
+    """
+    first_page = fetch_page(page=1, per_page=per_page)
+    yield from first_page["photos"]
+
+    remaining_pages = iter(range(2, first_page["count_pages"] + 1))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = collections.deque(
+            executor.submit(fetch_page, page=page, per_page=per_page)
+            for page in itertools.islice(remaining_pages, concurrency)
+        )
+
+        try:
+            while in_flight:
+                collection = in_flight.popleft().result()
+
+                # Start fetching the next page before we hand this one
+                # back to the caller, so there's always a full window
+                # of requests in flight.
+                for page in itertools.islice(remaining_pages, 1):
+                    in_flight.append(
+                        executor.submit(fetch_page, page=page, per_page=per_page)
+                    )
+
+                if not collection["photos"]:
+                    break
+
+                yield from collection["photos"]
+        finally:
+            # If the caller stops iterating early, don't bother fetching
+            # any pages that haven't started yet.
+            for future in in_flight:
+                future.cancel()
+
+
+def _get_single_photo(api: FlickrApi, *, photo_id: str) -> Photo:
+    """
+    Get a single photo.
+    """
+    photo = api.get_single_photo(photo_id=photo_id)
+
+    return {
+        "url": photo["url"],
+        "image_url": get_image_url(photo["sizes"], desired_size="Medium"),
+        "sizes": photo["sizes"],
+        "title": photo["title"],
+        "owner_url": photo["owner"]["profile_url"],
+        "owner_name": photo["owner"]["realname"] or photo["owner"]["username"],
+        "date_taken": photo["date_taken"],
+        "date_posted": photo["date_posted"],
+        "license": photo["license"],
+    }
 
 
 def _from_collection_photo(
-    api: FlickrApi, photo_elem: ET.Element, owner: User | None
+    api: FlickrApi,
+    photo_elem: ET.Element,
+    owner: User | None,
+    *,
+    licenses: dict[str, License],
+    owners: dict[str, User],
+    size_profile: SizeProfile,
 ) -> Photo:
     """
     Given a <photo> element from a collection response, extract all the photo info.
+
+    ``licenses`` is the table from ``api.get_licenses()``, and ``owners``
+    is a table of owners we've already seen, keyed by NSID.  These are
+    shared between all the photos in a page, so we only do the work
+    once per page, not once per photo.
     """
     photo_id = photo_elem.attrib["id"]
 
     if owner is None:
-        owner = create_user(
-            user_id=photo_elem.attrib["owner"],
-            username=photo_elem.attrib["ownername"],
-            realname=photo_elem.attrib.get("realname"),
-            path_alias=photo_elem.attrib["pathalias"],
-        )
-
-    assert owner is not None
+        owner = _lookup_owner(photo_elem, owners=owners)
 
-    license = api.lookup_license_by_id(id=photo_elem.attrib["license"])
+    license = _lookup_license(api, photo_elem.attrib["license"], licenses=licenses)
 
     title = photo_elem.attrib["title"] or None
 
@@ -103,11 +567,12 @@ def _from_collection_photo(
     assert owner["photos_url"].endswith("/")
     url = owner["photos_url"] + photo_id + "/"
 
-    sizes = parse_sizes(photo_elem)
+    sizes = parse_sizes(photo_elem, profile=size_profile)
 
     return {
         "url": url,
         "image_url": get_image_url(sizes, desired_size="Medium"),
+        "sizes": sizes,
         "title": title,
         "owner_url": owner["profile_url"],
         "owner_name": owner["realname"] or owner["username"],
@@ -117,80 +582,222 @@ def _from_collection_photo(
     }
 
 
-def parse_sizes(photo_elem: ET.Element) -> list[Size]:
+def _lookup_owner(photo_elem: ET.Element, *, owners: dict[str, User]) -> User:
     """
-    Get a list of sizes from a photo in a collection response.
+    Get the owner of a <photo> element, creating them if this is the
+    first of their photos we've seen.
+
+    In a gallery or group pool, the same owner can appear dozens of
+    times on a single page, and the owner attributes are the same
+    on every one of their photos.
     """
-    # When you get a collection of photos (e.g. in an album)
-    # you can get some of the sizes on the <photo> element, e.g.
-    #
-    #     <
-    #       photo
-    #       url_t="https://live.staticflickr.com/2893/1234567890_t.jpg"
-    #       height_t="78"
-    #       width_t="100"
-    #       …
-    #     />
-    #
-    sizes: list[Size] = []
-
-    for suffix, label in [
-        ("sq", "Square"),
-        ("q", "Large Square"),
-        ("t", "Thumbnail"),
-        ("s", "Small"),
-        ("m", "Medium"),
-        ("l", "Large"),
-        ("o", "Original"),
-    ]:
-        try:
-            media = photo_elem.attrib["media"]
-
-            if media not in ("video", "photo"):  # pragma: no cover
-                raise ValueError(f"Unrecognised media: {media!r}")
-
-            sizes.append(
-                {
-                    "height": int(photo_elem.attrib[f"height_{suffix}"]),
-                    "width": int(photo_elem.attrib[f"width_{suffix}"]),
-                    "label": label,
-                    "media": media,  # type: ignore
-                    "source": photo_elem.attrib[f"url_{suffix}"],
-                }
-            )
-        except KeyError:
-            pass
+    user_id = photo_elem.attrib["owner"]
+
+    try:
+        return owners[user_id]
+    except KeyError:
+        owner = create_user(
+            user_id=user_id,
+            username=photo_elem.attrib["ownername"],
+            realname=photo_elem.attrib.get("realname"),
+            path_alias=photo_elem.attrib["pathalias"],
+        )
+        owners[user_id] = owner
+        return owner
+
 
-    return sizes
+def _lookup_license(
+    api: FlickrApi, license_id: str, *, licenses: dict[str, License]
+) -> License:
+    """
+    Get the license for a numeric license ID.
+
+    This is a plain dict lookup in the table we got from the API; we
+    only call ``lookup_license_by_id`` if the ID isn't in the table,
+    so it can throw the usual ``LicenseNotFound`` error.
+    """
+    try:
+        return licenses[license_id]
+    except KeyError:
+        return api.lookup_license_by_id(id=license_id)
 
 
+# The extras we request for every photo in a collection.  We also
+# request the ``url_*`` extras for the sizes in the size profile.
 extras = [
     "license",
     "date_upload",
     "date_taken",
     "owner_name",
-    "url_sq",
-    "url_t",
-    "url_s",
-    "url_m",
-    "url_o",
     "media",
     "realname",
     "path_alias",
 ]
 
 
+def _extras(size_profile: SizeProfile) -> str:
+    """
+    Returns the ``extras`` parameter for a collection request.
+    """
+    return ",".join(extras + size_extras(size_profile))
+
+
+class CollectionRequest(typing.TypedDict):
+    """
+    The API method and parameters for fetching a collection of photos,
+    minus the pagination parameters.
+    """
+
+    method: str
+    params: dict[str, str | int]
+    exceptions: dict[str, Exception]
+
+
+def _album_request(
+    *, user_id: str, album_id: str, size_profile: SizeProfile
+) -> CollectionRequest:
+    # See https://www.flickr.com/services/api/flickr.photosets.getPhotos.html
+    return {
+        "method": "flickr.photosets.getPhotos",
+        "params": {
+            "user_id": user_id,
+            "photoset_id": album_id,
+            "extras": _extras(size_profile),
+        },
+        "exceptions": {
+            "1": ResourceNotFound(f"Could not find album with ID: {album_id!r}"),
+            "2": ResourceNotFound(f"Could not find user with ID: {user_id!r}"),
+        },
+    }
+
+
+def _gallery_request(
+    *, gallery_id: str, size_profile: SizeProfile
+) -> CollectionRequest:
+    # See https://www.flickr.com/services/api/flickr.galleries.getPhotos.html
+    return {
+        "method": "flickr.galleries.getPhotos",
+        "params": {
+            "gallery_id": gallery_id,
+            "get_gallery_info": "1",
+            "extras": _extras(size_profile),
+        },
+        "exceptions": {
+            "1": ResourceNotFound(f"Could not find gallery with ID: {gallery_id!r}")
+        },
+    }
+
+
+def _photostream_request(
+    *, user_id: str, size_profile: SizeProfile
+) -> CollectionRequest:
+    # See https://www.flickr.com/services/api/flickr.people.getPublicPhotos.html
+    return {
+        "method": "flickr.people.getPublicPhotos",
+        "params": {"user_id": user_id, "extras": _extras(size_profile)},
+        "exceptions": {
+            "1": ResourceNotFound(f"Could not find user with ID: {user_id!r}")
+        },
+    }
+
+
+def _group_pool_request(
+    *, group_id: str, size_profile: SizeProfile
+) -> CollectionRequest:
+    # See https://www.flickr.com/services/api/flickr.groups.pools.getPhotos.html
+    return {
+        "method": "flickr.groups.pools.getPhotos",
+        "params": {"group_id": group_id, "extras": _extras(size_profile)},
+        "exceptions": {},
+    }
+
+
+def _tag_request(
+    *, tag: str, size_profile: SizeProfile, min_upload_date: datetime | None = None
+) -> CollectionRequest:
+    # See https://www.flickr.com/services/api/flickr.photos.search.html
+    params: dict[str, str | int] = {
+        "tags": tag,
+        # This is so we get the same photos as you see on the "tag" page
+        # under "All Photos Tagged XYZ" -- if you click the URL to the
+        # full search results, you end up on a page like:
+        #
+        #     https://flickr.com/search/?sort=interestingness-desc&…
+        #
+        "sort": "interestingness-desc",
+        "extras": _extras(size_profile),
+    }
+
+    # Only get photos uploaded at or after this time, e.g. when we're
+    # looking for photos that are newer than a snapshot.
+    if min_upload_date is not None:
+        params["min_upload_date"] = str(int(min_upload_date.timestamp()))
+
+    return {
+        "method": "flickr.photos.search",
+        "params": params,
+        "exceptions": {},
+    }
+
+
+def raise_api_error(
+    errors: dict[str, str], *, exceptions: dict[str, Exception] | None
+) -> typing.NoReturn:
+    """
+    Raise the appropriate exception for an ``<err>`` in an API response.
+
+    This mirrors the error handling in ``FlickrApi.call()``.
+    """
+    if errors["code"] == "100":
+        raise InvalidApiKey(message=errors["msg"])
+
+    try:
+        raise (exceptions or {})[errors["code"]]
+    except KeyError:
+        raise UnrecognisedFlickrApiException(errors) from None
+
+
+def _call_collection_api(
+    api: FlickrApi, request: CollectionRequest, *, page: int, per_page: int
+) -> ET.Element:
+    """
+    Fetch a single page of a collection from the Flickr API.
+    """
+    return api.call(
+        method=request["method"],
+        params={**request["params"], "page": page, "per_page": per_page},
+        exceptions=request["exceptions"],
+    )
+
+
 def _create_collection(
-    api: FlickrApi, collection_elem: ET.Element, owner: User | None = None
+    api: FlickrApi,
+    collection_elem: ET.Element,
+    owner: User | None = None,
+    *,
+    size_profile: SizeProfile,
 ) -> CollectionOfPhotos:
     """
     This gets pagination information and extracts individual <photo>
     elements from a collection response.
     """
-    photos = [
-        _from_collection_photo(api, photo_elem, owner=owner)
-        for photo_elem in collection_elem.findall("photo")
-    ]
+    with timed("parse"):
+        # The list of licenses is fetched once, then cached by ``FlickrApi``
+        # for the life of the process.
+        licenses = api.get_licenses()
+        owners: dict[str, User] = {}
+
+        photos = [
+            _from_collection_photo(
+                api,
+                photo_elem,
+                owner=owner,
+                licenses=licenses,
+                owners=owners,
+                size_profile=size_profile,
+            )
+            for photo_elem in collection_elem.findall("photo")
+        ]
 
     # The wrapper element includes a couple of attributes related
     # to pagination, e.g.
@@ -207,6 +814,260 @@ def _create_collection(
     }
 
 
+def iterparse_collection(
+    api: FlickrApi,
+    chunks: Iterable[bytes],
+    *,
+    exceptions: dict[str, Exception] | None = None,
+    single_owner: bool = False,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> StreamedCollection:
+    """
+    Parse a collection response incrementally, as it's read from the network.
+
+    This reads just enough of the response to find the wrapper element
+    and its pagination attributes, e.g.
+
+        <photoset pages="1" total="2" …>
+
+    The photos are parsed lazily as you iterate over them, and each
+    <photo> element is discarded as soon as it's been consumed, so
+    we never hold the whole tree in memory.
+
+    If ``single_owner`` is True, every photo in the collection belongs
+    to the same person (e.g. an album or photostream), so we only
+    create the owner once.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+
+    def read_events() -> Iterator[tuple[str, ET.Element]]:
+        for chunk in chunks:
+            parser.feed(chunk)
+            yield from parser.read_events()
+
+        parser.close()
+        yield from parser.read_events()
+
+    events = read_events()
+
+    for event, elem in events:
+        # If the Flickr API call fails, it returns a block of XML like:
+        #
+        #       <rsp stat="fail">
+        #       	<err code="1" msg="Photo not found (invalid ID)" />
+        #       </rsp>
+        #
+        # This mirrors the error handling in ``FlickrApi.call()``.
+        if event == "start" and elem.tag == "err":
+            raise_api_error(dict(elem.attrib), exceptions=exceptions)
+
+        if event == "start" and "pages" in elem.attrib:
+            wrapper_elem = elem
+            break
+    else:
+        raise ValueError("Could not find a collection of photos in the response")
+
+    def parse_photos() -> Iterator[Photo]:
+        owner: User | None = None
+
+        licenses = api.get_licenses()
+        owners: dict[str, User] = {}
+
+        for event, elem in events:
+            if event != "end" or elem.tag != "photo":
+                continue
+
+            if single_owner and owner is None:
+                owner = create_user(
+                    user_id=wrapper_elem.attrib.get("owner") or elem.attrib["owner"],
+                    username=wrapper_elem.attrib.get("ownername")
+                    or elem.attrib["ownername"],
+                    realname=elem.attrib.get("realname"),
+                    path_alias=elem.attrib["pathalias"],
+                )
+
+            yield _from_collection_photo(
+                api,
+                elem,
+                owner=owner,
+                licenses=licenses,
+                owners=owners,
+                size_profile=size_profile,
+            )
+
+            # Throw away the element now we're done with it, so the
+            # tree doesn't grow as we read the response.
+            wrapper_elem.remove(elem)
+
+    return {
+        "photos": parse_photos(),
+        "count_pages": int(wrapper_elem.attrib["pages"]),
+        "count_photos": int(wrapper_elem.attrib["total"]),
+    }
+
+
+def _stream_collection_api(
+    api: FlickrApi, request: CollectionRequest, *, page: int, per_page: int
+) -> Iterator[bytes]:
+    """
+    Fetch a single page of a collection from the Flickr API, and yield
+    the body in chunks as it arrives.
+
+    Like ``FlickrApi.call()``, we retry the request if it fails with
+    an error that might be transient -- but only until we start reading
+    the body.  If the API is a ``CachingFlickrApi``, the request takes
+    a token from the rate budget (and backs off if Flickr throttles us),
+    and is recorded in our metrics, like any other call.
+    """
+
+    @retry(
+        retry=retry_if_exception(is_retryable),
+        stop=stop_after_attempt(5),
+        wait=wait_random_exponential(),
+        reraise=True,
+    )
+    def open_stream() -> httpx.Response:
+        resp = api.client.send(
+            api.client.build_request(
+                "GET",
+                "",
+                params={
+                    "method": request["method"],
+                    **request["params"],
+                    "page": page,
+                    "per_page": per_page,
+                },
+                timeout=15,
+            ),
+            stream=True,
+        )
+
+        try:
+            resp.raise_for_status()
+        except httpx.HTTPStatusError:
+            resp.close()
+            raise
+
+        return resp
+
+    if isinstance(api, CachingFlickrApi):
+        resp = api.call_within_budget(open_stream, method=request["method"])
+    else:
+        resp = open_stream()
+
+    try:
+        yield from resp.iter_bytes()
+    finally:
+        resp.close()
+
+
+def _get_collection_request(
+    api: FlickrApi, parsed_url: ParseResult, *, size_profile: SizeProfile
+) -> CollectionRequest:
+    """
+    Given a URL on Flickr.com that points to a collection of photos,
+    return the API request for fetching that collection.
+    """
+    if parsed_url["type"] == "album":
+        user_id = api._ensure_user_id(user_url=parsed_url["user_url"])
+        return _album_request(
+            user_id=user_id,
+            album_id=parsed_url["album_id"],
+            size_profile=size_profile,
+        )
+    elif parsed_url["type"] == "user":
+        user_id = api._ensure_user_id(user_url=parsed_url["user_url"])
+        return _photostream_request(user_id=user_id, size_profile=size_profile)
+    elif parsed_url["type"] == "gallery":
+        return _gallery_request(
+            gallery_id=parsed_url["gallery_id"], size_profile=size_profile
+        )
+    elif parsed_url["type"] == "group":
+        group_info = _lookup_group_from_url(api, url=parsed_url["group_url"])
+        return _group_pool_request(group_id=group_info["id"], size_profile=size_profile)
+    elif parsed_url["type"] == "tag":
+        return _tag_request(tag=parsed_url["tag"], size_profile=size_profile)
+    else:  # pragma: no cover
+        raise TypeError(f"Unrecognised URL type: {parsed_url['type']}")
+
+
+class StreamingPageFetcher(typing.Protocol):
+    """
+    A function that fetches a single page of photos from a collection,
+    and parses it as it's read from the network.
+    """
+
+    def __call__(  # pragma: no cover
+        self, *, page: int, per_page: int
+    ) -> StreamedCollection: ...
+
+
+def get_streaming_page_fetcher(
+    api: FlickrApi,
+    parsed_url: ParseResult,
+    *,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> StreamingPageFetcher:
+    """
+    Given a URL on Flickr.com that points to a collection of photos,
+    return a function that fetches individual pages of that collection,
+    parsing each page incrementally.
+
+    This is the streaming version of ``get_page_fetcher()``.  It uses
+    less memory for big pages, but it bypasses any response cache, so
+    it's for bulk work where each page is only read once.
+    """
+    request = _get_collection_request(api, parsed_url, size_profile=size_profile)
+
+    def fetch_page(*, page: int, per_page: int) -> StreamedCollection:
+        return iterparse_collection(
+            api,
+            _stream_collection_api(api, request, page=page, per_page=per_page),
+            exceptions=request["exceptions"],
+            single_owner=parsed_url["type"] in {"album", "user"},
+            size_profile=size_profile,
+        )
+
+    return fetch_page
+
+
+def stream_photos_from_flickr_url(
+    api: FlickrApi,
+    parsed_url: ParseResult,
+    *,
+    per_page: int = PER_PAGE["bulk"],
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+) -> Iterator[Photo]:
+    """
+    Given a URL on Flickr.com that's been parsed with flickr-url-parser,
+    yield every photo at that URL, parsing each page incrementally as
+    it's read from the network.
+
+    This gives the same photos as ``iter_photos_from_flickr_url``, but
+    uses less memory for big pages.  It bypasses any response cache.
+    """
+    if parsed_url["type"] == "single_photo":
+        yield _get_single_photo(api, photo_id=parsed_url["photo_id"])
+        return
+
+    fetch_page = get_streaming_page_fetcher(api, parsed_url, size_profile=size_profile)
+
+    page = 1
+
+    while True:
+        collection = fetch_page(page=page, per_page=per_page)
+        count_photos_on_page = 0
+
+        for photo in collection["photos"]:
+            count_photos_on_page += 1
+            yield photo
+
+        if page >= collection["count_pages"] or count_photos_on_page == 0:
+            break
+
+        page += 1
+
+
 def get_photos_in_album(
     api: FlickrApi,
     album_id: str,
@@ -214,6 +1075,7 @@ def get_photos_in_album(
     user_url: str | None = None,
     page: int = 1,
     per_page: int = 10,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
 ) -> PhotosInAlbum:
     """
     Get a page of photos from an album.
@@ -233,32 +1095,43 @@ def get_photos_in_album(
     user_id = api._ensure_user_id(user_id=user_id, user_url=user_url)
 
     return _get_photos_in_album(
-        api, user_id=user_id, album_id=album_id, page=page, per_page=per_page
+        api,
+        user_id=user_id,
+        album_id=album_id,
+        page=page,
+        per_page=per_page,
+        size_profile=size_profile,
     )
 
 
 def _get_photos_in_album(
-    api: FlickrApi, *, user_id: str, album_id: str, page: int, per_page: int
+    api: FlickrApi,
+    *,
+    user_id: str,
+    album_id: str,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile,
 ) -> PhotosInAlbum:
     """
     Get a page of photos from an album.
     """
-    # https://www.flickr.com/services/api/flickr.photosets.getPhotos.html
-    resp = api.call(
-        method="flickr.photosets.getPhotos",
-        params={
-            "user_id": user_id,
-            "photoset_id": album_id,
-            "extras": ",".join(extras),
-            "page": page,
-            "per_page": per_page,
-        },
-        exceptions={
-            "1": ResourceNotFound(f"Could not find album with ID: {album_id!r}"),
-            "2": ResourceNotFound(f"Could not find user with ID: {user_id!r}"),
-        },
+    resp = _call_collection_api(
+        api,
+        _album_request(user_id=user_id, album_id=album_id, size_profile=size_profile),
+        page=page,
+        per_page=per_page,
     )
 
+    return _parse_album_response(api, resp, size_profile=size_profile)
+
+
+def _parse_album_response(
+    api: FlickrApi, resp: ET.Element, *, size_profile: SizeProfile
+) -> PhotosInAlbum:
+    """
+    Parse a page of photos from the ``flickr.photosets.getPhotos`` API.
+    """
     # Albums are always non-empty, so we know we'll find something here
     photoset_elem = find_required_elem(resp, path="photoset")
     photo_elem = find_required_elem(photoset_elem, path="photo")
@@ -273,7 +1146,9 @@ def _get_photos_in_album(
     album_title = photoset_elem.attrib["title"]
 
     return {
-        **_create_collection(api, photoset_elem, owner=owner),
+        **_create_collection(
+            api, photoset_elem, owner=owner, size_profile=size_profile
+        ),
         "album": {
             "owner": owner,
             "title": album_title,
@@ -282,26 +1157,32 @@ def _get_photos_in_album(
 
 
 def get_photos_in_gallery(
-    api: FlickrApi, *, gallery_id: str, page: int = 1, per_page: int = 10
+    api: FlickrApi,
+    *,
+    gallery_id: str,
+    page: int = 1,
+    per_page: int = 10,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
 ) -> PhotosInGallery:
     """
     Get a page of photos in a gallery.
     """
-    # https://www.flickr.com/services/api/flickr.galleries.getPhotos.html
-    resp = api.call(
-        method="flickr.galleries.getPhotos",
-        params={
-            "gallery_id": gallery_id,
-            "get_gallery_info": "1",
-            "extras": ",".join(extras),
-            "page": page,
-            "per_page": per_page,
-        },
-        exceptions={
-            "1": ResourceNotFound(f"Could not find gallery with ID: {gallery_id!r}")
-        },
+    resp = _call_collection_api(
+        api,
+        _gallery_request(gallery_id=gallery_id, size_profile=size_profile),
+        page=page,
+        per_page=per_page,
     )
 
+    return _parse_gallery_response(api, resp, size_profile=size_profile)
+
+
+def _parse_gallery_response(
+    api: FlickrApi, resp: ET.Element, *, size_profile: SizeProfile
+) -> PhotosInGallery:
+    """
+    Parse a page of photos from the ``flickr.galleries.getPhotos`` API.
+    """
     gallery_elem = find_required_elem(resp, path="gallery")
 
     gallery_title = find_required_text(gallery_elem, path="title")
@@ -310,7 +1191,7 @@ def get_photos_in_gallery(
     photos_elem = find_required_elem(resp, path="photos")
 
     return {
-        **_create_collection(api, photos_elem),
+        **_create_collection(api, photos_elem, size_profile=size_profile),
         "gallery": {"owner_name": gallery_owner_name, "title": gallery_title},
     }
 
@@ -321,6 +1202,7 @@ def get_photos_in_user_photostream(
     user_url: str | None = None,
     page: int = 1,
     per_page: int = 10,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
 ) -> CollectionOfPhotos:
     """
     Get a page of photos from a user's photostream.
@@ -339,18 +1221,38 @@ def get_photos_in_user_photostream(
     """
     user_id = api._ensure_user_id(user_id=user_id, user_url=user_url)
 
-    # See https://www.flickr.com/services/api/flickr.people.getPublicPhotos.html
-    resp = api.call(
-        method="flickr.people.getPublicPhotos",
-        params={
-            "user_id": user_id,
-            "extras": ",".join(extras),
-            "page": page,
-            "per_page": per_page,
-        },
-        exceptions={"1": ResourceNotFound(f"Could not find user with ID: {user_id!r}")},
+    return _get_photos_in_user_photostream(
+        api, user_id=user_id, page=page, per_page=per_page, size_profile=size_profile
+    )
+
+
+def _get_photos_in_user_photostream(
+    api: FlickrApi,
+    *,
+    user_id: str,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile,
+) -> CollectionOfPhotos:
+    """
+    Get a page of photos from a user's photostream.
+    """
+    resp = _call_collection_api(
+        api,
+        _photostream_request(user_id=user_id, size_profile=size_profile),
+        page=page,
+        per_page=per_page,
     )
 
+    return _parse_photostream_response(api, resp, size_profile=size_profile)
+
+
+def _parse_photostream_response(
+    api: FlickrApi, resp: ET.Element, *, size_profile: SizeProfile
+) -> CollectionOfPhotos:
+    """
+    Parse a page of photos from the ``flickr.people.getPublicPhotos`` API.
+    """
     first_photo = resp.find(".//photo")
 
     # The user hasn't uploaded any photos
@@ -366,12 +1268,31 @@ def get_photos_in_user_photostream(
 
     photos_elem = find_required_elem(resp, path="photos")
 
-    return _create_collection(api, photos_elem, owner=owner)
+    return _create_collection(api, photos_elem, owner=owner, size_profile=size_profile)
 
 
 def _lookup_group_from_url(api: FlickrApi, *, url: str) -> GroupInfo:
     """
     Given the link to a group's photos or profile, return some info.
+
+    If the API has a resolution index, we check that first.
+    """
+    if isinstance(api, CachingFlickrApi) and api.resolution_index is not None:
+        group_info: GroupInfo | None = api.resolution_index.get("group", url)
+
+        if group_info is None:
+            group_info = _lookup_group_from_url_with_api(api, url=url)
+            api.resolution_index.set("group", url, group_info)
+
+        return group_info
+    else:
+        return _lookup_group_from_url_with_api(api, url=url)
+
+
+def _lookup_group_from_url_with_api(api: FlickrApi, *, url: str) -> GroupInfo:
+    """
+    Given the link to a group's photos or profile, look up the group
+    with the Flickr API.
     """
     # See https://www.flickr.com/services/api/flickr.urls.lookupGroup.html
     resp = api.call(
@@ -380,6 +1301,13 @@ def _lookup_group_from_url(api: FlickrApi, *, url: str) -> GroupInfo:
         exceptions={"1": ResourceNotFound(f"Could not find group with URL: {url!r}")},
     )
 
+    return _parse_group_lookup(resp)
+
+
+def _parse_group_lookup(resp: ET.Element) -> GroupInfo:
+    """
+    Parse the response from the ``flickr.urls.lookupGroup`` API.
+    """
     # The lookupUser response is of the form:
     #
     #       <group id="34427469792@N01">
@@ -395,62 +1323,106 @@ def _lookup_group_from_url(api: FlickrApi, *, url: str) -> GroupInfo:
 
 
 def get_photos_in_group_pool(
-    api: FlickrApi, *, group_url: str, page: int = 1, per_page: int = 10
+    api: FlickrApi,
+    *,
+    group_url: str,
+    page: int = 1,
+    per_page: int = 10,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
 ) -> PhotosInGroup:
     """
     Get a page of photos in a group pool.
     """
     group_info = _lookup_group_from_url(api, url=group_url)
 
-    # See https://www.flickr.com/services/api/flickr.groups.pools.getPhotos.html
-    resp = api.call(
-        method="flickr.groups.pools.getPhotos",
-        params={
-            "group_id": group_info["id"],
-            "extras": ",".join(extras),
-            "page": page,
-            "per_page": per_page,
-        },
+    return _get_photos_in_group_pool(
+        api,
+        group_info=group_info,
+        page=page,
+        per_page=per_page,
+        size_profile=size_profile,
+    )
+
+
+def _get_photos_in_group_pool(
+    api: FlickrApi,
+    *,
+    group_info: GroupInfo,
+    page: int,
+    per_page: int,
+    size_profile: SizeProfile,
+) -> PhotosInGroup:
+    """
+    Get a page of photos in a group pool.
+    """
+    resp = _call_collection_api(
+        api,
+        _group_pool_request(group_id=group_info["id"], size_profile=size_profile),
+        page=page,
+        per_page=per_page,
+    )
+
+    return _parse_group_pool_response(
+        api, resp, group_info=group_info, size_profile=size_profile
     )
 
+
+def _parse_group_pool_response(
+    api: FlickrApi,
+    resp: ET.Element,
+    *,
+    group_info: GroupInfo,
+    size_profile: SizeProfile,
+) -> PhotosInGroup:
+    """
+    Parse a page of photos from the ``flickr.groups.pools.getPhotos`` API.
+    """
     photos_elem = find_required_elem(resp, path="photos")
 
     return {
-        **_create_collection(api, photos_elem),
+        **_create_collection(api, photos_elem, size_profile=size_profile),
         "group": group_info,
     }
 
 
 def get_photos_with_tag(
-    api: FlickrApi, *, tag: str, page: int = 1, per_page: int = 10
+    api: FlickrApi,
+    *,
+    tag: str,
+    page: int = 1,
+    per_page: int = 10,
+    size_profile: SizeProfile = DEFAULT_SIZE_PROFILE,
+    min_upload_date: datetime | None = None,
 ) -> CollectionOfPhotos:
     """
-    Get a page of photos in a tag.
+    Get a page of photos in a tag, optionally only the photos uploaded
+    at or after ``min_upload_date``.
 
     Note that tag pagination and ordering results can be inconsistent,
     especially for large tags -- it's tricky to do an "exhaustive" search
     of a Flickr tag.
     """
-    resp = api.call(
-        method="flickr.photos.search",
-        params={
-            "tags": tag,
-            "page": page,
-            "per_page": per_page,
-            # This is so we get the same photos as you see on the "tag" page
-            # under "All Photos Tagged XYZ" -- if you click the URL to the
-            # full search results, you end up on a page like:
-            #
-            #     https://flickr.com/search/?sort=interestingness-desc&…
-            #
-            "sort": "interestingness-desc",
-            "extras": ",".join(extras),
-        },
+    resp = _call_collection_api(
+        api,
+        _tag_request(
+            tag=tag, size_profile=size_profile, min_upload_date=min_upload_date
+        ),
+        page=page,
+        per_page=per_page,
     )
 
+    return _parse_tag_response(api, resp, size_profile=size_profile)
+
+
+def _parse_tag_response(
+    api: FlickrApi, resp: ET.Element, *, size_profile: SizeProfile
+) -> CollectionOfPhotos:
+    """
+    Parse a page of photos from the ``flickr.photos.search`` API.
+    """
     photos_elem = find_required_elem(resp, path="photos")
 
-    return _create_collection(api, photos_elem)
+    return _create_collection(api, photos_elem, size_profile=size_profile)
 
 
 def get_image_url(sizes: list[Size], desired_size: str) -> str:
@@ -473,5 +1445,5 @@ def get_image_url(sizes: list[Size], desired_size: str) -> str:
     #
     try:
         return sizes_by_label[desired_size]["source"]
-    except KeyError:  # pragma: no cover
+    except KeyError:
         return max(sizes, key=lambda s: s["width"] or 0)["source"]
@@ -0,0 +1,172 @@
+"""
+A cache of the rendered ``<li>`` for each photo on /see_photos.
+
+Rendering a photo means a couple of ``url_for`` calls, formatting
+the dates, and including the license component, and we do it for the
+same photos every time somebody looks at a popular collection.  Instead,
+we keep the rendered HTML for recently-seen photos in memory, so a
+repeat render is mostly joining strings.
+
+Fragments are keyed on:
+
+*   the photo's URL, plus every other field we use in the template,
+    so if the title or license changes, we render it again
+*   the type of URL we're showing, because we only show the owner of
+    each photo if the URL isn't already about a single owner
+*   the script root, because the links in the fragment include it
+
+The cache is per-process, and bounded, so it only holds the most
+recently-used fragments.  It's skipped if Flask is reloading templates
+(e.g. in debug mode), so you can see your changes to the template.
+"""
+
+import collections
+from collections.abc import Callable
+from datetime import datetime
+import threading
+import typing
+
+from flask import current_app, request
+from markupsafe import Markup
+
+from .compact import CompactPhoto
+from .metrics import CACHE_REQUESTS
+from .models import Photo
+
+
+FragmentKey = tuple[
+    str,
+    str,
+    str,
+    str,
+    tuple[tuple[str, int | None, int | None], ...],
+    str | None,
+    str,
+    str,
+    tuple[datetime, str] | None,
+    datetime,
+    str,
+]
+
+
+# How many fragments we keep in each process.  A fragment is about 1KB,
+# so this is 10MB or so.
+MAX_FRAGMENTS = 10_000
+
+
+class FragmentCache:
+    """
+    A thread-safe, least-recently-used cache of rendered HTML.
+    """
+
+    def __init__(self, max_size: int = MAX_FRAGMENTS) -> None:
+        self.max_size = max_size
+        self._fragments: collections.OrderedDict[FragmentKey, Markup] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._fragments)
+
+    def get_or_render(self, key: FragmentKey, render: Callable[[], Markup]) -> Markup:
+        """
+        Returns the fragment with this key, rendering it if it isn't
+        in the cache.
+        """
+        with self._lock:
+            try:
+                fragment = self._fragments[key]
+            except KeyError:
+                pass
+            else:
+                self._fragments.move_to_end(key)
+                CACHE_REQUESTS.inc(cache="fragment", result="hit")
+                return fragment
+
+        CACHE_REQUESTS.inc(cache="fragment", result="miss")
+
+        # We render outside the lock, so other threads aren't kept
+        # waiting.  If two threads render the same photo at once,
+        # they both get the same HTML, and it doesn't matter which
+        # one ends up in the cache.
+        fragment = render()
+
+        with self._lock:
+            self._fragments[key] = fragment
+            self._fragments.move_to_end(key)
+
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+
+        return fragment
+
+    def clear(self) -> None:
+        """
+        Throw away every fragment.
+        """
+        with self._lock:
+            self._fragments.clear()
+
+
+fragment_cache = FragmentCache()
+
+
+def fragment_key(photo: Photo | CompactPhoto, url_type: str) -> FragmentKey:
+    """
+    Returns the key for the fragment for a photo.
+
+    This includes every field of the photo that's used in the
+    template, so if any of them change, we render the photo again.
+    If you use another field in "components/photo.html", add it here.
+
+    We use the fields themselves rather than a hash of their serialised
+    form, because serialising a photo takes about as long as rendering
+    it; the dict hashes the tuple for us.
+    """
+    if isinstance(photo, CompactPhoto):
+        photo = photo.to_photo()
+
+    date_taken = photo["date_taken"]
+
+    return (
+        url_type,
+        request.script_root,
+        photo["url"],
+        photo["image_url"],
+        tuple((s["source"], s["width"], s["height"]) for s in photo["sizes"]),
+        photo["title"],
+        photo["owner_url"],
+        photo["owner_name"],
+        (date_taken["value"], date_taken["granularity"]) if date_taken else None,
+        photo["date_posted"],
+        photo["license"]["id"],
+    )
+
+
+def render_photo(photo: Photo | CompactPhoto, url_type: str) -> Markup:
+    """
+    Render the ``<li>`` for a photo on /see_photos, using the cached
+    fragment if we have one.
+
+    This is a template global, so it can be called from the loop
+    in ``see_photos.html``.
+    """
+    key = fragment_key(photo, url_type)
+
+    def render() -> Markup:
+        # We call a macro, rather than rendering a template, because
+        # rendering a template sets up a new context every time, which
+        # takes almost as long as rendering the photo.
+        template = current_app.jinja_env.get_template("components/photo.html")
+        photo_item = template.module.photo_item  # type: ignore[attr-defined]
+
+        return typing.cast(Markup, photo_item(photo, url_type))
+
+    # If we're reloading templates as they change (e.g. when we're
+    # running the app in debug mode), the cached fragments might be
+    # out of date, so we always render the photo from scratch.
+    if current_app.jinja_env.auto_reload:
+        return render()
+
+    return fragment_cache.get_or_render(key, render)
@@ -0,0 +1,249 @@
+"""
+An optional proxy for the images on /see_photos, with a cache on disk.
+
+Normally, visitors' browsers fetch every image straight from
+``live.staticflickr.com``.  If the proxy is enabled, we rewrite the
+image URLs on /see_photos to point at the /images route instead, and:
+
+*   we keep a copy of every image we serve in a directory on disk, so
+    popular images are served locally rather than fetched again
+*   we send long-lived ``Cache-Control`` headers, because Flickr image
+    URLs include a secret, so an image never changes at the same URL
+*   we fetch images with a single pooled HTTP client, so we reuse
+    connections to Flickr rather than opening a new one each time
+
+Images are streamed in chunks in both directions, so we never hold a
+whole image in memory.  When we fetch an image from Flickr, we write it
+to a temporary file as we send it to the browser, and only move it into
+the cache once we've got the whole thing.
+
+The cache is a least-recently-used cache with a maximum size.  We
+touch the modification time of an image every time we serve it, and
+when the cache gets too big, we delete the images with the oldest
+modification times.  The cache directory can be shared between
+processes, but each process only counts the images it's written
+itself, so the cache can go over its limit by a bit before
+it's trimmed.
+
+The proxy is enabled by setting ``FLINUMERATR_IMAGE_CACHE_PATH``
+to the path of a directory.
+"""
+
+from collections.abc import Iterator
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import time
+
+import httpx
+
+
+# Where we fetch images from.
+UPSTREAM_URL = "https://live.staticflickr.com"
+
+
+# The path of an image on ``live.staticflickr.com``, which is the server,
+# then the photo ID, the secret, and an optional size suffix, e.g.
+#
+#     65535/50000000001_abcdef1234_b.jpg
+#
+# We only proxy paths that look like this, so the proxy can't be used
+# to fetch anything else.
+IMAGE_PATH_RE = re.compile(r"^[0-9]+/[0-9]+_[0-9a-f]+(?:_[a-z0-9]+)?\.(?:jpg|png|gif)$")
+
+
+# The most bytes of images we keep on disk.  When the cache gets bigger
+# than this, we delete images until it's back below the low water mark,
+# so we don't have to trim it again on every new image.
+MAX_CACHE_BYTES = 1_000_000_000
+LOW_WATER_MARK = 0.9
+
+
+# Images never change at the same URL, so browsers and any proxies
+# in front of the app can keep them for as long as they like.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+# How many bytes we read from Flickr at a time.
+CHUNK_SIZE = 64 * 1024
+
+
+def is_image_path(image_path: str) -> bool:
+    """
+    Returns True if this is the path of an image we can proxy.
+    """
+    return IMAGE_PATH_RE.match(image_path) is not None
+
+
+class ImageProxy:
+    """
+    Fetches images from Flickr, and caches them in a directory on disk.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        upstream_url: str = UPSTREAM_URL,
+        max_bytes: int = MAX_CACHE_BYTES,
+        client: httpx.Client | None = None,
+    ) -> None:
+        self.path = path
+        self.upstream_url = upstream_url.rstrip("/")
+        self.max_bytes = max_bytes
+        self.client = client or httpx.Client(
+            timeout=15,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+
+        os.makedirs(self.path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._size_bytes = sum(size for _, _, size in self._cached_files())
+
+    def image_path(self, url: str) -> str | None:
+        """
+        Returns the path of an image URL we can proxy, or ``None`` if
+        we can't proxy it.
+        """
+        prefix = self.upstream_url + "/"
+
+        if not url.startswith(prefix):
+            return None
+
+        image_path = url.removeprefix(prefix)
+
+        return image_path if is_image_path(image_path) else None
+
+    def content_type(self, image_path: str) -> str:
+        """
+        Returns the Content-Type of an image.
+        """
+        content_type, _ = mimetypes.guess_type(image_path)
+
+        return content_type or "application/octet-stream"
+
+    def cache_path(self, image_path: str) -> str:
+        """
+        Returns the path where we'd cache an image.
+        """
+        return os.path.join(
+            self.path, hashlib.sha256(image_path.encode("utf8")).hexdigest()
+        )
+
+    def get_cached(self, image_path: str) -> str | None:
+        """
+        Returns the path to the cached copy of an image, or ``None``
+        if it isn't cached.
+
+        This marks the image as recently used.
+        """
+        cache_path = self.cache_path(image_path)
+
+        try:
+            os.utime(cache_path, ns=(time.time_ns(), time.time_ns()))
+        except FileNotFoundError:
+            return None
+
+        return cache_path
+
+    def fetch(self, image_path: str) -> httpx.Response:
+        """
+        Start fetching an image from Flickr.
+
+        This returns as soon as we have the headers; the caller
+        must read or close the response.
+        """
+        request = self.client.build_request("GET", f"{self.upstream_url}/{image_path}")
+
+        return self.client.send(request, stream=True)
+
+    def stream_and_cache(
+        self, image_path: str, upstream: httpx.Response
+    ) -> Iterator[bytes]:
+        """
+        Yield the body of an image we're fetching from Flickr, and save
+        it in the cache once we've read all of it.
+
+        If we don't read the whole image (e.g. the browser goes away
+        before we've finished), we throw away what we've read.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+        size_bytes = 0
+
+        try:
+            with os.fdopen(fd, "wb") as out_file:
+                for chunk in upstream.iter_bytes(chunk_size=CHUNK_SIZE):
+                    out_file.write(chunk)
+                    size_bytes += len(chunk)
+                    yield chunk
+
+            os.replace(tmp_path, self.cache_path(image_path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        finally:
+            upstream.close()
+
+        with self._lock:
+            self._size_bytes += size_bytes
+            too_big = self._size_bytes > self.max_bytes
+
+        if too_big:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        Delete the least-recently-used images until the cache is back
+        below its low water mark.
+        """
+        with self._lock:
+            cached_files = sorted(self._cached_files())
+            size_bytes = sum(size for _, _, size in cached_files)
+
+            for _, path, size in cached_files:
+                if size_bytes <= self.max_bytes * LOW_WATER_MARK:
+                    break
+
+                # Another process may have deleted this image already.
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:  # pragma: no cover
+                    pass
+
+                size_bytes -= size
+
+            self._size_bytes = size_bytes
+
+    def _cached_files(self) -> Iterator[tuple[int, str, int]]:
+        """
+        Yield the modification time, path and size of every image
+        in the cache.
+        """
+        for entry in os.scandir(self.path):
+            if entry.name.startswith(".tmp-"):
+                continue
+
+            # Another process may have deleted this image since we
+            # listed the directory.
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:  # pragma: no cover
+                continue
+
+            yield stat.st_mtime_ns, entry.path, stat.st_size
+
+
+def get_image_proxy() -> ImageProxy | None:
+    """
+    Returns the image proxy configured by the
+    ``FLINUMERATR_IMAGE_CACHE_PATH`` environment variable, or ``None``
+    if it isn't set.
+    """
+    try:
+        return ImageProxy(path=os.environ["FLINUMERATR_IMAGE_CACHE_PATH"])
+    except KeyError:
+        return None
@@ -0,0 +1,582 @@
+"""
+Background jobs for enumerating very big collections.
+
+Fetching every photo in a 100k-photo photostream or a popular tag
+takes hundreds of calls to the Flickr API, which is far longer than
+a gunicorn worker can spend on a single request -- and while it's
+trying, that worker can't serve anybody else.
+
+Instead, you can submit the URL as a job.  Jobs are stored in a SQLite
+queue, and run by worker processes which are separate from the web
+workers (``flask --app flinumeratr.app run-job-worker``), so long jobs
+never starve interactive traffic:
+
+*   Submitting a job returns its ID, which you can use to poll its
+    progress -- how many pages we've fetched, how many photos we've
+    found so far, and roughly how long is left.
+*   Workers claim jobs with a lease, which they renew after every page.
+    If a worker dies (or the machine restarts), its lease expires, and
+    another worker picks up the job and starts it again.
+*   Every claim gets a new lease token, and a worker can only update
+    a job while it holds the current token.  If a worker was only
+    stalled, rather than dead, it finds out it's lost the job the next
+    time it renews its lease, and stops.
+*   If a worker runs out of API budget, it puts the job back in the
+    queue until the budget has refilled.  When the job is claimed
+    again, it carries on from the last page it saved.
+*   When a job is done, its photos are saved as CSV or JSON Lines in
+    the results directory, ready to be downloaded.  Finished jobs
+    and their results are deleted after a week.
+"""
+
+from collections.abc import Iterator
+import contextlib
+from datetime import datetime, timezone
+import glob
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import typing
+
+from flickr_api import FlickrApi, ResourceNotFound
+from flickr_url_parser import ParseResult
+
+from .export import ExportFormat, export_photos
+from .flickr_api import (
+    PER_PAGE,
+    get_streaming_page_fetcher,
+    iter_photos_from_flickr_url,
+)
+from .models import Photo
+from .ratelimit import RateLimitExceeded
+
+
+JobState = typing.Literal["queued", "running", "done", "failed"]
+
+
+# How long a worker can go without renewing its lease before we assume
+# it's died, in seconds.  Workers renew their lease after every page,
+# and a page can spend a couple of minutes waiting for the rate budget.
+LEASE_SECONDS = 10 * 60
+
+# How many times we'll start a job before we give up on it.
+MAX_ATTEMPTS = 3
+
+# How long we keep finished jobs and their results, in seconds.
+MAX_JOB_AGE = 7 * 24 * 60 * 60
+
+
+class Job(typing.TypedDict):
+    id: str
+    flickr_url: str
+    parsed_url: ParseResult
+    format: ExportFormat
+    state: JobState
+    submitted_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+    attempts: int
+
+    # If the job has been put back in the queue, the earliest time it
+    # can be claimed again.
+    not_before: datetime | None
+
+    # The token of the worker that's running the job, or that ran it
+    # most recently.  This is None until the job is first claimed.
+    lease: str | None
+
+    # Our progress through the collection.  ``count_pages`` is None
+    # until we've fetched the first page.
+    pages_done: int
+    count_pages: int | None
+    count_photos: int
+
+    error: str | None
+
+
+class LeaseLost(Exception):
+    """
+    Thrown when a worker tries to update a job after its lease has
+    expired, and another worker has claimed the job.
+    """
+
+
+class JobQueue:
+    """
+    A queue of background jobs, stored in SQLite, plus a directory
+    of results.
+
+    Like ``ResponseCache``, this opens a new connection for every
+    operation, so it can be shared between threads and processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.results_dir = os.path.join(path, "results")
+
+        os.makedirs(self.results_dir, exist_ok=True)
+
+        conn = sqlite3.connect(os.path.join(self.path, "jobs.db"), timeout=10)
+
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS jobs(
+                        id TEXT PRIMARY KEY,
+                        flickr_url TEXT NOT NULL,
+                        parsed_url TEXT NOT NULL,
+                        format TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        submitted_at REAL NOT NULL,
+                        started_at REAL,
+                        finished_at REAL,
+                        heartbeat_at REAL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        lease TEXT,
+                        not_before REAL,
+                        pages_done INTEGER NOT NULL DEFAULT 0,
+                        count_pages INTEGER,
+                        count_photos INTEGER NOT NULL DEFAULT 0,
+                        error TEXT
+                    )
+                    """
+                )
+
+                # Queues created before we fenced leases don't have
+                # a lease column, and queues created before we delayed
+                # retries don't have a not_before column.
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+
+                if "lease" not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN lease TEXT")
+
+                if "not_before" not in columns:
+                    conn.execute("ALTER TABLE jobs ADD COLUMN not_before REAL")
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # Claiming a job reads and updates the queue in a single
+        # transaction, so we take the write lock up front with
+        # ``BEGIN IMMEDIATE``, as in ``RateBudget``.
+        conn = sqlite3.connect(
+            os.path.join(self.path, "jobs.db"), timeout=10, isolation_level=None
+        )
+        conn.row_factory = sqlite3.Row
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def submit(
+        self, flickr_url: str, parsed_url: ParseResult, *, format: ExportFormat
+    ) -> str:
+        """
+        Add a job to the queue, and return its ID.
+        """
+        job_id = secrets.token_hex(16)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs(id, flickr_url, parsed_url, format, state, submitted_at)
+                VALUES(?, ?, ?, ?, 'queued', ?)
+                """,
+                (job_id, flickr_url, json.dumps(parsed_url), format, time.time()),
+            )
+
+        return job_id
+
+    def get(self, job_id: str) -> Job | None:
+        """
+        Returns a job, if it exists.
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+        return _job_from_row(row) if row is not None else None
+
+    def claim(self) -> Job | None:
+        """
+        Claim the oldest job that's waiting to run, if there is one.
+
+        This includes jobs whose worker has stopped renewing its lease,
+        which start again from the beginning.  If a job has already been
+        started ``MAX_ATTEMPTS`` times, we assume it's what's killing
+        the workers, and fail it instead.
+
+        Jobs that were put back in the queue keep their progress, but
+        we skip them until their ``not_before`` time.
+
+        The job we return has a new lease token, which the worker
+        passes back with every update.
+        """
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET
+                    state = 'failed',
+                    finished_at = ?,
+                    error = 'Gave up after ' || attempts || ' attempts'
+                WHERE state = 'running' AND heartbeat_at < ? AND attempts >= ?
+                """,
+                (now, now - LEASE_SECONDS, MAX_ATTEMPTS),
+            )
+
+            row = conn.execute(
+                """
+                SELECT id FROM jobs
+                WHERE (state = 'queued' AND coalesce(not_before, 0) <= ?)
+                    OR (state = 'running' AND heartbeat_at < ?)
+                ORDER BY submitted_at
+                LIMIT 1
+                """,
+                (now, now - LEASE_SECONDS),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            row = conn.execute(
+                """
+                UPDATE jobs SET
+                    state = 'running',
+                    started_at = ?,
+                    heartbeat_at = ?,
+                    attempts = attempts + 1,
+                    lease = ?,
+                    not_before = NULL,
+                    pages_done = iif(state = 'queued', pages_done, 0),
+                    count_pages = iif(state = 'queued', count_pages, NULL),
+                    count_photos = iif(state = 'queued', count_photos, 0)
+                WHERE id = ?
+                RETURNING *
+                """,
+                (now, now, secrets.token_hex(16), row["id"]),
+            ).fetchone()
+
+        return _job_from_row(row)
+
+    def update_progress(
+        self, job: Job, *, pages_done: int, count_pages: int, count_photos: int
+    ) -> None:
+        """
+        Record our progress through a job, and renew its lease.
+
+        Raises ``LeaseLost`` if another worker has claimed the job.
+        """
+        self._update_leased(
+            job,
+            "pages_done = ?, count_pages = ?, count_photos = ?, heartbeat_at = ?",
+            (pages_done, count_pages, count_photos, time.time()),
+        )
+
+    def finish(self, job: Job) -> None:
+        """
+        Mark a job as done.  Its result should already be saved.
+
+        Raises ``LeaseLost`` if another worker has claimed the job.
+        """
+        self._update_leased(job, "state = 'done', finished_at = ?", (time.time(),))
+
+    def fail(self, job: Job, *, error: str) -> None:
+        """
+        Mark a job as failed, and record why.
+
+        Raises ``LeaseLost`` if another worker has claimed the job.
+        """
+        self._update_leased(
+            job, "state = 'failed', finished_at = ?, error = ?", (time.time(), error)
+        )
+
+    def release(self, job: Job, *, delay: float = 0) -> None:
+        """
+        Put a job back in the queue, so it can be retried in ``delay``
+        seconds.  It keeps the progress it's made so far.
+
+        This doesn't count as one of the job's attempts.  Raises
+        ``LeaseLost`` if another worker has claimed the job.
+        """
+        self._update_leased(
+            job,
+            "state = 'queued', attempts = attempts - 1, not_before = ?",
+            (time.time() + delay,),
+        )
+
+    def delete_old_jobs(self, *, max_age: float) -> list[str]:
+        """
+        Delete jobs that finished more than ``max_age`` seconds ago,
+        along with their results, and return their IDs.
+
+        This also deletes any partial results left behind by workers
+        that died while they were running the job.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                DELETE FROM jobs
+                WHERE state IN ('done', 'failed') AND finished_at < ?
+                RETURNING id
+                """,
+                (time.time() - max_age,),
+            ).fetchall()
+
+        job_ids = [row["id"] for row in rows]
+
+        for job_id in job_ids:
+            for path in glob.glob(os.path.join(self.results_dir, f"{job_id}.*")):
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+
+        return job_ids
+
+    def _update_leased(
+        self, job: Job, assignments: str, params: tuple[str | int | float, ...]
+    ) -> None:
+        """
+        Update a running job, but only if we still hold its lease.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"""
+                UPDATE jobs SET {assignments}
+                WHERE id = ? AND lease = ? AND state = 'running'
+                """,
+                (*params, job["id"], job["lease"]),
+            )
+
+        if cursor.rowcount == 0:
+            raise LeaseLost(f"Job {job['id']} has been claimed by another worker")
+
+    def result_path(self, job: Job) -> str:
+        """
+        Returns the path where the result of a job is saved.
+        """
+        return os.path.join(self.results_dir, f"{job['id']}.{job['format']}")
+
+
+def _job_from_row(row: sqlite3.Row) -> Job:
+    def from_timestamp(ts: float | None) -> datetime | None:
+        return datetime.fromtimestamp(ts, tz=timezone.utc) if ts is not None else None
+
+    return {
+        "id": row["id"],
+        "flickr_url": row["flickr_url"],
+        "parsed_url": json.loads(row["parsed_url"]),
+        "format": row["format"],
+        "state": row["state"],
+        "submitted_at": datetime.fromtimestamp(row["submitted_at"], tz=timezone.utc),
+        "started_at": from_timestamp(row["started_at"]),
+        "finished_at": from_timestamp(row["finished_at"]),
+        "attempts": row["attempts"],
+        "not_before": from_timestamp(row["not_before"]),
+        "lease": row["lease"],
+        "pages_done": row["pages_done"],
+        "count_pages": row["count_pages"],
+        "count_photos": row["count_photos"],
+        "error": row["error"],
+    }
+
+
+def estimate_seconds_remaining(job: Job, *, now: datetime) -> float | None:
+    """
+    Guess how long a running job has left, assuming the rest of
+    the pages take as long as the ones we've already fetched.
+    """
+    if (
+        job["state"] != "running"
+        or job["started_at"] is None
+        or job["count_pages"] is None
+        or job["pages_done"] == 0
+    ):
+        return None
+
+    elapsed = (now - job["started_at"]).total_seconds()
+    pages_left = max(0, job["count_pages"] - job["pages_done"])
+
+    return elapsed / job["pages_done"] * pages_left
+
+
+def iter_job_pages(
+    queue: JobQueue, api: FlickrApi, job: Job
+) -> Iterator[tuple[int, Iterator[Photo]]]:
+    """
+    Yield the number and photos of each page in the job, starting after
+    the last page it saved.
+
+    We record our progress when the caller asks for the next page, so
+    by then it should have saved every photo on the previous one.
+
+    Pages are parsed as they're read from the network, so we only hold
+    one photo at a time, however big the pages are.
+    """
+    parsed_url = job["parsed_url"]
+
+    if parsed_url["type"] == "single_photo":
+        yield 1, iter(iter_photos_from_flickr_url(api, parsed_url))
+        queue.update_progress(job, pages_done=1, count_pages=1, count_photos=1)
+        return
+
+    fetch_page = get_streaming_page_fetcher(api, parsed_url)
+    count_photos = job["count_photos"]
+    count_photos_on_page = 0
+    page = job["pages_done"] + 1
+
+    def count(photos: Iterator[Photo]) -> Iterator[Photo]:
+        nonlocal count_photos_on_page
+
+        for photo in photos:
+            count_photos_on_page += 1
+            yield photo
+
+    while True:
+        collection = fetch_page(page=page, per_page=PER_PAGE["bulk"])
+        count_photos_on_page = 0
+
+        yield page, count(collection["photos"])
+
+        count_photos += count_photos_on_page
+
+        queue.update_progress(
+            job,
+            pages_done=page,
+            count_pages=collection["count_pages"],
+            count_photos=count_photos,
+        )
+
+        if page >= collection["count_pages"] or count_photos_on_page == 0:
+            break
+
+        page += 1
+
+
+def run_job(queue: JobQueue, api: FlickrApi, job: Job) -> None:
+    """
+    Fetch every photo for a job, and save them in the results directory.
+
+    We write the result to a temporary file and rename it when it's
+    complete, so a worker that dies halfway through never leaves
+    a partial result behind.  The temporary file is named after our
+    lease, so a worker that's lost the job never writes over the file
+    of the worker that's taken it over.
+
+    If we run out of API budget, we keep the pages we've saved in
+    a ``.partial`` file, which the next worker to claim the job
+    carries on from.
+    """
+    result_path = queue.result_path(job)
+    partial_path = f"{result_path}.partial"
+    tmp_path = f"{result_path}.{job['lease']}.tmp"
+
+    # Carry on from the pages saved by the last worker to run the job,
+    # or if they've gone missing, start again.
+    try:
+        os.replace(partial_path, tmp_path)
+    except FileNotFoundError:
+        job = {**job, "pages_done": 0, "count_photos": 0}
+
+    try:
+        with open(
+            tmp_path, "a" if job["pages_done"] else "w", encoding="utf8", newline=""
+        ) as out_file:
+            for page, photos in iter_job_pages(queue, api, job):
+                out_file.writelines(
+                    export_photos(photos, format=job["format"], header=page == 1)
+                )
+                out_file.flush()
+    except RateLimitExceeded:
+        os.replace(tmp_path, partial_path)
+        raise
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+        raise
+
+    os.replace(tmp_path, result_path)
+    queue.finish(job)
+
+
+def run_next_job(queue: JobQueue, api: FlickrApi) -> bool:
+    """
+    Claim and run the next job in the queue.
+
+    Returns True if there was a job to run, False if the queue was empty.
+    """
+    job = queue.claim()
+
+    if job is None:
+        return False
+
+    try:
+        try:
+            run_job(queue, api, job)
+        except RateLimitExceeded as err:
+            # We've used up our budget of API calls, which isn't the job's
+            # fault -- put it back, and try again once the budget refills.
+            queue.release(job, delay=err.retry_after)
+        except ResourceNotFound:
+            queue.fail(job, error=f"Unable to find any photos at {job['flickr_url']}")
+        except LeaseLost:
+            raise
+        except Exception as err:
+            queue.fail(job, error=f"{type(err).__name__}: {err}")
+    except LeaseLost:
+        # Another worker has claimed the job since we started it, so
+        # it's theirs now -- leave it alone.
+        pass
+
+    return True
+
+
+def run_worker(
+    queue: JobQueue,
+    api: FlickrApi,
+    *,
+    poll_interval: float = 1,
+    burst: bool = False,
+    stop: threading.Event | None = None,
+) -> None:
+    """
+    Run jobs from the queue until ``stop`` is set.
+
+    Whenever the queue is empty, we delete old jobs.  If ``burst`` is
+    set, we stop as soon as the queue is empty.
+    """
+    if stop is None:
+        stop = threading.Event()
+
+    while not stop.is_set():
+        if not run_next_job(queue, api):
+            queue.delete_old_jobs(max_age=MAX_JOB_AGE)
+
+            if burst:
+                break
+
+            stop.wait(poll_interval)
+
+
+def get_job_queue() -> JobQueue | None:
+    """
+    Returns the job queue configured by the ``FLINUMERATR_JOBS_PATH``
+    environment variable, or ``None`` if it isn't set.
+
+    This is a directory, which holds the queue and the results of
+    finished jobs.  Like snapshots, jobs are kept separate from the
+    response cache, because the cache can be thrown away at any time.
+    """
+    try:
+        return JobQueue(path=os.environ["FLINUMERATR_JOBS_PATH"])
+    except KeyError:
+        return None
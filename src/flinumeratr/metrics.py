@@ -0,0 +1,643 @@
+"""
+Timing and counters, so we can see where the time goes in a request.
+
+A request to /see_photos goes through several phases:
+
+*   ``parse_url`` -- parsing the URL with flickr-url-parser
+*   ``resolve`` -- looking up the IDs we need, e.g. a user's NSID
+*   ``cache`` -- reading and writing the response cache
+*   ``rate_budget`` -- waiting for our budget of Flickr API calls
+*   ``api_call`` -- the round trip to the Flickr API
+*   ``parse`` -- turning the XML response into ``Photo`` dicts
+*   ``render`` -- rendering the ``see_photos.html`` template
+
+Wrap each phase in ``timed()``, and the time is added to the
+``Timings`` for the current request.  Phases can be nested, e.g.
+``resolve`` may include an ``api_call``; we only count the time spent
+in the inner phase once.  (If we fetch several pages in parallel, the
+phases can add up to more than the total time for the request.)
+
+The timings are sent in a ``Server-Timing`` header, and added to
+histograms which are served in the Prometheus text format at /metrics.
+
+Each process records its metrics in memory.  If there's a shared
+``MetricsStore`` (in the same SQLite database as the response cache),
+every process saves a snapshot of its metrics there every few seconds,
+and /metrics adds up the snapshots from every process, so a scrape
+sees all the gunicorn workers and job workers, not just the one that
+happened to serve it.
+"""
+
+from collections.abc import Generator, Iterable, Iterator
+import contextlib
+import contextvars
+import dataclasses
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# The upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+LabelValues = tuple[tuple[str, str], ...]
+
+
+def _labels_from_json(labels: list[list[str]]) -> LabelValues:
+    return tuple((k, v) for k, v in labels)
+
+
+def _format_labels(labels: LabelValues) -> str:
+    """
+    Format a set of labels, e.g. ``{phase="render",url_type="album"}``.
+    """
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _escape(label_value: str) -> str:
+    return label_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """
+    A Prometheus counter, i.e. a number that only goes up.
+    """
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.values: dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """
+        Add ``amount`` to the counter with these labels.
+        """
+        key = tuple(sorted(labels.items()))
+
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self) -> str:
+        """
+        Returns the values in this process, serialised as JSON.
+        """
+        with self._lock:
+            return json.dumps(list(self.values.items()))
+
+    def merge(self, snapshots: Iterable[str]) -> dict[LabelValues, float]:
+        """
+        Add up the values in snapshots from several processes.
+        """
+        merged: dict[LabelValues, float] = {}
+
+        for snapshot in snapshots:
+            for labels, value in json.loads(snapshot):
+                key = _labels_from_json(labels)
+                merged[key] = merged.get(key, 0) + value
+
+        return merged
+
+    def render(self, values: dict[LabelValues, float] | None = None) -> Iterator[str]:
+        """
+        Yield the lines of this counter in the Prometheus text format.
+
+        By default, this is the values in this process.
+        """
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} counter"
+
+        if values is None:
+            with self._lock:
+                values = dict(self.values)
+
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(labels)} {value}"
+
+
+class Gauge:
+    """
+    A Prometheus gauge, i.e. a number that can go up and down.
+    """
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.values: dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: str) -> None:
+        """
+        Set the gauge with these labels to ``value``.
+        """
+        key = tuple(sorted(labels.items()))
+
+        with self._lock:
+            self.values[key] = value
+
+    def snapshot(self) -> str:
+        """
+        Returns the values in this process, serialised as JSON.
+        """
+        with self._lock:
+            return json.dumps(list(self.values.items()))
+
+    def merge(self, snapshots: Iterable[str]) -> dict[LabelValues, float]:
+        """
+        Combine snapshots from several processes, which are sorted from
+        oldest to newest.  We use the newest value for each set of labels.
+        """
+        merged: dict[LabelValues, float] = {}
+
+        for snapshot in snapshots:
+            for labels, value in json.loads(snapshot):
+                merged[_labels_from_json(labels)] = value
+
+        return merged
+
+    def render(self, values: dict[LabelValues, float] | None = None) -> Iterator[str]:
+        """
+        Yield the lines of this gauge in the Prometheus text format.
+
+        By default, this is the values in this process.
+        """
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} gauge"
+
+        if values is None:
+            with self._lock:
+                values = dict(self.values)
+
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(labels)} {value}"
+
+
+@dataclasses.dataclass
+class _HistogramValues:
+    bucket_counts: list[int]
+    count: int = 0
+    sum: float = 0.0
+
+
+class Histogram:
+    """
+    A Prometheus histogram, which counts observations in buckets.
+    """
+
+    def __init__(
+        self, name: str, description: str, buckets: tuple[float, ...] = BUCKETS
+    ) -> None:
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.values: dict[LabelValues, _HistogramValues] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        """
+        Record an observation in the histogram with these labels.
+        """
+        key = tuple(sorted(labels.items()))
+
+        with self._lock:
+            try:
+                values = self.values[key]
+            except KeyError:
+                values = self.values[key] = _HistogramValues(
+                    bucket_counts=[0] * len(self.buckets)
+                )
+
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    values.bucket_counts[i] += 1
+
+            values.count += 1
+            values.sum += value
+
+    def snapshot(self) -> str:
+        """
+        Returns the values in this process, serialised as JSON.
+        """
+        with self._lock:
+            return json.dumps(
+                [
+                    (labels, dataclasses.asdict(values))
+                    for labels, values in self.values.items()
+                ]
+            )
+
+    def merge(self, snapshots: Iterable[str]) -> dict[LabelValues, _HistogramValues]:
+        """
+        Add up the values in snapshots from several processes.
+        """
+        merged: dict[LabelValues, _HistogramValues] = {}
+
+        for snapshot in snapshots:
+            for labels, values in json.loads(snapshot):
+                key = _labels_from_json(labels)
+
+                try:
+                    total = merged[key]
+                except KeyError:
+                    total = merged[key] = _HistogramValues(
+                        bucket_counts=[0] * len(self.buckets)
+                    )
+
+                for i, count in enumerate(values["bucket_counts"]):
+                    total.bucket_counts[i] += count
+
+                total.count += values["count"]
+                total.sum += values["sum"]
+
+        return merged
+
+    def render(
+        self, values: dict[LabelValues, _HistogramValues] | None = None
+    ) -> Iterator[str]:
+        """
+        Yield the lines of this histogram in the Prometheus text format.
+
+        By default, this is the values in this process.
+        """
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} histogram"
+
+        if values is None:
+            with self._lock:
+                values = {
+                    labels: dataclasses.replace(v, bucket_counts=list(v.bucket_counts))
+                    for labels, v in self.values.items()
+                }
+
+        for labels, v in sorted(values.items()):
+            for upper_bound, count in zip(self.buckets, v.bucket_counts):
+                le = (("le", str(upper_bound)),)
+                yield f"{self.name}_bucket{_format_labels(labels + le)} {count}"
+
+            inf = (("le", "+Inf"),)
+            yield f"{self.name}_bucket{_format_labels(labels + inf)} {v.count}"
+            yield f"{self.name}_sum{_format_labels(labels)} {v.sum}"
+            yield f"{self.name}_count{_format_labels(labels)} {v.count}"
+
+
+API_CALLS = Counter(
+    "flinumeratr_api_calls_total",
+    "Calls to the Flickr API, by method.",
+)
+
+CACHE_REQUESTS = Counter(
+    "flinumeratr_cache_requests_total",
+    "Lookups in the response cache and resolution index, by result.",
+)
+
+CACHE_REFRESHES = Counter(
+    "flinumeratr_cache_refreshes_total",
+    "Background refreshes of stale responses in the response cache, by result.",
+)
+
+PREFETCHES = Counter(
+    "flinumeratr_prefetches_total",
+    "Pages of photos fetched into the cache ahead of time, by result.",
+)
+
+RATE_BUDGET_REQUESTS = Counter(
+    "flinumeratr_rate_budget_requests_total",
+    "Requests for a token from the Flickr API rate budget, by priority and result.",
+)
+
+RATE_BUDGET_THROTTLED = Counter(
+    "flinumeratr_rate_budget_throttled_total",
+    "Calls to the Flickr API that were throttled.",
+)
+
+RATE_BUDGET_TOKENS = Gauge(
+    "flinumeratr_rate_budget_tokens",
+    "Tokens left in the Flickr API rate budget, as last seen by any process.",
+)
+
+RATE_BUDGET_WAIT_SECONDS = Histogram(
+    "flinumeratr_rate_budget_wait_seconds",
+    "Time spent waiting for a token from the Flickr API rate budget, by priority.",
+)
+
+PHASE_SECONDS = Histogram(
+    "flinumeratr_phase_seconds",
+    "Time spent in each phase of a request, by phase and URL type.",
+)
+
+REQUEST_SECONDS = Histogram(
+    "flinumeratr_request_seconds",
+    "Total time to serve a request, by URL type.",
+)
+
+METRICS: list[Counter | Gauge | Histogram] = [
+    API_CALLS,
+    CACHE_REQUESTS,
+    CACHE_REFRESHES,
+    PREFETCHES,
+    RATE_BUDGET_REQUESTS,
+    RATE_BUDGET_THROTTLED,
+    RATE_BUDGET_TOKENS,
+    RATE_BUDGET_WAIT_SECONDS,
+    PHASE_SECONDS,
+    REQUEST_SECONDS,
+]
+
+
+# How often each process saves a snapshot of its metrics, in seconds.
+SAVE_INTERVAL = 15
+
+# How long we keep the snapshot of a process that's stopped saving
+# them (e.g. because it's exited), in seconds.  Until then, its counts
+# are still included in the totals.
+MAX_SNAPSHOT_AGE = 24 * 60 * 60
+
+
+class MetricsStore:
+    """
+    Snapshots of the metrics in every process, stored in SQLite.
+
+    Each process saves its own snapshot, keyed by its process ID, and
+    replaces it every time it saves.  Counters and histograms only go
+    up, so we get the totals by adding up the snapshots; for gauges,
+    we use the most recently saved value.
+
+    Like ``ResponseCache``, this opens a new connection for every
+    operation, so it can be shared between threads and processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS metrics(
+                    process TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    snapshot TEXT NOT NULL,
+                    saved_at REAL NOT NULL,
+                    PRIMARY KEY (process, name)
+                )
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=10)
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def save(
+        self, metrics: Iterable[Counter | Gauge | Histogram], *, process: str = ""
+    ) -> None:
+        """
+        Save a snapshot of the metrics in this process.
+
+        The process defaults to the ID of the current process.
+        """
+        now = time.time()
+        process = process or str(os.getpid())
+
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO metrics VALUES(?, ?, ?, ?)",
+                [(process, m.name, m.snapshot(), now) for m in metrics],
+            )
+            conn.execute(
+                "DELETE FROM metrics WHERE saved_at < ?", (now - MAX_SNAPSHOT_AGE,)
+            )
+
+    def load(self) -> dict[str, list[str]]:
+        """
+        Returns the snapshots of each metric from every process, sorted
+        from oldest to newest.
+        """
+        snapshots: dict[str, list[str]] = {}
+
+        with self._connect() as conn:
+            for name, snapshot in conn.execute(
+                "SELECT name, snapshot FROM metrics ORDER BY saved_at"
+            ):
+                snapshots.setdefault(name, []).append(snapshot)
+
+        return snapshots
+
+    def save_periodically(
+        self,
+        metrics: Iterable[Counter | Gauge | Histogram],
+        *,
+        stop: threading.Event,
+        interval: float = SAVE_INTERVAL,
+    ) -> None:
+        """
+        Save a snapshot of the metrics in this process every ``interval``
+        seconds, until ``stop`` is set.  This is meant to run in
+        a background thread.
+
+        If we can't save a snapshot (e.g. the database is locked),
+        we try again next time.
+        """
+        while not stop.wait(interval):
+            with contextlib.suppress(sqlite3.OperationalError):
+                self.save(metrics)
+
+
+def start_saving_metrics(
+    store: MetricsStore | None,
+    *,
+    stop: threading.Event,
+    interval: float = SAVE_INTERVAL,
+) -> threading.Thread | None:
+    """
+    Start a background thread which saves the metrics in this process
+    to ``store`` until ``stop`` is set, and return it.
+
+    If there's no store, we don't start a thread, and return ``None``.
+    """
+    if store is None:
+        return None
+
+    thread = threading.Thread(
+        target=store.save_periodically,
+        args=(METRICS,),
+        kwargs={"stop": stop, "interval": interval},
+        daemon=True,
+    )
+    thread.start()
+
+    return thread
+
+
+def get_metrics_store() -> MetricsStore | None:
+    """
+    Returns the metrics store configured by the ``FLINUMERATR_CACHE_PATH``
+    environment variable, or ``None`` if caching is disabled.
+
+    The store lives in the same database as the response cache.
+    """
+    try:
+        return MetricsStore(path=os.environ["FLINUMERATR_CACHE_PATH"])
+    except KeyError:
+        return None
+
+
+def render_metrics(store: MetricsStore | None = None) -> str:
+    """
+    Render all the metrics in the Prometheus text format.
+
+    If there's a store, we save a fresh snapshot of this process, and
+    render the totals from every process; otherwise we only render
+    the metrics in this process.
+    """
+    if store is None:
+        return "".join(line + "\n" for metric in METRICS for line in metric.render())
+
+    store.save(METRICS)
+    snapshots = store.load()
+
+    return "".join(
+        line + "\n"
+        for metric in METRICS
+        for line in metric.render(
+            metric.merge(snapshots.get(metric.name, []))  # type: ignore[arg-type]
+        )
+    )
+
+
+class Timings:
+    """
+    The time spent in each phase of a single request.
+    """
+
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.durations: dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        """
+        Add some time to a phase.
+        """
+        self.durations[phase] = self.durations.get(phase, 0) + seconds
+
+    @contextlib.contextmanager
+    def activate(self) -> Iterator[None]:
+        """
+        Make this the current request, so ``timed()`` records into it.
+        """
+        timings_token = _current_timings.set(self)
+        frame_token = _current_frame.set(None)
+
+        try:
+            yield
+        finally:
+            _current_frame.reset(frame_token)
+            _current_timings.reset(timings_token)
+
+    def server_timing(self) -> str:
+        """
+        Returns the phases as the value of a ``Server-Timing`` header, e.g.
+
+            parse_url;dur=0.12, api_call;dur=245.31
+
+        The durations are in milliseconds.
+        """
+        return ", ".join(
+            f"{phase};dur={seconds * 1000:.2f}"
+            for phase, seconds in self.durations.items()
+        )
+
+    def observe(self, *, url_type: str) -> None:
+        """
+        Add the timings for this request to the histograms.
+        """
+        for phase, seconds in self.durations.items():
+            PHASE_SECONDS.observe(seconds, phase=phase, url_type=url_type)
+
+        REQUEST_SECONDS.observe(time.perf_counter() - self.start, url_type=url_type)
+
+
+@dataclasses.dataclass
+class _Frame:
+    """
+    A phase that's currently being timed.  We track how long was spent
+    in any phases nested inside it, so we don't count that time twice.
+    """
+
+    child_seconds: float = 0.0
+
+
+_current_timings: contextvars.ContextVar[Timings | None] = contextvars.ContextVar(
+    "current_timings", default=None
+)
+_current_frame: contextvars.ContextVar[_Frame | None] = contextvars.ContextVar(
+    "current_frame", default=None
+)
+
+
+@contextlib.contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """
+    Time a phase of the current request.
+
+    If there's no current request (e.g. in a background job), this
+    does nothing.
+    """
+    timings = _current_timings.get()
+
+    if timings is None:
+        yield
+        return
+
+    parent = _current_frame.get()
+    frame = _Frame()
+    token = _current_frame.set(frame)
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _current_frame.reset(token)
+
+        timings.add(phase, max(0.0, elapsed - frame.child_seconds))
+
+        if parent is not None:
+            parent.child_seconds += elapsed
+
+
+def iter_timed(
+    chunks: Iterable[bytes], timings: Timings, *, phase: str, url_type: str
+) -> Generator[bytes, None, None]:
+    """
+    Iterate over a streamed response, and add the time spent producing
+    each chunk to ``phase``.  When the response is finished, add the
+    timings to the histograms.
+
+    Phases that happen while we produce the chunks (e.g. fetching
+    a later page of photos) are counted separately, as usual.
+    """
+    iterator = iter(chunks)
+
+    try:
+        while True:
+            with timings.activate(), timed(phase):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+
+            yield chunk
+    finally:
+        timings.observe(url_type=url_type)
@@ -1,7 +1,8 @@
+from collections.abc import Iterator
 from datetime import datetime
 import typing
 
-from flickr_api.models import DateTaken, License, User
+from flickr_api.models import DateTaken, License, Size, User
 
 
 class Photo(typing.TypedDict):
@@ -11,6 +12,11 @@ class Photo(typing.TypedDict):
     # URL to a photo size, i.e. the JPEG file
     image_url: str
 
+    # The sizes of the photo that we know about, including the one at
+    # ``image_url``.  Which sizes we have depends on the size profile
+    # we asked for -- see ``flinumeratr.sizes``.
+    sizes: list[Size]
+
     # title of the photo
     title: str | None
 
@@ -38,6 +44,15 @@ class CollectionOfPhotos(typing.TypedDict):
     count_photos: int
 
 
+class StreamedCollection(typing.TypedDict):
+    # The photos are parsed lazily, as the response is read from
+    # the network -- this is an iterator, not a list.
+    photos: Iterator[Photo]
+
+    count_pages: int
+    count_photos: int
+
+
 class AlbumInfo(typing.TypedDict):
     owner: User
     title: str
@@ -65,6 +80,18 @@ class PhotosInGroup(CollectionOfPhotos):
     group: GroupInfo
 
 
+class Pagination(typing.TypedDict):
+    # The first and last pages we're showing, and how many pages
+    # there are in the whole collection.
+    page: int
+    last_page: int
+    count_pages: int
+
+    # Links to the /see_photos pages before and after this one, if any.
+    prev_url: str | None
+    next_url: str | None
+
+
 PhotosFromUrl = (
     Photo | CollectionOfPhotos | PhotosInAlbum | PhotosInGallery | PhotosInGroup
 )
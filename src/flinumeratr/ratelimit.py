@@ -0,0 +1,339 @@
+"""
+A shared budget for calls to the Flickr API.
+
+Flickr limits each API key to roughly 3,600 calls an hour.  If we go
+over, every call fails until the limit resets, and it doesn't matter
+whether the call was for somebody waiting on /see_photos or for a big
+export that could happily wait a few seconds.
+
+This module keeps a token bucket in the same SQLite database as the
+response cache, so it's shared by all the gunicorn workers:
+
+*   The bucket refills at our hourly limit, and can hold a few minutes'
+    worth of calls, so we can absorb bursts.
+*   Each call has a priority.  ``"interactive"`` calls (somebody waiting
+    for a page) can use every token in the bucket; ``"bulk"`` calls
+    (exports, batch lookups, background refreshes) have to leave
+    a reserve, so interactive traffic isn't starved.
+*   If there isn't a token, a call waits for one -- but only until its
+    deadline.  If it can't get a token in time, we raise
+    ``RateLimitExceeded`` rather than keeping somebody waiting forever.
+*   If Flickr tells us we're going too fast (an HTTP 429), we stop
+    making calls for a while.  The backoff doubles every time we're
+    throttled, and halves every time a call succeeds.
+
+How much of the budget we're using is recorded in our metrics.
+"""
+
+from collections.abc import Awaitable, Callable, Iterator
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+import typing
+
+import httpx
+
+from .metrics import (
+    RATE_BUDGET_REQUESTS,
+    RATE_BUDGET_THROTTLED,
+    RATE_BUDGET_TOKENS,
+    RATE_BUDGET_WAIT_SECONDS,
+    timed,
+)
+
+
+T = typing.TypeVar("T")
+
+
+Priority = typing.Literal["interactive", "bulk"]
+
+
+# How long a call with each priority will wait for a token, in seconds.
+DEADLINES: dict[Priority, float] = {"interactive": 10, "bulk": 120}
+
+# The shortest and longest we'll back off after being throttled, in seconds.
+MIN_BACKOFF = 1
+MAX_BACKOFF = 5 * 60
+
+
+class RateLimitExceeded(Exception):
+    """
+    Thrown when we can't get a token from the budget before the
+    call's deadline.
+
+    ``retry_after`` is how many seconds we'd have had to wait for one.
+    """
+
+    def __init__(self, message: str, *, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateBudget:
+    """
+    A token bucket for calls to the Flickr API, stored in SQLite.
+
+    Like ``ResponseCache``, this opens a new connection for every
+    operation, so it can be shared between threads and processes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        calls_per_hour: float = 3600,
+        burst: float = 300,
+        bulk_reserve: float = 75,
+        deadlines: dict[Priority, float] = DEADLINES,
+    ) -> None:
+        self.path = path
+        self.rate = calls_per_hour / 3600
+        self.burst = burst
+        self.bulk_reserve = bulk_reserve
+        self.deadlines = deadlines
+
+        conn = sqlite3.connect(self.path, timeout=10)
+
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+
+            with conn:
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS rate_budget(
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        tokens REAL NOT NULL,
+                        updated_at REAL NOT NULL,
+                        backoff_until REAL NOT NULL,
+                        backoff_seconds REAL NOT NULL
+                    )
+                    """
+                )
+                conn.execute(
+                    "INSERT OR IGNORE INTO rate_budget VALUES(1, ?, ?, 0, 0)",
+                    (burst, time.time()),
+                )
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        # We read and update the bucket in a single transaction, so
+        # we take the write lock up front with ``BEGIN IMMEDIATE``.
+        # If anything goes wrong, closing the connection without
+        # committing rolls back the transaction.
+        conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def try_acquire(self, priority: Priority) -> float:
+        """
+        Try to take a token from the bucket.
+
+        Returns 0 if we got one, or else how many seconds to wait
+        before there might be one for a call with this priority.
+        """
+        now = time.time()
+        floor = self.bulk_reserve if priority == "bulk" else 0
+        wait: float
+
+        with self._connect() as conn:
+            tokens, updated_at, backoff_until = conn.execute(
+                "SELECT tokens, updated_at, backoff_until FROM rate_budget"
+            ).fetchone()
+
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+            if now < backoff_until:
+                wait = backoff_until - now
+            elif tokens - 1 >= floor:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (floor + 1 - tokens) / self.rate
+
+            conn.execute(
+                "UPDATE rate_budget SET tokens = ?, updated_at = ?", (tokens, now)
+            )
+
+        RATE_BUDGET_TOKENS.set(tokens)
+
+        return wait
+
+    def acquire(self, priority: Priority, *, deadline: float | None = None) -> None:
+        """
+        Take a token from the bucket, waiting for one if necessary.
+
+        Raises ``RateLimitExceeded`` if we can't get one before the
+        deadline, which defaults to the deadline for this priority.
+        """
+        start = time.time()
+
+        if deadline is None:
+            deadline = start + self.deadlines[priority]
+
+        with timed("rate_budget"):
+            while (wait := self.try_acquire(priority)) > 0:
+                if time.time() + wait > deadline:
+                    RATE_BUDGET_REQUESTS.inc(priority=priority, result="rejected")
+                    raise RateLimitExceeded(
+                        f"Couldn't make a {priority} call to the Flickr API "
+                        f"within {self.deadlines[priority]} seconds",
+                        retry_after=wait,
+                    )
+
+                time.sleep(wait)
+
+        RATE_BUDGET_REQUESTS.inc(priority=priority, result="granted")
+        RATE_BUDGET_WAIT_SECONDS.observe(time.time() - start, priority=priority)
+
+    async def async_acquire(self, priority: Priority, *, deadline: float) -> None:
+        """
+        The async version of ``acquire()``.
+
+        We only use a thread to read the bucket, and wait for a token
+        with ``asyncio.sleep()``, so waiting calls don't tie up threads
+        that other requests need.
+        """
+        start = time.time()
+
+        with timed("rate_budget"):
+            while (wait := await asyncio.to_thread(self.try_acquire, priority)) > 0:
+                if time.time() + wait > deadline:
+                    RATE_BUDGET_REQUESTS.inc(priority=priority, result="rejected")
+                    raise RateLimitExceeded(
+                        f"Couldn't make a {priority} call to the Flickr API "
+                        f"within {self.deadlines[priority]} seconds",
+                        retry_after=wait,
+                    )
+
+                await asyncio.sleep(wait)
+
+        RATE_BUDGET_REQUESTS.inc(priority=priority, result="granted")
+        RATE_BUDGET_WAIT_SECONDS.observe(time.time() - start, priority=priority)
+
+    def record_throttled(self) -> None:
+        """
+        Record that Flickr throttled one of our calls, so we stop
+        making calls for a while.
+        """
+        now = time.time()
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE rate_budget SET
+                    tokens = 0,
+                    updated_at = ?,
+                    backoff_seconds = min(max(backoff_seconds * 2, ?), ?),
+                    backoff_until = ? + min(max(backoff_seconds * 2, ?), ?)
+                """,
+                (now, MIN_BACKOFF, MAX_BACKOFF, now, MIN_BACKOFF, MAX_BACKOFF),
+            )
+
+        RATE_BUDGET_THROTTLED.inc()
+
+    def record_success(self) -> None:
+        """
+        Record that one of our calls succeeded, so we can back off
+        less next time we're throttled.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE rate_budget SET backoff_seconds = backoff_seconds / 2
+                WHERE backoff_seconds > 0
+                """
+            )
+
+    def call(
+        self,
+        fn: Callable[[], T],
+        *,
+        priority: Priority,
+        max_wait: float | None = None,
+    ) -> T:
+        """
+        Call ``fn()`` once we have a token from the bucket.
+
+        If Flickr throttles the call, we back off, and try again
+        if there's still time before the deadline.  The deadline is
+        ``max_wait`` seconds from now, or the deadline for this priority
+        if ``max_wait`` is ``None``.
+        """
+        if max_wait is None:
+            max_wait = self.deadlines[priority]
+
+        deadline = time.time() + max_wait
+
+        while True:
+            self.acquire(priority, deadline=deadline)
+
+            try:
+                result = fn()
+            except httpx.HTTPStatusError as err:
+                if not is_throttled(err):
+                    raise
+
+                self.record_throttled()
+            else:
+                self.record_success()
+                return result
+
+    async def async_call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        *,
+        priority: Priority,
+        max_wait: float | None = None,
+    ) -> T:
+        """
+        The async version of ``call()``.
+        """
+        if max_wait is None:
+            max_wait = self.deadlines[priority]
+
+        deadline = time.time() + max_wait
+
+        while True:
+            await self.async_acquire(priority, deadline=deadline)
+
+            try:
+                result = await fn()
+            except httpx.HTTPStatusError as err:
+                if not is_throttled(err):
+                    raise
+
+                await asyncio.to_thread(self.record_throttled)
+            else:
+                await asyncio.to_thread(self.record_success)
+                return result
+
+
+def is_throttled(err: httpx.HTTPStatusError) -> bool:
+    """
+    Returns True if this error means Flickr is throttling us.
+    """
+    return err.response.status_code == 429
+
+
+def get_rate_budget() -> RateBudget | None:
+    """
+    Returns the rate budget stored in the database configured by the
+    ``FLINUMERATR_CACHE_PATH`` environment variable, or ``None`` if
+    caching is disabled.
+
+    The budget is only useful if it's shared between all our processes,
+    so we don't keep one in memory.
+    """
+    try:
+        return RateBudget(path=os.environ["FLINUMERATR_CACHE_PATH"])
+    except KeyError:
+        return None
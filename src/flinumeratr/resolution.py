@@ -0,0 +1,174 @@
+"""
+A persistent index of URL lookups.
+
+Before we can fetch photos from most collections, we have to resolve
+the URL to an ID, e.g.
+
+*   a user's path alias to their NSID (``flickr.urls.lookupUser``)
+*   a group URL to the group ID (``flickr.urls.lookupGroup``)
+*   a flic.kr short link to the full URL (an HTTP redirect)
+
+These mappings almost never change, so we store them in a SQLite
+database with a long TTL, and check it before making the lookup.
+This saves a serial round trip before we can start fetching photos.
+
+If a mapping does change, you can remove it with ``invalidate()``.
+"""
+
+from collections.abc import Iterator
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import time
+import typing
+from urllib.parse import urlsplit
+
+from flickr_url_parser import ParseResult, parse_flickr_url
+
+from .metrics import CACHE_REQUESTS
+
+
+ResolutionKind = typing.Literal["user", "group", "short_url"]
+
+
+# How long we remember a resolution, in seconds.
+DEFAULT_TTL = 30 * 24 * 60 * 60
+
+
+def normalise_url(url: str) -> str:
+    """
+    Normalise a URL, so different ways of writing the same URL share
+    a single entry in the index, e.g.
+
+        >>> normalise_url("https://www.flickr.com/people/spike_yun/")
+        "flickr.com/photos/spike_yun"
+        >>> normalise_url("flickr.com/photos/spike_yun")
+        "flickr.com/photos/spike_yun"
+
+    """
+    u = urlsplit(url if "//" in url else f"https://{url}")
+
+    host = u.netloc.lower().removeprefix("www.")
+    path = u.path.rstrip("/").replace("/people/", "/photos/", 1)
+
+    return f"{host}{path}"
+
+
+def is_short_url(url: str) -> bool:
+    """
+    Returns True if this is a URL which ``parse_flickr_url`` has to
+    resolve with an HTTP request, e.g. a flic.kr short link or a guest
+    pass URL.
+    """
+    return re.search(r"(^|//)flic\.kr/|flickr\.com/gp/", url) is not None
+
+
+class ResolutionIndex:
+    """
+    A persistent map from (kind, URL) to some resolved value, stored in SQLite.
+
+    Like ``ResponseCache``, this opens a new connection for every
+    operation, so it can be shared between threads and processes.
+    """
+
+    def __init__(self, path: str, *, ttl: int = DEFAULT_TTL) -> None:
+        self.path = path
+        self.ttl = ttl
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS resolutions(
+                    kind TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (kind, url)
+                )
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=10)
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, kind: ResolutionKind, url: str) -> typing.Any:
+        """
+        Returns the resolved value for this URL, or ``None`` if we
+        don't have one (or it's expired).
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM resolutions WHERE kind = ? AND url = ? AND expires_at > ?",
+                (kind, normalise_url(url), time.time()),
+            ).fetchone()
+
+        if row is None:
+            CACHE_REQUESTS.inc(cache="resolution", result="miss")
+            return None
+        else:
+            CACHE_REQUESTS.inc(cache="resolution", result="hit")
+            return json.loads(row[0])
+
+    def set(self, kind: ResolutionKind, url: str, value: typing.Any) -> None:
+        """
+        Remember the resolved value for this URL.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO resolutions VALUES(?, ?, ?, ?)",
+                (kind, normalise_url(url), json.dumps(value), time.time() + self.ttl),
+            )
+
+    def invalidate(self, url: str) -> None:
+        """
+        Forget any resolutions for this URL.
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM resolutions WHERE url = ?", (normalise_url(url),))
+
+    def clear(self) -> None:
+        """
+        Forget every resolution in the index.
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM resolutions")
+
+
+def get_resolution_index() -> ResolutionIndex | None:
+    """
+    Returns the resolution index configured by the ``FLINUMERATR_CACHE_PATH``
+    environment variable, or ``None`` if caching is disabled.
+
+    The index lives in the same database as the response cache.
+    """
+    try:
+        return ResolutionIndex(path=os.environ["FLINUMERATR_CACHE_PATH"])
+    except KeyError:
+        return None
+
+
+def resolve_flickr_url(url: str, *, index: ResolutionIndex | None) -> ParseResult:
+    """
+    Parse a Flickr URL with flickr-url-parser, using the index to skip
+    the HTTP lookup for short links we've already seen.
+    """
+    if index is None or not is_short_url(url):
+        return parse_flickr_url(url)
+
+    parsed_url: ParseResult | None = index.get("short_url", url)
+
+    if parsed_url is None:
+        parsed_url = parse_flickr_url(url)
+        index.set("short_url", url, parsed_url)
+
+    return parsed_url
@@ -0,0 +1,306 @@
+"""
+Coalesce identical lookups that happen at the same time.
+
+When a Flickr URL goes viral, lots of people load it at once.  Without
+coalescing, every request makes its own identical calls to the Flickr
+API.  With coalescing, the first request (the "leader") does the
+lookup, and any identical requests that arrive while it's in flight
+(the "followers") wait for it and share the result -- including
+a ``ResourceNotFound`` if the photos don't exist.
+
+This works at two levels:
+
+*   Within a process, followers wait on the leader's future, and get
+    the same Python objects back.
+*   Across processes (e.g. gunicorn workers), the leader takes out
+    a lease in a SQLite database.  Followers in other processes wait
+    for the lease to be released, then repeat the lookup -- which is
+    served from the shared ``ResponseCache`` that the leader filled in.
+    If the leader got a ``ResourceNotFound``, the followers raise it
+    without repeating the lookup.
+
+Lookups are keyed on the normalised ``ParseResult``; see ``flight_key()``.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable, Iterator
+import concurrent.futures
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+
+from flickr_api import ResourceNotFound
+from flickr_url_parser import ParseResult
+
+from .resolution import normalise_url
+
+
+T = typing.TypeVar("T")
+
+
+def flight_key(parsed_url: ParseResult, **options: str | int) -> str:
+    """
+    Returns the key for a lookup of the photos at a URL.
+
+    Two lookups get the same key if they're for the same photos, and
+    the same options (e.g. the same ``page`` and ``per_page``).  We drop
+    the page from the parsed URL, so the options decide which page
+    we're looking up.
+    """
+    normalised = {
+        k: normalise_url(v) if k.endswith("_url") and isinstance(v, str) else v
+        for k, v in parsed_url.items()
+        if k != "page"
+    }
+
+    return json.dumps([normalised, options], sort_keys=True)
+
+
+LeaseOutcome = typing.Literal["ok", "not_found", "error"]
+
+
+class FlightLeases:
+    """
+    Leases that tell other processes a lookup is already in flight,
+    stored in SQLite.
+
+    Like ``ResponseCache``, this opens a new connection for every
+    operation, so it can be shared between threads and processes.
+    """
+
+    def __init__(
+        self, path: str, *, lease_seconds: float = 30, poll_interval: float = 0.05
+    ) -> None:
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS flight_leases(
+                    key TEXT PRIMARY KEY,
+                    token TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    outcome TEXT,
+                    message TEXT
+                )
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=10)
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def acquire(self, key: str) -> str | None:
+        """
+        Try to take the lease for a lookup.  Returns a token if we got
+        it, or ``None`` if another process has a lookup in flight.
+
+        If a lease has expired (e.g. because the process that took it
+        crashed), we take it over.
+        """
+        token = uuid.uuid4().hex
+        now = time.time()
+
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT INTO flight_leases VALUES(?, ?, ?, NULL, NULL)
+                ON CONFLICT(key) DO UPDATE SET
+                    token = excluded.token,
+                    expires_at = excluded.expires_at,
+                    outcome = NULL,
+                    message = NULL
+                WHERE outcome IS NOT NULL OR expires_at <= ?
+                """,
+                (key, token, now + self.lease_seconds, now),
+            )
+
+            # Clean up leases that nobody is waiting for any more.
+            conn.execute(
+                "DELETE FROM flight_leases WHERE expires_at <= ?",
+                (now - self.lease_seconds,),
+            )
+
+        return token if cursor.rowcount == 1 else None
+
+    def release(
+        self, key: str, token: str, outcome: LeaseOutcome, message: str = ""
+    ) -> None:
+        """
+        Release a lease, and record the outcome of the lookup for any
+        processes that are waiting for it.
+        """
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE flight_leases SET outcome = ?, message = ?
+                WHERE key = ? AND token = ?
+                """,
+                (outcome, message, key, token),
+            )
+
+    def wait(self, key: str) -> tuple[LeaseOutcome, str]:
+        """
+        Wait for the lookup that's currently in flight to finish, and
+        return its outcome.
+
+        If the lease expires before the lookup finishes, or the lease
+        has been taken by a newer lookup, we stop waiting and return
+        "error", so the caller does the lookup itself.
+        """
+        token: str | None = None
+
+        while True:
+            with self._connect() as conn:
+                row = conn.execute(
+                    """
+                    SELECT token, expires_at, outcome, message FROM flight_leases
+                    WHERE key = ?
+                    """,
+                    (key,),
+                ).fetchone()
+
+            if row is None or (token is not None and row[0] != token):
+                return ("error", "")
+
+            token, expires_at, outcome, message = row
+
+            if outcome is not None:
+                return (outcome, message)
+
+            if expires_at <= time.time():
+                return ("error", "")
+
+            time.sleep(self.poll_interval)
+
+
+class SingleFlight:
+    """
+    Coalesce identical lookups, so only one of them is in flight
+    at a time, and the others share its result.
+
+    If ``leases`` is set, lookups are also coalesced across processes.
+    """
+
+    def __init__(self, leases: FlightLeases | None = None) -> None:
+        self.leases = leases
+        self._lock = threading.Lock()
+        self._in_flight: dict[str, concurrent.futures.Future[typing.Any]] = {}
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        Call ``fn()``, unless there's already a call with the same key
+        in flight, in which case wait for that call and return its result
+        (or raise its exception).
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_leader = future is None
+
+            if future is None:
+                future = self._in_flight[key] = concurrent.futures.Future()
+
+        if not is_leader:
+            result: T = future.result()
+            return result
+
+        try:
+            result = self._call(key, fn)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _call(self, key: str, fn: Callable[[], T]) -> T:
+        """
+        Call ``fn()``, coalescing with any identical calls in other processes.
+        """
+        if self.leases is None:
+            return fn()
+
+        token = self.leases.acquire(key)
+
+        if token is None:
+            outcome, message = self.leases.wait(key)
+
+            if outcome == "not_found":
+                raise ResourceNotFound(message)
+
+            # The leader has finished, so the API responses we need
+            # should be in the response cache.
+            return fn()
+
+        try:
+            result = fn()
+        except ResourceNotFound as exc:
+            self.leases.release(key, token, outcome="not_found", message=str(exc))
+            raise
+        except BaseException:
+            self.leases.release(key, token, outcome="error")
+            raise
+        else:
+            self.leases.release(key, token, outcome="ok")
+            return result
+
+
+class AsyncSingleFlight:
+    """
+    The async version of ``SingleFlight``, which coalesces identical
+    lookups within a single event loop.
+    """
+
+    def __init__(self) -> None:
+        self._in_flight: dict[str, asyncio.Future[typing.Any]] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Await ``fn()``, unless there's already a call with the same key
+        in flight, in which case wait for that call and return its result
+        (or raise its exception).
+        """
+        try:
+            future = self._in_flight[key]
+        except KeyError:
+            future = self._in_flight[key] = asyncio.ensure_future(fn())
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        # If one of the waiting requests is cancelled (e.g. because the
+        # client went away), don't cancel the lookup for everyone else.
+        result: T = await asyncio.shield(future)
+        return result
+
+
+def get_single_flight() -> SingleFlight:
+    """
+    Returns a ``SingleFlight`` that coalesces lookups across processes
+    using the database in ``FLINUMERATR_CACHE_PATH``, or only within
+    this process if caching is disabled.
+
+    Followers in other processes rely on the response cache to get
+    the leader's responses, so there's no point sharing leases without it.
+    """
+    try:
+        return SingleFlight(
+            leases=FlightLeases(path=os.environ["FLINUMERATR_CACHE_PATH"])
+        )
+    except KeyError:
+        return SingleFlight()
@@ -0,0 +1,156 @@
+"""
+Named profiles for the sizes we ask Flickr for.
+
+When we get a collection of photos, we can ask Flickr to include
+the URLs of some sizes on each <photo> element, by passing ``url_*``
+extras, e.g. ``url_m`` for the Medium size.  Every size we ask for
+makes the response bigger and gives us more work to do when we parse
+each photo, so a size profile picks the sizes we actually need:
+
+*   ``medium-only`` is the Medium size, which is what we include
+    in exports
+*   ``responsive`` is a range of sizes from 150px to 1024px, which
+    is enough to build a ``srcset`` for an <img> tag, and is what we
+    use on /see_photos
+*   ``archival`` is the Medium size plus the largest sizes, including
+    the original if the owner allows it
+
+Every profile includes the Small size, because some photos are smaller
+than Medium, and Flickr doesn't return a size if the photo is smaller
+than it.  Small is the size we fall back to for those photos.
+
+The same profile decides which ``url_*`` extras we request and which
+sizes we look for when we parse the response.
+"""
+
+from collections.abc import Callable
+import typing
+from xml.etree import ElementTree as ET
+
+from flickr_api.models import Size
+
+
+SizeProfile = typing.Literal["medium-only", "responsive", "archival"]
+
+DEFAULT_SIZE_PROFILE: SizeProfile = "medium-only"
+
+
+# The sizes Flickr can return on a <photo> element, as a map from
+# the suffix used in the ``url_*`` extras to the label used by the
+# ``flickr.photos.getSizes`` API.
+#
+# See https://www.flickr.com/services/api/misc.urls.html
+SIZE_LABELS = {
+    "sq": "Square",
+    "q": "Large Square",
+    "t": "Thumbnail",
+    "s": "Small",
+    "n": "Small 320",
+    "w": "Small 400",
+    "m": "Medium",
+    "z": "Medium 640",
+    "c": "Medium 800",
+    "l": "Large",
+    "h": "Large 1600",
+    "k": "Large 2048",
+    "o": "Original",
+}
+
+
+# The suffixes of the sizes in each profile, smallest first.
+SIZE_PROFILES: dict[SizeProfile, list[str]] = {
+    "medium-only": ["s", "m"],
+    "responsive": ["q", "s", "n", "m", "z", "c", "l"],
+    "archival": ["s", "m", "l", "h", "k", "o"],
+}
+
+
+# For each profile, the label and attribute names of every size, e.g.
+#
+#     ("Medium", "url_m", "width_m", "height_m")
+#
+# We build these once, rather than formatting the attribute names
+# for every size of every photo.
+_SIZE_TABLES: dict[SizeProfile, list[tuple[str, str, str, str]]] = {
+    profile: [
+        (SIZE_LABELS[suffix], f"url_{suffix}", f"width_{suffix}", f"height_{suffix}")
+        for suffix in suffixes
+    ]
+    for profile, suffixes in SIZE_PROFILES.items()
+}
+
+
+# Sizes which are cropped to a square.  We leave these out of a ``srcset``,
+# because every image in a ``srcset`` has to have the same aspect ratio.
+CROPPED_SIZES = {"Square", "Large Square"}
+
+
+def size_extras(profile: SizeProfile) -> list[str]:
+    """
+    Returns the ``url_*`` extras to request for a size profile.
+    """
+    return [f"url_{suffix}" for suffix in SIZE_PROFILES[profile]]
+
+
+def parse_sizes(
+    photo_elem: ET.Element, *, profile: SizeProfile = DEFAULT_SIZE_PROFILE
+) -> list[Size]:
+    """
+    Get a list of sizes from a photo in a collection response.
+    """
+    # When you get a collection of photos (e.g. in an album)
+    # you can get some of the sizes on the <photo> element, e.g.
+    #
+    #     <
+    #       photo
+    #       url_t="https://live.staticflickr.com/2893/1234567890_t.jpg"
+    #       height_t="78"
+    #       width_t="100"
+    #       …
+    #     />
+    #
+    # A size may be missing even if we asked for it, e.g. if the photo
+    # is smaller than that size or the owner has disabled downloads
+    # of the original.  We skip any size that isn't there.
+    attrib = photo_elem.attrib
+    media = attrib["media"]
+
+    if media not in ("video", "photo"):  # pragma: no cover
+        raise ValueError(f"Unrecognised media: {media!r}")
+
+    sizes: list[Size] = []
+
+    for label, url_attr, width_attr, height_attr in _SIZE_TABLES[profile]:
+        source = attrib.get(url_attr)
+
+        if source is None:
+            continue
+
+        sizes.append(
+            {
+                "height": int(attrib[height_attr]),
+                "width": int(attrib[width_attr]),
+                "label": label,
+                "media": media,  # type: ignore
+                "source": source,
+            }
+        )
+
+    return sizes
+
+
+def srcset(sizes: list[Size], image_url: Callable[[str], str] | None = None) -> str:
+    """
+    Returns the ``srcset`` attribute for an <img> tag that shows a photo,
+    with every size we know that has the same aspect ratio as the photo.
+
+    If ``image_url`` is passed, it's called on the source of each size,
+    e.g. to point at the image proxy.
+
+    This is a template filter.
+    """
+    return ", ".join(
+        f"{image_url(s['source']) if image_url else s['source']} {s['width']}w"
+        for s in sizes
+        if s["media"] == "photo" and s["label"] not in CROPPED_SIZES
+    )
@@ -0,0 +1,438 @@
+"""
+Snapshots of the photos at a URL, which can be refreshed incrementally.
+
+We re-enumerate the same big photostreams and group pools every night,
+and usually only a few dozen photos have changed.  A snapshot is the
+list of photos we found last time, stored in SQLite and keyed on the
+parsed URL.  When we refresh a snapshot, we only fetch the new photos:
+
+*   Photostreams and group pools are sorted newest first, so we walk
+    the pages from the start, and stop as soon as we reach a photo
+    that's already in the snapshot.
+*   Tag searches are sorted by interestingness, so instead we search
+    for photos uploaded since the newest photo in the snapshot (its
+    "high-water mark"), using ``min_upload_date``.
+*   Albums and galleries can be sorted however their owner likes,
+    so we always fetch them in full.
+
+We can't see removed photos without fetching everything.  For
+photostreams and group pools, we compare the snapshot to Flickr's photo
+count, and if they don't add up, we fall back to a full refresh.  Tag
+searches report unreliable counts, so photos removed from a tag only
+show up in a full refresh.
+
+Every refresh returns a diff of the photos that were added and removed,
+and we only write the rows for photos that have been added, changed or
+moved, so the nightly refresh of a big photostream only writes a few
+rows rather than rewriting the whole snapshot.
+
+Snapshots of big photostreams can have 100k+ photos, and a full refresh
+holds both the old and new lists in memory, so we hold them as
+``CompactPhoto`` instances rather than ``Photo`` dicts.
+"""
+
+from collections.abc import Iterator
+import bisect
+import contextlib
+from datetime import datetime, timezone
+import itertools
+import json
+import os
+import sqlite3
+import time
+import typing
+
+from flickr_api import FlickrApi
+from flickr_url_parser import ParseResult
+
+from .cache import CachingFlickrApi
+from .compact import CompactPhoto, PhotoInterner
+from .export import photo_from_dict, photo_to_json
+from .flickr_api import (
+    FLICKR_PER_PAGE,
+    get_page_fetcher,
+    get_photos_with_tag,
+    stream_photos_from_flickr_url,
+)
+from .models import Photo
+from .singleflight import flight_key
+
+
+class Snapshot(typing.TypedDict):
+    photos: list[CompactPhoto]
+    taken_at: datetime
+
+
+class SnapshotDiff(typing.TypedDict):
+    added: list[CompactPhoto]
+    removed: list[CompactPhoto]
+
+    # Whether we had to fetch every photo at the URL, rather than
+    # just the new ones.
+    is_full: bool
+
+
+class SnapshotStore:
+    """
+    Snapshots of the photos at Flickr URLs, stored in SQLite.
+
+    Like ``ResponseCache``, this opens a new connection for every
+    operation, so it can be shared between threads and processes.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS snapshots(
+                    key TEXT PRIMARY KEY,
+                    taken_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS snapshot_photos(
+                    key TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    position REAL NOT NULL,
+                    photo TEXT NOT NULL,
+                    PRIMARY KEY(key, url)
+                )
+                """
+            )
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS snapshot_photos_position
+                ON snapshot_photos(key, position)
+                """
+            )
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=10)
+
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(
+        self, parsed_url: ParseResult, *, interner: PhotoInterner | None = None
+    ) -> Snapshot | None:
+        """
+        Returns the snapshot of the photos at a URL, if we have one.
+
+        Pass an ``interner`` to share owners and licenses with
+        other photos you're holding.
+        """
+        key = flight_key(parsed_url)
+        interner = interner or PhotoInterner()
+
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT taken_at FROM snapshots WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            photos = [
+                interner.compact(photo_from_dict(json.loads(photo)))
+                for (photo,) in conn.execute(
+                    "SELECT photo FROM snapshot_photos WHERE key = ? ORDER BY position",
+                    (key,),
+                )
+            ]
+
+        return {
+            "photos": photos,
+            "taken_at": datetime.fromtimestamp(row[0], tz=timezone.utc),
+        }
+
+    def put(self, parsed_url: ParseResult, photos: list[CompactPhoto]) -> None:
+        """
+        Store a snapshot of the photos at a URL, replacing any
+        previous snapshot.
+
+        We compare the photos to the previous snapshot, and only write
+        the rows for photos which are new, have changed, or have moved,
+        and delete the rows for photos which have gone.
+
+        Photos are identified by their URL; if the same photo appears
+        twice, we keep the first one.
+        """
+        key = flight_key(parsed_url)
+
+        photos_by_url: dict[str, CompactPhoto] = {}
+
+        for p in photos:
+            photos_by_url.setdefault(p.url, p)
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES(?, ?)", (key, time.time())
+            )
+
+            old_rows = {
+                url: (position, photo)
+                for url, position, photo in conn.execute(
+                    "SELECT url, position, photo FROM snapshot_photos WHERE key = ?",
+                    (key,),
+                )
+            }
+
+            positions = _assign_positions(
+                list(photos_by_url),
+                old_positions={url: row[0] for url, row in old_rows.items()},
+            )
+
+            conn.executemany(
+                "DELETE FROM snapshot_photos WHERE key = ? AND url = ?",
+                ((key, url) for url in old_rows.keys() - photos_by_url.keys()),
+            )
+
+            new_rows = (
+                (url, position, photo_to_json(p.to_photo()))
+                for (url, p), position in zip(photos_by_url.items(), positions)
+            )
+
+            conn.executemany(
+                "INSERT OR REPLACE INTO snapshot_photos VALUES(?, ?, ?, ?)",
+                (
+                    (key, url, position, photo)
+                    for url, position, photo in new_rows
+                    if old_rows.get(url) != (position, photo)
+                ),
+            )
+
+
+def _assign_positions(
+    urls: list[str], *, old_positions: dict[str, float]
+) -> list[float]:
+    """
+    Returns a position for each photo in a snapshot, keeping as many
+    of the positions from the previous snapshot as we can.
+
+    We keep the old positions of the longest sequence of photos which
+    are still in the same order, and give every other photo a new
+    position between its neighbours.  For example, if there are new
+    photos at the start of a photostream, only the new photos
+    get new positions.
+    """
+    # Find the longest increasing subsequence of old positions, using
+    # patience sorting.  ``tails[k]`` is the index of the smallest
+    # position which ends an increasing subsequence of length k + 1.
+    known = [i for i, url in enumerate(urls) if url in old_positions]
+    tails: list[int] = []
+    tail_positions: list[float] = []
+    previous: dict[int, int | None] = {}
+
+    for i in known:
+        position = old_positions[urls[i]]
+        k = bisect.bisect_left(tail_positions, position)
+        previous[i] = tails[k - 1] if k > 0 else None
+
+        if k == len(tails):
+            tails.append(i)
+            tail_positions.append(position)
+        else:
+            tails[k] = i
+            tail_positions[k] = position
+
+    positions: list[float | None] = [None] * len(urls)
+    i_kept = tails[-1] if tails else None
+
+    while i_kept is not None:
+        positions[i_kept] = old_positions[urls[i_kept]]
+        i_kept = previous[i_kept]
+
+    # Now fill in each run of photos which need a new position.
+    start = 0
+
+    while start < len(urls):
+        if positions[start] is not None:
+            start += 1
+            continue
+
+        end = start
+        while end < len(urls) and positions[end] is None:
+            end += 1
+
+        lo = positions[start - 1] if start > 0 else None
+        hi = positions[end] if end < len(urls) else None
+        count = end - start
+
+        for j in range(count):
+            if lo is not None and hi is not None:
+                positions[start + j] = lo + (hi - lo) * (j + 1) / (count + 1)
+            elif hi is not None:
+                positions[start + j] = hi - (count - j)
+            elif lo is not None:
+                positions[start + j] = lo + j + 1
+            else:
+                positions[start + j] = j
+
+        start = end
+
+    return typing.cast(list[float], positions)
+
+
+def refresh_snapshot(
+    api: FlickrApi,
+    store: SnapshotStore,
+    parsed_url: ParseResult,
+    *,
+    full: bool = False,
+    per_page: int = FLICKR_PER_PAGE,
+) -> SnapshotDiff:
+    """
+    Refresh the snapshot of the photos at a URL, and return the photos
+    that were added and removed since the last snapshot.
+
+    If there isn't a snapshot yet, or ``full`` is set, or we can't
+    refresh this sort of URL incrementally, we fetch every photo.
+    ``per_page`` is the page size for incremental refreshes, which
+    usually only need the first page.
+    """
+    interner = PhotoInterner()
+
+    snapshot = store.get(parsed_url, interner=interner)
+    old_photos = snapshot["photos"] if snapshot is not None else []
+
+    new_photos = None
+
+    if snapshot is not None and not full:
+        new_photos = _get_new_photos(api, parsed_url, old_photos, per_page=per_page)
+
+    if new_photos is None:
+        photos = list(
+            interner.compact_all(stream_photos_from_flickr_url(api, parsed_url))
+        )
+        diff = _diff(old_photos, photos)
+    else:
+        added = [interner.compact(p) for p in new_photos]
+        photos = added + old_photos
+        diff = {"added": added, "removed": [], "is_full": False}
+
+    store.put(parsed_url, photos)
+
+    return diff
+
+
+def _get_new_photos(
+    api: FlickrApi,
+    parsed_url: ParseResult,
+    old_photos: list[CompactPhoto],
+    *,
+    per_page: int,
+) -> list[Photo] | None:
+    """
+    Returns the photos at a URL that aren't in the snapshot, or ``None``
+    if we can't tell without fetching every photo.
+
+    We always fetch fresh pages, because a cached first page would
+    hide the photos uploaded since it was cached, and its photo count
+    wouldn't add up, so we'd do a full refresh for nothing.
+    """
+    if isinstance(api, CachingFlickrApi):
+        api = api.without_cache_reads()
+
+    known_urls = {p.url for p in old_photos}
+
+    if parsed_url["type"] in {"user", "group"}:
+        fetch_page = get_page_fetcher(api, parsed_url)
+        new_photos: list[Photo] = []
+
+        page = 1
+        collection = fetch_page(page=page, per_page=per_page)
+        count_photos = collection["count_photos"]
+
+        while True:
+            unseen = list(
+                itertools.takewhile(
+                    lambda p: p["url"] not in known_urls, collection["photos"]
+                )
+            )
+            new_photos.extend(unseen)
+
+            if (
+                len(unseen) < len(collection["photos"])
+                or page >= collection["count_pages"]
+            ):
+                break
+
+            page += 1
+            collection = fetch_page(page=page, per_page=per_page)
+
+        # If the counts don't add up, photos have been removed (or have
+        # moved around), and the only way to find them is to look at
+        # every photo.
+        if count_photos != len(known_urls) + len(new_photos):
+            return None
+
+        return new_photos
+
+    if parsed_url["type"] == "tag" and old_photos:
+        high_water = max(p.date_posted for p in old_photos)
+        new_photos = []
+        page = 1
+
+        while True:
+            collection = get_photos_with_tag(
+                api,
+                tag=parsed_url["tag"],
+                page=page,
+                per_page=per_page,
+                min_upload_date=high_water,
+            )
+
+            # The search includes photos uploaded in the same second as
+            # the high-water mark, which we may already have.
+            new_photos.extend(
+                p for p in collection["photos"] if p["url"] not in known_urls
+            )
+
+            if page >= collection["count_pages"] or not collection["photos"]:
+                break
+
+            page += 1
+
+        return new_photos
+
+    return None
+
+
+def _diff(
+    old_photos: list[CompactPhoto], new_photos: list[CompactPhoto]
+) -> SnapshotDiff:
+    """
+    Compare a snapshot to every photo at the URL, matching photos
+    by their URL.
+    """
+    old_urls = {p.url for p in old_photos}
+    new_urls = {p.url for p in new_photos}
+
+    return {
+        "added": [p for p in new_photos if p.url not in old_urls],
+        "removed": [p for p in old_photos if p.url not in new_urls],
+        "is_full": True,
+    }
+
+
+def get_snapshot_store() -> SnapshotStore | None:
+    """
+    Returns the snapshot store configured by the ``FLINUMERATR_SNAPSHOT_PATH``
+    environment variable, or ``None`` if it isn't set.
+
+    Snapshots are kept separate from the response cache, because
+    the cache can be thrown away at any time, and snapshots can't.
+    """
+    try:
+        return SnapshotStore(path=os.environ["FLINUMERATR_SNAPSHOT_PATH"])
+    except KeyError:
+        return None
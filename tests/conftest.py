@@ -1,22 +1,23 @@
 from collections.abc import Iterator
 import os
 
+from flask import Flask
 from flask.testing import FlaskClient
 from flickr_api import FlickrApi
 from flickr_api.fixtures import flickr_api
 from nitrate.cassettes import cassette_name
 import pytest
 
+from fake_flickr import FakeFlickr
 
-__all__ = ["flickr_api", "client", "cassette_name"]
+
+__all__ = ["flickr_api", "app", "client", "cassette_name", "fake_flickr"]
 
 
 @pytest.fixture()
-def client(flickr_api: FlickrApi) -> Iterator[FlaskClient]:
+def app() -> Flask:
     """
-    Creates an instance of the app for use in testing.
-
-    See https://flask.palletsprojects.com/en/3.0.x/testing/#fixtures
+    Returns the Flask app, configured for testing.
     """
     os.environ.setdefault("FLICKR_API_KEY", "<testing>")
 
@@ -24,5 +25,31 @@ def client(flickr_api: FlickrApi) -> Iterator[FlaskClient]:
 
     app.config["TESTING"] = True
 
+    return app
+
+
+@pytest.fixture()
+def client(
+    app: Flask, flickr_api: FlickrApi, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[FlaskClient]:
+    """
+    Creates an instance of the app for use in testing.
+
+    See https://flask.palletsprojects.com/en/3.0.x/testing/#fixtures
+    """
+    # The cassettes were recorded before /see_photos asked Flickr for
+    # the responsive sizes, and they don't include most of them.  They
+    # match on the ``extras`` we ask for, so we use the sizes they have.
+    monkeypatch.setattr("flinumeratr.app.SIZE_PROFILE", "medium-only")
+
     with app.test_client() as client:
         yield client
+
+
+@pytest.fixture()
+def fake_flickr() -> FakeFlickr:
+    """
+    Creates an in-memory fake of the Flickr API, for tests that need
+    more data than we can reasonably record in a cassette.
+    """
+    return FakeFlickr()
@@ -0,0 +1,411 @@
+"""
+A fake version of the Flickr API, which serves synthetic collections
+of photos from memory.
+
+The VCR cassettes in ``tests/fixtures/cassettes`` are real responses,
+but they only ever cover the first page of a collection.  This fake
+lets us test things that need lots of pages (e.g. walking an entire
+album) without recording thousands of API responses.
+
+It's plugged into an ``httpx.MockTransport``, so the requests still
+go through the real ``FlickrApi.call()`` code path.
+"""
+
+from collections.abc import Iterable
+import math
+import typing
+from xml.sax.saxutils import quoteattr
+
+import httpx
+from flickr_api import FlickrApi
+
+
+class FakeOwner(typing.TypedDict):
+    user_id: str
+    username: str
+    realname: str
+    path_alias: str
+
+
+class FakeAlbum(typing.TypedDict):
+    owner: FakeOwner
+    title: str
+    photos: list[dict[str, str]]
+
+
+class FakeGallery(typing.TypedDict):
+    owner_name: str
+    title: str
+    photos: list[dict[str, str]]
+
+
+class FakeGroup(typing.TypedDict):
+    id: str
+    url: str
+    name: str
+    photos: list[dict[str, str]]
+
+
+def make_owner(n: int) -> FakeOwner:
+    """
+    Create a fake Flickr member.
+    """
+    return {
+        "user_id": f"{1000 + n}@N0{n % 10}",
+        "username": f"user{n}",
+        "realname": f"User Number {n}",
+        "path_alias": f"user{n}",
+    }
+
+
+def make_photo_attrs(n: int, owner: FakeOwner) -> dict[str, str]:
+    """
+    Create the attributes of a <photo> element in a collection
+    response, as if we'd asked for all our ``extras``.
+
+    The photo has a handful of sizes, but not every size Flickr can
+    return -- e.g. there's no "Large 1600" or "Large 2048".  The fake
+    only returns the sizes we ask for in the ``url_*`` extras.
+    """
+    photo_id = str(50000000000 + n)
+    base = f"https://live.staticflickr.com/65535/{photo_id}_abcdef1234"
+
+    return {
+        "id": photo_id,
+        "owner": owner["user_id"],
+        "ownername": owner["username"],
+        "realname": owner["realname"],
+        "pathalias": owner["path_alias"],
+        "title": f"Photo {n}" if n % 7 else "",
+        "license": str(n % 11),
+        "dateupload": str(1600000000 - n * 60),
+        "datetaken": "2020-10-05 17:31:27",
+        "datetakengranularity": "0",
+        "datetakenunknown": "0",
+        "media": "photo",
+        "url_sq": f"{base}_s.jpg",
+        "height_sq": "75",
+        "width_sq": "75",
+        "url_q": f"{base}_q.jpg",
+        "height_q": "150",
+        "width_q": "150",
+        "url_t": f"{base}_t.jpg",
+        "height_t": "67",
+        "width_t": "100",
+        "url_s": f"{base}_m.jpg",
+        "height_s": "160",
+        "width_s": "240",
+        "url_m": f"{base}.jpg",
+        "height_m": "333",
+        "width_m": "500",
+        "url_l": f"{base}_b.jpg",
+        "height_l": "683",
+        "width_l": "1024",
+        "url_o": f"{base}_o.jpg",
+        "height_o": "2000",
+        "width_o": "3000",
+    }
+
+
+def make_photos(
+    count: int, owners: list[FakeOwner], start: int = 0
+) -> list[dict[str, str]]:
+    """
+    Create a list of fake photos, spread evenly among the given owners.
+    """
+    return [
+        make_photo_attrs(n, owner=owners[n % len(owners)])
+        for n in range(start, start + count)
+    ]
+
+
+LICENSES = [
+    ("0", "All Rights Reserved"),
+    ("1", "CC BY-NC-SA 2.0"),
+    ("2", "CC BY-NC 2.0"),
+    ("3", "CC BY-NC-ND 2.0"),
+    ("4", "CC BY 2.0"),
+    ("5", "CC BY-SA 2.0"),
+    ("6", "CC BY-ND 2.0"),
+    ("7", "No known copyright restrictions"),
+    ("8", "United States Government Work"),
+    ("9", "Public Domain Dedication (CC0)"),
+    ("10", "Public Domain Mark"),
+]
+
+
+def _attrs(attrs: dict[str, str]) -> str:
+    return " ".join(f"{k}={quoteattr(v)}" for k, v in attrs.items())
+
+
+def _ok(body: str) -> str:
+    return f'<?xml version="1.0" encoding="utf-8" ?>\n<rsp stat="ok">\n{body}\n</rsp>\n'
+
+
+def _fail(code: str, msg: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="utf-8" ?>\n'
+        f'<rsp stat="fail">\n\t<err code="{code}" msg={quoteattr(msg)} />\n</rsp>\n'
+    )
+
+
+class FakeFlickr:
+    """
+    An in-memory stand-in for the Flickr API.
+
+    Add some collections with the ``add_*`` methods, then use ``api``
+    to get a ``FlickrApi`` instance that talks to this fake.
+    """
+
+    def __init__(self) -> None:
+        self.users: dict[str, FakeOwner] = {}
+        self.photostreams: dict[str, list[dict[str, str]]] = {}
+        self.albums: dict[str, FakeAlbum] = {}
+        self.galleries: dict[str, FakeGallery] = {}
+        self.groups: dict[str, FakeGroup] = {}
+        self.tags: dict[str, list[dict[str, str]]] = {}
+
+        # A record of every API call we've received, as a list of
+        # query parameters.
+        self.calls: list[dict[str, str]] = []
+
+    @property
+    def api(self) -> FlickrApi:
+        """
+        Returns an instance of ``FlickrApi`` which is backed by this fake.
+        """
+        return FlickrApi(client=httpx.Client(transport=self.transport))
+
+    @property
+    def transport(self) -> httpx.MockTransport:
+        """
+        Returns an httpx transport which is backed by this fake.
+        """
+        return httpx.MockTransport(self.handle_request)
+
+    def calls_to(self, method: str) -> list[dict[str, str]]:
+        """
+        Returns all the calls we've received for a particular API method.
+        """
+        return [c for c in self.calls if c["method"] == method]
+
+    def add_user(self, owner: FakeOwner, count_photos: int) -> FakeOwner:
+        """
+        Add a user with a photostream of ``count_photos`` photos.
+        """
+        self.users[owner["user_id"]] = owner
+        self.photostreams[owner["user_id"]] = make_photos(count_photos, [owner])
+        return owner
+
+    def add_album(self, album_id: str, owner: FakeOwner, count_photos: int) -> None:
+        """
+        Add an album with ``count_photos`` photos, all owned by ``owner``.
+        """
+        self.users[owner["user_id"]] = owner
+        self.albums[album_id] = {
+            "owner": owner,
+            "title": f"Album {album_id}",
+            "photos": make_photos(count_photos, [owner]),
+        }
+
+    def add_gallery(self, gallery_id: str, count_photos: int) -> None:
+        """
+        Add a gallery with ``count_photos`` photos from a handful of owners.
+        """
+        self.galleries[gallery_id] = {
+            "owner_name": "gallerycurator",
+            "title": f"Gallery {gallery_id}",
+            "photos": make_photos(count_photos, [make_owner(n) for n in range(5)]),
+        }
+
+    def add_group(
+        self, group_id: str, url: str, count_photos: int, count_owners: int = 5
+    ) -> None:
+        """
+        Add a group pool with ``count_photos`` photos from a handful of owners.
+        """
+        self.groups[group_id] = {
+            "id": group_id,
+            "url": url,
+            "name": f"Group {group_id}",
+            "photos": make_photos(
+                count_photos, [make_owner(n) for n in range(count_owners)]
+            ),
+        }
+
+    def add_tag(self, tag: str, count_photos: int) -> None:
+        """
+        Add a tag with ``count_photos`` photos from a handful of owners.
+        """
+        self.tags[tag] = make_photos(count_photos, [make_owner(n) for n in range(5)])
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        """
+        Respond to an HTTP request to the Flickr API.
+        """
+        params = dict(request.url.params)
+        params.pop("api_key", None)
+        self.calls.append(params)
+
+        return httpx.Response(status_code=200, text=self.respond(params))
+
+    def respond(self, params: dict[str, str]) -> str:
+        """
+        Build the XML response for a single API call.
+        """
+        method = params["method"]
+
+        if method == "flickr.photos.licenses.getInfo":
+            return _ok(
+                "<licenses>"
+                + "".join(
+                    f'<license id="{id}" name="{name}" url="https://example.net/{id}" />'
+                    for id, name in LICENSES
+                )
+                + "</licenses>"
+            )
+
+        if method == "flickr.urls.lookupUser":
+            for owner in self.users.values():
+                if (
+                    params["url"]
+                    .rstrip("/")
+                    .endswith((f"/{owner['path_alias']}", f"/{owner['user_id']}"))
+                ):
+                    return _ok(
+                        f'<user id="{owner["user_id"]}">'
+                        f"<username>{owner['username']}</username></user>"
+                    )
+
+            return _fail("1", "User not found")
+
+        if method == "flickr.urls.lookupGroup":
+            for group in self.groups.values():
+                if params["url"].rstrip("/") == group["url"].rstrip("/"):
+                    return _ok(
+                        f'<group id="{group["id"]}">'
+                        f"<groupname>{group['name']}</groupname></group>"
+                    )
+
+            return _fail("1", "Group not found")
+
+        if method == "flickr.photosets.getPhotos":
+            try:
+                album = self.albums[params["photoset_id"]]
+            except KeyError:
+                return _fail("1", "Photoset not found")
+
+            # Photos in an album don't have an `owner` attribute; that's
+            # on the wrapper <photoset> element instead.
+            photos = [
+                {k: v for k, v in p.items() if k != "owner"} for p in album["photos"]
+            ]
+
+            return _ok(
+                self._render_page(
+                    "photoset",
+                    {
+                        "id": params["photoset_id"],
+                        "owner": album["owner"]["user_id"],
+                        "ownername": album["owner"]["username"],
+                        "title": album["title"],
+                    },
+                    photos,
+                    params,
+                )
+            )
+
+        if method == "flickr.people.getPublicPhotos":
+            try:
+                photos = self.photostreams[params["user_id"]]
+            except KeyError:
+                return _fail("1", "User not found")
+
+            return _ok(self._render_page("photos", {}, photos, params))
+
+        if method == "flickr.galleries.getPhotos":
+            try:
+                gallery = self.galleries[params["gallery_id"]]
+            except KeyError:
+                return _fail("1", "Gallery not found")
+
+            return _ok(
+                f'<gallery id="{params["gallery_id"]}" '
+                f'username="{gallery["owner_name"]}">'
+                f"<title>{gallery['title']}</title></gallery>\n"
+                + self._render_page("photos", {}, gallery["photos"], params)
+            )
+
+        if method == "flickr.groups.pools.getPhotos":
+            group = self.groups[params["group_id"]]
+
+            return _ok(self._render_page("photos", {}, group["photos"], params))
+
+        if method == "flickr.photos.search":
+            photos = self.tags.get(params["tags"], [])
+
+            if "min_upload_date" in params:
+                photos = [
+                    p
+                    for p in photos
+                    if int(p["dateupload"]) >= int(params["min_upload_date"])
+                ]
+
+            return _ok(self._render_page("photos", {}, photos, params))
+
+        raise ValueError(
+            f"Unsupported method in FakeFlickr: {method}"
+        )  # pragma: no cover
+
+    @staticmethod
+    def _render_page(
+        tag: str,
+        wrapper_attrs: dict[str, str],
+        photos: list[dict[str, str]],
+        params: dict[str, str],
+    ) -> str:
+        page = int(params.get("page", "1"))
+        per_page = int(params.get("per_page", "100"))
+
+        count_pages = math.ceil(len(photos) / per_page)
+        this_page = photos[(page - 1) * per_page : page * per_page]
+
+        # Only include the sizes we were asked for, e.g. if the extras
+        # include ``url_m``, we return ``url_m``, ``width_m`` and ``height_m``.
+        extras = params.get("extras", "").split(",")
+        sizes = {e.removeprefix("url_") for e in extras if e.startswith("url_")}
+
+        this_page = [
+            {
+                k: v
+                for k, v in p.items()
+                if not k.startswith(("url_", "width_", "height_"))
+                or k.split("_", 1)[1] in sizes
+            }
+            for p in this_page
+        ]
+
+        return render_collection(
+            tag,
+            {
+                **wrapper_attrs,
+                "page": str(page),
+                "pages": str(count_pages),
+                "perpage": str(per_page),
+                "total": str(len(photos)),
+            },
+            this_page,
+        )
+
+
+def render_collection(
+    tag: str, wrapper_attrs: dict[str, str], photos: Iterable[dict[str, str]]
+) -> str:
+    """
+    Render the XML for a single page of a collection response.
+    """
+    return (
+        f"<{tag} {_attrs(wrapper_attrs)}>\n"
+        + "".join(f"\t<photo {_attrs(p)} />\n" for p in photos)
+        + f"</{tag}>"
+    )
@@ -1,7 +1,12 @@
+from flask import Flask
 from flask.testing import FlaskClient
 from flickr_api import FlickrApi
+import httpx
 import pytest
 
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.cache import CachingFlickrApi
+
 
 def test_load_homepage(client: FlaskClient) -> None:
     """
@@ -136,3 +141,68 @@ def test_empty_url_redirects_to_homepage(client: FlaskClient) -> None:
 
     assert resp.status_code == 302
     assert resp.headers["location"] == "/"
+
+
+def test_results_page_is_streamed(client: FlaskClient, flickr_api: FlickrApi) -> None:
+    """
+    The results page is streamed to the browser, rather than rendered
+    in one go.
+    """
+    resp = client.get(
+        "/see_photos?flickr_url=https://www.flickr.com/photos/aljazeeraenglish/albums/72157626164453131"
+    )
+
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.text.count('<a class="photo"') == 22
+
+
+@pytest.mark.parametrize("pages", ["0", "2", "100", "two"])
+def test_pages_parameter_is_clamped(
+    client: FlaskClient, flickr_api: FlickrApi, pages: str
+) -> None:
+    """
+    If you pass a silly value for ``pages``, you still get the page.
+
+    This album only has a single page, so we use the same cassette
+    for every value.
+    """
+    resp = client.get(
+        "/see_photos?flickr_url=https://www.flickr.com/photos/aljazeeraenglish/albums/72157626164453131"
+        f"&pages={pages}"
+    )
+
+    assert resp.status_code == 200
+    assert resp.text.count('<a class="photo"') == 22
+
+
+def test_infobox_is_sent_before_later_pages_are_fetched(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    When we're showing multiple pages, the header and infobox are sent
+    to the browser before we fetch the later pages.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+    fake_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", fake_api)
+
+    with app.test_client() as client:
+        resp = client.get(
+            f"/see_photos?flickr_url=https://www.flickr.com/photos/{owner['path_alias']}/&pages=3",
+            buffered=False,
+        )
+
+        body = ""
+        chunks = resp.iter_encoded()
+
+        while "who has posted 250" not in body:
+            body += next(chunks).decode("utf8")
+
+        assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 1
+
+        body += b"".join(chunks).decode("utf8")
+        resp.close()
+
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 2
+    assert body.count('<a class="photo"') == 250
@@ -0,0 +1,203 @@
+"""
+Tests for `flinumeratr.asgi`, the async entry point for the app.
+"""
+
+import asyncio
+from collections.abc import Iterator
+import threading
+import types
+import typing
+
+from asgiref.typing import ASGIReceiveEvent, ASGISendEvent
+from flask import Flask
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.async_flickr_api import AsyncFlickrApi
+from flinumeratr.cache import CachingFlickrApi
+
+
+@pytest.fixture
+def asgi(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> Iterator[types.ModuleType]:
+    """
+    Returns the ``flinumeratr.asgi`` module, with an async API that
+    gets photos from the fake Flickr API.
+    """
+    import flinumeratr.asgi
+
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr(
+        flinumeratr.asgi,
+        "async_api",
+        AsyncFlickrApi(
+            api=api, client=httpx.AsyncClient(transport=fake_flickr.transport)
+        ),
+    )
+
+    yield flinumeratr.asgi
+
+
+def get(
+    asgi: types.ModuleType,
+    url: str,
+    headers: dict[str, str] | None = None,
+    *,
+    method: str = "GET",
+) -> httpx.Response:
+    """
+    Make a GET request to the ASGI app.
+    """
+
+    async def make_request() -> httpx.Response:
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=asgi.app), base_url="http://testserver"
+        ) as client:
+            return await client.request(method, url, headers=headers)
+
+    return asyncio.run(make_request())
+
+
+def test_see_photos(asgi: types.ModuleType, fake_flickr: FakeFlickr) -> None:
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+
+    resp = get(
+        asgi,
+        f"/see_photos?flickr_url=https://www.flickr.com/photos/{owner['path_alias']}/&pages=3",
+    )
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "text/html; charset=utf-8"
+    assert "who has posted 250" in resp.text.replace("&nbsp;", " ")
+    assert resp.text.count('<a class="photo"') == 250
+    assert resp.text.rstrip().endswith("</html>")
+
+
+def test_head_request_has_no_body(
+    asgi: types.ModuleType, fake_flickr: FakeFlickr
+) -> None:
+    fake_flickr.add_tag("sunset", count_photos=10)
+
+    resp = get(
+        asgi,
+        "/see_photos?flickr_url=https://www.flickr.com/photos/tags/sunset/",
+        method="HEAD",
+    )
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "text/html; charset=utf-8"
+    assert "ETag" in resp.headers
+    assert resp.content == b""
+
+
+def test_page_is_rendered_off_the_event_loop(
+    app: Flask,
+    asgi: types.ModuleType,
+    fake_flickr: FakeFlickr,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    We render the page in a thread, so rendering a big page doesn't
+    hold up every other request on the event loop.
+    """
+    fake_flickr.add_tag("sunset", count_photos=100)
+
+    render_photo = app.jinja_env.globals["render_photo"]
+    render_threads = set()
+
+    def record_render_thread(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        render_threads.add(threading.get_ident())
+        return render_photo(*args, **kwargs)  # type: ignore[operator]
+
+    monkeypatch.setitem(app.jinja_env.globals, "render_photo", record_render_thread)
+
+    resp = get(
+        asgi, "/see_photos?flickr_url=https://www.flickr.com/photos/tags/sunset/"
+    )
+
+    assert resp.text.count('<a class="photo"') == 100
+    assert render_threads
+    assert threading.get_ident() not in render_threads
+
+
+@pytest.mark.parametrize("query", ["", "?flickr_url="])
+def test_no_flickr_url_redirects_you_to_homepage(
+    asgi: types.ModuleType, query: str
+) -> None:
+    resp = get(asgi, f"/see_photos{query}")
+
+    assert resp.status_code == 302
+    assert resp.headers["location"] == "/"
+
+
+@pytest.mark.parametrize(
+    ["flickr_url", "expected_text"],
+    [
+        pytest.param(
+            "https://www.example.net", "doesn’t live on Flickr.com", id="not_flickr"
+        ),
+        pytest.param(
+            "https://www.flickr.com/help", "There are no photos to show", id="no_photos"
+        ),
+        pytest.param(
+            "https://www.flickr.com/photos/doesnotexist/",
+            "Unable to find a person",
+            id="missing_user",
+        ),
+    ],
+)
+def test_errors(asgi: types.ModuleType, flickr_url: str, expected_text: str) -> None:
+    resp = get(asgi, f"/see_photos?flickr_url={flickr_url}")
+
+    assert resp.status_code == 200
+    assert expected_text in resp.text
+
+
+def test_other_routes_go_to_the_flask_app(asgi: types.ModuleType) -> None:
+    resp = get(asgi, "/")
+
+    assert resp.status_code == 200
+    assert '<form id="enter_flickr_url"' in resp.text
+
+
+@pytest.mark.parametrize(["method", "status_code"], [("POST", 405), ("OPTIONS", 200)])
+def test_other_methods_go_to_the_flask_app(
+    asgi: types.ModuleType, method: str, status_code: int
+) -> None:
+    resp = get(
+        asgi,
+        "/see_photos?flickr_url=https://www.flickr.com/photos/tags/sunset/",
+        method=method,
+    )
+
+    assert resp.status_code == status_code
+    assert set(resp.headers["allow"].split(", ")) == {"GET", "HEAD", "OPTIONS"}
+
+
+def test_lifespan_closes_the_client(asgi: types.ModuleType) -> None:
+    """
+    When the server shuts down, we close our connections to Flickr.
+    """
+    received: list[ASGIReceiveEvent] = [
+        {"type": "lifespan.startup"},
+        {"type": "lifespan.shutdown"},
+    ]
+    sent: list[ASGISendEvent] = []
+
+    async def receive() -> ASGIReceiveEvent:
+        return received.pop(0)
+
+    async def send(event: ASGISendEvent) -> None:
+        sent.append(event)
+
+    asyncio.run(
+        asgi.app({"type": "lifespan", "asgi": {"version": "3.0"}}, receive, send)
+    )
+
+    assert sent == [
+        {"type": "lifespan.startup.complete"},
+        {"type": "lifespan.shutdown.complete"},
+    ]
+    assert asgi.async_api.client.is_closed
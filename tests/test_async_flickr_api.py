@@ -0,0 +1,439 @@
+"""
+Tests for `flinumeratr.async_flickr_api`.
+"""
+
+import asyncio
+import concurrent.futures
+from pathlib import Path
+import threading
+import typing
+
+from flickr_api import FlickrApi, ResourceNotFound, UnrecognisedFlickrApiException
+from flickr_api.exceptions import InvalidXmlException
+from flickr_url_parser import parse_flickr_url
+import httpx
+import pytest
+from tenacity import wait_none
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr import async_flickr_api, flickr_api
+from flinumeratr.async_flickr_api import AsyncFlickrApi
+from flinumeratr.cache import CachingFlickrApi, ResponseCache
+from flinumeratr.resolution import ResolutionIndex
+
+
+def async_api(fake_flickr: FakeFlickr, api: FlickrApi | None = None) -> AsyncFlickrApi:
+    """
+    Create an async API which is backed by the fake Flickr API.
+    """
+    return AsyncFlickrApi(
+        api=api or fake_flickr.api,
+        client=httpx.AsyncClient(transport=fake_flickr.transport),
+    )
+
+
+def add_collections(fake_flickr: FakeFlickr) -> None:
+    """
+    Add one of every type of collection to the fake Flickr API.
+    """
+    owner = make_owner(1)
+    fake_flickr.add_user(owner, count_photos=150)
+    fake_flickr.add_user({**owner, "user_id": "12345678@N01"}, count_photos=150)
+    fake_flickr.add_album("72157640898611483", owner=owner, count_photos=150)
+    fake_flickr.add_gallery("72157621848008117", count_photos=150)
+    fake_flickr.add_group(
+        "1234@N01", url="https://www.flickr.com/groups/geologists", count_photos=150
+    )
+    fake_flickr.add_tag("sunset", count_photos=150)
+
+
+@pytest.mark.parametrize(
+    "flickr_url",
+    [
+        pytest.param(
+            "https://www.flickr.com/photos/user1/albums/72157640898611483",
+            id="album",
+        ),
+        pytest.param("https://www.flickr.com/photos/user1/", id="user"),
+        pytest.param("https://www.flickr.com/photos/12345678@N01/", id="user_nsid"),
+        pytest.param(
+            "https://www.flickr.com/photos/gallerycurator/galleries/72157621848008117/",
+            id="gallery",
+        ),
+        pytest.param("https://www.flickr.com/groups/geologists/", id="group"),
+        pytest.param("https://www.flickr.com/photos/tags/sunset/page2", id="tag"),
+    ],
+)
+def test_matches_the_sync_api(fake_flickr: FakeFlickr, flickr_url: str) -> None:
+    """
+    The async API returns exactly the same photos as the sync API.
+    """
+    add_collections(fake_flickr)
+    parsed_url = parse_flickr_url(flickr_url)
+
+    expected = flickr_api.get_photos_from_flickr_url(fake_flickr.api, parsed_url)
+    actual = asyncio.run(
+        async_flickr_api.get_photos_from_flickr_url(async_api(fake_flickr), parsed_url)
+    )
+
+    assert actual == expected
+
+
+class TestGetPagesFromFlickrUrl:
+    def test_gets_all_the_pages(self, fake_flickr: FakeFlickr) -> None:
+        fake_flickr.add_tag("sunset", count_photos=250)
+
+        photo_data, photos = asyncio.run(
+            async_flickr_api.get_pages_from_flickr_url(
+                async_api(fake_flickr),
+                parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+                count_pages=5,
+            )
+        )
+
+        assert photo_data["count_photos"] == 250  # type: ignore[typeddict-item]
+        assert len(photos) == 250
+        assert len({p["url"] for p in photos}) == 250
+
+        # After the first page, we get the rest in a single call.
+        assert [
+            (c["page"], c["per_page"])
+            for c in fake_flickr.calls_to("flickr.photos.search")
+        ] == [("1", "100"), ("1", "300")]
+
+    def test_later_pages_are_fetched_concurrently(
+        self, fake_flickr: FakeFlickr
+    ) -> None:
+        """
+        After the first page, all the pages are in flight at once.
+        """
+        fake_flickr.add_tag("sunset", count_photos=500)
+
+        active = 0
+        max_active = 0
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            nonlocal active, max_active
+
+            active += 1
+            max_active = max(max_active, active)
+            await asyncio.sleep(0.05)
+            active -= 1
+
+            return fake_flickr.handle_request(request)
+
+        api = AsyncFlickrApi(
+            api=fake_flickr.api,
+            client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+
+        _, photos = asyncio.run(
+            async_flickr_api.get_pages_from_flickr_url(
+                api,
+                parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+                count_pages=5,
+                max_per_page=100,
+            )
+        )
+
+        assert len(photos) == 500
+        assert max_active == 4
+
+    def test_stops_at_an_empty_page(self, fake_flickr: FakeFlickr) -> None:
+        """
+        If a later page comes back empty, we stop there.
+        """
+        fake_flickr.add_tag("sunset", count_photos=30)
+
+        # Remove photos from the tag after we've fetched the first page --
+        # this mimics the inconsistent page counts of big tag searches.
+        def handler(request: httpx.Request) -> httpx.Response:
+            resp = fake_flickr.handle_request(request)
+            del fake_flickr.tags["sunset"][10:]
+            return resp
+
+        api = AsyncFlickrApi(
+            api=fake_flickr.api,
+            client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+        )
+
+        _, photos = asyncio.run(
+            async_flickr_api.get_pages_from_flickr_url(
+                api,
+                parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+                count_pages=3,
+                per_page=10,
+            )
+        )
+
+        assert len(photos) == 10
+
+    def test_single_photo(self, flickr_api: FlickrApi) -> None:
+        """
+        Single photos are fetched with the sync API.
+        """
+        api = AsyncFlickrApi(api=flickr_api, client=httpx.AsyncClient())
+
+        photo_data, photos = asyncio.run(
+            async_flickr_api.get_pages_from_flickr_url(
+                api,
+                parse_flickr_url(
+                    "https://www.flickr.com/photos/sdasmarchives/50567413447"
+                ),
+                count_pages=3,
+            )
+        )
+
+        assert photos == [photo_data]
+
+
+@pytest.mark.parametrize(
+    "flickr_url",
+    [
+        pytest.param(
+            "https://www.flickr.com/photos/user1/albums/72157640898611483",
+            id="missing_album",
+        ),
+        pytest.param("https://www.flickr.com/photos/doesnotexist/", id="missing_user"),
+        pytest.param(
+            "https://www.flickr.com/photos/12345678@N01/", id="missing_user_nsid"
+        ),
+        pytest.param(
+            "https://www.flickr.com/photos/gallerycurator/galleries/72157621848008117/",
+            id="missing_gallery",
+        ),
+        pytest.param("https://www.flickr.com/groups/doesnotexist/", id="missing_group"),
+    ],
+)
+def test_missing_collection_is_not_found(
+    fake_flickr: FakeFlickr, flickr_url: str
+) -> None:
+    with pytest.raises(ResourceNotFound):
+        asyncio.run(
+            async_flickr_api.get_photos_from_flickr_url(
+                async_api(fake_flickr), parse_flickr_url(flickr_url)
+            )
+        )
+
+
+def test_unrecognised_error_is_raised(fake_flickr: FakeFlickr) -> None:
+    """
+    If the API returns an error code we don't know about, we raise
+    the same exception as the sync API.
+    """
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            status_code=200,
+            text='<rsp stat="fail"><err code="999" msg="Unknown error" /></rsp>',
+        )
+
+    api = AsyncFlickrApi(
+        api=fake_flickr.api,
+        client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+    with pytest.raises(UnrecognisedFlickrApiException):
+        asyncio.run(
+            async_flickr_api.lookup_group_from_url(
+                api, url="https://www.flickr.com/groups/geologists"
+            )
+        )
+
+
+def test_invalid_xml_is_retried(
+    fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    If the API returns something that isn't XML, we retry the request.
+    """
+    monkeypatch.setattr(AsyncFlickrApi._call_api.retry, "wait", wait_none())  # type: ignore[attr-defined]
+
+    attempts = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal attempts
+        attempts += 1
+
+        return httpx.Response(status_code=200, text="{'error': 'not XML'}")
+
+    api = AsyncFlickrApi(
+        api=fake_flickr.api,
+        client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+    with pytest.raises(InvalidXmlException):
+        asyncio.run(api.call(method="flickr.test.echo"))
+
+    assert attempts == 5
+
+
+def test_uses_the_response_cache(fake_flickr: FakeFlickr, tmp_path: Path) -> None:
+    """
+    The async API reads and writes the same response cache as the sync API.
+    """
+    fake_flickr.add_tag("sunset", count_photos=10)
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.response_cache = ResponseCache(path=str(tmp_path / "cache.db"))
+
+    flickr_api.get_photos_from_flickr_url(api, parsed_url)
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+    photos = asyncio.run(
+        async_flickr_api.get_photos_from_flickr_url(
+            async_api(fake_flickr, api=api), parsed_url
+        )
+    )
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+    assert photos == flickr_api.get_photos_from_flickr_url(api, parsed_url)
+
+
+def test_fills_the_response_cache(fake_flickr: FakeFlickr, tmp_path: Path) -> None:
+    fake_flickr.add_tag("sunset", count_photos=10)
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.response_cache = ResponseCache(path=str(tmp_path / "cache.db"))
+
+    asyncio.run(
+        async_flickr_api.get_photos_from_flickr_url(
+            async_api(fake_flickr, api=api), parsed_url
+        )
+    )
+    flickr_api.get_photos_from_flickr_url(api, parsed_url)
+
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+
+def test_serves_stale_responses_and_refreshes_them(
+    fake_flickr: FakeFlickr, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    The async API serves stale responses from the cache, and uses
+    the sync API to refresh them in the background.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr("flinumeratr.cache._refresh_executor", executor)
+
+    fake_flickr.add_tag("sunset", count_photos=10)
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.response_cache = ResponseCache(
+        path=str(tmp_path / "cache.db"), ttls={"flickr.photos.search": 0}
+    )
+
+    first = flickr_api.get_photos_from_flickr_url(api, parsed_url)
+
+    second = asyncio.run(
+        async_flickr_api.get_photos_from_flickr_url(
+            async_api(fake_flickr, api=api), parsed_url
+        )
+    )
+    assert second == first
+
+    executor.shutdown(wait=True)
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 2
+
+
+@pytest.mark.parametrize(
+    ["flickr_url", "lookup_method"],
+    [
+        ("https://www.flickr.com/photos/user1/", "flickr.urls.lookupUser"),
+        ("https://www.flickr.com/groups/geologists/", "flickr.urls.lookupGroup"),
+    ],
+)
+def test_uses_the_resolution_index(
+    fake_flickr: FakeFlickr, tmp_path: Path, flickr_url: str, lookup_method: str
+) -> None:
+    """
+    User and group lookups are remembered in the resolution index.
+    """
+    add_collections(fake_flickr)
+    parsed_url = parse_flickr_url(flickr_url)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.resolution_index = ResolutionIndex(path=str(tmp_path / "cache.db"))
+
+    for _ in range(2):
+        asyncio.run(
+            async_flickr_api.get_photos_from_flickr_url(
+                async_api(fake_flickr, api=api), parsed_url
+            )
+        )
+
+    assert len(fake_flickr.calls_to(lookup_method)) == 1
+
+
+def test_from_api_copies_the_api_key_and_user_agent() -> None:
+    api = FlickrApi.with_api_key(api_key="12345", user_agent="Flinumeratr/test")
+
+    async_api = AsyncFlickrApi.from_api(api)
+
+    assert async_api.client.params["api_key"] == "12345"
+    assert async_api.client.headers["User-Agent"] == "Flinumeratr/test"
+    assert async_api.client.base_url == "https://api.flickr.com/services/rest/"
+    assert async_api.response_cache is None
+    assert async_api.resolution_index is None
+
+
+def test_responses_are_parsed_off_the_event_loop(
+    fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Parsing a page of photos is CPU-bound, so we do it in a thread
+    rather than holding up the event loop.
+    """
+    fake_flickr.add_tag("sunset", count_photos=10)
+
+    parse_tag_response = flickr_api._parse_tag_response
+    parse_threads = set()
+
+    def record_parse_thread(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        parse_threads.add(threading.get_ident())
+        return parse_tag_response(*args, **kwargs)
+
+    monkeypatch.setattr(async_flickr_api, "_parse_tag_response", record_parse_thread)
+
+    photos = asyncio.run(
+        async_flickr_api.get_photos_with_tag(
+            async_api(fake_flickr), tag="sunset", page=1, per_page=10
+        )
+    )
+
+    assert len(photos["photos"]) == 10
+    assert parse_threads
+    assert threading.get_ident() not in parse_threads
+
+
+@pytest.mark.parametrize("page", [1, 3])
+def test_get_pages_in_bulk(fake_flickr: FakeFlickr, page: int) -> None:
+    """
+    The async API gets the same photos as the sync API with the bulk
+    page size, which is bigger than a Flickr.com page.
+    """
+    fake_flickr.add_tag("sunset", count_photos=1000)
+    parsed_url = parse_flickr_url(
+        f"https://www.flickr.com/photos/tags/sunset/page{page}"
+    )
+
+    _, expected = flickr_api.get_pages_from_flickr_url(
+        fake_flickr.api,
+        parsed_url,
+        count_pages=2,
+        per_page=flickr_api.PER_PAGE["bulk"],
+    )
+    _, actual = asyncio.run(
+        async_flickr_api.get_pages_from_flickr_url(
+            async_api(fake_flickr),
+            parsed_url,
+            count_pages=2,
+            per_page=flickr_api.PER_PAGE["bulk"],
+        )
+    )
+
+    assert actual == list(expected)
+    assert len(actual) == 200
@@ -0,0 +1,410 @@
+"""
+Tests for `flinumeratr.batch` and the /batch endpoint.
+"""
+
+import json
+import threading
+import time
+
+from flask import Flask
+from flask.testing import FlaskClient
+from flickr_api import ResourceNotFound
+from flickr_url_parser import (
+    NotAFlickrUrl,
+    ParseResult,
+    UnrecognisedUrl,
+    parse_flickr_url,
+)
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr import batch
+from flinumeratr.batch import TooManyPhotos, lookup_flickr_urls
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.resolution import ResolutionIndex
+
+
+def tag_url(tag: str) -> str:
+    return f"https://www.flickr.com/photos/tags/{tag}/"
+
+
+def test_gets_every_photo_at_every_url(fake_flickr: FakeFlickr) -> None:
+    fake_flickr.add_tag("sunset", count_photos=1200)
+    owner = fake_flickr.add_user(make_owner(1), count_photos=10)
+
+    results = {
+        r["flickr_url"]: r
+        for r in lookup_flickr_urls(
+            fake_flickr.api,
+            [
+                tag_url("sunset"),
+                f"https://www.flickr.com/photos/{owner['path_alias']}/",
+            ],
+        )
+    }
+
+    assert len(results) == 2
+
+    sunset = results[tag_url("sunset")]
+    assert "photos" in sunset
+    assert len(sunset["photos"]) == 1200
+    assert sunset["parsed_url"] == {"type": "tag", "tag": "sunset", "page": 1}
+
+
+def test_urls_for_the_same_photos_are_only_fetched_once(
+    fake_flickr: FakeFlickr,
+) -> None:
+    """
+    URLs that point to the same photos, including different pages of
+    the same collection, share a single fetch.  Identical URLs only
+    get a single result.
+    """
+    fake_flickr.add_tag("sunset", count_photos=10)
+
+    flickr_urls = [
+        tag_url("sunset"),
+        "https://www.flickr.com/photos/tags/sunset/page2",
+        tag_url("sunset"),
+    ]
+
+    results = list(lookup_flickr_urls(fake_flickr.api, flickr_urls, concurrency=1))
+
+    assert sorted(r["flickr_url"] for r in results) == sorted(set(flickr_urls))
+    assert all(len(r["photos"]) == 10 for r in results)  # type: ignore[typeddict-item]
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+
+def test_urls_are_normalised_before_theyre_compared(
+    fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    URLs whose parsed form differs only in how the user URL is
+    written (e.g. a short link resolved to a URL without ``www.``)
+    share a single fetch.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=10)
+    user_url = f"https://www.flickr.com/photos/{owner['path_alias']}/"
+    short_url = "https://flic.kr/ps/abc123"
+
+    def resolve_flickr_url(url: str, *, index: ResolutionIndex | None) -> ParseResult:
+        if url == short_url:
+            return {
+                "type": "user",
+                "user_url": f"https://flickr.com/people/{owner['path_alias']}",
+                "user_id": None,
+                "page": 1,
+            }
+
+        return parse_flickr_url(url)
+
+    monkeypatch.setattr(batch, "resolve_flickr_url", resolve_flickr_url)
+
+    results = list(
+        lookup_flickr_urls(fake_flickr.api, [user_url, short_url], concurrency=1)
+    )
+
+    assert len(results) == 2
+    assert all(len(r["photos"]) == 10 for r in results)  # type: ignore[typeddict-item]
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 1
+
+
+def test_a_url_parsed_after_its_fetch_reuses_the_result(
+    fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    If a URL is parsed after we've already fetched the photos it
+    points to, we reuse the photos rather than fetching them again.
+    """
+    fake_flickr.add_tag("sunset", count_photos=10)
+
+    second_url = "https://www.flickr.com/photos/tags/sunset/page2"
+    first_fetch_done = threading.Event()
+
+    def resolve_flickr_url(url: str, *, index: ResolutionIndex | None) -> ParseResult:
+        if url == second_url:
+            first_fetch_done.wait(timeout=5)
+        return parse_flickr_url(url)
+
+    monkeypatch.setattr(batch, "resolve_flickr_url", resolve_flickr_url)
+
+    results = lookup_flickr_urls(
+        fake_flickr.api, [tag_url("sunset"), second_url], concurrency=2
+    )
+
+    assert next(results)["flickr_url"] == tag_url("sunset")
+    first_fetch_done.set()
+    assert next(results)["flickr_url"] == second_url
+    assert list(results) == []
+
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+
+def test_a_url_parsed_during_its_fetch_waits_for_it(
+    fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    If a URL is parsed while we're fetching the photos it points to,
+    it waits for that fetch rather than starting another one.
+    """
+    fake_flickr.add_tag("sunset", count_photos=10)
+
+    second_url = "https://www.flickr.com/photos/tags/sunset/page2"
+    fetch_started = threading.Event()
+    release = threading.Event()
+
+    def resolve_flickr_url(url: str, *, index: ResolutionIndex | None) -> ParseResult:
+        if url == second_url:
+            fetch_started.wait(timeout=5)
+        return parse_flickr_url(url)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        fetch_started.set()
+        release.wait(timeout=5)
+        return fake_flickr.handle_request(request)
+
+    monkeypatch.setattr(batch, "resolve_flickr_url", resolve_flickr_url)
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+    # Give the second URL a chance to be parsed before the fetch finishes.
+    threading.Timer(0.1, release.set).start()
+
+    results = list(
+        lookup_flickr_urls(api, [tag_url("sunset"), second_url], concurrency=2)
+    )
+
+    assert len(results) == 2
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+
+def test_errors_are_returned_as_results(fake_flickr: FakeFlickr) -> None:
+    results = {
+        r["flickr_url"]: r
+        for r in lookup_flickr_urls(
+            fake_flickr.api,
+            [
+                "https://www.example.net",
+                "https://www.flickr.com/help",
+                "https://www.flickr.com/photos/doesnotexist/",
+            ],
+        )
+    }
+
+    assert isinstance(results["https://www.example.net"]["error"], NotAFlickrUrl)  # type: ignore[typeddict-item]
+    assert isinstance(
+        results["https://www.flickr.com/help"]["error"],  # type: ignore[typeddict-item]
+        UnrecognisedUrl,
+    )
+    assert isinstance(
+        results["https://www.flickr.com/photos/doesnotexist/"]["error"],  # type: ignore[typeddict-item]
+        ResourceNotFound,
+    )
+
+
+def test_unexpected_errors_are_returned_as_results(fake_flickr: FakeFlickr) -> None:
+    """
+    If the lookup for one URL fails unexpectedly (e.g. Flickr times out),
+    we return the error for that URL, and still look up the others.
+    """
+    fake_flickr.add_tag("sunset", count_photos=10)
+    fake_flickr.add_tag("sunrise", count_photos=10)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("tags") == "sunrise":
+            raise httpx.ReadTimeout("The read operation timed out", request=request)
+
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+    results = {
+        r["flickr_url"]: r
+        for r in lookup_flickr_urls(api, [tag_url("sunrise"), tag_url("sunset")])
+    }
+
+    assert isinstance(results[tag_url("sunrise")]["error"], httpx.ReadTimeout)  # type: ignore[typeddict-item]
+    assert len(results[tag_url("sunset")]["photos"]) == 10  # type: ignore[typeddict-item]
+
+
+def test_big_collections_are_sent_to_the_job_queue(fake_flickr: FakeFlickr) -> None:
+    fake_flickr.add_tag("sunset", count_photos=1200)
+
+    (result,) = lookup_flickr_urls(
+        fake_flickr.api, [tag_url("sunset")], max_photos=1000
+    )
+
+    assert isinstance(result["error"], TooManyPhotos)  # type: ignore[typeddict-item]
+    assert "submit it as a job at /jobs" in str(result["error"])  # type: ignore[typeddict-item]
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 3
+
+
+def test_results_are_yielded_as_soon_as_they_are_ready(
+    fake_flickr: FakeFlickr,
+) -> None:
+    """
+    A slow URL doesn't hold up the results for the other URLs.
+    """
+    fake_flickr.add_tag("slow", count_photos=10)
+    fake_flickr.add_tag("fast", count_photos=10)
+
+    slow_can_finish = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.params.get("tags") == "slow":
+            slow_can_finish.wait(timeout=5)
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    results = lookup_flickr_urls(api, [tag_url("slow"), tag_url("fast")])
+
+    assert next(results)["flickr_url"] == tag_url("fast")
+    slow_can_finish.set()
+    assert next(results)["flickr_url"] == tag_url("slow")
+
+
+def test_concurrency_is_capped(fake_flickr: FakeFlickr) -> None:
+    """
+    However many URLs there are, we only fetch a few of them at once.
+    """
+    tags = [f"tag{i}" for i in range(10)]
+
+    for t in tags:
+        fake_flickr.add_tag(t, count_photos=1)
+
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal active, max_active
+
+        with lock:
+            active += 1
+            max_active = max(max_active, active)
+
+        time.sleep(0.05)
+
+        with lock:
+            active -= 1
+
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    results = list(lookup_flickr_urls(api, [tag_url(t) for t in tags], concurrency=3))
+
+    assert len(results) == 10
+    assert max_active == 3
+
+
+def test_stopping_early_cancels_the_remaining_lookups(
+    fake_flickr: FakeFlickr,
+) -> None:
+    tags = [f"tag{i}" for i in range(5)]
+
+    for t in tags:
+        fake_flickr.add_tag(t, count_photos=1)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        time.sleep(0.1)
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    results = lookup_flickr_urls(api, [tag_url(t) for t in tags], concurrency=1)
+
+    next(results)
+    results.close()
+
+    assert len(fake_flickr.calls_to("flickr.photos.search")) < len(tags)
+
+
+@pytest.fixture
+def batch_client(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> FlaskClient:
+    """
+    A test client for the app, which gets photos from the fake Flickr API.
+    """
+    fake_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", fake_api)
+
+    return app.test_client()
+
+
+class TestBatchEndpoint:
+    def test_urls_as_json(
+        self, batch_client: FlaskClient, fake_flickr: FakeFlickr
+    ) -> None:
+        fake_flickr.add_tag("sunset", count_photos=3)
+
+        resp = batch_client.post(
+            "/batch",
+            json={"flickr_urls": [tag_url("sunset"), "https://www.example.net"]},
+        )
+
+        assert resp.status_code == 200
+        assert resp.is_streamed
+        assert resp.headers["content-type"] == "application/x-ndjson; charset=utf-8"
+
+        results = {r["flickr_url"]: r for r in map(json.loads, resp.text.splitlines())}
+
+        assert results["https://www.example.net"] == {
+            "flickr_url": "https://www.example.net",
+            "error": {
+                "type": "NotAFlickrUrl",
+                "message": "https://www.example.net",
+            },
+        }
+
+        sunset = results[tag_url("sunset")]
+        assert sunset["parsed_url"] == {"type": "tag", "tag": "sunset", "page": 1}
+        assert len(sunset["photos"]) == 3
+        assert isinstance(sunset["photos"][0]["date_posted"], str)
+
+    def test_urls_as_form(
+        self, batch_client: FlaskClient, fake_flickr: FakeFlickr
+    ) -> None:
+        fake_flickr.add_tag("sunset", count_photos=3)
+        fake_flickr.add_tag("sunrise", count_photos=3)
+
+        resp = batch_client.post(
+            "/batch",
+            data={"flickr_urls": f"{tag_url('sunset')}\n\n  {tag_url('sunrise')}  \n"},
+        )
+
+        assert resp.status_code == 200
+        assert sorted(
+            json.loads(line)["flickr_url"] for line in resp.text.splitlines()
+        ) == [
+            tag_url("sunrise"),
+            tag_url("sunset"),
+        ]
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            pytest.param({"json": {"flickr_urls": tag_url("sunset")}}, id="not_a_list"),
+            pytest.param({"json": {"flickr_urls": [1, 2, 3]}}, id="not_strings"),
+            pytest.param({"json": {}}, id="missing"),
+            pytest.param(
+                {"data": "{", "content_type": "application/json"}, id="invalid_json"
+            ),
+        ],
+    )
+    def test_invalid_input_is_rejected(
+        self, batch_client: FlaskClient, kwargs: dict[str, object]
+    ) -> None:
+        resp = batch_client.post("/batch", **kwargs)
+
+        assert resp.status_code == 400
+        assert resp.json == {"error": "flickr_urls should be a list of URLs"}
+
+    def test_too_many_urls_is_rejected(
+        self, batch_client: FlaskClient, fake_flickr: FakeFlickr
+    ) -> None:
+        resp = batch_client.post(
+            "/batch", json={"flickr_urls": [tag_url(f"tag{i}") for i in range(1001)]}
+        )
+
+        assert resp.status_code == 400
+        assert resp.json == {"error": "You can look up at most 1000 URLs at once"}
+        assert fake_flickr.calls == []
@@ -0,0 +1,520 @@
+"""
+Tests for `flinumeratr.cache`.
+"""
+
+import concurrent.futures
+import gc
+from pathlib import Path
+import sqlite3
+import threading
+import time
+import types
+import weakref
+
+from flickr_api import ResourceNotFound
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner, make_photo_attrs
+from flinumeratr.cache import (
+    CachingFlickrApi,
+    ResponseCache,
+    cache_key,
+    get_response_cache,
+)
+from flinumeratr.flickr_api import get_photos_in_user_photostream
+from flinumeratr.metrics import CACHE_REFRESHES
+
+
+@pytest.fixture
+def cache(tmp_path: Path) -> ResponseCache:
+    return ResponseCache(path=str(tmp_path / "cache.db"))
+
+
+def caching_api(fake_flickr: FakeFlickr, cache: ResponseCache) -> CachingFlickrApi:
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.response_cache = cache
+    return api
+
+
+def test_cache_key_normalises_params() -> None:
+    """
+    The same params in a different order or with different types
+    get the same key.
+    """
+    assert cache_key("flickr.photos.search", {"tags": "cat", "page": 2}) == cache_key(
+        "flickr.photos.search", {"page": "2", "tags": "cat"}
+    )
+    assert cache_key("flickr.photos.search", {"page": 1}) != cache_key(
+        "flickr.photos.search", {"page": 2}
+    )
+    assert cache_key("flickr.photos.search", {}) != cache_key(
+        "flickr.people.getPublicPhotos", {}
+    )
+
+
+def test_cache_hit_skips_the_network(
+    fake_flickr: FakeFlickr, cache: ResponseCache
+) -> None:
+    """
+    If we make the same call twice, the second one comes from the cache.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+    api = caching_api(fake_flickr, cache)
+
+    first = get_photos_in_user_photostream(api, user_id=owner["user_id"])
+    count_calls = len(fake_flickr.calls)
+
+    second = get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+    assert first == second
+    assert len(fake_flickr.calls) == count_calls
+
+
+def test_cache_is_shared_between_instances(
+    fake_flickr: FakeFlickr, tmp_path: Path
+) -> None:
+    """
+    Two caches pointing at the same file share their responses, e.g.
+    if they're running in different gunicorn workers.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+
+    api1 = caching_api(fake_flickr, ResponseCache(path=str(tmp_path / "cache.db")))
+    api2 = caching_api(fake_flickr, ResponseCache(path=str(tmp_path / "cache.db")))
+
+    get_photos_in_user_photostream(api1, user_id=owner["user_id"])
+    get_photos_in_user_photostream(api2, user_id=owner["user_id"])
+
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 1
+
+
+def test_errors_are_not_cached(fake_flickr: FakeFlickr, cache: ResponseCache) -> None:
+    """
+    If the API returns an error, we call it again next time.
+    """
+    api = caching_api(fake_flickr, cache)
+
+    for _ in range(2):
+        with pytest.raises(ResourceNotFound):
+            get_photos_in_user_photostream(api, user_id="12345678@N01")
+
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 2
+
+
+def test_no_cache_calls_the_api(fake_flickr: FakeFlickr) -> None:
+    """
+    If there's no response cache, every call goes to Flickr.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+
+    get_photos_in_user_photostream(api, user_id=owner["user_id"])
+    get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 2
+
+
+def test_expired_entries_are_ignored(tmp_path: Path) -> None:
+    cache = ResponseCache(
+        path=str(tmp_path / "cache.db"), ttls={"flickr.photos.search": 0}
+    )
+
+    cache.set("flickr.photos.search", {"tags": "cat"}, body="<rsp />")
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp />")
+
+    assert cache.get("flickr.photos.search", {"tags": "cat"}) is None
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "1"}) == "<rsp />"
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> types.SimpleNamespace:
+    """
+    A fake clock for the response cache, which only moves when
+    we tell it to.
+    """
+    clock = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(
+        "flinumeratr.cache.time", types.SimpleNamespace(time=lambda: clock.now)
+    )
+    return clock
+
+
+def test_least_recently_used_entries_are_evicted(
+    tmp_path: Path, clock: types.SimpleNamespace
+) -> None:
+    """
+    When the bodies in the cache add up to more than ``max_bytes``,
+    the least recently used entries are evicted.
+    """
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), max_bytes=25)
+
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp>1</rsp>")
+    clock.now += 120
+    cache.set("flickr.photos.getInfo", {"photo_id": "2"}, body="<rsp>2</rsp>")
+    clock.now += 120
+
+    # Read photo 1, so it's more recently used than photo 2
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "1"}) is not None
+    clock.now += 120
+
+    cache.set("flickr.photos.getInfo", {"photo_id": "3"}, body="<rsp>3</rsp>")
+
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "1"}) is not None
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "2"}) is None
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "3"}) is not None
+
+
+def test_big_entries_are_evicted_by_size(
+    tmp_path: Path, clock: types.SimpleNamespace
+) -> None:
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), max_bytes=100)
+
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp>1</rsp>")
+    clock.now += 120
+    cache.set("flickr.photos.search", {"tags": "cat"}, body="<rsp>" + "x" * 95)
+
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "1"}) is None
+    assert cache.get("flickr.photos.search", {"tags": "cat"}) is not None
+
+
+def test_bulk_entries_have_their_own_limit(
+    tmp_path: Path, clock: types.SimpleNamespace
+) -> None:
+    """
+    Responses to bulk calls are evicted once they go over their own
+    limit, even if there's room in the cache, so they can't push out
+    the responses for interactive calls.
+    """
+    cache = ResponseCache(
+        path=str(tmp_path / "cache.db"), max_bytes=1000, max_bulk_bytes=25
+    )
+
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp>1</rsp>")
+    clock.now += 120
+
+    for page in range(1, 4):
+        cache.set(
+            "flickr.photos.search",
+            {"tags": "cat", "page": page},
+            body=f"<rsp>{page}</rsp>",
+            priority="bulk",
+        )
+        clock.now += 120
+
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "1"}) is not None
+    assert cache.get("flickr.photos.search", {"tags": "cat", "page": 1}) is None
+    assert cache.get("flickr.photos.search", {"tags": "cat", "page": 2}) is not None
+    assert cache.get("flickr.photos.search", {"tags": "cat", "page": 3}) is not None
+
+
+def test_last_used_is_only_updated_once_a_minute(
+    tmp_path: Path, clock: types.SimpleNamespace
+) -> None:
+    """
+    Reading an entry doesn't write to the database if we've already
+    recorded that it was used in the last minute.
+    """
+    cache = ResponseCache(path=str(tmp_path / "cache.db"))
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp />")
+
+    def last_used() -> float:
+        with sqlite3.connect(cache.path) as conn:
+            value: float = conn.execute("SELECT last_used FROM responses").fetchone()[0]
+        return value
+
+    clock.now += 30
+    cache.get("flickr.photos.getInfo", {"photo_id": "1"})
+    assert last_used() == clock.now - 30
+
+    clock.now += 31
+    cache.get("flickr.photos.getInfo", {"photo_id": "1"})
+    assert last_used() == clock.now
+
+
+def test_get_response_cache(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.delenv("FLINUMERATR_CACHE_PATH", raising=False)
+    assert get_response_cache() is None
+
+    monkeypatch.setenv("FLINUMERATR_CACHE_PATH", str(tmp_path / "cache.db"))
+    cache = get_response_cache()
+    assert cache is not None
+    assert cache.path == str(tmp_path / "cache.db")
+
+
+@pytest.fixture
+def reset_refreshes() -> None:
+    """
+    Clear the count of background refreshes before a test.
+    """
+    CACHE_REFRESHES.values.clear()
+
+
+@pytest.fixture
+def refresh_executor(
+    monkeypatch: pytest.MonkeyPatch,
+) -> concurrent.futures.ThreadPoolExecutor:
+    """
+    Replace the executor that refreshes stale responses, so tests can
+    wait for the refresh to finish by shutting it down.
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr("flinumeratr.cache._refresh_executor", executor)
+    return executor
+
+
+def stale_cache(tmp_path: Path) -> ResponseCache:
+    """
+    Returns a response cache where every photostream is stale as soon
+    as it's stored.
+    """
+    return ResponseCache(
+        path=str(tmp_path / "cache.db"), ttls={"flickr.people.getPublicPhotos": 0}
+    )
+
+
+def test_stale_response_is_served_then_refreshed(
+    fake_flickr: FakeFlickr,
+    tmp_path: Path,
+    refresh_executor: concurrent.futures.ThreadPoolExecutor,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+    api = caching_api(fake_flickr, stale_cache(tmp_path))
+
+    first = get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+    # Somebody uploads a new photo, but we serve the stale response
+    # while we refresh it.
+    fake_flickr.photostreams[owner["user_id"]].insert(0, make_photo_attrs(-1, owner))
+
+    second = get_photos_in_user_photostream(api, user_id=owner["user_id"])
+    assert second == first
+
+    refresh_executor.shutdown(wait=True)
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 2
+
+    # The next request gets the refreshed response (and starts
+    # another refresh, because it's still stale).
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr("flinumeratr.cache._refresh_executor", executor)
+
+    third = get_photos_in_user_photostream(api, user_id=owner["user_id"])
+    assert third["count_photos"] == 21
+
+    executor.shutdown(wait=True)
+
+
+def test_only_one_refresh_at_a_time(tmp_path: Path) -> None:
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), ttls={})
+    cache2 = ResponseCache(path=cache.path, ttls={})
+
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp />")
+
+    # It's not stale yet, so there's nothing to refresh.
+    assert not cache.claim_refresh("flickr.photos.getInfo", {"photo_id": "1"})
+
+    cache = ResponseCache(path=cache.path, ttls={}, default_ttl=0)
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp />")
+
+    assert cache.claim_refresh("flickr.photos.getInfo", {"photo_id": "1"})
+    assert not cache2.claim_refresh("flickr.photos.getInfo", {"photo_id": "1"})
+
+    # While it's being refreshed, other processes see it as fresh.
+    assert cache2.lookup("flickr.photos.getInfo", {"photo_id": "1"}) == {
+        "body": "<rsp />",
+        "is_stale": False,
+    }
+
+
+@pytest.mark.usefixtures("reset_refreshes")
+def test_refresh_errors_keep_the_stale_response(
+    fake_flickr: FakeFlickr,
+    tmp_path: Path,
+    refresh_executor: concurrent.futures.ThreadPoolExecutor,
+) -> None:
+    """
+    If Flickr returns an error when we try to refresh a response,
+    we keep serving the stale response.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+    cache = stale_cache(tmp_path)
+
+    first = get_photos_in_user_photostream(
+        caching_api(fake_flickr, cache), user_id=owner["user_id"]
+    )
+
+    api = CachingFlickrApi(
+        client=httpx.Client(
+            transport=httpx.MockTransport(lambda _: httpx.Response(status_code=403))
+        )
+    )
+    api.response_cache = cache
+
+    assert get_photos_in_user_photostream(api, user_id=owner["user_id"]) == first
+    refresh_executor.shutdown(wait=True)
+
+    assert CACHE_REFRESHES.values == {(("result", "error"),): 1}
+
+    # Nobody else tries to refresh it until the refresh times out.
+    assert get_photos_in_user_photostream(api, user_id=owner["user_id"]) == first
+
+
+@pytest.mark.usefixtures("reset_refreshes")
+def test_refresh_drops_photos_that_have_gone(
+    fake_flickr: FakeFlickr,
+    tmp_path: Path,
+    refresh_executor: concurrent.futures.ThreadPoolExecutor,
+) -> None:
+    """
+    If the photos have been deleted when we refresh a response,
+    the next request gets the error rather than the stale photos.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+    api = caching_api(fake_flickr, stale_cache(tmp_path))
+
+    get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+    del fake_flickr.photostreams[owner["user_id"]]
+
+    get_photos_in_user_photostream(api, user_id=owner["user_id"])
+    refresh_executor.shutdown(wait=True)
+
+    assert CACHE_REFRESHES.values == {(("result", "not_found"),): 1}
+
+    with pytest.raises(ResourceNotFound):
+        get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+
+@pytest.mark.usefixtures("reset_refreshes")
+def test_refresh_isnt_started_twice(
+    fake_flickr: FakeFlickr,
+    tmp_path: Path,
+    refresh_executor: concurrent.futures.ThreadPoolExecutor,
+) -> None:
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+    release = threading.Event()
+    release.set()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        release.wait()
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    api.response_cache = stale_cache(tmp_path)
+
+    get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+    # Hold up the refresh until we've made all our requests.
+    release.clear()
+
+    for _ in range(3):
+        get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+    release.set()
+    refresh_executor.shutdown(wait=True)
+
+    assert CACHE_REFRESHES.values == {(("result", "ok"),): 1}
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 2
+
+
+def test_refresh_is_skipped_if_another_process_is_refreshing(
+    fake_flickr: FakeFlickr, tmp_path: Path
+) -> None:
+    cache = ResponseCache(path=str(tmp_path / "cache.db"), ttls={}, default_ttl=0)
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp />")
+
+    assert cache.claim_refresh("flickr.photos.getInfo", {"photo_id": "1"})
+
+    api = caching_api(fake_flickr, cache)
+
+    assert (
+        api.refresh_in_background(
+            method="flickr.photos.getInfo", params={"photo_id": "1"}, exceptions={}
+        )
+        is None
+    )
+    assert fake_flickr.calls == []
+
+
+def test_stale_entries_expire_after_max_stale(tmp_path: Path) -> None:
+    cache = ResponseCache(
+        path=str(tmp_path / "cache.db"), ttls={}, default_ttl=0, max_stale=0
+    )
+
+    cache.set("flickr.photos.getInfo", {"photo_id": "1"}, body="<rsp />")
+
+    assert cache.lookup("flickr.photos.getInfo", {"photo_id": "1"}) is None
+    assert not cache.claim_refresh("flickr.photos.getInfo", {"photo_id": "1"})
+
+
+def test_old_databases_are_upgraded(tmp_path: Path) -> None:
+    """
+    Entries in a cache created before we served stale responses
+    are treated as stale.
+    """
+    path = str(tmp_path / "cache.db")
+
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            """
+            CREATE TABLE responses(
+                key TEXT PRIMARY KEY,
+                method TEXT NOT NULL,
+                body TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "INSERT INTO responses VALUES(?, ?, ?, ?, ?)",
+            (
+                cache_key("flickr.photos.getInfo", {"photo_id": "1"}),
+                "flickr.photos.getInfo",
+                "<rsp />",
+                time.time() + 60,
+                time.time(),
+            ),
+        )
+
+    cache = ResponseCache(path=path)
+
+    assert cache.lookup("flickr.photos.getInfo", {"photo_id": "1"}) == {
+        "body": "<rsp />",
+        "is_stale": True,
+    }
+    assert cache.get("flickr.photos.getInfo", {"photo_id": "1"}) is None
+
+
+def test_with_priority_reuses_copies() -> None:
+    api = CachingFlickrApi(client=httpx.Client())
+
+    bulk = api.with_priority("bulk")
+
+    assert bulk.priority == "bulk"
+    assert api.priority == "interactive"
+    assert api.with_priority("bulk") is bulk
+    assert api.with_priority("bulk", max_wait=0) is not bulk
+    assert api.with_priority("bulk", max_wait=0).max_wait == 0
+
+
+def test_with_priority_uses_the_latest_caches(tmp_path: Path) -> None:
+    api = CachingFlickrApi(client=httpx.Client())
+    bulk = api.with_priority("bulk")
+
+    api.response_cache = ResponseCache(path=str(tmp_path / "cache.db"))
+
+    assert api.with_priority("bulk") is not bulk
+    assert api.with_priority("bulk").response_cache is api.response_cache
+
+
+def test_with_priority_doesnt_keep_clients_alive() -> None:
+    api = CachingFlickrApi(client=httpx.Client())
+    api.with_priority("bulk")
+
+    ref = weakref.ref(api)
+    del api
+    gc.collect()
+
+    assert ref() is None
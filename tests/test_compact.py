@@ -0,0 +1,148 @@
+"""
+Tests for `flinumeratr.compact`.
+"""
+
+import gc
+import tracemalloc
+
+from flask import Flask, render_template
+from flickr_api import FlickrApi
+from flickr_url_parser import parse_flickr_url
+
+from fake_flickr import FakeFlickr
+from flinumeratr.compact import PhotoInterner
+from flinumeratr.flickr_api import iter_photos_from_flickr_url
+from flinumeratr.fragments import fragment_cache
+from flinumeratr.models import Photo
+
+
+def add_group(fake_flickr: FakeFlickr, count_photos: int) -> None:
+    fake_flickr.add_group(
+        "1234@N01",
+        url="https://www.flickr.com/groups/geologists",
+        count_photos=count_photos,
+        count_owners=10,
+    )
+
+
+def get_group_photos(fake_flickr: FakeFlickr, count_photos: int) -> list[Photo]:
+    add_group(fake_flickr, count_photos=count_photos)
+
+    return fetch_group_photos(fake_flickr, fake_flickr.api)
+
+
+def fetch_group_photos(fake_flickr: FakeFlickr, api: FlickrApi) -> list[Photo]:
+    return list(
+        iter_photos_from_flickr_url(
+            api,
+            parse_flickr_url("https://www.flickr.com/groups/geologists"),
+            per_page=500,
+        )
+    )
+
+
+def test_compact_photos_round_trip(fake_flickr: FakeFlickr) -> None:
+    photos = get_group_photos(fake_flickr, count_photos=100)
+
+    interner = PhotoInterner()
+    compact = list(interner.compact_all(photos))
+
+    assert [c.to_photo() for c in compact] == photos
+
+
+def test_owners_and_licenses_are_shared(fake_flickr: FakeFlickr) -> None:
+    photos = get_group_photos(fake_flickr, count_photos=100)
+
+    interner = PhotoInterner()
+    compact = list(interner.compact_all(photos))
+
+    # There are 10 owners in the group, so every 10th photo has the
+    # same owner -- and the same Owner object.
+    assert compact[0].owner is compact[10].owner
+    assert compact[0].owner is not compact[1].owner
+    assert len(interner.owners) == 10
+
+    assert compact[0].license is compact[11].license
+    assert len(interner.licenses) == 11
+
+
+def test_date_taken_is_optional(fake_flickr: FakeFlickr) -> None:
+    photo = get_group_photos(fake_flickr, count_photos=1)[0]
+    photo["date_taken"] = None
+
+    compact = PhotoInterner().compact(photo)
+
+    assert compact.date_taken is None
+    assert compact.to_photo() == photo
+
+
+def test_compact_photos_use_less_memory(fake_flickr: FakeFlickr) -> None:
+    """
+    Compact photos use much less memory than the equivalent dicts.
+
+    This is the measurement quoted in the docstring of `flinumeratr.compact`.
+    """
+    add_group(fake_flickr, count_photos=2000)
+    api = fake_flickr.api
+
+    # Fetch the photos once before we start measuring, so we don't
+    # count the licenses or any modules that are imported lazily.
+    fetch_group_photos(fake_flickr, api)
+
+    gc.collect()
+    tracemalloc.start()
+
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        photos = fetch_group_photos(fake_flickr, api)
+        gc.collect()
+        dict_size = tracemalloc.get_traced_memory()[0] - baseline
+
+        compact = list(PhotoInterner().compact_all(photos))
+        del photos
+        gc.collect()
+        compact_size = tracemalloc.get_traced_memory()[0] - baseline
+    finally:
+        tracemalloc.stop()
+
+    assert len(compact) == 2000
+    assert compact_size < dict_size * 0.6
+
+
+def test_templates_can_render_compact_photos(
+    app: Flask, fake_flickr: FakeFlickr
+) -> None:
+    """
+    Compact photos can be passed straight to the templates.
+    """
+    photos = get_group_photos(fake_flickr, count_photos=10)
+    compact = list(PhotoInterner().compact_all(photos))
+
+    with app.test_request_context():
+        expected = render_template(
+            "see_photos.html",
+            parsed_url={"type": "group"},
+            photo_data={
+                "photos": photos,
+                "count_photos": 10,
+                "group": {"name": "Geologists"},
+            },
+            photos=photos,
+        )
+
+        # Make sure we render the compact photos from scratch, rather
+        # than reusing the fragments we just rendered.
+        fragment_cache.clear()
+
+        actual = render_template(
+            "see_photos.html",
+            parsed_url={"type": "group"},
+            photo_data={
+                "photos": compact,
+                "count_photos": 10,
+                "group": {"name": "Geologists"},
+            },
+            photos=compact,
+        )
+
+    assert actual == expected
@@ -0,0 +1,193 @@
+"""
+Tests for `flinumeratr.conditional`, and conditional GET requests
+for /see_photos and the homepage.
+"""
+
+from datetime import datetime, timezone
+import types
+
+from flask import Flask
+from flask.testing import FlaskClient
+from flickr_url_parser import parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner, make_photo_attrs
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.conditional import get_etag
+from flinumeratr.models import CollectionOfPhotos, Photo
+from test_asgi import asgi, get
+
+
+__all__ = ["asgi"]
+
+
+@pytest.fixture
+def conditional_client(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> FlaskClient:
+    """
+    A test client for the app, which gets photos from the fake Flickr API.
+    """
+    fake_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", fake_api)
+
+    return app.test_client()
+
+
+def photo(n: int, *, date_posted: datetime) -> Photo:
+    return {
+        "url": f"https://www.flickr.com/photos/user1/{n}/",
+        "image_url": f"https://live.staticflickr.com/65535/{n}_abcdef1234.jpg",
+        "sizes": [],
+        "title": f"Photo {n}",
+        "owner_url": "https://www.flickr.com/people/user1/",
+        "owner_name": "User 1",
+        "date_taken": None,
+        "date_posted": date_posted,
+        "license": {
+            "id": "cc-by-2.0",
+            "label": "CC BY 2.0",
+            "url": "https://creativecommons.org/licenses/by/2.0/",
+        },
+    }
+
+
+class TestGetEtag:
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    def collection(self, *photos: Photo, count_photos: int = 2) -> CollectionOfPhotos:
+        return {"photos": list(photos), "count_pages": 1, "count_photos": count_photos}
+
+    def test_etag_changes_with_the_collection(self) -> None:
+        p1 = photo(1, date_posted=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        p2 = photo(2, date_posted=datetime(2024, 6, 1, tzinfo=timezone.utc))
+
+        etags = {
+            get_etag(self.parsed_url, self.collection(p1, p2), count_pages=1),
+            get_etag(self.parsed_url, self.collection(p2, p1), count_pages=1),
+            get_etag(
+                self.parsed_url, self.collection(p1, p2, count_photos=3), count_pages=1
+            ),
+            get_etag(self.parsed_url, self.collection(p1, p2), count_pages=2),
+            get_etag(
+                parse_flickr_url("https://www.flickr.com/photos/tags/sunset/page2"),
+                self.collection(p1, p2),
+                count_pages=1,
+            ),
+        }
+
+        assert len(etags) == 5
+
+    def test_single_photo(self) -> None:
+        p1 = photo(1, date_posted=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        p2 = photo(2, date_posted=datetime(2024, 1, 1, tzinfo=timezone.utc))
+        parsed_url = parse_flickr_url("https://www.flickr.com/photos/user1/1/")
+
+        assert get_etag(parsed_url, p1, count_pages=1) != get_etag(
+            parsed_url, p2, count_pages=1
+        )
+
+
+def user_url(fake_flickr: FakeFlickr) -> str:
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+    return f"/see_photos?flickr_url=https://www.flickr.com/photos/{owner['path_alias']}/&pages=3"
+
+
+def test_see_photos_has_caching_headers(
+    conditional_client: FlaskClient, fake_flickr: FakeFlickr
+) -> None:
+    resp = conditional_client.get(user_url(fake_flickr))
+
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.headers["ETag"].startswith('W/"')
+    assert "Last-Modified" not in resp.headers
+    assert resp.headers["Cache-Control"] == "public, max-age=300"
+
+
+def test_matching_etag_is_not_modified(
+    conditional_client: FlaskClient, fake_flickr: FakeFlickr
+) -> None:
+    """
+    If the client already has the page, we send a 304 and don't
+    fetch any of the later pages.
+    """
+    url = user_url(fake_flickr)
+    etag = conditional_client.get(url).headers["ETag"]
+
+    fake_flickr.calls.clear()
+
+    resp = conditional_client.get(url, headers={"If-None-Match": etag})
+
+    assert resp.status_code == 304
+    assert resp.data == b""
+    assert resp.headers["ETag"] == etag
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 1
+
+
+def test_if_modified_since_is_ignored(
+    conditional_client: FlaskClient, fake_flickr: FakeFlickr
+) -> None:
+    """
+    A collection can change without any new uploads, e.g. if a photo
+    is removed, so we only use the ETag to decide if a page is modified.
+    """
+    url = user_url(fake_flickr)
+    etag = conditional_client.get(url).headers["ETag"]
+
+    owner = make_owner(1)
+    fake_flickr.photostreams[owner["user_id"]].pop(1)
+
+    resp = conditional_client.get(
+        url, headers={"If-Modified-Since": "Sun, 13 Sep 2030 12:26:40 GMT"}
+    )
+
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_new_upload_changes_the_etag(
+    conditional_client: FlaskClient, fake_flickr: FakeFlickr
+) -> None:
+    url = user_url(fake_flickr)
+    etag = conditional_client.get(url).headers["ETag"]
+
+    owner = make_owner(1)
+    new_photo = {**make_photo_attrs(-1, owner), "dateupload": "1700000000"}
+    fake_flickr.photostreams[owner["user_id"]].insert(0, new_photo)
+
+    resp = conditional_client.get(url, headers={"If-None-Match": etag})
+
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+    assert resp.text.count('<a class="photo"') == 251
+
+
+def test_error_pages_arent_cached(conditional_client: FlaskClient) -> None:
+    resp = conditional_client.get("/see_photos?flickr_url=https://www.example.net")
+
+    assert "ETag" not in resp.headers
+    assert "Cache-Control" not in resp.headers
+
+
+def test_homepage_is_not_modified(client: FlaskClient) -> None:
+    resp = client.get("/")
+
+    assert resp.status_code == 200
+    assert resp.headers["Cache-Control"] == "public, max-age=300"
+
+    resp = client.get("/", headers={"If-None-Match": resp.headers["ETag"]})
+
+    assert resp.status_code == 304
+    assert resp.data == b""
+
+
+def test_asgi_is_not_modified(asgi: types.ModuleType, fake_flickr: FakeFlickr) -> None:
+    url = user_url(fake_flickr)
+    etag = get(asgi, url).headers["ETag"]
+
+    resp = get(asgi, url, headers={"If-None-Match": etag})
+
+    assert resp.status_code == 304
+    assert resp.content == b""
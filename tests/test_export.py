@@ -0,0 +1,250 @@
+"""
+Tests for `flinumeratr.export` and the /export endpoint.
+"""
+
+import csv
+from datetime import datetime
+import io
+import json
+
+from flask import Flask
+from flask.testing import FlaskClient
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.export import (
+    CSV_FIELDS,
+    export_as_csv,
+    export_as_jsonl,
+    photo_from_dict,
+    photo_to_dict,
+)
+from flinumeratr.models import Photo
+
+
+photo: Photo = {
+    "url": "https://www.flickr.com/photos/user1/50000000001/",
+    "image_url": "https://live.staticflickr.com/65535/50000000001_abcdef1234.jpg",
+    "sizes": [
+        {
+            "label": "Medium",
+            "width": 500,
+            "height": 375,
+            "media": "photo",
+            "source": "https://live.staticflickr.com/65535/50000000001_abcdef1234.jpg",
+        }
+    ],
+    "title": "A “photo”, with a comma",
+    "owner_url": "https://www.flickr.com/photos/user1/",
+    "owner_name": "User Number 1",
+    "date_taken": {"value": datetime(2020, 10, 5, 17, 31, 27), "granularity": "second"},
+    "date_posted": datetime(2020, 9, 13, 12, 26, 40),
+    "license": {
+        "id": "cc-by-2.0",
+        "label": "CC BY 2.0",
+        "url": "https://creativecommons.org/licenses/by/2.0/",
+    },
+}
+
+
+class TestSerialisers:
+    def test_csv(self) -> None:
+        untitled: Photo = {**photo, "title": None, "date_taken": None}
+
+        rows = list(csv.reader(io.StringIO("".join(export_as_csv([photo, untitled])))))
+
+        assert rows == [
+            CSV_FIELDS,
+            [
+                photo["url"],
+                photo["image_url"],
+                "A “photo”, with a comma",
+                photo["owner_url"],
+                "User Number 1",
+                "2020-10-05T17:31:27",
+                "second",
+                "2020-09-13T12:26:40",
+                "cc-by-2.0",
+                "CC BY 2.0",
+                "https://creativecommons.org/licenses/by/2.0/",
+            ],
+            [
+                photo["url"],
+                photo["image_url"],
+                "",
+                photo["owner_url"],
+                "User Number 1",
+                "",
+                "",
+                "2020-09-13T12:26:40",
+                "cc-by-2.0",
+                "CC BY 2.0",
+                "https://creativecommons.org/licenses/by/2.0/",
+            ],
+        ]
+
+    def test_csv_with_no_photos_is_just_the_header(self) -> None:
+        assert "".join(export_as_csv([])) == ",".join(CSV_FIELDS) + "\r\n"
+
+    def test_csv_without_a_header(self) -> None:
+        assert "".join(export_as_csv([], header=False)) == ""
+        assert "".join(export_as_csv([photo], header=False)).startswith(photo["url"])
+
+    def test_jsonl(self) -> None:
+        lines = "".join(export_as_jsonl([photo, {**photo, "date_taken": None}]))
+
+        assert [json.loads(line) for line in lines.splitlines()] == [
+            {
+                **photo,
+                "date_taken": {"value": "2020-10-05T17:31:27", "granularity": "second"},
+                "date_posted": "2020-09-13T12:26:40",
+            },
+            {**photo, "date_taken": None, "date_posted": "2020-09-13T12:26:40"},
+        ]
+
+    @pytest.mark.parametrize("p", [photo, {**photo, "date_taken": None}])
+    def test_photo_dicts_round_trip(self, p: Photo) -> None:
+        assert photo_from_dict(json.loads(json.dumps(photo_to_dict(p)))) == p
+
+    def test_photo_dicts_without_sizes_can_be_read(self) -> None:
+        """
+        Exports and snapshots saved before we kept the sizes of each
+        photo can still be read.
+        """
+        d = photo_to_dict(photo)
+        del d["sizes"]
+
+        assert photo_from_dict(d) == {**photo, "sizes": []}
+
+    def test_output_is_chunked(self) -> None:
+        """
+        We yield the output in chunks, rather than as one big string
+        or one string per photo.
+        """
+        chunks = list(export_as_jsonl([photo] * 250))
+
+        assert len(chunks) == 3
+        assert [c.count("\n") for c in chunks] == [100, 100, 50]
+
+
+@pytest.fixture
+def export_client(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> FlaskClient:
+    """
+    A test client for the app, which gets photos from the fake Flickr API.
+    """
+    fake_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", fake_api)
+
+    return app.test_client()
+
+
+class TestExportEndpoint:
+    def test_exports_every_photo_as_csv(
+        self, export_client: FlaskClient, fake_flickr: FakeFlickr
+    ) -> None:
+        fake_flickr.add_tag("sunset", count_photos=1200)
+
+        resp = export_client.get(
+            "/export?flickr_url=https://www.flickr.com/photos/tags/sunset/&format=csv"
+        )
+
+        assert resp.status_code == 200
+        assert resp.is_streamed
+        assert resp.headers["content-type"] == "text/csv; charset=utf-8"
+        assert (
+            resp.headers["content-disposition"] == 'attachment; filename="photos.csv"'
+        )
+
+        rows = list(csv.DictReader(io.StringIO(resp.text)))
+        assert len(rows) == 1200
+        assert len({r["url"] for r in rows}) == 1200
+
+        assert [
+            c["per_page"] for c in fake_flickr.calls_to("flickr.photos.search")
+        ] == [
+            "500",
+            "500",
+            "500",
+        ]
+
+    def test_exports_every_photo_as_jsonl(
+        self, export_client: FlaskClient, fake_flickr: FakeFlickr
+    ) -> None:
+        owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+
+        resp = export_client.get(
+            f"/export?flickr_url=https://www.flickr.com/photos/{owner['path_alias']}/"
+        )
+
+        assert resp.status_code == 200
+        assert resp.headers["content-type"] == "application/x-ndjson; charset=utf-8"
+
+        photos = [json.loads(line) for line in resp.text.splitlines()]
+        assert len(photos) == 250
+        assert {p["owner_name"] for p in photos} == {"User Number 1"}
+
+    def test_empty_collection_is_just_the_header(
+        self, export_client: FlaskClient, fake_flickr: FakeFlickr
+    ) -> None:
+        owner = fake_flickr.add_user(make_owner(1), count_photos=0)
+
+        resp = export_client.get(
+            f"/export?flickr_url=https://www.flickr.com/photos/{owner['path_alias']}/&format=csv"
+        )
+
+        assert resp.status_code == 200
+        assert resp.text == ",".join(CSV_FIELDS) + "\r\n"
+
+    @pytest.mark.parametrize(
+        ["query", "status_code", "expected_text"],
+        [
+            pytest.param(
+                "flickr_url=https://www.flickr.com/photos/tags/sunset/&format=xml",
+                400,
+                "isn’t a format we can export",
+                id="bad_format",
+            ),
+            pytest.param(
+                "flickr_url=https://www.example.net",
+                400,
+                "doesn’t live on Flickr.com",
+                id="not_flickr",
+            ),
+            pytest.param(
+                "flickr_url=https://www.flickr.com/help",
+                404,
+                "There are no photos to show",
+                id="no_photos",
+            ),
+            pytest.param(
+                "flickr_url=https://www.flickr.com/photos/doesnotexist/",
+                404,
+                "Unable to find a person",
+                id="missing_user",
+            ),
+        ],
+    )
+    def test_errors(
+        self,
+        export_client: FlaskClient,
+        query: str,
+        status_code: int,
+        expected_text: str,
+    ) -> None:
+        resp = export_client.get(f"/export?{query}")
+
+        assert resp.status_code == status_code
+        assert expected_text in resp.text
+
+    @pytest.mark.parametrize("query", ["", "?flickr_url="])
+    def test_no_flickr_url_redirects_you_to_homepage(
+        self, export_client: FlaskClient, query: str
+    ) -> None:
+        resp = export_client.get(f"/export{query}")
+
+        assert resp.status_code == 302
+        assert resp.headers["location"] == "/"
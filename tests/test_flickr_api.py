@@ -1,6 +1,40 @@
-from flickr_api import FlickrApi
+import itertools
+import threading
+import time
+import typing
+from unittest import mock
+from xml.etree import ElementTree as ET
 
-from flinumeratr.flickr_api import get_photos_in_user_photostream
+from flickr_api import FlickrApi, LicenseNotFound, ResourceNotFound
+from flickr_api.models import User
+from flickr_api.parsers import create_user
+import httpx
+from flickr_url_parser import parse_flickr_url
+import pytest
+
+from fake_flickr import (
+    FakeFlickr,
+    make_owner,
+    make_photo_attrs,
+    make_photos,
+    render_collection,
+)
+from flinumeratr.flickr_api import (
+    PER_PAGE,
+    PageRequest,
+    _create_collection,
+    first_api_page,
+    get_pages_from_flickr_url,
+    get_photos_from_flickr_url,
+    get_photos_in_album,
+    get_photos_in_group_pool,
+    get_photos_in_user_photostream,
+    iter_photos_from_flickr_url,
+    iterparse_collection,
+    plan_page_requests,
+    with_page,
+)
+from flinumeratr.models import Photo
 
 
 def test_empty_result_if_no_public_photos(flickr_api: FlickrApi) -> None:
@@ -16,3 +50,572 @@ def test_empty_result_if_no_public_photos(flickr_api: FlickrApi) -> None:
     photos = get_photos_in_user_photostream(flickr_api, user_id="51635425@N00")
 
     assert photos == {"count_pages": 1, "count_photos": 0, "photos": []}
+
+
+@pytest.mark.parametrize(
+    ["flickr_url", "api_method"],
+    [
+        pytest.param(
+            "https://www.flickr.com/photos/user1/albums/72157640898611483",
+            "flickr.photosets.getPhotos",
+            id="album",
+        ),
+        pytest.param(
+            "https://www.flickr.com/photos/user1/",
+            "flickr.people.getPublicPhotos",
+            id="user",
+        ),
+        pytest.param(
+            "https://www.flickr.com/photos/george/galleries/72157677773252346/",
+            "flickr.galleries.getPhotos",
+            id="gallery",
+        ),
+        pytest.param(
+            "https://www.flickr.com/groups/geologists/",
+            "flickr.groups.pools.getPhotos",
+            id="group",
+        ),
+        pytest.param(
+            "https://www.flickr.com/photos/tags/botany/",
+            "flickr.photos.search",
+            id="tag",
+        ),
+    ],
+)
+def test_iter_photos_walks_every_page(
+    fake_flickr: FakeFlickr, flickr_url: str, api_method: str
+) -> None:
+    """
+    Iterating over the photos at a URL gets every photo from every page.
+
+    We use small pages, so there's more than one page to walk.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+    fake_flickr.add_album("72157640898611483", owner=owner, count_photos=250)
+    fake_flickr.add_gallery("72157677773252346", count_photos=250)
+    fake_flickr.add_group(
+        "1234@N01", url="https://www.flickr.com/groups/geologists", count_photos=250
+    )
+    fake_flickr.add_tag("botany", count_photos=250)
+
+    photos = list(
+        iter_photos_from_flickr_url(
+            fake_flickr.api, parse_flickr_url(flickr_url), per_page=100
+        )
+    )
+
+    assert len(photos) == 250
+    assert len({p["url"] for p in photos}) == 250
+    assert [c["page"] for c in fake_flickr.calls_to(api_method)] == ["1", "2", "3"]
+
+    # Any lookups for the user or group only happen once, not once per page
+    assert len(fake_flickr.calls_to("flickr.urls.lookupUser")) <= 1
+    assert len(fake_flickr.calls_to("flickr.urls.lookupGroup")) <= 1
+
+
+def test_iter_photos_only_fetches_pages_as_needed(fake_flickr: FakeFlickr) -> None:
+    """
+    Pages are fetched lazily, so if you stop iterating we don't fetch
+    the remaining pages.
+    """
+    fake_flickr.add_tag("sunset", count_photos=1000)
+
+    photos = iter_photos_from_flickr_url(
+        fake_flickr.api,
+        parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+        per_page=10,
+    )
+
+    assert len(list(itertools.islice(photos, 15))) == 15
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 2
+
+
+def test_iter_photos_in_empty_photostream(fake_flickr: FakeFlickr) -> None:
+    """
+    If a user doesn't have any public photos, we don't yield anything.
+    """
+    fake_flickr.add_user(make_owner(1), count_photos=0)
+
+    photos = iter_photos_from_flickr_url(
+        fake_flickr.api, parse_flickr_url("https://www.flickr.com/photos/user1/")
+    )
+
+    assert list(photos) == []
+
+
+def test_iter_photos_from_single_photo(flickr_api: FlickrApi) -> None:
+    """
+    Iterating over a single photo URL yields exactly one photo.
+    """
+    photos = list(
+        iter_photos_from_flickr_url(
+            flickr_api,
+            parse_flickr_url("https://www.flickr.com/photos/sdasmarchives/50567413447"),
+        )
+    )
+
+    assert len(photos) == 1
+    assert (
+        photos[0]["url"] == "https://www.flickr.com/photos/sdasmarchives/50567413447/"
+    )
+
+
+@pytest.mark.parametrize(
+    "flickr_url",
+    [
+        pytest.param(
+            "https://www.flickr.com/photos/user1/albums/72157640898611483",
+            id="missing_album",
+        ),
+        pytest.param("https://www.flickr.com/photos/doesnotexist/", id="missing_user"),
+        pytest.param(
+            "https://www.flickr.com/photos/12345678@N01/", id="missing_user_id"
+        ),
+        pytest.param(
+            "https://www.flickr.com/photos/george/galleries/72157677773252346/",
+            id="missing_gallery",
+        ),
+        pytest.param("https://www.flickr.com/groups/doesnotexist/", id="missing_group"),
+    ],
+)
+def test_iter_photos_from_missing_collection_is_error(
+    fake_flickr: FakeFlickr, flickr_url: str
+) -> None:
+    """
+    If the collection doesn't exist, we get a ResourceNotFound error.
+    """
+    fake_flickr.add_user(make_owner(1), count_photos=10)
+    fake_flickr.add_user(make_owner(2), count_photos=10)
+    fake_flickr.add_group(
+        "1234@N01", url="https://www.flickr.com/groups/geologists", count_photos=10
+    )
+
+    with pytest.raises(ResourceNotFound):
+        list(iter_photos_from_flickr_url(fake_flickr.api, parse_flickr_url(flickr_url)))
+
+
+def test_get_photos_in_album(fake_flickr: FakeFlickr) -> None:
+    """
+    Get a single page of photos from an album.
+    """
+    owner = make_owner(1)
+    fake_flickr.add_album("72157640898611483", owner=owner, count_photos=25)
+
+    photos = get_photos_in_album(
+        fake_flickr.api, album_id="72157640898611483", user_id=owner["user_id"]
+    )
+
+    assert photos["album"]["title"] == "Album 72157640898611483"
+    assert photos["count_pages"] == 3
+    assert photos["count_photos"] == 25
+    assert len(photos["photos"]) == 10
+
+
+def test_get_photos_in_group_pool(fake_flickr: FakeFlickr) -> None:
+    """
+    Get a single page of photos from a group pool.
+    """
+    fake_flickr.add_group(
+        "1234@N01", url="https://www.flickr.com/groups/geologists", count_photos=25
+    )
+
+    photos = get_photos_in_group_pool(
+        fake_flickr.api, group_url="https://www.flickr.com/groups/geologists"
+    )
+
+    assert photos["group"] == {"id": "1234@N01", "name": "Group 1234@N01"}
+    assert photos["count_pages"] == 3
+    assert len(photos["photos"]) == 10
+
+
+class TestConcurrentPageFetching:
+    def test_yields_photos_in_page_order(self, fake_flickr: FakeFlickr) -> None:
+        """
+        Fetching pages concurrently gives the same photos in the same order
+        as fetching them one at a time.
+        """
+        fake_flickr.add_tag("sunset", count_photos=95)
+        parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+        sequential = list(
+            iter_photos_from_flickr_url(fake_flickr.api, parsed_url, per_page=10)
+        )
+        concurrent = list(
+            iter_photos_from_flickr_url(
+                fake_flickr.api, parsed_url, per_page=10, concurrency=4
+            )
+        )
+
+        assert len(concurrent) == 95
+        assert concurrent == sequential
+
+    def test_fetches_pages_in_parallel(self, fake_flickr: FakeFlickr) -> None:
+        """
+        Pages are fetched in parallel, but there are never more than
+        ``concurrency`` requests in flight at once.
+        """
+        fake_flickr.add_tag("sunset", count_photos=200)
+
+        lock = threading.Lock()
+        active = 0
+        max_active = 0
+
+        def slow_handler(request: httpx.Request) -> httpx.Response:
+            nonlocal active, max_active
+
+            with lock:
+                active += 1
+                max_active = max(max_active, active)
+
+            time.sleep(0.02)
+            resp = fake_flickr.handle_request(request)
+
+            with lock:
+                active -= 1
+
+            return resp
+
+        api = FlickrApi(
+            client=httpx.Client(transport=httpx.MockTransport(slow_handler))
+        )
+
+        photos = list(
+            iter_photos_from_flickr_url(
+                api,
+                parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+                per_page=10,
+                concurrency=4,
+            )
+        )
+
+        assert len(photos) == 200
+        assert 1 < max_active <= 4
+
+    def test_stops_fetching_if_you_stop_iterating(
+        self, fake_flickr: FakeFlickr
+    ) -> None:
+        """
+        If the caller stops early, we don't fetch every remaining page.
+        """
+        fake_flickr.add_tag("sunset", count_photos=1000)
+
+        photos = iter_photos_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+            per_page=10,
+            concurrency=4,
+        )
+
+        assert len(list(itertools.islice(photos, 15))) == 15
+        assert len(fake_flickr.calls_to("flickr.photos.search")) <= 1 + 4 + 1
+
+    def test_stops_at_an_empty_page(self, fake_flickr: FakeFlickr) -> None:
+        """
+        If a page comes back empty, we stop, even if the first page
+        told us there'd be more.
+        """
+        fake_flickr.add_tag("sunset", count_photos=30)
+
+        photos = iter_photos_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+            per_page=10,
+            concurrency=2,
+        )
+
+        assert next(photos)["title"] is None
+
+        # Remove photos from the tag after we've fetched the first page --
+        # this mimics the inconsistent page counts of big tag searches.
+        # The second page is now empty, so we stop there.
+        del fake_flickr.tags["sunset"][10:]
+
+        assert len(list(photos)) == 9
+
+
+def photo_id(photo: Photo) -> str:
+    """
+    Returns the ID of a photo, from its URL.
+    """
+    return photo["url"].rstrip("/").split("/")[-1]
+
+
+class TestGetPagesFromFlickrUrl:
+    def test_later_pages_are_fetched_lazily(self, fake_flickr: FakeFlickr) -> None:
+        """
+        Only the first page is fetched up front; the later pages are
+        fetched as we iterate over the photos.
+        """
+        fake_flickr.add_tag("sunset", count_photos=250)
+
+        photo_data, photos = get_pages_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+            count_pages=2,
+        )
+
+        assert photo_data["count_photos"] == 250  # type: ignore[typeddict-item]
+        assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+        assert len(list(photos)) == 200
+        assert [c["page"] for c in fake_flickr.calls_to("flickr.photos.search")] == [
+            "1",
+            "2",
+        ]
+
+    def test_starts_from_the_page_in_the_url(self, fake_flickr: FakeFlickr) -> None:
+        """
+        If the URL points to a later page, we start from that page and
+        stop at the end of the collection.
+        """
+        fake_flickr.add_tag("sunset", count_photos=250)
+
+        _, photos = get_pages_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/page2"),
+            count_pages=5,
+        )
+
+        assert len(list(photos)) == 150
+        assert [c["page"] for c in fake_flickr.calls_to("flickr.photos.search")] == [
+            "2",
+            "3",
+        ]
+
+    def test_stops_at_an_empty_page(self, fake_flickr: FakeFlickr) -> None:
+        """
+        If a later page comes back empty, we stop there.
+        """
+        fake_flickr.add_tag("sunset", count_photos=30)
+
+        _, photos = get_pages_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+            count_pages=3,
+            per_page=10,
+        )
+
+        assert next(photos)["title"] is None
+        del fake_flickr.tags["sunset"][10:]
+
+        assert len(list(photos)) == 9
+        assert len(fake_flickr.calls_to("flickr.photos.search")) == 2
+
+    def test_later_pages_are_fetched_in_as_few_calls_as_possible(
+        self, fake_flickr: FakeFlickr
+    ) -> None:
+        fake_flickr.add_tag("sunset", count_photos=1000)
+
+        _, photos = get_pages_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+            count_pages=10,
+        )
+
+        assert [photo_id(p) for p in photos] == [
+            p["id"] for p in fake_flickr.tags["sunset"]
+        ]
+        assert [
+            (c["page"], c["per_page"])
+            for c in fake_flickr.calls_to("flickr.photos.search")
+        ] == [("1", "100"), ("1", "500"), ("2", "500")]
+
+    def test_smaller_first_page_matches_flickr_pages(
+        self, fake_flickr: FakeFlickr
+    ) -> None:
+        """
+        If we ask for a smaller first page, the page in the URL still
+        starts at the same photo as it does on Flickr.com, and the page
+        count is in Flickr.com pages.
+        """
+        fake_flickr.add_tag("sunset", count_photos=250)
+
+        photo_data, photos = get_pages_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/page2"),
+            count_pages=1,
+            per_page=25,
+        )
+
+        assert photo_data["count_pages"] == 3  # type: ignore[typeddict-item]
+        assert [photo_id(p) for p in photos] == [
+            p["id"] for p in fake_flickr.tags["sunset"][100:200]
+        ]
+        assert [
+            (c["page"], c["per_page"])
+            for c in fake_flickr.calls_to("flickr.photos.search")
+        ] == [("5", "25"), ("2", "100")]
+
+    def test_single_photo(self, flickr_api: FlickrApi) -> None:
+        """
+        A single photo URL gives us that photo, both as the photo data
+        and the only photo in the iterator.
+        """
+        photo_data, photos = get_pages_from_flickr_url(
+            flickr_api,
+            parse_flickr_url("https://www.flickr.com/photos/sdasmarchives/50567413447"),
+            count_pages=3,
+        )
+
+        assert list(photos) == [photo_data]
+
+
+def test_get_photos_from_single_photo_url(flickr_api: FlickrApi) -> None:
+    """
+    Looking up a single photo URL gives us that photo.
+    """
+    photo = get_photos_from_flickr_url(
+        flickr_api,
+        parse_flickr_url("https://www.flickr.com/photos/sdasmarchives/50567413447"),
+    )
+
+    assert photo["url"] == "https://www.flickr.com/photos/sdasmarchives/50567413447/"  # type: ignore[typeddict-item]
+
+
+def parse_page(api: FlickrApi, xml: str, *, streaming: bool) -> list[Photo]:
+    """
+    Parse a page of a collection response with either of our parsers.
+    """
+    if streaming:
+        return list(iterparse_collection(api, [xml.encode("utf8")])["photos"])
+    else:
+        return _create_collection(api, ET.fromstring(xml), size_profile="medium-only")[
+            "photos"
+        ]
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+class TestParsingCollections:
+    def test_owners_are_only_created_once_per_page(
+        self,
+        fake_flickr: FakeFlickr,
+        monkeypatch: pytest.MonkeyPatch,
+        streaming: bool,
+    ) -> None:
+        """
+        If the same owner appears on lots of photos, we only create
+        the ``User`` once.
+        """
+        owners = [make_owner(n) for n in range(5)]
+        xml = render_collection(
+            "photos", {"pages": "1", "total": "100"}, make_photos(100, owners)
+        )
+
+        calls_to_create_user = 0
+
+        def counting_create_user(**kwargs: typing.Any) -> User:
+            nonlocal calls_to_create_user
+            calls_to_create_user += 1
+            return create_user(**kwargs)
+
+        monkeypatch.setattr("flinumeratr.flickr_api.create_user", counting_create_user)
+
+        photos = parse_page(fake_flickr.api, xml, streaming=streaming)
+
+        assert len(photos) == 100
+        assert calls_to_create_user == 5
+        assert {(p["owner_name"], p["owner_url"]) for p in photos} == {
+            (o["realname"], f"https://www.flickr.com/people/{o['path_alias']}/")
+            for o in owners
+        }
+
+    def test_licenses_are_looked_up_in_a_table(
+        self,
+        fake_flickr: FakeFlickr,
+        monkeypatch: pytest.MonkeyPatch,
+        streaming: bool,
+    ) -> None:
+        api = fake_flickr.api
+        xml = render_collection(
+            "photos",
+            {"pages": "1", "total": "22"},
+            make_photos(22, [make_owner(1)]),
+        )
+
+        lookup_license_by_id = mock.Mock(wraps=api.lookup_license_by_id)
+        monkeypatch.setattr(api, "lookup_license_by_id", lookup_license_by_id)
+
+        photos = parse_page(api, xml, streaming=streaming)
+
+        lookup_license_by_id.assert_not_called()
+
+        assert {p["license"]["id"] for p in photos} == {
+            lic["id"] for lic in api.get_licenses().values()
+        }
+
+    def test_unrecognised_license_is_error(
+        self, fake_flickr: FakeFlickr, streaming: bool
+    ) -> None:
+        xml = render_collection(
+            "photos",
+            {"pages": "1", "total": "1"},
+            [{**make_photo_attrs(1, owner=make_owner(1)), "license": "999"}],
+        )
+
+        with pytest.raises(LicenseNotFound):
+            parse_page(fake_flickr.api, xml, streaming=streaming)
+
+
+@pytest.mark.parametrize(
+    ["start", "stop", "expected"],
+    [
+        (0, 100, [{"page": 1, "per_page": 100, "skip": 0}]),
+        (100, 200, [{"page": 2, "per_page": 100, "skip": 0}]),
+        (100, 300, [{"page": 1, "per_page": 300, "skip": 100}]),
+        (
+            100,
+            1000,
+            [
+                {"page": 1, "per_page": 500, "skip": 100},
+                {"page": 2, "per_page": 500, "skip": 0},
+            ],
+        ),
+        (500, 500, []),
+    ],
+)
+def test_plan_page_requests(start: int, stop: int, expected: list[PageRequest]) -> None:
+    assert plan_page_requests(start, stop) == expected
+
+
+@pytest.mark.parametrize(
+    ["flickr_page", "per_page", "expected"],
+    [
+        (3, 100, {"page": 3, "per_page": 100, "skip": 0}),
+        (3, 50, {"page": 5, "per_page": 50, "skip": 0}),
+        (3, 30, {"page": 7, "per_page": 30, "skip": 20}),
+        (1, 500, {"page": 1, "per_page": 500, "skip": 0}),
+        (3, 500, {"page": 1, "per_page": 500, "skip": 200}),
+        (6, 500, {"page": 2, "per_page": 500, "skip": 0}),
+    ],
+)
+def test_first_api_page(flickr_page: int, per_page: int, expected: PageRequest) -> None:
+    assert first_api_page(flickr_page, per_page=per_page) == expected
+
+
+@pytest.mark.parametrize("page", [1, 3])
+def test_get_photos_in_bulk(fake_flickr: FakeFlickr, page: int) -> None:
+    """
+    We can ask for photos with the bulk page size, which is bigger
+    than a Flickr.com page.
+    """
+    fake_flickr.add_tag("sunset", count_photos=1000)
+    parsed_url = parse_flickr_url(
+        f"https://www.flickr.com/photos/tags/sunset/page{page}"
+    )
+
+    photo_data = get_photos_from_flickr_url(
+        fake_flickr.api, parsed_url, per_page=PER_PAGE["bulk"]
+    )
+    all_photos = list(
+        iter_photos_from_flickr_url(
+            fake_flickr.api, with_page(parsed_url, 1), per_page=100
+        )
+    )
+
+    assert photo_data["photos"] == all_photos[(page - 1) * 100 : 500]  # type: ignore[typeddict-item]
+
+    _, photos = get_pages_from_flickr_url(
+        fake_flickr.api, parsed_url, count_pages=4, per_page=PER_PAGE["bulk"]
+    )
+
+    assert list(photos) == all_photos[(page - 1) * 100 : (page + 3) * 100]
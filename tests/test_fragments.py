@@ -0,0 +1,173 @@
+"""
+Tests for `flinumeratr.fragments`.
+"""
+
+from collections.abc import Iterator
+
+from flask import Flask, render_template
+from flickr_url_parser import parse_flickr_url
+from markupsafe import Markup
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.compact import PhotoInterner
+from flinumeratr.flickr_api import iter_photos_from_flickr_url
+from flinumeratr.fragments import (
+    FragmentCache,
+    FragmentKey,
+    fragment_cache,
+    fragment_key,
+)
+from flinumeratr.metrics import CACHE_REQUESTS
+from flinumeratr.models import Photo
+
+
+@pytest.fixture(autouse=True)
+def empty_cache() -> Iterator[None]:
+    """
+    Empty the fragment cache and clear the metrics before each test.
+    """
+    fragment_cache.clear()
+    CACHE_REQUESTS.values.clear()
+
+    yield
+
+    fragment_cache.clear()
+
+
+@pytest.fixture
+def photos(fake_flickr: FakeFlickr) -> list[Photo]:
+    """
+    Returns some photos to render.
+    """
+    fake_flickr.add_tag("sunset", count_photos=10)
+
+    return list(
+        iter_photos_from_flickr_url(
+            fake_flickr.api,
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+        )
+    )
+
+
+def render_photos(photos: list[Photo], url_type: str = "tag") -> str:
+    """
+    Render the /see_photos template with these photos.
+    """
+    return render_template(
+        "see_photos.html",
+        parsed_url={"type": url_type},
+        photo_data={"photos": photos, "count_photos": len(photos)},
+        photos=photos,
+    )
+
+
+def key(name: str) -> FragmentKey:
+    return (name, "", "", "", (), None, "", "", None, None, "")  # type: ignore[return-value]
+
+
+class TestFragmentCache:
+    def test_renders_each_fragment_once(self) -> None:
+        cache = FragmentCache()
+        calls = []
+
+        def render() -> Markup:
+            calls.append(1)
+            return Markup("<li>1</li>")
+
+        assert cache.get_or_render(key("1"), render) == "<li>1</li>"
+        assert cache.get_or_render(key("1"), render) == "<li>1</li>"
+        assert len(calls) == 1
+
+    def test_evicts_the_least_recently_used_fragment(self) -> None:
+        cache = FragmentCache(max_size=2)
+
+        cache.get_or_render(key("1"), lambda: Markup("1"))
+        cache.get_or_render(key("2"), lambda: Markup("2"))
+        cache.get_or_render(key("1"), lambda: Markup("1"))
+        cache.get_or_render(key("3"), lambda: Markup("3"))
+
+        assert len(cache) == 2
+        assert cache.get_or_render(key("1"), lambda: Markup("new")) == "1"
+        assert cache.get_or_render(key("2"), lambda: Markup("new")) == "new"
+
+
+def test_repeat_renders_use_the_cache(app: Flask, photos: list[Photo]) -> None:
+    with app.test_request_context():
+        first = render_photos(photos)
+        second = render_photos(photos)
+
+    assert first == second
+    assert first.count('<a class="photo"') == 10
+    assert CACHE_REQUESTS.values == {
+        (("cache", "fragment"), ("result", "hit")): 10,
+        (("cache", "fragment"), ("result", "miss")): 10,
+    }
+
+
+def test_changed_photos_are_rendered_again(app: Flask, photos: list[Photo]) -> None:
+    with app.test_request_context():
+        render_photos(photos)
+
+        photos[0]["title"] = "A brand new title"
+        html = render_photos(photos)
+
+    assert "A brand new title" in html
+    assert CACHE_REQUESTS.values[(("cache", "fragment"), ("result", "miss"))] == 11
+
+
+def test_fragments_depend_on_the_url_type(app: Flask, photos: list[Photo]) -> None:
+    """
+    We only show the owner of each photo if the URL isn't about
+    a single owner, so the same photo has different fragments.
+    """
+    with app.test_request_context():
+        tag_html = render_photos(photos, url_type="tag")
+        user_html = render_photos(photos, url_type="user")
+
+    assert tag_html.count('class="owner"') == 10
+    assert user_html.count('class="owner"') == 0
+
+
+def test_fragments_depend_on_the_script_root(app: Flask, photos: list[Photo]) -> None:
+    with app.test_request_context():
+        render_photos(photos)
+
+    with app.test_request_context(base_url="http://localhost/tools/flinumeratr/"):
+        html = render_photos(photos)
+
+    assert html.count('href="/tools/flinumeratr/see_photos?') == 10
+
+
+def test_cache_is_skipped_when_reloading_templates(
+    app: Flask, photos: list[Photo], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(app.jinja_env, "auto_reload", True)
+
+    with app.test_request_context():
+        render_photos(photos)
+
+    assert len(fragment_cache) == 0
+    assert CACHE_REQUESTS.values == {}
+
+
+def test_compact_photos_have_the_same_key(app: Flask, photos: list[Photo]) -> None:
+    compact = list(PhotoInterner().compact_all(photos))
+
+    with app.test_request_context():
+        assert [fragment_key(p, "tag") for p in photos] == [
+            fragment_key(c, "tag") for c in compact
+        ]
+
+
+def test_photos_without_a_date_taken(app: Flask, fake_flickr: FakeFlickr) -> None:
+    fake_flickr.add_user(make_owner(1), count_photos=1)
+    photo = next(
+        iter_photos_from_flickr_url(
+            fake_flickr.api, parse_flickr_url("https://www.flickr.com/photos/user1/")
+        )
+    )
+    photo["date_taken"] = None
+
+    with app.test_request_context():
+        assert fragment_key(photo, "user")[8] is None
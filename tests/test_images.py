@@ -0,0 +1,406 @@
+"""
+Tests for `flinumeratr.images` and the /images endpoint.
+
+These tests fetch images from a stand-in for ``live.staticflickr.com``,
+which is a real HTTP server running in a background thread.
+"""
+
+from collections.abc import Iterator
+import http.server
+import os
+import pathlib
+import threading
+
+from flask import Flask
+from flask.testing import FlaskClient
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.fragments import fragment_cache
+from flinumeratr.images import CACHE_CONTROL, ImageProxy, get_image_proxy
+from flinumeratr.metrics import CACHE_REQUESTS
+
+
+class ImageServer(http.server.ThreadingHTTPServer):
+    """
+    A stand-in for ``live.staticflickr.com``, which serves the images
+    in ``self.images`` and records the path of every request.
+
+    Images in ``self.without_length`` are sent without a Content-Length
+    header, so the end of the image is when the server closes the
+    connection.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(("127.0.0.1", 0), ImageRequestHandler)
+        self.images: dict[str, bytes] = {}
+        self.without_length: set[str] = set()
+        self.requests: list[str] = []
+
+    @property
+    def url(self) -> str:
+        """
+        The base URL of the server.
+        """
+        return f"http://127.0.0.1:{self.server_port}"
+
+
+class ImageRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles requests to the stand-in image server.
+    """
+
+    server: ImageServer
+
+    def do_GET(self) -> None:
+        """
+        Serve an image, or an error if the path starts with a status code.
+        """
+        self.server.requests.append(self.path)
+
+        if self.path.startswith("/500"):
+            self.send_error(500)
+            return
+
+        try:
+            body = self.server.images[self.path]
+        except KeyError:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        if self.path not in self.server.without_length:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        """
+        Don't log requests to stderr.
+        """
+        pass
+
+
+@pytest.fixture
+def image_server() -> Iterator[ImageServer]:
+    """
+    Runs a stand-in image server in a background thread.
+    """
+    server = ImageServer()
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture
+def image_proxy(
+    app: Flask,
+    image_server: ImageServer,
+    tmp_path: pathlib.Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> Iterator[ImageProxy]:
+    """
+    Enables the image proxy, with images from the stand-in server.
+    """
+    proxy = ImageProxy(path=str(tmp_path), upstream_url=image_server.url)
+    monkeypatch.setattr("flinumeratr.app.image_proxy", proxy)
+    CACHE_REQUESTS.values.clear()
+
+    yield proxy
+
+    proxy.client.close()
+
+
+@pytest.fixture
+def client(app: Flask) -> FlaskClient:
+    """
+    A test client for the app, which doesn't need any cassettes.
+    """
+    return app.test_client()
+
+
+JPEG = b"\xff\xd8\xff\xe0" + b"x" * 200_000
+IMAGE_PATH = "65535/50000000001_abcdef1234_b.jpg"
+
+
+def get_image(client: FlaskClient, image_path: str) -> bytes:
+    """
+    Fetch an image through the proxy, and read all of it.
+    """
+    resp = client.get(f"/images/{image_path}")
+    assert resp.status_code == 200
+
+    data = resp.get_data()
+    resp.close()
+
+    return data
+
+
+def cached_images(proxy: ImageProxy) -> list[str]:
+    """
+    Returns the names of the files in the cache.
+    """
+    return sorted(os.listdir(proxy.path))
+
+
+def test_image_is_fetched_and_cached(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    image_server.images[f"/{IMAGE_PATH}"] = JPEG
+
+    first = client.get(f"/images/{IMAGE_PATH}")
+    assert first.status_code == 200
+    assert first.is_streamed
+    assert first.data == JPEG
+
+    second = client.get(f"/images/{IMAGE_PATH}")
+    assert second.status_code == 200
+    assert second.data == JPEG
+    second.close()
+
+    for resp in (first, second):
+        assert resp.headers["Content-Type"] == "image/jpeg"
+        assert resp.headers["Content-Length"] == str(len(JPEG))
+        assert resp.headers["Cache-Control"] == CACHE_CONTROL
+
+    assert image_server.requests == [f"/{IMAGE_PATH}"]
+    assert cached_images(image_proxy) == [
+        os.path.basename(image_proxy.cache_path(IMAGE_PATH))
+    ]
+    assert CACHE_REQUESTS.values == {
+        (("cache", "image"), ("result", "hit")): 1,
+        (("cache", "image"), ("result", "miss")): 1,
+    }
+
+
+def test_image_is_streamed_in_chunks(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    image_server.images[f"/{IMAGE_PATH}"] = JPEG
+
+    resp = client.get(f"/images/{IMAGE_PATH}", buffered=False)
+    chunks = list(resp.iter_encoded())
+    resp.close()
+
+    assert len(chunks) > 1
+    assert b"".join(chunks) == JPEG
+
+
+def test_image_without_a_content_length(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    image_server.images[f"/{IMAGE_PATH}"] = JPEG
+    image_server.without_length.add(f"/{IMAGE_PATH}")
+
+    resp = client.get(f"/images/{IMAGE_PATH}")
+
+    assert resp.data == JPEG
+    assert "Content-Length" not in resp.headers
+
+
+def test_partly_read_image_is_not_cached(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    """
+    If the browser goes away before we've sent the whole image, we
+    don't keep the partial image in the cache.
+    """
+    image_server.images[f"/{IMAGE_PATH}"] = JPEG
+
+    resp = client.get(f"/images/{IMAGE_PATH}", buffered=False)
+    next(iter(resp.response))
+    resp.close()
+
+    assert cached_images(image_proxy) == []
+
+
+def test_unread_image_closes_the_upstream_connection(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    image_server.images[f"/{IMAGE_PATH}"] = JPEG
+
+    resp = client.head(f"/images/{IMAGE_PATH}")
+
+    assert resp.status_code == 200
+    assert resp.data == b""
+    assert cached_images(image_proxy) == []
+
+
+def test_missing_image_is_not_found(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    resp = client.get(f"/images/{IMAGE_PATH}")
+
+    assert resp.status_code == 404
+    assert cached_images(image_proxy) == []
+
+
+def test_upstream_error_is_bad_gateway(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    resp = client.get("/images/500/50000000001_abcdef1234_b.jpg")
+
+    assert resp.status_code == 502
+    assert cached_images(image_proxy) == []
+
+
+def test_unreachable_upstream_is_bad_gateway(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    image_server.shutdown()
+    image_server.server_close()
+
+    resp = client.get(f"/images/{IMAGE_PATH}")
+
+    assert resp.status_code == 502
+
+
+@pytest.mark.parametrize(
+    "image_path",
+    [
+        "65535/50000000001_abcdef1234_b.html",
+        "65535/../../etc/passwd",
+        "services/rest/",
+    ],
+)
+def test_only_flickr_images_are_proxied(
+    client: FlaskClient,
+    image_server: ImageServer,
+    image_proxy: ImageProxy,
+    image_path: str,
+) -> None:
+    resp = client.get(f"/images/{image_path}")
+
+    assert resp.status_code == 404
+    assert image_server.requests == []
+
+
+def test_proxy_is_disabled_by_default(client: FlaskClient) -> None:
+    resp = client.get(f"/images/{IMAGE_PATH}")
+
+    assert resp.status_code == 404
+
+
+def test_least_recently_used_images_are_evicted(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    image_proxy.max_bytes = 3 * len(JPEG)
+
+    paths = [f"65535/5000000000{i}_abcdef1234_b.jpg" for i in range(4)]
+
+    for p in paths:
+        image_server.images[f"/{p}"] = JPEG
+
+    # Fetch three images, which fills the cache, then look at the
+    # first image again, so the second image is the least recently used.
+    for p in paths[:3]:
+        assert get_image(client, p) == JPEG
+
+    assert get_image(client, paths[0]) == JPEG
+
+    # Now fetch a fourth image, which pushes the second and third
+    # images out of the cache -- we trim to below the low water mark.
+    assert get_image(client, paths[3]) == JPEG
+
+    assert cached_images(image_proxy) == sorted(
+        os.path.basename(image_proxy.cache_path(p)) for p in (paths[0], paths[3])
+    )
+
+
+def test_image_bigger_than_the_cache_is_not_kept(
+    client: FlaskClient, image_server: ImageServer, image_proxy: ImageProxy
+) -> None:
+    image_proxy.max_bytes = len(JPEG) // 2
+    image_server.images[f"/{IMAGE_PATH}"] = JPEG
+
+    assert get_image(client, IMAGE_PATH) == JPEG
+    assert cached_images(image_proxy) == []
+
+
+def test_cache_size_includes_existing_images(
+    image_server: ImageServer, tmp_path: pathlib.Path
+) -> None:
+    """
+    When we start, we count the images that are already in the cache,
+    but not any temporary files.
+    """
+    with open(os.path.join(tmp_path, "image"), "wb") as out_file:
+        out_file.write(JPEG)
+
+    with open(os.path.join(tmp_path, ".tmp-partial"), "wb") as out_file:
+        out_file.write(JPEG)
+
+    proxy = ImageProxy(path=str(tmp_path), upstream_url=image_server.url)
+
+    assert proxy._size_bytes == len(JPEG)
+
+
+def test_see_photos_uses_the_proxy(
+    app: Flask,
+    fake_flickr: FakeFlickr,
+    image_proxy: ImageProxy,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    fake_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", fake_api)
+    fake_flickr.add_tag("sunset", count_photos=1)
+
+    # The fake photos have image URLs on the real live.staticflickr.com.
+    image_proxy.upstream_url = "https://live.staticflickr.com"
+    fragment_cache.clear()
+
+    resp = app.test_client().get(
+        "/see_photos?flickr_url=https://www.flickr.com/photos/tags/sunset/"
+    )
+    html = resp.data.decode("utf8")
+    fragment_cache.clear()
+
+    assert '<img src="/images/65535/50000000000_abcdef1234.jpg"' in html
+    assert 'srcset="/images/65535/50000000000_abcdef1234_m.jpg 240w, ' in html
+    assert "live.staticflickr.com" not in html
+
+
+def test_other_images_are_not_proxied(app: Flask, image_proxy: ImageProxy) -> None:
+    from flinumeratr.app import proxied_image_url
+
+    with app.test_request_context():
+        assert proxied_image_url(f"{image_proxy.upstream_url}/{IMAGE_PATH}") == (
+            f"/images/{IMAGE_PATH}"
+        )
+        assert proxied_image_url("https://example.com/cat.jpg") == (
+            "https://example.com/cat.jpg"
+        )
+
+
+def test_image_path(image_proxy: ImageProxy) -> None:
+    url = f"{image_proxy.upstream_url}/{IMAGE_PATH}"
+
+    assert image_proxy.image_path(url) == IMAGE_PATH
+    assert image_proxy.image_path(f"https://example.com/{IMAGE_PATH}") is None
+    assert image_proxy.image_path(f"{image_proxy.upstream_url}/favicon.ico") is None
+
+
+def test_content_type(image_proxy: ImageProxy) -> None:
+    assert image_proxy.content_type("1/2_ab.png") == "image/png"
+
+
+def test_get_image_proxy(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.delenv("FLINUMERATR_IMAGE_CACHE_PATH", raising=False)
+    assert get_image_proxy() is None
+
+    monkeypatch.setenv("FLINUMERATR_IMAGE_CACHE_PATH", str(tmp_path / "images"))
+    proxy = get_image_proxy()
+
+    assert proxy is not None
+    assert os.path.isdir(proxy.path)
+    proxy.client.close()
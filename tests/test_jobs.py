@@ -0,0 +1,696 @@
+"""
+Tests for `flinumeratr.jobs`, the /jobs endpoints and the
+``run-job-worker`` command.
+"""
+
+from datetime import datetime, timedelta, timezone
+import json
+import os
+from pathlib import Path
+import sqlite3
+import threading
+
+from flask import Flask
+from flask.testing import FlaskClient
+from flickr_api import FlickrApi
+from flickr_url_parser import ParseResult, parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr import flickr_api
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.export import ExportFormat
+from flinumeratr.flickr_api import StreamingPageFetcher, iter_photos_from_flickr_url
+from flinumeratr.jobs import (
+    Job,
+    JobQueue,
+    LeaseLost,
+    estimate_seconds_remaining,
+    get_job_queue,
+    run_next_job,
+    run_worker,
+)
+from flinumeratr.models import Photo, StreamedCollection
+from flinumeratr.ratelimit import RateBudget, RateLimitExceeded
+
+
+user_url = "https://www.flickr.com/photos/user1/"
+
+
+@pytest.fixture
+def queue(tmp_path: Path) -> JobQueue:
+    """
+    Returns a job queue in a temporary directory.
+    """
+    return JobQueue(path=str(tmp_path / "jobs"))
+
+
+@pytest.fixture
+def api(fake_flickr: FakeFlickr) -> CachingFlickrApi:
+    """
+    Returns an API client for a user with three pages of photos.
+    """
+    fake_flickr.add_user(make_owner(1), count_photos=1200)
+
+    return CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+
+
+def submit(
+    queue: JobQueue, flickr_url: str = user_url, format: ExportFormat = "jsonl"
+) -> Job:
+    """
+    Submit a job, and return it.
+    """
+    job_id = queue.submit(flickr_url, parse_flickr_url(flickr_url), format=format)
+    job = queue.get(job_id)
+    assert job is not None
+    return job
+
+
+class TestJobQueue:
+    def test_submitted_jobs_are_queued(self, queue: JobQueue) -> None:
+        job = submit(queue)
+
+        assert job["state"] == "queued"
+        assert job["parsed_url"] == parse_flickr_url(user_url)
+        assert job["started_at"] is None
+        assert job["count_pages"] is None
+
+    def test_unknown_job_is_none(self, queue: JobQueue) -> None:
+        assert queue.get("doesnotexist") is None
+
+    def test_claims_the_oldest_job(self, queue: JobQueue) -> None:
+        job1 = submit(queue)
+        job2 = submit(queue)
+
+        claimed = [queue.claim(), queue.claim(), queue.claim()]
+
+        assert [j and j["id"] for j in claimed] == [job1["id"], job2["id"], None]
+        assert claimed[0] is not None
+        assert claimed[0]["state"] == "running"
+        assert claimed[0]["attempts"] == 1
+
+    def test_jobs_survive_a_restart(self, queue: JobQueue) -> None:
+        job = submit(queue)
+
+        claimed = JobQueue(path=queue.path).claim()
+
+        assert claimed is not None
+        assert claimed["id"] == job["id"]
+
+    def test_expired_leases_are_reclaimed(
+        self, queue: JobQueue, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        submit(queue)
+        job = queue.claim()
+        assert job is not None
+        queue.update_progress(job, pages_done=2, count_pages=3, count_photos=20)
+
+        monkeypatch.setattr("flinumeratr.jobs.LEASE_SECONDS", -1)
+        claimed = queue.claim()
+
+        assert claimed is not None
+        assert claimed["id"] == job["id"]
+        assert claimed["attempts"] == 2
+        assert claimed["pages_done"] == 0
+
+    def test_gives_up_after_too_many_attempts(
+        self, queue: JobQueue, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        job = submit(queue)
+        monkeypatch.setattr("flinumeratr.jobs.LEASE_SECONDS", -1)
+
+        for _ in range(3):
+            assert queue.claim() is not None
+
+        assert queue.claim() is None
+
+        failed = queue.get(job["id"])
+        assert failed is not None
+        assert failed["state"] == "failed"
+        assert failed["error"] == "Gave up after 3 attempts"
+
+    def test_released_jobs_are_queued_again(self, queue: JobQueue) -> None:
+        submit(queue)
+        job = queue.claim()
+        assert job is not None
+        queue.update_progress(job, pages_done=2, count_pages=3, count_photos=20)
+        queue.release(job)
+
+        claimed = queue.claim()
+
+        assert claimed is not None
+        assert claimed["attempts"] == 1
+        assert claimed["not_before"] is None
+        assert (claimed["pages_done"], claimed["count_photos"]) == (2, 20)
+
+    def test_released_jobs_can_be_delayed(self, queue: JobQueue) -> None:
+        submit(queue)
+        job = queue.claim()
+        assert job is not None
+        queue.release(job, delay=60)
+
+        assert queue.claim() is None
+
+        released = queue.get(job["id"])
+        assert released is not None
+        assert released["not_before"] is not None
+        delay = released["not_before"] - datetime.now(tz=timezone.utc)
+        assert delay.total_seconds() == pytest.approx(60, abs=5)
+
+    def test_deletes_old_jobs(self, queue: JobQueue) -> None:
+        """
+        Finished jobs are deleted along with their results, and any
+        files left by workers that died, but unfinished jobs are kept.
+        """
+        queued = [submit(queue) for _ in range(3)][-1]
+        done, failed = queue.claim(), queue.claim()
+        assert done is not None and failed is not None
+        queue.finish(done)
+        queue.fail(failed, error="boom")
+
+        for name in [
+            f"{done['id']}.jsonl",
+            f"{done['id']}.jsonl.1234.tmp",
+            f"{queued['id']}.jsonl.partial",
+        ]:
+            Path(queue.results_dir, name).touch()
+
+        assert queue.delete_old_jobs(max_age=60) == []
+        assert sorted(queue.delete_old_jobs(max_age=-1)) == sorted(
+            [done["id"], failed["id"]]
+        )
+
+        assert queue.get(done["id"]) is None
+        assert queue.get(failed["id"]) is None
+        assert queue.get(queued["id"]) == queued
+        assert os.listdir(queue.results_dir) == [f"{queued['id']}.jsonl.partial"]
+
+    def test_every_claim_gets_a_new_lease(
+        self, queue: JobQueue, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        job = submit(queue)
+        assert job["lease"] is None
+
+        monkeypatch.setattr("flinumeratr.jobs.LEASE_SECONDS", -1)
+        first = queue.claim()
+        second = queue.claim()
+
+        assert first is not None and second is not None
+        assert first["lease"] is not None
+        assert first["lease"] != second["lease"]
+
+    def test_workers_cant_update_a_job_theyve_lost(
+        self, queue: JobQueue, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """
+        If a worker's lease expires and another worker claims the job,
+        the first worker can't record progress, finish, fail or release
+        the job any more.
+        """
+        submit(queue)
+        stale = queue.claim()
+        assert stale is not None
+
+        monkeypatch.setattr("flinumeratr.jobs.LEASE_SECONDS", -1)
+        current = queue.claim()
+        assert current is not None
+
+        with pytest.raises(LeaseLost):
+            queue.update_progress(stale, pages_done=1, count_pages=3, count_photos=10)
+
+        with pytest.raises(LeaseLost):
+            queue.finish(stale)
+
+        with pytest.raises(LeaseLost):
+            queue.fail(stale, error="boom")
+
+        with pytest.raises(LeaseLost):
+            queue.release(stale)
+
+        assert queue.get(current["id"]) == current
+
+    def test_adds_new_columns_to_old_queues(self, tmp_path: Path) -> None:
+        os.makedirs(tmp_path / "jobs")
+
+        with sqlite3.connect(tmp_path / "jobs" / "jobs.db") as conn:
+            conn.execute("CREATE TABLE jobs(id TEXT PRIMARY KEY, attempts INTEGER)")
+
+        JobQueue(path=str(tmp_path / "jobs"))
+
+        with sqlite3.connect(tmp_path / "jobs" / "jobs.db") as conn:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+
+        assert {"lease", "not_before"} <= columns
+
+
+@pytest.mark.parametrize(
+    ["state", "pages_done", "expected"],
+    [
+        ("queued", 0, None),
+        ("running", 0, None),
+        ("running", 2, 80),
+        ("done", 10, None),
+    ],
+)
+def test_estimate_seconds_remaining(
+    queue: JobQueue, state: str, pages_done: int, expected: float | None
+) -> None:
+    started_at = datetime(2001, 2, 3, 4, 5, 6, tzinfo=timezone.utc)
+    job: Job = {
+        **submit(queue),
+        "state": state,  # type: ignore[typeddict-item]
+        "started_at": started_at,
+        "pages_done": pages_done,
+        "count_pages": 10,
+    }
+
+    now = started_at + timedelta(seconds=20)
+
+    assert estimate_seconds_remaining(job, now=now) == expected
+
+
+class TestRunNextJob:
+    def test_runs_a_job(self, queue: JobQueue, api: CachingFlickrApi) -> None:
+        job = submit(queue)
+
+        assert run_next_job(queue, api)
+
+        done = queue.get(job["id"])
+        assert done is not None
+        assert done["state"] == "done"
+        assert done["pages_done"] == 3
+        assert done["count_pages"] == 3
+        assert done["count_photos"] == 1200
+
+        with open(queue.result_path(done)) as in_file:
+            lines = in_file.readlines()
+
+        assert len(lines) == 1200
+        assert json.loads(lines[0])["url"].startswith(user_url)
+
+    def test_empty_queue(self, queue: JobQueue, api: CachingFlickrApi) -> None:
+        assert not run_next_job(queue, api)
+
+    def test_csv_of_a_single_photo(
+        self, queue: JobQueue, api: CachingFlickrApi, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        photo = next(iter_photos_from_flickr_url(api, parse_flickr_url(user_url)))
+
+        def get_single_photo(api: FlickrApi, parsed_url: ParseResult) -> list[Photo]:
+            return [photo]
+
+        monkeypatch.setattr(
+            "flinumeratr.jobs.iter_photos_from_flickr_url", get_single_photo
+        )
+
+        job = submit(queue, photo["url"], format="csv")
+        run_next_job(queue, api)
+
+        done = queue.get(job["id"])
+        assert done is not None
+        assert (done["pages_done"], done["count_photos"]) == (1, 1)
+
+        with open(queue.result_path(done)) as in_file:
+            assert in_file.read().splitlines()[1].startswith(photo["url"])
+
+    def test_missing_collection_fails(
+        self, queue: JobQueue, api: CachingFlickrApi
+    ) -> None:
+        job = submit(queue, "https://www.flickr.com/photos/nobody/")
+        run_next_job(queue, api)
+
+        failed = queue.get(job["id"])
+        assert failed is not None
+        assert failed["state"] == "failed"
+        assert failed["error"] == (
+            "Unable to find any photos at https://www.flickr.com/photos/nobody/"
+        )
+
+    def test_unexpected_errors_fail_the_job(
+        self, queue: JobQueue, api: CachingFlickrApi, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """
+        If a job fails halfway through, it's marked as failed, and we
+        don't leave a partial result behind.
+        """
+
+        def get_streaming_page_fetcher(
+            api: FlickrApi, parsed_url: ParseResult
+        ) -> StreamingPageFetcher:
+            fetch_page = flickr_api.get_streaming_page_fetcher(api, parsed_url)
+
+            def fetch_first_page(*, page: int, per_page: int) -> StreamedCollection:
+                if page > 1:
+                    raise ValueError("boom")
+
+                return fetch_page(page=page, per_page=per_page)
+
+            return fetch_first_page
+
+        monkeypatch.setattr(
+            "flinumeratr.jobs.get_streaming_page_fetcher", get_streaming_page_fetcher
+        )
+
+        job = submit(queue)
+        run_next_job(queue, api)
+
+        failed = queue.get(job["id"])
+        assert failed is not None
+        assert failed["state"] == "failed"
+        assert failed["pages_done"] == 1
+        assert failed["error"] == "ValueError: boom"
+        assert os.listdir(queue.results_dir) == []
+
+    def test_rate_limited_jobs_are_retried(
+        self, queue: JobQueue, api: CachingFlickrApi, tmp_path: Path
+    ) -> None:
+        api.rate_budget = RateBudget(
+            path=str(tmp_path / "cache.db"),
+            calls_per_hour=1,
+            burst=0,
+            deadlines={"interactive": 0, "bulk": 0},
+        )
+
+        job = submit(queue)
+        run_next_job(queue, api)
+
+        released = queue.get(job["id"])
+        assert released is not None
+        assert released["state"] == "queued"
+        assert released["attempts"] == 0
+
+        # We don't retry the job until the budget has another token,
+        # which at one call an hour is a long way off.
+        assert released["not_before"] is not None
+        assert released["not_before"] > datetime.now(tz=timezone.utc) + timedelta(
+            minutes=55
+        )
+        assert queue.claim() is None
+
+    @pytest.mark.parametrize("format", ["csv", "jsonl"])
+    def test_rate_limited_jobs_carry_on_where_they_stopped(
+        self,
+        queue: JobQueue,
+        api: CachingFlickrApi,
+        monkeypatch: pytest.MonkeyPatch,
+        format: ExportFormat,
+    ) -> None:
+        """
+        If a job runs out of API budget on the second page, it keeps the
+        first page, and only fetches the rest when it's retried.
+        """
+        fetched_pages = []
+
+        def get_streaming_page_fetcher(
+            api: FlickrApi, parsed_url: ParseResult
+        ) -> StreamingPageFetcher:
+            fetch_page = flickr_api.get_streaming_page_fetcher(api, parsed_url)
+
+            def fetch_or_run_out(*, page: int, per_page: int) -> StreamedCollection:
+                if page == 2 and 2 not in fetched_pages:
+                    fetched_pages.append(2)
+                    raise RateLimitExceeded("out of budget", retry_after=0)
+
+                fetched_pages.append(page)
+                return fetch_page(page=page, per_page=per_page)
+
+            return fetch_or_run_out
+
+        monkeypatch.setattr(
+            "flinumeratr.jobs.get_streaming_page_fetcher", get_streaming_page_fetcher
+        )
+
+        job = submit(queue, format=format)
+        run_next_job(queue, api)
+
+        released = queue.get(job["id"])
+        assert released is not None
+        assert released["state"] == "queued"
+        assert (released["pages_done"], released["count_photos"]) == (1, 500)
+
+        run_next_job(queue, api)
+
+        done = queue.get(job["id"])
+        assert done is not None
+        assert done["state"] == "done"
+        assert (done["pages_done"], done["count_photos"]) == (3, 1200)
+        assert fetched_pages == [1, 2, 2, 3]
+
+        with open(queue.result_path(done)) as in_file:
+            lines = in_file.read().splitlines()
+
+        if format == "csv":
+            assert lines.pop(0).startswith("url,")
+
+        assert len(lines) == len(set(lines)) == 1200
+        assert os.listdir(queue.results_dir) == [f"{job['id']}.{format}"]
+
+    def test_starts_again_if_the_saved_pages_are_missing(
+        self, queue: JobQueue, api: CachingFlickrApi
+    ) -> None:
+        submit(queue)
+        job = queue.claim()
+        assert job is not None
+        queue.update_progress(job, pages_done=2, count_pages=3, count_photos=1000)
+        queue.release(job)
+
+        assert run_next_job(queue, api)
+
+        done = queue.get(job["id"])
+        assert done is not None
+        assert (done["pages_done"], done["count_photos"]) == (3, 1200)
+
+        with open(queue.result_path(done)) as in_file:
+            assert len(in_file.readlines()) == 1200
+
+    def test_stops_if_another_worker_claims_the_job(
+        self, queue: JobQueue, api: CachingFlickrApi, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """
+        If a worker stalls for so long that another worker claims its
+        job, it stops when it next tries to renew its lease, and it
+        leaves the job and the results directory alone.
+        """
+        claimed: list[Job] = []
+
+        def get_streaming_page_fetcher(
+            api: FlickrApi, parsed_url: ParseResult
+        ) -> StreamingPageFetcher:
+            fetch_page = flickr_api.get_streaming_page_fetcher(api, parsed_url)
+
+            def fetch_and_stall(*, page: int, per_page: int) -> StreamedCollection:
+                if page == 2:
+                    monkeypatch.setattr("flinumeratr.jobs.LEASE_SECONDS", -1)
+                    job = queue.claim()
+                    assert job is not None
+                    claimed.append(job)
+
+                return fetch_page(page=page, per_page=per_page)
+
+            return fetch_and_stall
+
+        monkeypatch.setattr(
+            "flinumeratr.jobs.get_streaming_page_fetcher", get_streaming_page_fetcher
+        )
+
+        submit(queue)
+        assert run_next_job(queue, api)
+
+        assert queue.get(claimed[0]["id"]) == claimed[0]
+        assert os.listdir(queue.results_dir) == []
+
+
+class TestRunWorker:
+    def test_burst_stops_when_the_queue_is_empty(
+        self, queue: JobQueue, api: CachingFlickrApi
+    ) -> None:
+        jobs = [submit(queue), submit(queue)]
+
+        run_worker(queue, api, burst=True)
+
+        for job in jobs:
+            done = queue.get(job["id"])
+            assert done is not None
+            assert done["state"] == "done"
+
+    def test_deletes_old_jobs_when_the_queue_is_empty(
+        self, queue: JobQueue, api: CachingFlickrApi, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        job = submit(queue)
+        run_worker(queue, api, burst=True)
+        assert queue.get(job["id"]) is not None
+
+        monkeypatch.setattr("flinumeratr.jobs.MAX_JOB_AGE", -1)
+        run_worker(queue, api, burst=True)
+
+        assert queue.get(job["id"]) is None
+        assert os.listdir(queue.results_dir) == []
+
+    def test_waits_for_new_jobs_until_stopped(
+        self, queue: JobQueue, api: CachingFlickrApi
+    ) -> None:
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=run_worker,
+            args=(queue, api),
+            kwargs={"poll_interval": 0.01, "stop": stop},
+        )
+        worker.start()
+
+        job = submit(queue)
+
+        while (state := queue.get(job["id"])) is None or state["state"] != "done":
+            stop.wait(0.01)
+
+        stop.set()
+        worker.join()
+
+
+@pytest.mark.parametrize("jobs_path", [None, "jobs"])
+def test_get_job_queue(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, jobs_path: str | None
+) -> None:
+    if jobs_path is None:
+        monkeypatch.delenv("FLINUMERATR_JOBS_PATH", raising=False)
+    else:
+        monkeypatch.setenv("FLINUMERATR_JOBS_PATH", str(tmp_path / jobs_path))
+
+    assert (get_job_queue() is None) == (jobs_path is None)
+
+
+class TestApp:
+    @pytest.fixture
+    def client(
+        self,
+        app: Flask,
+        api: CachingFlickrApi,
+        queue: JobQueue,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> FlaskClient:
+        """
+        A test client for the app, with a job queue and the fake Flickr API.
+        """
+        monkeypatch.setattr("flinumeratr.app.api", api)
+        monkeypatch.setattr("flinumeratr.app.job_queue", queue)
+
+        return app.test_client()
+
+    def test_submit_poll_and_download(
+        self, client: FlaskClient, queue: JobQueue, api: CachingFlickrApi
+    ) -> None:
+        resp = client.post("/jobs", json={"flickr_url": user_url, "format": "csv"})
+
+        assert resp.status_code == 202
+        assert resp.json is not None
+        assert resp.json["state"] == "queued"
+        assert resp.json["result_url"] is None
+
+        progress_url = resp.headers["Location"]
+        result_url = f"{progress_url}/result"
+
+        assert client.get(result_url).status_code == 409
+
+        run_next_job(queue, api)
+
+        resp = client.get(progress_url)
+        assert resp.json is not None
+        assert resp.json["state"] == "done"
+        assert resp.json["pages_done"] == resp.json["count_pages"] == 3
+        assert resp.json["count_photos"] == 1200
+        assert resp.json["eta_seconds"] is None
+        assert resp.json["result_url"] == result_url
+
+        resp = client.get(result_url)
+        assert resp.status_code == 200
+        assert resp.headers["Content-Type"] == "text/csv; charset=utf-8"
+        assert resp.headers["Content-Disposition"] == "attachment; filename=photos.csv"
+        assert len(resp.text.splitlines()) == 1201
+
+        resp.close()
+
+    def test_submit_a_form(self, client: FlaskClient) -> None:
+        resp = client.post("/jobs", data={"flickr_url": user_url})
+
+        assert resp.status_code == 202
+        assert resp.json is not None
+        assert resp.json["format"] == "jsonl"
+
+    @pytest.mark.parametrize(
+        ["body", "status_code", "error"],
+        [
+            ({}, 400, "flickr_url should be a Flickr URL"),
+            ([user_url], 400, "flickr_url should be a Flickr URL"),
+            (
+                {"flickr_url": user_url, "format": "xml"},
+                400,
+                "xml isn’t a format we can export",
+            ),
+            (
+                {"flickr_url": "https://example.net"},
+                400,
+                "https://example.net doesn’t live on Flickr.com",
+            ),
+            (
+                {"flickr_url": "https://www.flickr.com/help"},
+                404,
+                "There are no photos to show at https://www.flickr.com/help",
+            ),
+        ],
+    )
+    def test_bad_submissions(
+        self, client: FlaskClient, body: object, status_code: int, error: str
+    ) -> None:
+        resp = client.post("/jobs", json=body)
+
+        assert resp.status_code == status_code
+        assert resp.json == {"error": error}
+
+    @pytest.mark.parametrize(
+        "path", ["/jobs/doesnotexist", "/jobs/doesnotexist/result"]
+    )
+    def test_unknown_job(self, client: FlaskClient, path: str) -> None:
+        resp = client.get(path)
+
+        assert resp.status_code == 404
+        assert resp.json == {"error": "There is no job doesnotexist"}
+
+    def test_jobs_can_be_disabled(
+        self, client: FlaskClient, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr("flinumeratr.app.job_queue", None)
+
+        assert client.post("/jobs", json={"flickr_url": user_url}).status_code == 503
+        assert client.get("/jobs/doesnotexist").status_code == 404
+        assert client.get("/jobs/doesnotexist/result").status_code == 404
+
+
+class TestRunJobWorkerCommand:
+    def test_runs_queued_jobs(
+        self,
+        app: Flask,
+        api: CachingFlickrApi,
+        queue: JobQueue,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        monkeypatch.setattr("flinumeratr.app.api", api)
+        monkeypatch.setattr("flinumeratr.app.job_queue", queue)
+        job = submit(queue)
+
+        result = app.test_cli_runner().invoke(args=["run-job-worker", "--burst"])
+
+        assert result.exit_code == 0
+        done = queue.get(job["id"])
+        assert done is not None
+        assert done["state"] == "done"
+
+    def test_needs_a_job_queue(
+        self, app: Flask, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr("flinumeratr.app.job_queue", None)
+
+        result = app.test_cli_runner().invoke(args=["run-job-worker"])
+
+        assert result.exit_code == 2
+        assert "FLINUMERATR_JOBS_PATH" in result.output
@@ -0,0 +1,411 @@
+"""
+Tests for `flinumeratr.metrics`, and the timings on /see_photos.
+"""
+
+from collections.abc import Iterator
+from pathlib import Path
+import sqlite3
+import threading
+import types
+import typing
+
+from flask import Flask
+from flask.testing import FlaskClient
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.cache import CachingFlickrApi, ResponseCache
+from flinumeratr.flickr_api import get_photos_in_user_photostream
+from flinumeratr.metrics import (
+    API_CALLS,
+    CACHE_REQUESTS,
+    METRICS,
+    RATE_BUDGET_TOKENS,
+    REQUEST_SECONDS,
+    Counter,
+    Gauge,
+    Histogram,
+    MetricsStore,
+    Timings,
+    get_metrics_store,
+    iter_timed,
+    start_saving_metrics,
+    timed,
+)
+from flinumeratr.resolution import ResolutionIndex
+from test_asgi import asgi, get
+
+
+__all__ = ["asgi"]
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics() -> Iterator[None]:
+    """
+    Clear all the metrics before and after each test, so they only
+    count what happened in the test.
+    """
+    for metric in METRICS:
+        metric.values.clear()
+
+    yield
+
+    for metric in METRICS:
+        metric.values.clear()
+
+
+@pytest.fixture
+def metrics_client(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> FlaskClient:
+    """
+    A test client for the app, which gets photos from the fake Flickr API.
+    """
+    fake_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", fake_api)
+
+    return app.test_client()
+
+
+def test_counter() -> None:
+    counter = Counter("requests_total", "All the requests.")
+
+    counter.inc(method="GET")
+    counter.inc(method="GET")
+    counter.inc(3, method='P"O\\S\nT')
+
+    assert list(counter.render()) == [
+        "# HELP requests_total All the requests.",
+        "# TYPE requests_total counter",
+        'requests_total{method="GET"} 2',
+        'requests_total{method="P\\"O\\\\S\\nT"} 3',
+    ]
+
+
+def test_histogram() -> None:
+    histogram = Histogram("latency_seconds", "How long it took.", buckets=(0.1, 1.0))
+
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert list(histogram.render()) == [
+        "# HELP latency_seconds How long it took.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_nested_phases_are_only_counted_once(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    # A fake clock, which only moves when we tell it to, so the
+    # durations are exact however busy the machine is.
+    clock = types.SimpleNamespace(now=0.0)
+    monkeypatch.setattr(
+        "flinumeratr.metrics.time",
+        types.SimpleNamespace(perf_counter=lambda: clock.now),
+    )
+
+    timings = Timings()
+
+    with timings.activate():
+        with timed("resolve"):
+            clock.now += 0.01
+
+            with timed("api_call"):
+                clock.now += 0.05
+
+    assert timings.durations["resolve"] == pytest.approx(0.01)
+    assert timings.durations["api_call"] == pytest.approx(0.05)
+
+
+def test_timed_does_nothing_outside_a_request() -> None:
+    timings = Timings()
+
+    with timed("api_call"):
+        pass
+
+    assert timings.durations == {}
+
+
+def test_server_timing() -> None:
+    timings = Timings()
+    timings.add("parse_url", 0.0001234)
+    timings.add("api_call", 0.25)
+    timings.add("api_call", 0.125)
+
+    assert timings.server_timing() == "parse_url;dur=0.12, api_call;dur=375.00"
+
+
+def test_iter_timed_observes_when_the_stream_is_closed() -> None:
+    """
+    If the client goes away before the end of a streamed response,
+    we still record the timings.
+    """
+    timings = Timings()
+    chunks = iter_timed([b"a", b"b", b"c"], timings, phase="render", url_type="tag")
+
+    assert next(chunks) == b"a"
+    chunks.close()
+
+    assert "render" in timings.durations
+    assert 'flinumeratr_request_seconds_count{url_type="tag"} 1' in "\n".join(
+        REQUEST_SECONDS.render()
+    )
+
+
+def test_see_photos_sends_server_timing(
+    metrics_client: FlaskClient, fake_flickr: FakeFlickr
+) -> None:
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+
+    resp = metrics_client.get(
+        f"/see_photos?flickr_url=https://www.flickr.com/photos/{owner['path_alias']}/&pages=3"
+    )
+
+    assert resp.status_code == 200
+    assert resp.text.count('<a class="photo"') == 250
+
+    # The page is rendered after we send the headers, so the render
+    # phase is only in the metrics.
+    phases = {p.split(";")[0] for p in resp.headers["Server-Timing"].split(", ")}
+    assert phases == {"parse_url", "resolve", "api_call", "parse"}
+
+    metrics = metrics_client.get("/metrics")
+
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"] == (
+        "text/plain; version=0.0.4; charset=utf-8"
+    )
+
+    lines = metrics.text.splitlines()
+
+    for phase in ["parse_url", "resolve", "api_call", "parse", "render"]:
+        assert (
+            f'flinumeratr_phase_seconds_count{{phase="{phase}",url_type="user"}} 1'
+            in lines
+        )
+
+    assert 'flinumeratr_request_seconds_count{url_type="user"} 1' in lines
+
+    assert (
+        'flinumeratr_api_calls_total{method="flickr.people.getPublicPhotos"} 2' in lines
+    )
+    assert 'flinumeratr_api_calls_total{method="flickr.urls.lookupUser"} 1' in lines
+
+
+def test_invalid_urls_are_counted(metrics_client: FlaskClient) -> None:
+    resp = metrics_client.get("/see_photos?flickr_url=https://www.example.net")
+
+    assert resp.status_code == 200
+    assert resp.headers["Server-Timing"].startswith("parse_url;dur=")
+
+    metrics = metrics_client.get("/metrics")
+    assert 'flinumeratr_request_seconds_count{url_type="invalid"} 1' in metrics.text
+
+
+def test_cache_hits_and_misses_are_counted(
+    fake_flickr: FakeFlickr, tmp_path: Path
+) -> None:
+    owner = fake_flickr.add_user(make_owner(1), count_photos=20)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.response_cache = ResponseCache(path=str(tmp_path / "cache.db"))
+
+    get_photos_in_user_photostream(api, user_id=owner["user_id"])
+    get_photos_in_user_photostream(api, user_id=owner["user_id"])
+
+    assert CACHE_REQUESTS.values == {
+        (("cache", "response"), ("result", "hit")): 1,
+        (("cache", "response"), ("result", "miss")): 2,
+    }
+    assert API_CALLS.values == {
+        (("method", "flickr.people.getPublicPhotos"),): 1,
+        (("method", "flickr.photos.licenses.getInfo"),): 1,
+    }
+
+
+def test_resolution_hits_and_misses_are_counted(tmp_path: Path) -> None:
+    index = ResolutionIndex(path=str(tmp_path / "cache.db"))
+    url = "https://www.flickr.com/photos/spike_yun/"
+
+    assert index.get("user", url) is None
+    index.set("user", url, "1234567@N01")
+    assert index.get("user", url) == "1234567@N01"
+
+    assert CACHE_REQUESTS.values == {
+        (("cache", "resolution"), ("result", "hit")): 1,
+        (("cache", "resolution"), ("result", "miss")): 1,
+    }
+
+
+def test_asgi_sends_server_timing(
+    asgi: types.ModuleType, fake_flickr: FakeFlickr
+) -> None:
+    fake_flickr.add_tag("sunset", count_photos=10)
+
+    resp = get(
+        asgi, "/see_photos?flickr_url=https://www.flickr.com/photos/tags/sunset/"
+    )
+
+    assert resp.status_code == 200
+    assert "api_call;dur=" in resp.headers["Server-Timing"]
+    assert API_CALLS.values[(("method", "flickr.photos.search"),)] == 1
+
+
+def test_metrics_from_every_process_are_added_up(tmp_path: Path) -> None:
+    store = MetricsStore(path=str(tmp_path / "cache.db"))
+
+    counter = Counter("requests_total", "All the requests.")
+    gauge = Gauge("tokens", "Tokens left.")
+    histogram = Histogram("latency_seconds", "How long it took.", buckets=(1.0,))
+
+    counter.inc(method="GET")
+    gauge.set(10)
+    histogram.observe(0.5)
+    store.save([counter, gauge, histogram], process="1")
+
+    counter.inc(2, method="GET")
+    counter.inc(method="POST")
+    gauge.set(7)
+    histogram.observe(5)
+    store.save([counter, gauge, histogram], process="2")
+
+    snapshots = store.load()
+
+    assert list(counter.render(counter.merge(snapshots["requests_total"]))) == [
+        "# HELP requests_total All the requests.",
+        "# TYPE requests_total counter",
+        'requests_total{method="GET"} 4',
+        'requests_total{method="POST"} 1',
+    ]
+    assert list(gauge.render(gauge.merge(snapshots["tokens"]))) == [
+        "# HELP tokens Tokens left.",
+        "# TYPE tokens gauge",
+        "tokens 7",
+    ]
+    assert list(histogram.render(histogram.merge(snapshots["latency_seconds"]))) == [
+        "# HELP latency_seconds How long it took.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 6.0",
+        "latency_seconds_count 3",
+    ]
+
+
+def test_old_snapshots_are_deleted(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store = MetricsStore(path=str(tmp_path / "cache.db"))
+    counter = Counter("requests_total", "All the requests.")
+    counter.inc()
+
+    monkeypatch.setattr(
+        "flinumeratr.metrics.time", types.SimpleNamespace(time=lambda: 0)
+    )
+    store.save([counter], process="1")
+
+    monkeypatch.setattr(
+        "flinumeratr.metrics.time", types.SimpleNamespace(time=lambda: 2 * 24 * 60 * 60)
+    )
+    store.save([counter], process="2")
+
+    assert len(store.load()["requests_total"]) == 1
+
+
+def test_metrics_page_includes_other_processes(
+    metrics_client: FlaskClient, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    store = MetricsStore(path=str(tmp_path / "cache.db"))
+    monkeypatch.setattr("flinumeratr.app.metrics_store", store)
+
+    # Another process has made some API calls and seen the budget
+    API_CALLS.inc(5, method="flickr.photos.search")
+    RATE_BUDGET_TOKENS.set(100)
+    store.save(METRICS, process="another-process")
+    API_CALLS.values.clear()
+    RATE_BUDGET_TOKENS.values.clear()
+
+    API_CALLS.inc(2, method="flickr.photos.search")
+
+    resp = metrics_client.get("/metrics")
+
+    assert resp.status_code == 200
+    assert 'flinumeratr_api_calls_total{method="flickr.photos.search"} 7' in resp.text
+    assert "flinumeratr_rate_budget_tokens 100" in resp.text
+
+
+def test_metrics_are_saved_until_stopped(tmp_path: Path) -> None:
+    store = MetricsStore(path=str(tmp_path / "cache.db"))
+    stop = threading.Event()
+    API_CALLS.inc(method="flickr.photos.search")
+
+    saves = 0
+    save = store.save
+
+    def save_twice(*args: typing.Any, **kwargs: typing.Any) -> None:
+        nonlocal saves
+        saves += 1
+        save(*args, **kwargs)
+        if saves == 2:
+            stop.set()
+
+    store.save = save_twice  # type: ignore[method-assign]
+    store.save_periodically(METRICS, interval=0, stop=stop)
+
+    assert saves == 2
+    assert len(store.load()["flinumeratr_api_calls_total"]) == 1
+
+
+def test_saving_keeps_going_if_the_database_is_locked(tmp_path: Path) -> None:
+    store = MetricsStore(path=str(tmp_path / "cache.db"))
+    stop = threading.Event()
+    attempts = 0
+
+    def locked(*args: typing.Any, **kwargs: typing.Any) -> None:
+        nonlocal attempts
+        attempts += 1
+        if attempts == 2:
+            stop.set()
+        raise sqlite3.OperationalError("database is locked")
+
+    store.save = locked  # type: ignore[method-assign]
+    store.save_periodically(METRICS, interval=0, stop=stop)
+
+    assert attempts == 2
+
+
+def test_metrics_are_saved_in_the_background(tmp_path: Path) -> None:
+    store = MetricsStore(path=str(tmp_path / "cache.db"))
+    stop = threading.Event()
+    API_CALLS.inc(method="flickr.photos.search")
+
+    thread = start_saving_metrics(store, stop=stop, interval=0.01)
+    assert thread is not None
+    assert thread.daemon
+
+    while "flinumeratr_api_calls_total" not in store.load():
+        stop.wait(0.01)
+
+    stop.set()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_metrics_arent_saved_without_a_store() -> None:
+    assert start_saving_metrics(None, stop=threading.Event()) is None
+
+
+def test_get_metrics_store(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("FLINUMERATR_CACHE_PATH", raising=False)
+    assert get_metrics_store() is None
+
+    monkeypatch.setenv("FLINUMERATR_CACHE_PATH", str(tmp_path / "cache.db"))
+    assert isinstance(get_metrics_store(), MetricsStore)
@@ -0,0 +1,283 @@
+"""
+Tests for the prev/next links on /see_photos, and prefetching the
+next page into the cache.
+"""
+
+from collections.abc import Iterator
+import concurrent.futures
+from pathlib import Path
+import threading
+import types
+import typing
+
+from flask import Flask
+from flask.testing import FlaskClient
+from flickr_url_parser import parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.cache import CachingFlickrApi, ResponseCache
+from flinumeratr.flickr_api import get_pages_from_flickr_url, prefetch_page, with_page
+from flinumeratr.metrics import PREFETCHES, RATE_BUDGET_REQUESTS
+from flinumeratr.models import PhotosFromUrl
+from flinumeratr.ratelimit import RateBudget
+from flinumeratr.singleflight import SingleFlight
+from test_asgi import asgi, get
+
+
+__all__ = ["asgi"]
+
+
+@pytest.fixture(autouse=True)
+def prefetch_executor(
+    monkeypatch: pytest.MonkeyPatch,
+) -> Iterator[concurrent.futures.ThreadPoolExecutor]:
+    """
+    Replace the executor that prefetches pages with a single thread,
+    so tests can wait for prefetches to finish, and clear the metrics.
+    """
+    PREFETCHES.values.clear()
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr("flinumeratr.flickr_api._prefetch_executor", executor)
+
+    yield executor
+
+    executor.shutdown(wait=True)
+
+
+@pytest.fixture
+def fake_api(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> CachingFlickrApi:
+    """
+    Returns the API used by the app, which talks to the fake Flickr API.
+    """
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", api)
+    return api
+
+
+@pytest.fixture
+def photostream_url(fake_flickr: FakeFlickr) -> str:
+    """
+    Returns the URL of a photostream with three pages of photos.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+    return f"https://www.flickr.com/photos/{owner['path_alias']}/"
+
+
+def wait_for_prefetches(executor: concurrent.futures.ThreadPoolExecutor) -> None:
+    """
+    Wait for every prefetch that's been started so far.  The executor
+    only has one thread, so they finish before this no-op job.
+    """
+    executor.submit(lambda: None).result()
+
+
+def see_photos(client: FlaskClient, url: str, query: str = "") -> str:
+    resp = client.get(f"/see_photos?flickr_url={url}{query}")
+    assert resp.status_code == 200
+    return resp.text
+
+
+def test_first_page_only_has_a_next_link(
+    app: Flask, fake_api: CachingFlickrApi, photostream_url: str
+) -> None:
+    html = see_photos(app.test_client(), photostream_url)
+
+    assert 'rel="prev"' not in html
+    assert 'rel="next"' in html
+    assert "&amp;page=2" in html
+    assert "Page 1\n      of 3" in html
+
+
+def test_middle_page_has_both_links(
+    app: Flask, fake_api: CachingFlickrApi, photostream_url: str
+) -> None:
+    html = see_photos(app.test_client(), photostream_url, "&page=2")
+
+    assert 'rel="prev"' in html
+    assert 'rel="next"' in html
+    assert html.count('<a class="photo"') == 100
+
+
+def test_last_pages_only_have_a_prev_link(
+    app: Flask, fake_api: CachingFlickrApi, photostream_url: str
+) -> None:
+    html = see_photos(app.test_client(), photostream_url, "&page=2&pages=2")
+
+    assert "page=1&amp;pages=2" in html
+    assert 'rel="next"' not in html
+    assert "Page 2&ndash;3\n      of 3" in html
+    assert html.count('<a class="photo"') == 150
+
+
+@pytest.mark.parametrize("page", ["0", "two"])
+def test_silly_page_parameter_is_ignored(
+    app: Flask, fake_api: CachingFlickrApi, photostream_url: str, page: str
+) -> None:
+    html = see_photos(app.test_client(), photostream_url, f"&page={page}")
+
+    assert "Page 1\n      of 3" in html
+
+
+def test_page_in_the_url_is_used(
+    app: Flask, fake_api: CachingFlickrApi, photostream_url: str
+) -> None:
+    html = see_photos(app.test_client(), photostream_url + "page3")
+
+    assert "Page 3\n      of 3" in html
+
+
+def test_single_photos_dont_have_pagination(app: Flask) -> None:
+    from flinumeratr.app import get_pagination
+
+    parsed_url = parse_flickr_url(
+        "https://www.flickr.com/photos/sdasmarchives/50567413447"
+    )
+    photo_data = typing.cast(PhotosFromUrl, {})
+
+    with app.test_request_context():
+        assert get_pagination("", parsed_url, photo_data, count_pages=1) is None
+
+
+def test_next_page_is_prefetched(
+    app: Flask,
+    fake_api: CachingFlickrApi,
+    fake_flickr: FakeFlickr,
+    photostream_url: str,
+    prefetch_executor: concurrent.futures.ThreadPoolExecutor,
+    tmp_path: Path,
+) -> None:
+    """
+    While we're showing page 1, page 2 is fetched into the cache,
+    so clicking "next" doesn't have to wait for Flickr.
+    """
+    fake_api.response_cache = ResponseCache(path=str(tmp_path / "cache.db"))
+    client = app.test_client()
+
+    see_photos(client, photostream_url)
+    wait_for_prefetches(prefetch_executor)
+
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 2
+    assert PREFETCHES.values == {(("result", "ok"),): 1}
+
+    see_photos(client, photostream_url, "&page=2")
+    wait_for_prefetches(prefetch_executor)
+
+    pages = [c["page"] for c in fake_flickr.calls_to("flickr.people.getPublicPhotos")]
+    assert pages == ["1", "2", "3"]
+
+
+def test_last_page_isnt_prefetched(
+    app: Flask,
+    fake_api: CachingFlickrApi,
+    photostream_url: str,
+    prefetch_executor: concurrent.futures.ThreadPoolExecutor,
+    tmp_path: Path,
+) -> None:
+    fake_api.response_cache = ResponseCache(path=str(tmp_path / "cache.db"))
+
+    see_photos(app.test_client(), photostream_url, "&page=3")
+    wait_for_prefetches(prefetch_executor)
+
+    assert PREFETCHES.values == {}
+
+
+def test_nothing_is_prefetched_without_a_cache(
+    app: Flask,
+    fake_api: CachingFlickrApi,
+    photostream_url: str,
+    prefetch_executor: concurrent.futures.ThreadPoolExecutor,
+) -> None:
+    see_photos(app.test_client(), photostream_url)
+    wait_for_prefetches(prefetch_executor)
+
+    assert PREFETCHES.values == {}
+
+
+def test_failed_prefetch_is_counted(fake_flickr: FakeFlickr) -> None:
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/nobody/")
+
+    prefetch_page(api, parsed_url, page=2).result()
+
+    assert PREFETCHES.values == {(("result", "error"),): 1}
+
+
+def test_interactive_lookup_doesnt_wait_for_a_prefetch(
+    fake_flickr: FakeFlickr,
+) -> None:
+    """
+    If somebody asks for a page while we're prefetching it, they make
+    their own lookup, rather than waiting for the prefetch.
+    """
+    fake_flickr.add_tag("sunset", count_photos=250)
+    prefetch_started = threading.Event()
+    release = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if threading.current_thread() is not threading.main_thread():
+            prefetch_started.set()
+            release.wait()
+
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    api.single_flight = SingleFlight()
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    prefetch = prefetch_page(api, parsed_url, page=2)
+    assert prefetch_started.wait(timeout=5)
+
+    get_pages_from_flickr_url(api, with_page(parsed_url, 2), count_pages=1)
+    was_prefetching = not prefetch.done()
+
+    release.set()
+    prefetch.result()
+
+    assert was_prefetching
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 2
+    assert PREFETCHES.values == {(("result", "ok"),): 1}
+
+
+def test_prefetch_doesnt_wait_for_the_rate_budget(
+    fake_flickr: FakeFlickr, tmp_path: Path
+) -> None:
+    """
+    If there are no bulk tokens free, a prefetch gives up immediately,
+    rather than waiting until the bulk deadline.
+    """
+    fake_flickr.add_tag("sunset", count_photos=250)
+    RATE_BUDGET_REQUESTS.values.clear()
+
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.rate_budget = RateBudget(
+        path=str(tmp_path / "cache.db"), burst=5, bulk_reserve=5
+    )
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    prefetch_page(api, parsed_url, page=2).result(timeout=5)
+
+    assert PREFETCHES.values == {(("result", "error"),): 1}
+    assert RATE_BUDGET_REQUESTS.values == {
+        (("priority", "bulk"), ("result", "rejected")): 1
+    }
+
+
+def test_with_page_leaves_single_photos_alone() -> None:
+    parsed_url = parse_flickr_url(
+        "https://www.flickr.com/photos/sdasmarchives/50567413447"
+    )
+
+    assert with_page(parsed_url, page=2) == parsed_url
+
+
+def test_asgi_pagination(asgi: types.ModuleType, photostream_url: str) -> None:
+    resp = get(asgi, f"/see_photos?flickr_url={photostream_url}&page=2")
+
+    assert resp.status_code == 200
+    assert 'rel="prev"' in resp.text
+    assert 'rel="next"' in resp.text
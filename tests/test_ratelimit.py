@@ -0,0 +1,392 @@
+"""
+Tests for `flinumeratr.ratelimit`.
+"""
+
+import asyncio
+from collections.abc import Iterator
+import concurrent.futures
+import json
+from pathlib import Path
+import sqlite3
+import time
+import types
+
+from flask import Flask
+from flask.testing import FlaskClient
+from flickr_url_parser import parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr
+from flinumeratr import async_flickr_api, flickr_api
+from flinumeratr.async_flickr_api import AsyncFlickrApi
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.metrics import (
+    RATE_BUDGET_REQUESTS,
+    RATE_BUDGET_THROTTLED,
+    RATE_BUDGET_TOKENS,
+    RATE_BUDGET_WAIT_SECONDS,
+    render_metrics,
+)
+from flinumeratr.ratelimit import RateBudget, RateLimitExceeded, get_rate_budget
+from test_asgi import asgi, get
+
+
+__all__ = ["asgi"]
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    """
+    Clear the rate budget metrics before each test, and make the
+    backoff short enough that tests don't have to wait for it.
+    """
+    monkeypatch.setattr("flinumeratr.ratelimit.MIN_BACKOFF", 0.01)
+
+    for metric in (
+        RATE_BUDGET_REQUESTS,
+        RATE_BUDGET_THROTTLED,
+        RATE_BUDGET_TOKENS,
+        RATE_BUDGET_WAIT_SECONDS,
+    ):
+        metric.values.clear()
+
+    yield
+
+
+def exhausted_budget(tmp_path: Path) -> RateBudget:
+    """
+    Returns a rate budget which has no tokens, and won't wait for any.
+    """
+    return RateBudget(
+        path=str(tmp_path / "cache.db"),
+        calls_per_hour=1,
+        burst=0,
+        deadlines={"interactive": 0, "bulk": 0},
+    )
+
+
+def throttled_error() -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://api.flickr.com/services/rest/")
+
+    return httpx.HTTPStatusError(
+        "429 Too Many Requests",
+        request=request,
+        response=httpx.Response(status_code=429, request=request),
+    )
+
+
+def backoff_seconds(budget: RateBudget) -> float:
+    with sqlite3.connect(budget.path) as conn:
+        seconds: float = conn.execute(
+            "SELECT backoff_seconds FROM rate_budget"
+        ).fetchone()[0]
+
+    return seconds
+
+
+class TestRateBudget:
+    def test_takes_tokens_until_the_bucket_is_empty(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        # Stop the clock, so the bucket doesn't refill between calls.
+        monkeypatch.setattr(
+            "flinumeratr.ratelimit.time", types.SimpleNamespace(time=lambda: 1000.0)
+        )
+        budget = RateBudget(path=str(tmp_path / "cache.db"), burst=3)
+
+        assert [budget.try_acquire("interactive") for _ in range(3)] == [0, 0, 0]
+        assert budget.try_acquire("interactive") == pytest.approx(1)
+
+    def test_tokens_are_in_the_metrics(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"), burst=3)
+        budget.try_acquire("interactive")
+
+        assert RATE_BUDGET_TOKENS.values[()] == pytest.approx(2, abs=0.01)
+        assert "\nflinumeratr_rate_budget_tokens 2\n" in render_metrics()
+
+    def test_bulk_calls_leave_a_reserve(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"), burst=3, bulk_reserve=2)
+
+        assert budget.try_acquire("bulk") == 0
+        assert budget.try_acquire("bulk") > 0
+
+        assert budget.try_acquire("interactive") == 0
+        assert budget.try_acquire("interactive") == 0
+
+    def test_budget_is_shared_between_processes(self, tmp_path: Path) -> None:
+        budget1 = RateBudget(path=str(tmp_path / "cache.db"), burst=2)
+        budget2 = RateBudget(path=str(tmp_path / "cache.db"), burst=2)
+
+        assert budget1.try_acquire("interactive") == 0
+        assert budget2.try_acquire("interactive") == 0
+        assert budget1.try_acquire("interactive") > 0
+
+    def test_acquire_waits_for_a_token(self, tmp_path: Path) -> None:
+        budget = RateBudget(
+            path=str(tmp_path / "cache.db"), calls_per_hour=36_000, burst=1
+        )
+
+        budget.acquire("interactive")
+        budget.acquire("interactive")
+
+        assert RATE_BUDGET_REQUESTS.values == {
+            (("priority", "interactive"), ("result", "granted")): 2
+        }
+        assert RATE_BUDGET_WAIT_SECONDS.values[
+            (("priority", "interactive"),)
+        ].sum == pytest.approx(0.1, abs=0.05)
+
+    def test_acquire_gives_up_at_the_deadline(self, tmp_path: Path) -> None:
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            exhausted_budget(tmp_path).acquire("bulk")
+
+        # The budget refills at one call an hour, and a bulk call has to
+        # wait until there are enough tokens to leave the reserve of 75.
+        assert exc_info.value.retry_after == pytest.approx(76 * 3600, rel=0.01)
+
+        assert RATE_BUDGET_REQUESTS.values == {
+            (("priority", "bulk"), ("result", "rejected")): 1
+        }
+
+    def test_call_retries_after_being_throttled(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"), calls_per_hour=36_000)
+        attempts = []
+
+        def fn() -> str:
+            attempts.append(1)
+
+            if len(attempts) == 1:
+                raise throttled_error()
+
+            return "ok"
+
+        assert budget.call(fn, priority="interactive") == "ok"
+        assert len(attempts) == 2
+        assert RATE_BUDGET_THROTTLED.values == {(): 1}
+
+    def test_call_doesnt_retry_other_errors(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"))
+        request = httpx.Request("GET", "https://api.flickr.com/services/rest/")
+
+        def fn() -> None:
+            raise httpx.HTTPStatusError(
+                "403 Forbidden",
+                request=request,
+                response=httpx.Response(status_code=403, request=request),
+            )
+
+        with pytest.raises(httpx.HTTPStatusError):
+            budget.call(fn, priority="interactive")
+
+        assert RATE_BUDGET_THROTTLED.values == {}
+
+    def test_backoff_adapts_to_throttling(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"))
+
+        budget.record_throttled()
+        assert backoff_seconds(budget) == 0.01
+
+        budget.record_throttled()
+        budget.record_throttled()
+        assert backoff_seconds(budget) == 0.04
+
+        budget.record_success()
+        assert backoff_seconds(budget) == 0.02
+
+    def test_waits_while_backing_off(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"))
+
+        budget.record_throttled()
+
+        assert 0 < budget.try_acquire("interactive") <= 0.01
+
+    def test_async_call_retries_after_being_throttled(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"), calls_per_hour=36_000)
+        attempts = []
+
+        async def fn() -> str:
+            attempts.append(1)
+
+            if len(attempts) == 1:
+                raise throttled_error()
+
+            return "ok"
+
+        assert asyncio.run(budget.async_call(fn, priority="interactive")) == "ok"
+        assert len(attempts) == 2
+
+    def test_async_call_doesnt_retry_other_errors(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"))
+
+        request = httpx.Request("GET", "https://api.flickr.com/services/rest/")
+
+        async def fn() -> None:
+            raise httpx.HTTPStatusError(
+                "403 Forbidden",
+                request=request,
+                response=httpx.Response(status_code=403, request=request),
+            )
+
+        with pytest.raises(httpx.HTTPStatusError):
+            asyncio.run(budget.async_call(fn, priority="interactive"))
+
+    def test_async_call_respects_max_wait(self, tmp_path: Path) -> None:
+        budget = RateBudget(path=str(tmp_path / "cache.db"), calls_per_hour=1, burst=0)
+
+        async def fn() -> str:
+            return "ok"  # pragma: no cover
+
+        with pytest.raises(RateLimitExceeded):
+            asyncio.run(budget.async_call(fn, priority="interactive", max_wait=0))
+
+        assert RATE_BUDGET_REQUESTS.values == {
+            (("priority", "interactive"), ("result", "rejected")): 1
+        }
+
+    def test_async_waits_dont_hold_a_thread(self, tmp_path: Path) -> None:
+        """
+        While an async call waits for a token, the threads in the
+        default executor are free for other work.
+        """
+        budget = RateBudget(
+            path=str(tmp_path / "cache.db"), calls_per_hour=7200, burst=1
+        )
+
+        async def fn() -> str:
+            return "ok"
+
+        async def other_work() -> float:
+            await asyncio.sleep(0.05)
+            start = time.time()
+            await asyncio.to_thread(lambda: None)
+            return time.time() - start
+
+        async def main() -> float:
+            loop = asyncio.get_running_loop()
+            loop.set_default_executor(concurrent.futures.ThreadPoolExecutor(1))
+
+            # The second call has to wait ~0.5s for a token.
+            await budget.async_call(fn, priority="interactive")
+
+            _, elapsed = await asyncio.gather(
+                budget.async_call(fn, priority="interactive"), other_work()
+            )
+
+            return elapsed
+
+        assert asyncio.run(main()) < 0.25
+        assert RATE_BUDGET_REQUESTS.values == {
+            (("priority", "interactive"), ("result", "granted")): 2
+        }
+
+
+@pytest.mark.parametrize("cache_path", [None, "cache.db"])
+def test_get_rate_budget(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, cache_path: str | None
+) -> None:
+    if cache_path is None:
+        monkeypatch.delenv("FLINUMERATR_CACHE_PATH", raising=False)
+    else:
+        monkeypatch.setenv("FLINUMERATR_CACHE_PATH", str(tmp_path / cache_path))
+
+    assert (get_rate_budget() is None) == (cache_path is None)
+
+
+class TestCachingFlickrApi:
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    def test_calls_take_tokens_with_the_clients_priority(
+        self, fake_flickr: FakeFlickr, tmp_path: Path
+    ) -> None:
+        fake_flickr.add_tag("sunset", count_photos=10)
+
+        api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+        api.rate_budget = RateBudget(path=str(tmp_path / "cache.db"))
+
+        flickr_api.get_photos_from_flickr_url(api, self.parsed_url)
+        flickr_api.get_photos_from_flickr_url(
+            api.with_priority("bulk"), self.parsed_url
+        )
+
+        assert api.priority == "interactive"
+        assert RATE_BUDGET_REQUESTS.values == {
+            (("priority", "interactive"), ("result", "granted")): 2,
+            (("priority", "bulk"), ("result", "granted")): 2,
+        }
+        assert api.with_priority("bulk") is api.with_priority("bulk")
+
+    def test_async_calls_take_tokens(
+        self, fake_flickr: FakeFlickr, tmp_path: Path
+    ) -> None:
+        fake_flickr.add_tag("sunset", count_photos=10)
+
+        api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+        api.rate_budget = RateBudget(path=str(tmp_path / "cache.db"))
+
+        async_api = AsyncFlickrApi(
+            api=api, client=httpx.AsyncClient(transport=fake_flickr.transport)
+        )
+        asyncio.run(
+            async_flickr_api.get_photos_from_flickr_url(async_api, self.parsed_url)
+        )
+
+        assert RATE_BUDGET_REQUESTS.values == {
+            (("priority", "interactive"), ("result", "granted")): 2,
+        }
+
+
+class TestApp:
+    sunset_url = "https://www.flickr.com/photos/tags/sunset/"
+
+    @pytest.fixture
+    def limited_client(
+        self,
+        app: Flask,
+        fake_flickr: FakeFlickr,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ) -> FlaskClient:
+        """
+        A test client for the app, which has used up its rate budget.
+        """
+        fake_flickr.add_tag("sunset", count_photos=10)
+
+        fake_api = CachingFlickrApi(
+            client=httpx.Client(transport=fake_flickr.transport)
+        )
+        fake_api.rate_budget = exhausted_budget(tmp_path)
+        monkeypatch.setattr("flinumeratr.app.api", fake_api)
+
+        return app.test_client()
+
+    def test_see_photos(self, limited_client: FlaskClient) -> None:
+        resp = limited_client.get(f"/see_photos?flickr_url={self.sunset_url}")
+
+        assert resp.status_code == 503
+        assert resp.headers["Retry-After"] == "60"
+        assert "Flickr is very busy right now" in resp.text
+
+    def test_export(self, limited_client: FlaskClient) -> None:
+        resp = limited_client.get(f"/export?flickr_url={self.sunset_url}")
+
+        assert resp.status_code == 503
+        assert RATE_BUDGET_REQUESTS.values == {
+            (("priority", "bulk"), ("result", "rejected")): 1
+        }
+
+    def test_batch(self, limited_client: FlaskClient) -> None:
+        resp = limited_client.post("/batch", json={"flickr_urls": [self.sunset_url]})
+
+        assert json.loads(resp.text)["error"]["type"] == "RateLimitExceeded"
+
+    def test_asgi(
+        self, asgi: types.ModuleType, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+    ) -> None:
+        monkeypatch.setattr(
+            asgi.async_api.api, "rate_budget", exhausted_budget(tmp_path)
+        )
+
+        resp = get(asgi, f"/see_photos?flickr_url={self.sunset_url}")
+
+        assert resp.status_code == 503
@@ -0,0 +1,163 @@
+"""
+Tests for `flinumeratr.resolution`.
+"""
+
+from pathlib import Path
+
+from flickr_url_parser import ParseResult, parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.flickr_api import get_photos_from_flickr_url
+from flinumeratr.resolution import (
+    ResolutionIndex,
+    get_resolution_index,
+    is_short_url,
+    normalise_url,
+    resolve_flickr_url,
+)
+
+
+@pytest.fixture
+def index(tmp_path: Path) -> ResolutionIndex:
+    return ResolutionIndex(path=str(tmp_path / "cache.db"))
+
+
+def indexed_api(fake_flickr: FakeFlickr, index: ResolutionIndex) -> CachingFlickrApi:
+    api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    api.resolution_index = index
+    return api
+
+
+@pytest.mark.parametrize(
+    ["url", "expected"],
+    [
+        ("https://www.flickr.com/photos/spike_yun/", "flickr.com/photos/spike_yun"),
+        ("https://flickr.com/people/spike_yun", "flickr.com/photos/spike_yun"),
+        ("www.flickr.com/groups/geologists/", "flickr.com/groups/geologists"),
+        ("https://flic.kr/s/aHsjybZ5ZD", "flic.kr/s/aHsjybZ5ZD"),
+    ],
+)
+def test_normalise_url(url: str, expected: str) -> None:
+    assert normalise_url(url) == expected
+
+
+@pytest.mark.parametrize(
+    ["url", "expected"],
+    [
+        ("https://flic.kr/s/aHsjybZ5ZD", True),
+        ("flic.kr/ps/ZVcni", True),
+        ("https://www.flickr.com/gp/realphotomatt/M195SLkj98", True),
+        ("https://www.flickr.com/photos/spike_yun/", False),
+    ],
+)
+def test_is_short_url(url: str, expected: bool) -> None:
+    assert is_short_url(url) == expected
+
+
+def test_user_lookups_are_remembered(
+    fake_flickr: FakeFlickr, index: ResolutionIndex
+) -> None:
+    """
+    Once we've looked up a user's NSID, we don't look it up again,
+    even if the URL is written differently.
+    """
+    fake_flickr.add_user(make_owner(1), count_photos=10)
+
+    for url in [
+        "https://www.flickr.com/photos/user1/",
+        "https://flickr.com/people/user1",
+    ]:
+        api = indexed_api(fake_flickr, index)
+        get_photos_from_flickr_url(api, parse_flickr_url(url))
+
+    assert len(fake_flickr.calls_to("flickr.urls.lookupUser")) == 1
+    assert len(fake_flickr.calls_to("flickr.people.getPublicPhotos")) == 2
+
+
+def test_group_lookups_are_remembered(
+    fake_flickr: FakeFlickr, index: ResolutionIndex
+) -> None:
+    fake_flickr.add_group(
+        "1234@N01", url="https://www.flickr.com/groups/geologists", count_photos=10
+    )
+    parsed_url = parse_flickr_url("https://www.flickr.com/groups/geologists/")
+
+    first = get_photos_from_flickr_url(indexed_api(fake_flickr, index), parsed_url)
+    second = get_photos_from_flickr_url(indexed_api(fake_flickr, index), parsed_url)
+
+    assert first == second
+    assert len(fake_flickr.calls_to("flickr.urls.lookupGroup")) == 1
+
+
+def test_invalidated_lookups_are_repeated(
+    fake_flickr: FakeFlickr, index: ResolutionIndex
+) -> None:
+    fake_flickr.add_user(make_owner(1), count_photos=10)
+    fake_flickr.add_user(make_owner(2), count_photos=10)
+
+    user1 = parse_flickr_url("https://www.flickr.com/photos/user1/")
+    user2 = parse_flickr_url("https://www.flickr.com/photos/user2/")
+
+    get_photos_from_flickr_url(indexed_api(fake_flickr, index), user1)
+    get_photos_from_flickr_url(indexed_api(fake_flickr, index), user2)
+    assert len(fake_flickr.calls_to("flickr.urls.lookupUser")) == 2
+
+    index.invalidate("https://www.flickr.com/people/user1/")
+    get_photos_from_flickr_url(indexed_api(fake_flickr, index), user1)
+    get_photos_from_flickr_url(indexed_api(fake_flickr, index), user2)
+    assert len(fake_flickr.calls_to("flickr.urls.lookupUser")) == 3
+
+    index.clear()
+    get_photos_from_flickr_url(indexed_api(fake_flickr, index), user1)
+    get_photos_from_flickr_url(indexed_api(fake_flickr, index), user2)
+    assert len(fake_flickr.calls_to("flickr.urls.lookupUser")) == 5
+
+
+def test_expired_lookups_are_repeated(tmp_path: Path) -> None:
+    index = ResolutionIndex(path=str(tmp_path / "cache.db"), ttl=0)
+
+    index.set("user", "https://www.flickr.com/photos/user1/", "1001@N01")
+
+    assert index.get("user", "https://www.flickr.com/photos/user1/") is None
+
+
+def test_resolve_flickr_url_remembers_short_urls(
+    monkeypatch: pytest.MonkeyPatch, index: ResolutionIndex
+) -> None:
+    """
+    Short URLs are only resolved once; other URLs are always parsed directly.
+    """
+    parsed_urls: list[str] = []
+
+    def fake_parse_flickr_url(url: str) -> ParseResult:
+        parsed_urls.append(url)
+        return {"type": "tag", "tag": "sunset", "page": 1}
+
+    monkeypatch.setattr(
+        "flinumeratr.resolution.parse_flickr_url", fake_parse_flickr_url
+    )
+
+    for _ in range(3):
+        assert resolve_flickr_url("https://flic.kr/s/aHsjybZ5ZD", index=index) == {
+            "type": "tag",
+            "tag": "sunset",
+            "page": 1,
+        }
+        resolve_flickr_url("https://www.flickr.com/photos/tags/sunset", index=index)
+        resolve_flickr_url("https://flic.kr/s/aHsjybZ5ZD", index=None)
+
+    assert parsed_urls.count("https://flic.kr/s/aHsjybZ5ZD") == 4
+    assert parsed_urls.count("https://www.flickr.com/photos/tags/sunset") == 3
+
+
+def test_get_resolution_index(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    monkeypatch.delenv("FLINUMERATR_CACHE_PATH", raising=False)
+    assert get_resolution_index() is None
+
+    monkeypatch.setenv("FLINUMERATR_CACHE_PATH", str(tmp_path / "cache.db"))
+    index = get_resolution_index()
+    assert index is not None
+    assert index.path == str(tmp_path / "cache.db")
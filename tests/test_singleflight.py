@@ -0,0 +1,435 @@
+"""
+Tests for `flinumeratr.singleflight`.
+"""
+
+import asyncio
+from collections.abc import Callable
+import concurrent.futures
+import pathlib
+import sqlite3
+import threading
+import time
+import typing
+
+from flickr_api import ResourceNotFound
+from flickr_url_parser import parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr
+from flinumeratr.async_flickr_api import (
+    AsyncFlickrApi,
+    get_pages_from_flickr_url as async_get_pages_from_flickr_url,
+)
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.flickr_api import get_pages_from_flickr_url
+from flinumeratr.singleflight import (
+    AsyncSingleFlight,
+    FlightLeases,
+    SingleFlight,
+    flight_key,
+    get_single_flight,
+)
+
+
+T = typing.TypeVar("T")
+
+
+@pytest.fixture
+def leases(tmp_path: pathlib.Path) -> FlightLeases:
+    """
+    Returns a set of leases in a temporary database.
+    """
+    return FlightLeases(path=str(tmp_path / "cache.db"), poll_interval=0.01)
+
+
+def run_concurrently(
+    fn: Callable[[], T], *, count: int, release: threading.Event
+) -> list[concurrent.futures.Future[T]]:
+    """
+    Call ``fn()`` in ``count`` threads at once, then set ``release``
+    (which ``fn`` should wait for) once they've all started.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(fn) for _ in range(count)]
+
+        # Give all the threads a chance to join the flight before
+        # we let the leader finish.
+        time.sleep(0.1)
+        release.set()
+
+    return futures
+
+
+class TestFlightKey:
+    def test_normalises_the_url(self) -> None:
+        assert flight_key(
+            parse_flickr_url("https://www.flickr.com/people/george/")
+        ) == flight_key(parse_flickr_url("https://flickr.com/photos/george"))
+
+    def test_ignores_the_page_in_the_url(self) -> None:
+        assert flight_key(
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/page2"), page=3
+        ) == flight_key(
+            parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"), page=3
+        )
+
+    def test_includes_the_options(self) -> None:
+        parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+        assert flight_key(parsed_url, per_page=100) != flight_key(
+            parsed_url, per_page=500
+        )
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_a_result(self) -> None:
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn() -> list[int]:
+            calls.append(1)
+            release.wait()
+            return [1, 2, 3]
+
+        futures = run_concurrently(
+            lambda: single_flight.do("key", fn), count=5, release=release
+        )
+
+        results = [f.result() for f in futures]
+        assert len(calls) == 1
+        assert all(r is results[0] for r in results)
+
+    def test_concurrent_calls_share_an_exception(self) -> None:
+        single_flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn() -> None:
+            calls.append(1)
+            release.wait()
+            raise ResourceNotFound("Photoset not found")
+
+        futures = run_concurrently(
+            lambda: single_flight.do("key", fn), count=5, release=release
+        )
+
+        assert len(calls) == 1
+        assert all(isinstance(f.exception(), ResourceNotFound) for f in futures)
+
+    def test_later_calls_run_again(self) -> None:
+        """
+        We only coalesce calls that are in flight at the same time;
+        we don't cache results.
+        """
+        single_flight = SingleFlight()
+        calls = []
+
+        def fn() -> int:
+            calls.append(1)
+            return len(calls)
+
+        assert single_flight.do("key", fn) == 1
+        assert single_flight.do("key", fn) == 2
+
+
+class TestFlightLeases:
+    def test_only_one_process_can_take_a_lease(self, leases: FlightLeases) -> None:
+        token = leases.acquire("key")
+
+        assert token is not None
+        assert leases.acquire("key") is None
+        assert leases.acquire("another_key") is not None
+
+        leases.release("key", token, outcome="ok")
+        assert leases.acquire("key") is not None
+
+    def test_expired_leases_are_taken_over(self, tmp_path: pathlib.Path) -> None:
+        leases = FlightLeases(path=str(tmp_path / "cache.db"), lease_seconds=0)
+
+        assert leases.acquire("key") is not None
+        assert leases.acquire("key") is not None
+
+    def test_wait_returns_the_outcome(self, leases: FlightLeases) -> None:
+        token = leases.acquire("key")
+        assert token is not None
+
+        threading.Timer(
+            0.05,
+            lambda: leases.release(
+                "key", token, outcome="not_found", message="User not found"
+            ),
+        ).start()
+
+        assert leases.wait("key") == ("not_found", "User not found")
+
+    def test_wait_gives_up_if_theres_no_lease(self, leases: FlightLeases) -> None:
+        assert leases.wait("key") == ("error", "")
+
+    def test_wait_gives_up_if_the_lease_expires(self, tmp_path: pathlib.Path) -> None:
+        leases = FlightLeases(
+            path=str(tmp_path / "cache.db"), lease_seconds=0.05, poll_interval=0.01
+        )
+        leases.acquire("key")
+
+        assert leases.wait("key") == ("error", "")
+
+    def test_wait_gives_up_if_the_lease_is_taken_over(
+        self, leases: FlightLeases, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        leases.acquire("key")
+
+        def take_over_lease(seconds: float) -> None:
+            with sqlite3.connect(leases.path) as conn:
+                conn.execute("UPDATE flight_leases SET token = 'newer'")
+
+        monkeypatch.setattr("flinumeratr.singleflight.time.sleep", take_over_lease)
+
+        assert leases.wait("key") == ("error", "")
+
+
+class TestSingleFlightAcrossProcesses:
+    """
+    These tests use two ``FlightLeases`` on the same database to
+    stand in for two gunicorn workers.
+    """
+
+    @pytest.fixture
+    def other_process(self, leases: FlightLeases) -> FlightLeases:
+        """
+        Returns the leases, as seen from another process.
+        """
+        return FlightLeases(path=leases.path)
+
+    @pytest.mark.parametrize(
+        ["message", "outcome"],
+        [
+            ("User not found", "not_found"),
+            ("Bad gateway", "error"),
+        ],
+    )
+    def test_leader_records_the_outcome(
+        self,
+        leases: FlightLeases,
+        other_process: FlightLeases,
+        message: str,
+        outcome: str,
+    ) -> None:
+        def fn() -> None:
+            if outcome == "not_found":
+                raise ResourceNotFound(message)
+            else:
+                raise ValueError(message)
+
+        with pytest.raises((ResourceNotFound, ValueError)):
+            SingleFlight(leases).do("key", fn)
+
+        assert other_process.wait("key") == (
+            outcome,
+            message if outcome == "not_found" else "",
+        )
+
+    def test_leader_records_success(
+        self, leases: FlightLeases, other_process: FlightLeases
+    ) -> None:
+        assert SingleFlight(leases).do("key", lambda: 42) == 42
+        assert other_process.wait("key") == ("ok", "")
+
+    def test_follower_repeats_the_lookup(
+        self, leases: FlightLeases, other_process: FlightLeases
+    ) -> None:
+        """
+        If another process is doing the lookup, we wait for it to finish,
+        then repeat the lookup -- which should be served from the cache.
+        """
+        token = other_process.acquire("key")
+        assert token is not None
+
+        calls = []
+
+        def fn() -> int:
+            calls.append(time.time())
+            return 42
+
+        threading.Timer(
+            0.05, lambda: other_process.release("key", token, outcome="ok")
+        ).start()
+        started = time.time()
+
+        assert SingleFlight(leases).do("key", fn) == 42
+        assert len(calls) == 1
+        assert calls[0] - started >= 0.05
+
+    def test_follower_raises_not_found(
+        self, leases: FlightLeases, other_process: FlightLeases
+    ) -> None:
+        token = other_process.acquire("key")
+        assert token is not None
+
+        threading.Timer(
+            0.05,
+            lambda: other_process.release(
+                "key", token, outcome="not_found", message="Photoset not found"
+            ),
+        ).start()
+
+        def fn() -> None:  # pragma: no cover
+            raise AssertionError("The follower shouldn't repeat the lookup")
+
+        with pytest.raises(ResourceNotFound, match="Photoset not found"):
+            SingleFlight(leases).do("key", fn)
+
+
+def test_concurrent_page_lookups_share_api_calls(fake_flickr: FakeFlickr) -> None:
+    fake_flickr.add_tag("sunset", count_photos=50)
+    release = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        release.wait()
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    api.single_flight = SingleFlight()
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    futures = run_concurrently(
+        lambda: get_pages_from_flickr_url(api, parsed_url, count_pages=1)[0],
+        count=5,
+        release=release,
+    )
+
+    results = [f.result() for f in futures]
+    assert all(r is results[0] for r in results)
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 1
+
+
+def test_concurrent_lookups_share_not_found(
+    fake_flickr: FakeFlickr,
+) -> None:
+    release = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        release.wait()
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    api.single_flight = SingleFlight()
+    parsed_url = parse_flickr_url(
+        "https://www.flickr.com/photos/user1/albums/72157621848008117"
+    )
+
+    futures = run_concurrently(
+        lambda: get_pages_from_flickr_url(api, parsed_url, count_pages=1)[0],
+        count=5,
+        release=release,
+    )
+
+    assert all(isinstance(f.exception(), ResourceNotFound) for f in futures)
+    assert len(fake_flickr.calls) == 1
+
+
+def test_uncached_lookups_dont_share_with_cached_ones(
+    fake_flickr: FakeFlickr,
+) -> None:
+    """
+    A client that doesn't read the cache never joins a lookup by
+    one that does, which might have been served from the cache.
+    """
+    fake_flickr.add_tag("sunset", count_photos=50)
+    release = threading.Event()
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        release.wait()
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    api.single_flight = SingleFlight()
+    apis = [api, api, api.without_cache_reads(), api.without_cache_reads()]
+    parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+    futures = run_concurrently(
+        lambda: get_pages_from_flickr_url(apis.pop(), parsed_url, count_pages=1)[0],
+        count=4,
+        release=release,
+    )
+
+    assert all(f.result() for f in futures)
+    assert len(fake_flickr.calls_to("flickr.photos.search")) == 2
+
+
+@pytest.mark.parametrize("cache_path", [None, "cache.db"])
+def test_get_single_flight(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch, cache_path: str | None
+) -> None:
+    if cache_path is None:
+        monkeypatch.delenv("FLINUMERATR_CACHE_PATH", raising=False)
+    else:
+        monkeypatch.setenv("FLINUMERATR_CACHE_PATH", str(tmp_path / cache_path))
+
+    assert (get_single_flight().leases is None) == (cache_path is None)
+
+
+class TestAsyncSingleFlight:
+    def test_concurrent_calls_share_a_result(self) -> None:
+        single_flight = AsyncSingleFlight()
+        calls = []
+
+        async def fn() -> list[int]:
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [1, 2, 3]
+
+        async def run() -> list[list[int]]:
+            return await asyncio.gather(
+                *(single_flight.do("key", fn) for _ in range(5))
+            )
+
+        results = asyncio.run(run())
+
+        assert len(calls) == 1
+        assert all(r is results[0] for r in results)
+
+    def test_cancelling_one_caller_doesnt_cancel_the_others(self) -> None:
+        single_flight = AsyncSingleFlight()
+
+        async def fn() -> int:
+            await asyncio.sleep(0.05)
+            return 42
+
+        async def run() -> int:
+            first = asyncio.create_task(single_flight.do("key", fn))
+            second = asyncio.create_task(single_flight.do("key", fn))
+            await asyncio.sleep(0.01)
+
+            first.cancel()
+            return await second
+
+        assert asyncio.run(run()) == 42
+
+    def test_concurrent_page_lookups_share_api_calls(
+        self, fake_flickr: FakeFlickr
+    ) -> None:
+        fake_flickr.add_tag("sunset", count_photos=250)
+        parsed_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+        async def run() -> None:
+            api = AsyncFlickrApi(
+                api=CachingFlickrApi(
+                    client=httpx.Client(transport=fake_flickr.transport)
+                ),
+                client=httpx.AsyncClient(transport=fake_flickr.transport),
+            )
+
+            results = await asyncio.gather(
+                *(
+                    async_get_pages_from_flickr_url(api, parsed_url, count_pages=3)
+                    for _ in range(5)
+                )
+            )
+
+            assert all(r is results[0] for r in results)
+
+        asyncio.run(run())
+
+        assert len(fake_flickr.calls_to("flickr.photos.search")) == 2
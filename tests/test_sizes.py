@@ -0,0 +1,180 @@
+"""
+Tests for `flinumeratr.sizes`.
+"""
+
+from xml.etree import ElementTree as ET
+
+from flask import Flask
+from flickr_url_parser import parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner, make_photo_attrs
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.export import photo_from_dict
+from flinumeratr.flickr_api import get_image_url, get_photos_from_flickr_url
+from flinumeratr.fragments import render_photo
+from flinumeratr.sizes import SizeProfile, parse_sizes, size_extras, srcset
+
+
+def photo_elem(**attrs: str) -> ET.Element:
+    """
+    Create a <photo> element with every size the fake Flickr API knows about.
+    """
+    return ET.Element("photo", attrib={**make_photo_attrs(1, make_owner(1)), **attrs})
+
+
+@pytest.mark.parametrize(
+    ["profile", "expected_extras"],
+    [
+        ("medium-only", ["url_s", "url_m"]),
+        (
+            "responsive",
+            ["url_q", "url_s", "url_n", "url_m", "url_z", "url_c", "url_l"],
+        ),
+        ("archival", ["url_s", "url_m", "url_l", "url_h", "url_k", "url_o"]),
+    ],
+)
+def test_size_extras(profile: SizeProfile, expected_extras: list[str]) -> None:
+    assert size_extras(profile) == expected_extras
+
+
+@pytest.mark.parametrize(
+    ["profile", "expected_labels"],
+    [
+        ("medium-only", ["Small", "Medium"]),
+        ("responsive", ["Large Square", "Small", "Medium", "Large"]),
+        ("archival", ["Small", "Medium", "Large", "Original"]),
+    ],
+)
+def test_parse_sizes_skips_missing_sizes(
+    profile: SizeProfile, expected_labels: list[str]
+) -> None:
+    """
+    We only parse the sizes in the profile, and skip any sizes in
+    the profile which aren't on the photo.
+    """
+    sizes = parse_sizes(photo_elem(), profile=profile)
+
+    assert [s["label"] for s in sizes] == expected_labels
+
+
+def test_parse_sizes() -> None:
+    assert parse_sizes(photo_elem(media="video")) == [
+        {
+            "height": 160,
+            "width": 240,
+            "label": "Small",
+            "media": "video",
+            "source": "https://live.staticflickr.com/65535/50000000001_abcdef1234_m.jpg",
+        },
+        {
+            "height": 333,
+            "width": 500,
+            "label": "Medium",
+            "media": "video",
+            "source": "https://live.staticflickr.com/65535/50000000001_abcdef1234.jpg",
+        },
+    ]
+
+
+@pytest.mark.parametrize("profile", ["medium-only", "responsive", "archival"])
+def test_photos_smaller_than_medium_fall_back_to_small(profile: SizeProfile) -> None:
+    attrs = make_photo_attrs(1, make_owner(1))
+    elem = ET.Element(
+        "photo",
+        attrib={
+            k: v
+            for k, v in attrs.items()
+            if not k.startswith(("url_", "width_", "height_"))
+            or k.endswith(("_sq", "_s"))
+        },
+    )
+
+    image_url = get_image_url(parse_sizes(elem, profile=profile), "Medium")
+
+    assert image_url == attrs["url_s"]
+
+
+@pytest.mark.parametrize(
+    ["profile", "expected_sizes"],
+    [
+        ("medium-only", "url_s,url_m"),
+        ("archival", "url_s,url_m,url_l,url_h,url_k,url_o"),
+    ],
+)
+def test_profile_decides_the_extras_we_request(
+    fake_flickr: FakeFlickr, profile: SizeProfile, expected_sizes: str
+) -> None:
+    fake_flickr.add_tag("sunset", count_photos=3)
+
+    photos = get_photos_from_flickr_url(
+        fake_flickr.api,
+        parse_flickr_url("https://www.flickr.com/photos/tags/sunset/"),
+        size_profile=profile,
+    )
+
+    (call,) = fake_flickr.calls_to("flickr.photos.search")
+    assert call["extras"].endswith("," + expected_sizes)
+    assert "url_sq" not in call["extras"]
+
+    assert photos["photos"][0]["image_url"].endswith("_abcdef1234.jpg")  # type: ignore[typeddict-item]
+
+
+def test_srcset_leaves_out_cropped_sizes() -> None:
+    sizes = parse_sizes(photo_elem(), profile="responsive")
+
+    assert srcset(sizes) == (
+        "https://live.staticflickr.com/65535/50000000001_abcdef1234_m.jpg 240w, "
+        "https://live.staticflickr.com/65535/50000000001_abcdef1234.jpg 500w, "
+        "https://live.staticflickr.com/65535/50000000001_abcdef1234_b.jpg 1024w"
+    )
+
+
+def test_srcset_leaves_out_videos() -> None:
+    assert srcset(parse_sizes(photo_elem(media="video"))) == ""
+
+
+def test_see_photos_has_responsive_images(
+    app: Flask, fake_flickr: FakeFlickr, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    fake_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    monkeypatch.setattr("flinumeratr.app.api", fake_api)
+    fake_flickr.add_tag("sunset", count_photos=3)
+
+    resp = app.test_client().get(
+        "/see_photos?flickr_url=https://www.flickr.com/photos/tags/sunset/"
+    )
+    html = resp.data.decode("utf8")
+
+    assert html.count('loading="lazy" decoding="async"') == 3
+    assert html.count('width="500" height="333"') == 3
+    assert html.count('sizes="(max-width: 700px) 100vw, 500px"') == 3
+    assert 'srcset="https://live.staticflickr.com/65535/' in html
+    assert "_q.jpg" not in html
+
+
+def test_images_without_known_sizes(app: Flask) -> None:
+    """
+    If we don't know the sizes of a photo (e.g. it was saved before
+    we kept them), we still show the image, just without a ``srcset``.
+    """
+    photo = photo_from_dict(
+        {
+            "url": "https://www.flickr.com/photos/user1/50000000001/",
+            "image_url": "https://live.staticflickr.com/65535/50000000001.jpg",
+            "title": None,
+            "owner_url": "https://www.flickr.com/photos/user1/",
+            "owner_name": "User 1",
+            "date_taken": None,
+            "date_posted": "2020-09-13T12:26:40",
+            "license": {"id": "cc-by-2.0", "label": "CC BY 2.0", "url": ""},
+        }
+    )
+
+    with app.test_request_context():
+        html = render_photo(photo, "user")
+
+    assert '<img src="https://live.staticflickr.com/65535/50000000001.jpg"' in html
+    assert "srcset" not in html
+    assert "width=" not in html
@@ -0,0 +1,501 @@
+"""
+Tests for `flinumeratr.snapshots` and the ``refresh-snapshots`` command.
+"""
+
+import dataclasses
+from pathlib import Path
+import sqlite3
+
+from flask import Flask
+from flickr_api import FlickrApi
+from flickr_url_parser import ParseResult, parse_flickr_url
+import httpx
+import pytest
+
+from fake_flickr import FakeFlickr, make_owner, make_photo_attrs
+from flinumeratr.cache import CachingFlickrApi, ResponseCache
+from flinumeratr.compact import CompactPhoto, PhotoInterner
+from flinumeratr.flickr_api import iter_photos_from_flickr_url
+from flinumeratr.snapshots import SnapshotStore, get_snapshot_store, refresh_snapshot
+
+
+user_url = parse_flickr_url("https://www.flickr.com/photos/user1/")
+group_url = parse_flickr_url("https://www.flickr.com/groups/geologists/")
+tag_url = parse_flickr_url("https://www.flickr.com/photos/tags/sunset/")
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> SnapshotStore:
+    """
+    Returns a snapshot store in a temporary database.
+    """
+    return SnapshotStore(path=str(tmp_path / "snapshots.db"))
+
+
+@pytest.fixture
+def api(fake_flickr: FakeFlickr) -> FlickrApi:
+    """
+    Returns an API client with a user, a group and a tag to snapshot.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+    fake_flickr.add_album("72157640898611483", owner=owner, count_photos=20)
+    fake_flickr.add_group(
+        "1234@N01", url="https://www.flickr.com/groups/geologists", count_photos=250
+    )
+    fake_flickr.add_tag("sunset", count_photos=30)
+
+    return fake_flickr.api
+
+
+def track_writes(store: SnapshotStore) -> None:
+    """
+    Record the URL of every photo we write to the store from now on,
+    which you can read with ``written_urls()``.
+    """
+    with sqlite3.connect(store.path) as conn:
+        conn.execute("CREATE TABLE writes(url TEXT)")
+        conn.execute(
+            """
+            CREATE TRIGGER track_writes AFTER INSERT ON snapshot_photos
+            BEGIN
+                INSERT INTO writes VALUES(NEW.url);
+            END
+            """
+        )
+
+
+def written_urls(store: SnapshotStore) -> list[str]:
+    """
+    Returns the URL of every photo we've written since ``track_writes()``.
+    """
+    with sqlite3.connect(store.path) as conn:
+        return [url for (url,) in conn.execute("SELECT url FROM writes")]
+
+
+def new_photos(count: int) -> list[dict[str, str]]:
+    """
+    Returns some photos that were uploaded after all the existing ones.
+    """
+    return [make_photo_attrs(-n, owner=make_owner(1)) for n in range(count, 0, -1)]
+
+
+def test_first_refresh_gets_every_photo(
+    api: FlickrApi, fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    diff = refresh_snapshot(api, store, user_url)
+
+    assert len(diff["added"]) == 250
+    assert diff["removed"] == []
+    assert diff["is_full"]
+
+    snapshot = store.get(user_url)
+    assert snapshot is not None
+    assert [p.to_photo() for p in snapshot["photos"]] == list(
+        iter_photos_from_flickr_url(api, user_url)
+    )
+
+
+def test_photos_in_a_snapshot_share_their_owner(
+    api: FlickrApi, store: SnapshotStore
+) -> None:
+    diff = refresh_snapshot(api, store, user_url)
+    assert all(p.owner is diff["added"][0].owner for p in diff["added"])
+
+    snapshot = store.get(user_url)
+    assert snapshot is not None
+    assert all(p.owner is snapshot["photos"][0].owner for p in snapshot["photos"])
+
+
+def test_missing_snapshot_is_none(store: SnapshotStore) -> None:
+    assert store.get(user_url) is None
+
+
+def test_snapshots_are_keyed_on_the_normalised_url(
+    api: FlickrApi, store: SnapshotStore
+) -> None:
+    refresh_snapshot(api, store, user_url)
+
+    assert store.get(parse_flickr_url("https://flickr.com/photos/user1")) is not None
+
+
+@pytest.mark.parametrize(
+    ["parsed_url", "api_method"],
+    [
+        (user_url, "flickr.people.getPublicPhotos"),
+        (group_url, "flickr.groups.pools.getPhotos"),
+    ],
+)
+def test_refresh_only_fetches_new_photos(
+    api: FlickrApi,
+    fake_flickr: FakeFlickr,
+    store: SnapshotStore,
+    parsed_url: ParseResult,
+    api_method: str,
+) -> None:
+    refresh_snapshot(api, store, parsed_url)
+
+    photos = (
+        fake_flickr.photostreams["1001@N01"]
+        if parsed_url is user_url
+        else fake_flickr.groups["1234@N01"]["photos"]
+    )
+    photos[:0] = new_photos(3)
+    fake_flickr.calls.clear()
+
+    diff = refresh_snapshot(api, store, parsed_url)
+
+    assert [p.url.split("/")[-2] for p in diff["added"]] == [
+        p["id"] for p in photos[:3]
+    ]
+    assert diff["removed"] == []
+    assert not diff["is_full"]
+    assert [c["page"] for c in fake_flickr.calls_to(api_method)] == ["1"]
+
+    snapshot = store.get(parsed_url)
+    assert snapshot is not None
+    assert len(snapshot["photos"]) == 253
+    assert snapshot["photos"][:3] == diff["added"]
+
+
+@pytest.mark.parametrize(
+    "parsed_url",
+    [pytest.param(user_url, id="user"), pytest.param(tag_url, id="tag")],
+)
+def test_refresh_doesnt_use_cached_pages(
+    api: FlickrApi,
+    fake_flickr: FakeFlickr,
+    store: SnapshotStore,
+    tmp_path: Path,
+    parsed_url: ParseResult,
+) -> None:
+    """
+    An incremental refresh always fetches fresh pages, even if the
+    response cache has an older copy of the same page.
+    """
+    cached_api = CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport))
+    cached_api.response_cache = ResponseCache(path=str(tmp_path / "cache.db"))
+
+    # The first refresh gets every photo; the second one puts the pages
+    # it fetches in the response cache.
+    refresh_snapshot(cached_api, store, parsed_url)
+    refresh_snapshot(cached_api, store, parsed_url)
+
+    if parsed_url is user_url:
+        fake_flickr.photostreams["1001@N01"][:0] = new_photos(3)
+    else:
+        fake_flickr.tags["sunset"].extend(new_photos(3))
+
+    diff = refresh_snapshot(cached_api, store, parsed_url)
+
+    assert len(diff["added"]) == 3
+    assert not diff["is_full"]
+
+
+def test_refresh_only_writes_new_photos(
+    api: FlickrApi, fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    refresh_snapshot(api, store, user_url)
+    track_writes(store)
+
+    fake_flickr.photostreams["1001@N01"][:0] = new_photos(3)
+    diff = refresh_snapshot(api, store, user_url)
+
+    assert written_urls(store) == [p.url for p in diff["added"]]
+
+
+@pytest.mark.parametrize(
+    ["order", "expected_writes"],
+    [
+        # New photos at the start, the end, and in the middle
+        ("xabcdef", "x"),
+        ("abcdefx", "x"),
+        ("abcxydef", "xy"),
+        # Photos removed
+        ("acdf", ""),
+        # A photo moved to the start
+        ("fabcde", "f"),
+        # Everything reversed, so only one photo can stay where it is
+        ("fedcba", "fedcb"),
+    ],
+)
+def test_put_only_writes_changed_rows(
+    api: FlickrApi, store: SnapshotStore, order: str, expected_writes: str
+) -> None:
+    all_photos = list(
+        PhotoInterner().compact_all(iter_photos_from_flickr_url(api, user_url))
+    )
+    photos_by_name = dict(zip("abcdefxy", all_photos))
+
+    def get_photos(names: str) -> list[CompactPhoto]:
+        return [photos_by_name[n] for n in names]
+
+    store.put(user_url, get_photos("abcdef"))
+    track_writes(store)
+
+    store.put(user_url, get_photos(order))
+
+    snapshot = store.get(user_url)
+    assert snapshot is not None
+    assert snapshot["photos"] == get_photos(order)
+
+    # We only write the photos which are new, or have moved relative
+    # to the others.
+    assert written_urls(store) == [p.url for p in get_photos(expected_writes)]
+
+
+def test_put_rewrites_changed_photos(api: FlickrApi, store: SnapshotStore) -> None:
+    photos = list(
+        PhotoInterner().compact_all(iter_photos_from_flickr_url(api, user_url))
+    )
+    store.put(user_url, photos)
+    track_writes(store)
+
+    photos[1] = dataclasses.replace(photos[1], title="A new title")
+    store.put(user_url, photos)
+
+    assert written_urls(store) == [photos[1].url]
+
+    snapshot = store.get(user_url)
+    assert snapshot is not None
+    assert snapshot["photos"][1].title == "A new title"
+
+
+def test_duplicate_photos_are_only_stored_once(
+    api: FlickrApi, store: SnapshotStore
+) -> None:
+    photos = list(
+        PhotoInterner().compact_all(iter_photos_from_flickr_url(api, user_url))
+    )
+
+    store.put(user_url, photos[:2] + photos[:1])
+
+    snapshot = store.get(user_url)
+    assert snapshot is not None
+    assert snapshot["photos"] == photos[:2]
+
+
+def test_refresh_walks_pages_until_it_finds_a_known_photo(
+    api: FlickrApi, fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    refresh_snapshot(api, store, user_url)
+
+    fake_flickr.photostreams["1001@N01"][:0] = new_photos(25)
+    fake_flickr.calls.clear()
+
+    diff = refresh_snapshot(api, store, user_url, per_page=10)
+
+    assert len(diff["added"]) == 25
+    assert [
+        c["page"] for c in fake_flickr.calls_to("flickr.people.getPublicPhotos")
+    ] == ["1", "2", "3"]
+
+
+def test_refresh_with_no_changes(api: FlickrApi, store: SnapshotStore) -> None:
+    refresh_snapshot(api, store, user_url)
+
+    assert refresh_snapshot(api, store, user_url) == {
+        "added": [],
+        "removed": [],
+        "is_full": False,
+    }
+
+
+def test_removed_photos_need_a_full_refresh(
+    api: FlickrApi, fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    """
+    If the photo count doesn't match the snapshot, we fetch every photo
+    so we can find the ones that were removed.
+    """
+    refresh_snapshot(api, store, user_url)
+
+    removed = fake_flickr.photostreams["1001@N01"].pop(100)
+    fake_flickr.photostreams["1001@N01"][:0] = new_photos(1)
+
+    diff = refresh_snapshot(api, store, user_url)
+
+    assert len(diff["added"]) == 1
+    assert [p.url.split("/")[-2] for p in diff["removed"]] == [removed["id"]]
+    assert diff["is_full"]
+
+
+def test_empty_photostream(fake_flickr: FakeFlickr, store: SnapshotStore) -> None:
+    fake_flickr.add_user(make_owner(1), count_photos=0)
+
+    refresh_snapshot(fake_flickr.api, store, user_url)
+    diff = refresh_snapshot(fake_flickr.api, store, user_url)
+
+    assert diff == {"added": [], "removed": [], "is_full": False}
+
+
+def test_tag_refresh_searches_for_newer_photos(
+    api: FlickrApi, fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    refresh_snapshot(api, store, tag_url)
+
+    fake_flickr.tags["sunset"].extend(new_photos(2))
+    fake_flickr.calls.clear()
+
+    diff = refresh_snapshot(api, store, tag_url)
+
+    assert len(diff["added"]) == 2
+    assert not diff["is_full"]
+
+    # The newest photo in the first snapshot was uploaded at 1600000000,
+    # and the search includes it, but it isn't reported as new.
+    searches = fake_flickr.calls_to("flickr.photos.search")
+    assert [c["min_upload_date"] for c in searches] == ["1600000000"]
+
+
+def test_tag_refresh_walks_every_page_of_newer_photos(
+    api: FlickrApi, fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    refresh_snapshot(api, store, tag_url)
+
+    fake_flickr.tags["sunset"].extend(new_photos(25))
+    fake_flickr.calls.clear()
+
+    diff = refresh_snapshot(api, store, tag_url, per_page=10)
+
+    assert len(diff["added"]) == 25
+    assert [c["page"] for c in fake_flickr.calls_to("flickr.photos.search")] == [
+        "1",
+        "2",
+        "3",
+    ]
+
+
+def test_empty_tag_gets_a_full_refresh(
+    fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    """
+    If a tag didn't have any photos, there's no high-water mark, so
+    we have to fetch every photo.
+    """
+    fake_flickr.add_tag("sunset", count_photos=0)
+    refresh_snapshot(fake_flickr.api, store, tag_url)
+
+    fake_flickr.tags["sunset"] = new_photos(2)
+
+    diff = refresh_snapshot(fake_flickr.api, store, tag_url)
+
+    assert len(diff["added"]) == 2
+    assert diff["is_full"]
+
+
+def test_albums_always_get_a_full_refresh(
+    api: FlickrApi, fake_flickr: FakeFlickr, store: SnapshotStore
+) -> None:
+    album_url = parse_flickr_url(
+        "https://www.flickr.com/photos/user1/albums/72157640898611483"
+    )
+    refresh_snapshot(api, store, album_url)
+
+    fake_flickr.albums["72157640898611483"]["photos"].reverse()
+
+    assert refresh_snapshot(api, store, album_url) == {
+        "added": [],
+        "removed": [],
+        "is_full": True,
+    }
+
+
+def test_full_refresh_can_be_forced(api: FlickrApi, store: SnapshotStore) -> None:
+    refresh_snapshot(api, store, user_url)
+
+    assert refresh_snapshot(api, store, user_url, full=True)["is_full"]
+
+
+@pytest.mark.parametrize("snapshot_path", [None, "snapshots.db"])
+def test_get_snapshot_store(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, snapshot_path: str | None
+) -> None:
+    if snapshot_path is None:
+        monkeypatch.delenv("FLINUMERATR_SNAPSHOT_PATH", raising=False)
+    else:
+        monkeypatch.setenv("FLINUMERATR_SNAPSHOT_PATH", str(tmp_path / snapshot_path))
+
+    assert (get_snapshot_store() is None) == (snapshot_path is None)
+
+
+class TestRefreshSnapshotsCommand:
+    @pytest.fixture
+    def snapshot_path(
+        self,
+        app: Flask,
+        api: FlickrApi,
+        fake_flickr: FakeFlickr,
+        monkeypatch: pytest.MonkeyPatch,
+        tmp_path: Path,
+    ) -> Path:
+        """
+        Point the app at the fake Flickr API and a temporary snapshot store.
+        """
+        monkeypatch.setattr(
+            "flinumeratr.app.api",
+            CachingFlickrApi(client=httpx.Client(transport=fake_flickr.transport)),
+        )
+
+        path = tmp_path / "snapshots.db"
+        monkeypatch.setenv("FLINUMERATR_SNAPSHOT_PATH", str(path))
+        return path
+
+    def test_prints_the_diff(
+        self, app: Flask, fake_flickr: FakeFlickr, snapshot_path: Path
+    ) -> None:
+        runner = app.test_cli_runner()
+        runner.invoke(
+            args=["refresh-snapshots", "https://www.flickr.com/photos/user1/"]
+        )
+
+        fake_flickr.photostreams["1001@N01"][:0] = new_photos(2)
+
+        result = runner.invoke(
+            args=["refresh-snapshots", "https://www.flickr.com/photos/user1/"]
+        )
+
+        assert result.exit_code == 0
+        assert result.output.count('"change": "added"') == 2
+        assert "2 added, 0 removed (incremental refresh)" in result.output
+
+    def test_full_flag(self, app: Flask, snapshot_path: Path) -> None:
+        result = app.test_cli_runner().invoke(
+            args=[
+                "refresh-snapshots",
+                "--full",
+                "https://www.flickr.com/groups/geologists/",
+            ]
+        )
+
+        assert result.exit_code == 0
+        assert result.output.count('"change": "added"') == 250
+        assert "(full refresh)" in result.output
+
+    def test_errors_dont_stop_other_urls(self, app: Flask, snapshot_path: Path) -> None:
+        result = app.test_cli_runner().invoke(
+            args=[
+                "refresh-snapshots",
+                "https://example.com",
+                "https://www.flickr.com/photos/nobody/",
+                "https://www.flickr.com/photos/tags/sunset/",
+            ]
+        )
+
+        assert result.exit_code == 1
+        assert "https://example.com: NotAFlickrUrl" in result.output
+        assert "https://www.flickr.com/photos/nobody/: ResourceNotFound" in (
+            result.output
+        )
+        assert result.output.count('"change": "added"') == 30
+
+    def test_needs_a_snapshot_path(
+        self, app: Flask, snapshot_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.delenv("FLINUMERATR_SNAPSHOT_PATH")
+
+        result = app.test_cli_runner().invoke(
+            args=["refresh-snapshots", "https://www.flickr.com/photos/user1/"]
+        )
+
+        assert result.exit_code == 2
+        assert "Set FLINUMERATR_SNAPSHOT_PATH" in result.output
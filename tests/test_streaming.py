@@ -0,0 +1,284 @@
+"""
+Tests for the incremental (streaming) parser in `flinumeratr.flickr_api`.
+"""
+
+from collections.abc import Iterator
+import gzip
+import itertools
+from pathlib import Path
+
+from flickr_api import (
+    FlickrApi,
+    InvalidApiKey,
+    ResourceNotFound,
+    UnrecognisedFlickrApiException,
+)
+from flickr_url_parser import parse_flickr_url
+import httpx
+import pytest
+import yaml  # type: ignore[import-untyped]
+
+from fake_flickr import FakeFlickr, make_owner
+from flinumeratr.cache import CachingFlickrApi
+from flinumeratr.flickr_api import (
+    get_page_fetcher,
+    iter_photos_from_flickr_url,
+    iterparse_collection,
+    stream_photos_from_flickr_url,
+)
+from flinumeratr.metrics import API_CALLS, RATE_BUDGET_REQUESTS, RATE_BUDGET_THROTTLED
+from flinumeratr.ratelimit import RateBudget
+
+
+def load_cassette_bodies(cassette_name: str) -> dict[str, bytes]:
+    """
+    Read the response bodies from a VCR cassette, keyed by API method.
+    """
+    with open(f"tests/fixtures/cassettes/{cassette_name}") as in_file:
+        cassette = yaml.safe_load(in_file)
+
+    bodies = {}
+
+    for interaction in cassette["interactions"]:
+        method = httpx.URL(interaction["request"]["uri"]).params["method"]
+        body = interaction["response"]["body"]["string"]
+
+        bodies[method] = gzip.decompress(body) if body[:2] == b"\x1f\x8b" else body
+
+    return bodies
+
+
+def replaying_api(fake_flickr: FakeFlickr, cassette_name: str) -> FlickrApi:
+    """
+    Create an API which replays the responses from a cassette, split
+    into small chunks so they have to be parsed incrementally.
+
+    Anything not in the cassette (e.g. licenses) comes from the fake.
+    """
+    bodies = load_cassette_bodies(cassette_name)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        try:
+            body = bodies[request.url.params["method"]]
+        except KeyError:
+            return fake_flickr.handle_request(request)
+
+        chunks = [body[i : i + 100] for i in range(0, len(body), 100)]
+        return httpx.Response(status_code=200, content=iter(chunks))
+
+    return FlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+
+@pytest.mark.parametrize(
+    ["flickr_url", "cassette_name"],
+    [
+        pytest.param(
+            "https://www.flickr.com/photos/aljazeeraenglish/albums/72157626164453131",
+            "test_results_page_shows_info_box[album].yml",
+            id="album",
+        ),
+        pytest.param(
+            "https://www.flickr.com/groups/birdguide/",
+            "test_results_page_shows_info_box[group].yml",
+            id="group",
+        ),
+        pytest.param(
+            "https://www.flickr.com/people/blueminds/",
+            "test_results_page_shows_info_box[user].yml",
+            id="user",
+        ),
+        pytest.param(
+            "https://www.flickr.com/photos/george/galleries/72157621848008117/",
+            "test_results_page_shows_info_box[gallery].yml",
+            id="gallery",
+        ),
+        pytest.param(
+            "https://flickr.com/photos/tags/thatch/",
+            "test_results_page_shows_info_box[tag].yml",
+            id="tag",
+        ),
+    ],
+)
+def test_streaming_parse_matches_tree_parse(
+    fake_flickr: FakeFlickr, flickr_url: str, cassette_name: str
+) -> None:
+    """
+    Parsing a real response incrementally gives the same photos as
+    parsing the whole tree.
+    """
+    api = replaying_api(fake_flickr, cassette_name)
+    parsed_url = parse_flickr_url(flickr_url)
+
+    expected = get_page_fetcher(api, parsed_url)(page=1, per_page=100)
+    assert len(expected["photos"]) > 0
+
+    # The replaying API returns the same page every time, so only
+    # compare the first page.
+    actual = list(
+        itertools.islice(
+            stream_photos_from_flickr_url(api, parsed_url),
+            len(expected["photos"]),
+        )
+    )
+
+    assert actual == expected["photos"]
+
+
+@pytest.mark.parametrize(
+    "flickr_url",
+    [
+        "https://www.flickr.com/photos/user1/albums/72157640898611483",
+        "https://www.flickr.com/photos/user1/",
+        "https://www.flickr.com/photos/george/galleries/72157677773252346/",
+        "https://www.flickr.com/groups/geologists/",
+        "https://www.flickr.com/photos/tags/botany/",
+    ],
+)
+def test_streaming_walks_every_page(fake_flickr: FakeFlickr, flickr_url: str) -> None:
+    """
+    Streaming the photos at a URL gets every photo from every page, in
+    the same order as the non-streaming iterator.
+    """
+    owner = fake_flickr.add_user(make_owner(1), count_photos=250)
+    fake_flickr.add_album("72157640898611483", owner=owner, count_photos=250)
+    fake_flickr.add_gallery("72157677773252346", count_photos=250)
+    fake_flickr.add_group(
+        "1234@N01", url="https://www.flickr.com/groups/geologists", count_photos=250
+    )
+    fake_flickr.add_tag("botany", count_photos=250)
+
+    parsed_url = parse_flickr_url(flickr_url)
+
+    # We use small pages, so there's more than one page to walk.
+    streamed = list(
+        stream_photos_from_flickr_url(fake_flickr.api, parsed_url, per_page=100)
+    )
+
+    assert len(streamed) == 250
+    assert streamed == list(
+        iter_photos_from_flickr_url(fake_flickr.api, parsed_url, per_page=100)
+    )
+
+
+def test_streaming_empty_photostream(fake_flickr: FakeFlickr) -> None:
+    fake_flickr.add_user(make_owner(1), count_photos=0)
+
+    photos = stream_photos_from_flickr_url(
+        fake_flickr.api, parse_flickr_url("https://www.flickr.com/photos/user1/")
+    )
+
+    assert list(photos) == []
+
+
+def test_streaming_single_photo(flickr_api: FlickrApi) -> None:
+    photos = list(
+        stream_photos_from_flickr_url(
+            flickr_api,
+            parse_flickr_url("https://www.flickr.com/photos/sdasmarchives/50567413447"),
+        )
+    )
+
+    assert len(photos) == 1
+
+
+def test_streaming_missing_collection_is_error(fake_flickr: FakeFlickr) -> None:
+    with pytest.raises(ResourceNotFound):
+        list(
+            stream_photos_from_flickr_url(
+                fake_flickr.api,
+                parse_flickr_url("https://www.flickr.com/photos/12345678@N01/"),
+            )
+        )
+
+
+@pytest.mark.parametrize(
+    ["body", "exc_class"],
+    [
+        (
+            b'<rsp stat="fail"><err code="100" msg="Invalid API Key" /></rsp>',
+            InvalidApiKey,
+        ),
+        (
+            b'<rsp stat="fail"><err code="99" msg="Something else" /></rsp>',
+            UnrecognisedFlickrApiException,
+        ),
+        (b'<rsp stat="ok"></rsp>', ValueError),
+    ],
+)
+def test_iterparse_collection_errors(
+    fake_flickr: FakeFlickr, body: bytes, exc_class: type[Exception]
+) -> None:
+    with pytest.raises(exc_class):
+        iterparse_collection(fake_flickr.api, [body])
+
+
+def test_iterparse_collection_reads_pagination_before_photos(
+    fake_flickr: FakeFlickr,
+) -> None:
+    """
+    We can get the page count before the photos have arrived.
+    """
+    chunks_read = 0
+
+    def chunks() -> Iterator[bytes]:
+        nonlocal chunks_read
+
+        for chunk in [
+            b'<rsp stat="ok">\n<photos page="1" pages="7" perpage="1" total="7">',
+            b"</photos></rsp>",
+        ]:
+            chunks_read += 1
+            yield chunk
+
+    collection = iterparse_collection(fake_flickr.api, chunks())
+
+    assert collection["count_pages"] == 7
+    assert collection["count_photos"] == 7
+    assert chunks_read == 1
+
+    assert list(collection["photos"]) == []
+    assert chunks_read == 2
+
+
+def test_streaming_uses_the_rate_budget(
+    fake_flickr: FakeFlickr, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Streamed requests go through the rate budget like any other call:
+    they take a token, back off if Flickr throttles us, and are counted
+    in our metrics.
+    """
+    monkeypatch.setattr("flinumeratr.ratelimit.MIN_BACKOFF", 0.01)
+
+    for metric in (API_CALLS, RATE_BUDGET_REQUESTS, RATE_BUDGET_THROTTLED):
+        metric.values.clear()
+
+    fake_flickr.add_tag("botany", count_photos=250)
+    throttled = False
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal throttled
+
+        if request.url.params["method"] == "flickr.photos.search" and not throttled:
+            throttled = True
+            return httpx.Response(status_code=429)
+
+        return fake_flickr.handle_request(request)
+
+    api = CachingFlickrApi(client=httpx.Client(transport=httpx.MockTransport(handler)))
+    api.rate_budget = RateBudget(
+        path=str(tmp_path / "cache.db"), calls_per_hour=36_000, bulk_reserve=0
+    )
+
+    photos = stream_photos_from_flickr_url(
+        api.with_priority("bulk"),
+        parse_flickr_url("https://www.flickr.com/photos/tags/botany/"),
+        per_page=100,
+    )
+
+    assert len(list(photos)) == 250
+    assert RATE_BUDGET_THROTTLED.values == {(): 1}
+    assert API_CALLS.values[(("method", "flickr.photos.search"),)] == 4
+    assert RATE_BUDGET_REQUESTS.values == {
+        (("priority", "bulk"), ("result", "granted")): 5,
+    }